@@ -14,6 +14,12 @@ from app.api.v1.admin import schemas
 from app.api.v1.admin.service import AdminProductService
 from app.api.v1.products import schemas as product_schemas
 from app.api.v1.products.service import ProductService
+from app.api.v1.orders.service import order_service
+from app.api.v1.subscriptions.service import subscription_service
+from app.api.v1.loyalty.service import loyalty_service
+from app.services.stripe_webhook_service import stripe_webhook_service
+from app.services import resilience
+from app.services.subscription_catalog_service import subscription_catalog_service
 from app.models.user import User
 
 router = APIRouter()
@@ -179,6 +185,7 @@ async def create_product(
     
     db.commit()
     db.refresh(new_product)
+    subscription_catalog_service.invalidate()
     
     return new_product
 
@@ -253,4 +260,142 @@ def bulk_product_action(
     Retorna:
         BulkActionResponse: Resultado con cantidad de éxitos, fallos y lista de errores.
     """
-    return AdminProductService.bulk_update_products(db, action_data)
\ No newline at end of file
+    return AdminProductService.bulk_update_products(db, action_data)
+
+
+# ============ GESTIÓN DE PEDIDOS (ADMIN) ============
+
+@router.post("/orders/bulk-status", response_model=schemas.BulkOrderStatusResponse)
+def bulk_update_order_status(
+    request: schemas.BulkOrderStatusRequest,
+    current_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Marca muchos pedidos como enviados o entregados en una sola petición.
+                 Los pedidos con transiciones no permitidas o inexistentes se reportan
+                 como fallidos sin afectar a los demás.
+    Parámetros:
+        request (BulkOrderStatusRequest): Lista de (order_id, new_status, tracking_number).
+        current_user (User): Usuario administrador autenticado.
+        db (Session): Sesión de base de datos.
+    Retorna:
+        BulkOrderStatusResponse: Totales y resultado por pedido.
+    """
+    result = order_service.bulk_update_order_status(
+        db,
+        [item.model_dump() for item in request.updates]
+    )
+    
+    return schemas.BulkOrderStatusResponse(
+        updated=result["updated"],
+        failed=result["failed"],
+        results=result["results"]
+    )
+
+
+# ============ COBRO DE SUSCRIPCIONES (ADMIN) ============
+
+@router.get("/billing/runs", response_model=schemas.BillingRunsResponse)
+def get_billing_runs(
+    limit: int = Query(20, ge=1, le=100, description="Número de ejecuciones"),
+    current_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Progreso de las ejecuciones más recientes del cobro de suscripciones:
+                 cobros por estado, porcentaje terminado y último latido.
+    Parámetros:
+        limit (int): Número de ejecuciones a regresar.
+        current_user (User): Usuario administrador autenticado.
+        db (Session): Sesión de base de datos.
+    Retorna:
+        BillingRunsResponse: Ejecuciones de la más reciente a la más antigua.
+    """
+    return {"runs": subscription_service.get_billing_runs(db, limit=limit)}
+
+
+@router.get("/billing/runs/{run_id}", response_model=schemas.BillingRunProgress)
+def get_billing_run(
+    run_id: int,
+    current_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Progreso de una ejecución del cobro de suscripciones.
+    Parámetros:
+        run_id (int): ID de la ejecución.
+        current_user (User): Usuario administrador autenticado.
+        db (Session): Sesión de base de datos.
+    Retorna:
+        BillingRunProgress: Progreso de la ejecución.
+    """
+    runs = subscription_service.get_billing_runs(db, run_id=run_id)
+    if not runs:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ejecución de cobro no encontrada"
+        )
+    return runs[0]
+
+
+# ============ CUPONES MENSUALES (ADMIN) ============
+
+@router.get("/coupons/issuance-runs", response_model=schemas.CouponIssuanceRunsResponse)
+def get_coupon_issuance_runs(
+    limit: int = Query(12, ge=1, le=100, description="Número de emisiones"),
+    current_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Progreso de las emisiones mensuales de cupones más recientes: usuarios
+                 procesados, cupones emitidos, porcentaje terminado y último latido.
+    Parámetros:
+        limit (int): Número de emisiones a regresar.
+        current_user (User): Usuario administrador autenticado.
+        db (Session): Sesión de base de datos.
+    Retorna:
+        CouponIssuanceRunsResponse: Emisiones de la más reciente a la más antigua.
+    """
+    return {"runs": loyalty_service.get_coupon_issuance_runs(db, limit=limit)}
+
+
+# ============ PROVEEDORES EXTERNOS (ADMIN) ============
+
+@router.get("/webhooks/stripe/metrics", response_model=schemas.StripeWebhookMetricsResponse)
+def get_stripe_webhook_metrics(
+    current_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Métricas de la cola de webhooks de Stripe: eventos por estado, lag del
+                 evento pendiente más viejo y resultado de la última ejecución del worker.
+    Parámetros:
+        current_user (User): Usuario administrador autenticado.
+        db (Session): Sesión de base de datos.
+    Retorna:
+        StripeWebhookMetricsResponse: Métricas de la cola.
+    """
+    return stripe_webhook_service.get_metrics(db)
+
+
+@router.get("/providers/health", response_model=schemas.ProvidersHealthResponse)
+def get_providers_health(
+    current_user: User = Depends(require_admin)
+):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Estado del circuit breaker, llamadas en curso, contadores (reintentos,
+                 rechazos por circuito abierto o bulkhead lleno) y latencias de cada
+                 proveedor externo en este proceso.
+    Parámetros:
+        current_user (User): Usuario administrador autenticado.
+    Retorna:
+        ProvidersHealthResponse: Métricas por proveedor.
+    """
+    return {"providers": resilience.get_metrics()}
@@ -4,7 +4,9 @@
 #              Define las estructuras de datos para operaciones administrativas en lote.
 
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Dict, List, Optional
+from datetime import date, datetime
+from app.models.enum import OrderStatus
 
 
 # ============ GESTIÓN DE PRODUCTOS ============
@@ -34,4 +36,155 @@ class BulkActionResponse(BaseModel):
     errors: List[str] = Field(
         default=[],
         description="Lista de mensajes de error para productos que fallaron"
-    )
\ No newline at end of file
+    )
+
+
+# ============ GESTIÓN DE PEDIDOS ============
+
+class BulkOrderStatusItem(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Cambio de estado de un pedido dentro de una actualización masiva.
+    """
+    order_id: int = Field(..., gt=0, description="ID del pedido")
+    new_status: OrderStatus = Field(..., description="Nuevo estado: 'shipped' o 'delivered'")
+    tracking_number: Optional[str] = Field(None, max_length=100, description="Número de rastreo")
+
+
+class BulkOrderStatusRequest(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Schema para actualizar el estado de muchos pedidos en una sola petición.
+    """
+    updates: List[BulkOrderStatusItem] = Field(
+        ...,
+        min_length=1,
+        max_length=5000,
+        description="Lista de cambios de estado a aplicar"
+    )
+
+
+class BulkOrderStatusResult(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Resultado de la actualización de un pedido dentro de la operación masiva.
+    """
+    order_id: int
+    success: bool
+    previous_status: Optional[str] = None
+    new_status: str
+    error: Optional[str] = None
+
+
+class BulkOrderStatusResponse(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Schema de respuesta para la actualización masiva de estados de pedidos.
+    """
+    updated: int = Field(..., description="Cantidad de pedidos actualizados")
+    failed: int = Field(..., description="Cantidad de pedidos que fallaron")
+    results: List[BulkOrderStatusResult] = Field(..., description="Resultado por pedido")
+
+
+class WebhookWorkerRun(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Resultados de la última ejecución del worker de webhooks en esta instancia.
+    """
+    started_at: datetime
+    duration_seconds: float
+    batches: int
+    claimed: int
+    processed: int
+    retried: int
+    failed: int
+    avg_lag_seconds: Optional[float] = Field(None, description="Lag promedio (creación en Stripe -> procesado)")
+    max_lag_seconds: Optional[float] = None
+
+
+class StripeWebhookMetricsResponse(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Schema de respuesta con las métricas de la cola de webhooks de Stripe.
+    """
+    counts: Dict[str, int] = Field(..., description="Eventos por estado")
+    oldest_pending_age_seconds: float = Field(..., description="Antigüedad del evento abierto más viejo")
+    last_run: Optional[WebhookWorkerRun] = None
+
+
+class ProviderLatency(BaseModel):
+    avg: Optional[float] = None
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+
+
+class ProviderHealth(BaseModel):
+    provider: str
+    state: str
+    open_remaining_seconds: float
+    consecutive_failures: int
+    in_flight: int
+    max_concurrent: int
+    calls: int
+    successes: int
+    failures: int
+    retries: int
+    short_circuited: int
+    bulkhead_rejected: int
+    deadline_exceeded: int
+    latency_ms: ProviderLatency
+
+
+class ProvidersHealthResponse(BaseModel):
+    providers: List[ProviderHealth]
+
+
+class BillingRunProgress(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Schema de progreso de una ejecución del cobro de suscripciones.
+    """
+    run_id: int
+    billing_date: date
+    status: str
+    max_items: Optional[int] = Field(None, description="Tamaño de la porción, None = todas las vencidas")
+    started_at: datetime
+    heartbeat_at: datetime = Field(..., description="Último bloque terminado")
+    finished_at: Optional[datetime] = None
+    counts: Dict[str, int] = Field(..., description="Cobros del ledger por estado")
+    total_items: int
+    progress_percent: float
+
+
+class BillingRunsResponse(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Schema de respuesta con las ejecuciones de cobro más recientes.
+    """
+    runs: List[BillingRunProgress]
+
+
+class CouponIssuanceRunProgress(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Schema de progreso de una emisión mensual de cupones.
+    """
+    run_id: int
+    period_start: date = Field(..., description="Primer día del mes emitido")
+    status: str
+    total_users: int = Field(..., description="Usuarios con cupones al iniciar la emisión")
+    users_processed: int
+    coupons_issued: int
+    started_at: datetime
+    heartbeat_at: datetime = Field(..., description="Último bloque terminado")
+    finished_at: Optional[datetime] = None
+    progress_percent: float
+
+
+class CouponIssuanceRunsResponse(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Schema de respuesta con las emisiones mensuales de cupones más recientes.
+    """
+    runs: List[CouponIssuanceRunProgress]
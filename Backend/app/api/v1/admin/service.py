@@ -7,6 +7,7 @@ from sqlalchemy.orm import Session
 
 from app.models.product import Product
 from app.api.v1.admin import schemas
+from app.services.subscription_catalog_service import subscription_catalog_service
 
 
 class AdminProductService:
@@ -62,6 +63,7 @@ class AdminProductService:
                 failed += 1
         
         db.commit()
+        subscription_catalog_service.invalidate()
         
         return schemas.BulkActionResponse(
             success=success,
@@ -1,9 +1,11 @@
 import boto3
+from botocore.config import Config
 from jose import jwt, JWTError
 from typing import Dict, Optional
 import requests
 from app.config import settings
 from app.services.s3_service import S3Service
+from app.services.resilience import ResilientClient, get_policy, is_transient_boto_error
 import uuid
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
@@ -13,6 +15,11 @@ from app.core.security import hash_password
 from app.api.v1.auth.schemas import SignUpRequest
 
 
+def _is_transient_cognito_error(error: Exception) -> bool:
+    """Fallos de red/5xx/throttling de Cognito o de la descarga del JWKS"""
+    return is_transient_boto_error(error) or isinstance(error, requests.RequestException)
+
+
 class CognitoService:
     """Servicio para gestión de autenticación con AWS Cognito"""
     
@@ -22,16 +29,39 @@ class CognitoService:
     _jwks_cache_duration = timedelta(hours=1)
     
     def __init__(self):
-        self.client = boto3.client(
-            'cognito-idp',
-            region_name=settings.COGNITO_REGION,
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
+        self.policy = get_policy(
+            'cognito',
+            timeout_seconds=settings.COGNITO_TIMEOUT_SECONDS,
+            max_concurrent=settings.COGNITO_MAX_CONCURRENT_CALLS,
+            is_transient=_is_transient_cognito_error
+        )
+        # Los reintentos los hace la política (solo en operaciones idempotentes), no boto3
+        self.client = ResilientClient(
+            boto3.client(
+                'cognito-idp',
+                region_name=settings.COGNITO_REGION,
+                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                endpoint_url=settings.COGNITO_ENDPOINT_URL,
+                config=Config(
+                    connect_timeout=settings.COGNITO_TIMEOUT_SECONDS,
+                    read_timeout=settings.COGNITO_TIMEOUT_SECONDS,
+                    retries={'total_max_attempts': 1}
+                )
+            ),
+            self.policy,
+            idempotent_operations=('InitiateAuth', 'GetUser', 'GlobalSignOut')
         )
         self.user_pool_id = settings.COGNITO_USER_POOL_ID
         self.client_id = settings.COGNITO_CLIENT_ID
         self.jwks = None
     
+    def _issuer(self) -> str:
+        """URL del user pool; es el issuer de los tokens y la base del JWKS"""
+        if settings.COGNITO_ENDPOINT_URL:
+            return f"{settings.COGNITO_ENDPOINT_URL.rstrip('/')}/{self.user_pool_id}"
+        return f"https://cognito-idp.{settings.COGNITO_REGION}.amazonaws.com/{self.user_pool_id}"
+    
     def _get_jwks(self):
         """Obtiene las claves públicas de Cognito con cache"""
         now = datetime.now()
@@ -43,18 +73,20 @@ class CognitoService:
             # --- INICIO DE NUESTRO FIX PARA PRUEBAS ---
             # Si estamos usando el .env de prueba (region='test'), 
             # no intentes conectar a AWS. Devuelve un JWKS falso.
-            if settings.COGNITO_REGION == 'test':
+            if settings.COGNITO_REGION == 'test' and not settings.COGNITO_ENDPOINT_URL:
                 CognitoService._jwks_cache = {'keys': []} # Un JWKS vacío pero válido
                 CognitoService._jwks_cache_time = now
                 return CognitoService._jwks_cache
             # --- FIN DE NUESTRO FIX PARA PRUEBAS ---
             
-            jwks_url = (
-                f"https://cognito-idp.{settings.COGNITO_REGION}.amazonaws.com/"
-                f"{self.user_pool_id}/.well-known/jwks.json"
-            )
-            response = requests.get(jwks_url)
-            CognitoService._jwks_cache = response.json()
+            jwks_url = f"{self._issuer()}/.well-known/jwks.json"
+            
+            def fetch_jwks():
+                response = requests.get(jwks_url, timeout=settings.COGNITO_TIMEOUT_SECONDS)
+                response.raise_for_status()
+                return response.json()
+            
+            CognitoService._jwks_cache = self.policy.call(fetch_jwks, idempotent=True)
             CognitoService._jwks_cache_time = now
         
         return CognitoService._jwks_cache
@@ -333,10 +365,7 @@ class CognitoService:
                 key,
                 algorithms=['RS256'],
                 audience=self.client_id,
-                issuer=(
-                    f"https://cognito-idp.{settings.COGNITO_REGION}.amazonaws.com/"
-                    f"{self.user_pool_id}"
-                ),
+                issuer=self._issuer(),
                 options={'verify_exp': True}
             )
             
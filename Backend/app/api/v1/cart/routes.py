@@ -15,23 +15,16 @@ from app.models.user import User
 router = APIRouter()
 
 
-@router.get("/", response_model=schemas.ShoppingCartResponse)
-def get_cart(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
+def _build_cart_response(cart) -> schemas.ShoppingCartResponse:
     """
     Autor: Luis Flores
-    Descripción: Obtiene el carrito completo del usuario autenticado con todos
-                 sus items, información de productos y totales calculados.
+    Descripción: Construye la respuesta del carrito con items, información de productos
+                 y totales calculados.
     Parámetros:
-        current_user (User): Usuario autenticado obtenido del token JWT.
-        db (Session): Sesión de base de datos.
+        cart (ShoppingCart): Carrito con items, productos e imágenes cargados.
     Retorna:
         ShoppingCartResponse: Carrito con lista de items, total de items y precio total.
     """
-    cart = CartService.get_cart(db, current_user.user_id)
-    
     # Preparar respuesta con cálculos
     items_response = []
     total_items = 0
@@ -70,7 +63,7 @@ def get_cart(
         )
         
         items_response.append(item_response)
-        subtotal = item.quantity * item.product.price
+        total_items += item.quantity
         total_price += float(subtotal)
     
     return schemas.ShoppingCartResponse(
@@ -84,6 +77,26 @@ def get_cart(
     )
 
 
+@router.get("/", response_model=schemas.ShoppingCartResponse)
+def get_cart(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Autor: Luis Flores
+    Descripción: Obtiene el carrito completo del usuario autenticado con todos
+                 sus items, información de productos y totales calculados.
+    Parámetros:
+        current_user (User): Usuario autenticado obtenido del token JWT.
+        db (Session): Sesión de base de datos.
+    Retorna:
+        ShoppingCartResponse: Carrito con lista de items, total de items y precio total.
+    """
+    cart = CartService.get_cart(db, current_user.user_id)
+    
+    return _build_cart_response(cart)
+
+
 @router.get("/summary", response_model=schemas.CartSummary)
 def get_cart_summary(
     current_user: User = Depends(get_current_user),
@@ -126,9 +139,6 @@ def add_item_to_cart(
         item_data=item_data
     )
     
-    # Recargar con relaciones para la respuesta
-    db.refresh(cart_item)
-    
     # Preparar respuesta
     primary_image = None
     if cart_item.product.product_images:
@@ -158,6 +168,34 @@ def add_item_to_cart(
     )
 
 
+@router.patch("/items", response_model=schemas.ShoppingCartResponse)
+def update_cart_items(
+    batch_data: schemas.CartBatchUpdate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Autor: Luis Flores
+    Descripción: Aplica varias operaciones al carrito en una sola petición: fijar la
+                 cantidad de un producto ('set') o quitarlo ('remove'). Se usa para
+                 sincronizar el carrito después de ediciones offline o "volver a comprar".
+                 Si alguna operación es inválida no se aplica ninguna.
+    Parámetros:
+        batch_data (CartBatchUpdate): Lista de operaciones a aplicar.
+        current_user (User): Usuario autenticado.
+        db (Session): Sesión de base de datos.
+    Retorna:
+        ShoppingCartResponse: Carrito actualizado.
+    """
+    cart = CartService.apply_cart_operations(
+        db=db,
+        user_id=current_user.user_id,
+        batch_data=batch_data
+    )
+    
+    return _build_cart_response(cart)
+
+
 @router.put("/{cart_item_id}", response_model=schemas.CartItemResponse)
 def update_cart_item(
     cart_item_id: int,
@@ -184,9 +222,6 @@ def update_cart_item(
         update_data=update_data
     )
     
-    # Recargar con relaciones
-    db.refresh(cart_item)
-    
     # Preparar respuesta
     primary_image = None
     if cart_item.product.product_images:
@@ -3,7 +3,7 @@
 # Descripción: Schemas de validación y serialización para el módulo de carrito de compras.
 #              Define las estructuras de datos para items del carrito, resúmenes y respuestas.
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional
 from datetime import datetime
 
@@ -35,6 +35,33 @@ class CartItemUpdate(BaseModel):
     quantity: int = Field(..., ge=1, description="Nueva cantidad del producto (mínimo 1)")
 
 
+class CartItemOperation(BaseModel):
+    """
+    Autor: Luis Flores
+    Descripción: Operación sobre una línea del carrito dentro de una actualización en lote.
+                 'set' fija la cantidad del producto (lo agrega si no está) y 'remove' lo quita.
+    """
+    op: str = Field(..., pattern="^(set|remove)$", description="Operación: 'set' o 'remove'")
+    product_id: int = Field(..., gt=0)
+    quantity: Optional[int] = Field(None, ge=1, description="Cantidad final (requerida en 'set')")
+
+    @model_validator(mode="after")
+    def validate_quantity(self):
+        """Valida que 'set' incluya la cantidad"""
+        if self.op == "set" and self.quantity is None:
+            raise ValueError("La operación 'set' requiere quantity")
+        return self
+
+
+class CartBatchUpdate(BaseModel):
+    """
+    Autor: Luis Flores
+    Descripción: Schema para aplicar varias operaciones al carrito en una sola petición
+                 (sincronización después de edición offline o "volver a comprar").
+    """
+    operations: List[CartItemOperation] = Field(..., min_length=1, max_length=200)
+
+
 class CartItemProductInfo(BaseModel):
     """
     Autor: Luis Flores
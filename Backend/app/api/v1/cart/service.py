@@ -2,15 +2,26 @@
 # Fecha: 13/11/2025
 # Descripción: Servicios de lógica de negocio para el carrito de compras. Implementa
 #              operaciones CRUD del carrito, validación de stock y cálculos de totales.
+#              Con CART_STORE_BACKEND distinto de "database", las cantidades viven en un
+#              store (memoria o Redis) y se persisten de forma diferida.
 
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import and_, or_, func, select, literal, update, bindparam
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException, status
+from datetime import datetime, timedelta, UTC
+import time
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
 
 from app.models.shopping_cart import ShoppingCart
 from app.models.cart_item import CartItem
 from app.models.product import Product
 from app.api.v1.cart import schemas
+from app.services.cart_store import CartStore, CartLines, create_cart_store
 
 
 class CartService:
@@ -21,6 +32,9 @@ class CartService:
                  con el carrito.
     """
     
+    # Store de carritos (write-behind). None = lectura y escritura directa en la BD
+    store: Optional[CartStore] = create_cart_store()
+    
     @staticmethod
     def get_or_create_cart(db: Session, user_id: int) -> ShoppingCart:
         """
@@ -33,6 +47,8 @@ class CartService:
         Retorna:
             ShoppingCart: Carrito del usuario (existente o recién creado).
         """
+        CartService.persist_cart(db, user_id)
+        
         cart = db.query(ShoppingCart).options(
             joinedload(ShoppingCart.cart_items).joinedload(CartItem.product)
         ).filter(ShoppingCart.user_id == user_id).first()
@@ -50,7 +66,8 @@ class CartService:
         """
         Autor: Luis Flores
         Descripción: Obtiene el carrito completo del usuario con todos los items
-                     y sus relaciones (producto, imágenes).
+                     y sus relaciones (producto, imágenes). Si hay cambios pendientes en
+                     el store se persisten antes de leer.
         Parámetros:
             db (Session): Sesión de base de datos.
             user_id (int): ID del usuario.
@@ -59,6 +76,8 @@ class CartService:
         Excepciones:
             HTTPException 404: Si el carrito no existe.
         """
+        CartService.persist_cart(db, user_id)
+        
         cart = db.query(ShoppingCart).options(
             joinedload(ShoppingCart.cart_items).joinedload(CartItem.product).joinedload(Product.product_images)
         ).filter(ShoppingCart.user_id == user_id).first()
@@ -80,7 +99,11 @@ class CartService:
         """
         Autor: Luis Flores
         Descripción: Agrega un producto al carrito o actualiza la cantidad si ya existe.
-                     Verifica disponibilidad del producto y suficiencia de stock.
+                     Verifica disponibilidad del producto y suficiencia de stock dentro del
+                     mismo INSERT ... ON CONFLICT DO UPDATE, por lo que dos clics simultáneos
+                     suman la cantidad en la misma línea en lugar de duplicarla.
+                     Con store, solo las líneas nuevas se insertan de inmediato (para obtener
+                     su cart_item_id); los incrementos se acumulan en el store.
         Parámetros:
             db (Session): Sesión de base de datos.
             user_id (int): ID del usuario.
@@ -91,66 +114,140 @@ class CartService:
             HTTPException 404: Si el producto no existe o no está disponible.
             HTTPException 400: Si no hay stock suficiente.
         """
-        # Obtener o crear carrito
-        cart = CartService.get_or_create_cart(db, user_id)
+        if CartService.store is not None:
+            return CartService._add_item_to_store(db, user_id, item_data)
         
-        # Verificar que el producto existe y está activo
-        product = db.query(Product).filter(
+        return CartService._upsert_item(db, user_id, item_data)
+    
+    @staticmethod
+    def _upsert_item(db: Session, user_id: int, item_data: schemas.CartItemAdd) -> CartItem:
+        """
+        Autor: Luis Flores
+        Descripción: Inserta la línea o suma la cantidad directamente en cart_item y hace commit.
+        Parámetros:
+            db (Session): Sesión de base de datos.
+            user_id (int): ID del usuario.
+            item_data (CartItemAdd): Datos del item a agregar.
+        Retorna:
+            CartItem: Item del carrito creado o actualizado.
+        """
+        cart_id = CartService._get_or_create_cart_id(db, user_id)
+        now = datetime.now(UTC)
+        
+        # Inserta la linea o suma la cantidad en una sola sentencia. El SELECT solo produce
+        # fila si el producto está activo y tiene stock para la cantidad pedida, y el
+        # DO UPDATE solo aplica si el stock alcanza para la cantidad acumulada.
+        insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else postgresql_insert
+        
+        product_row = select(
+            literal(cart_id),
+            Product.product_id,
+            literal(item_data.quantity),
+            literal(now),
+            literal(now)
+        ).where(
+            Product.product_id == item_data.product_id,
+            Product.is_active == True,
+            Product.stock >= item_data.quantity
+        )
+        
+        statement = insert(CartItem).from_select(
+            ["cart_id", "product_id", "quantity", "added_at", "updated_at"],
+            product_row
+        )
+        accumulated_quantity = CartItem.quantity + statement.excluded.quantity
+        statement = statement.on_conflict_do_update(
+            index_elements=[CartItem.cart_id, CartItem.product_id],
+            set_={
+                "quantity": accumulated_quantity,
+                "updated_at": statement.excluded.updated_at
+            },
+            where=select(Product.stock).where(
+                Product.product_id == item_data.product_id
+            ).scalar_subquery() >= accumulated_quantity
+        ).returning(CartItem.cart_item_id)
+        
+        cart_item_id = db.execute(statement).scalar()
+        
+        if cart_item_id is None:
+            # No se insertó ni actualizó: se identifica el motivo para responder igual que antes
+            db.rollback()
+            CartService._raise_add_item_error(db, cart_id, item_data)
+        
+        db.commit()
+        
+        return db.get(CartItem, cart_item_id, populate_existing=True)
+    
+    @staticmethod
+    def _get_or_create_cart_id(db: Session, user_id: int) -> int:
+        """
+        Autor: Luis Flores
+        Descripción: Obtiene el ID del carrito del usuario sin cargar sus items, creándolo
+                     si no existe. Si dos peticiones lo crean a la vez, la que pierde
+                     reutiliza el carrito de la otra (user_id es único).
+        Parámetros:
+            db (Session): Sesión de base de datos.
+            user_id (int): ID del usuario.
+        Retorna:
+            int: ID del carrito.
+        """
+        cart_id = db.query(ShoppingCart.cart_id).filter(ShoppingCart.user_id == user_id).scalar()
+        if cart_id is not None:
+            return cart_id
+        
+        try:
+            cart = ShoppingCart(user_id=user_id)
+            db.add(cart)
+            db.commit()
+            return cart.cart_id
+        except IntegrityError:
+            db.rollback()
+            return db.query(ShoppingCart.cart_id).filter(ShoppingCart.user_id == user_id).scalar()
+    
+    @staticmethod
+    def _raise_add_item_error(db: Session, cart_id: int, item_data: schemas.CartItemAdd) -> None:
+        """
+        Autor: Luis Flores
+        Descripción: Lanza el error correspondiente cuando el upsert de add_item_to_cart no
+                     afectó ninguna fila (producto no disponible o stock insuficiente).
+        Parámetros:
+            db (Session): Sesión de base de datos.
+            cart_id (int): ID del carrito.
+            item_data (CartItemAdd): Datos del item que se intentó agregar.
+        Excepciones:
+            HTTPException 404: Si el producto no existe o no está disponible.
+            HTTPException 400: Si no hay stock suficiente.
+        """
+        row = db.query(
+            Product.stock,
+            CartItem.quantity
+        ).outerjoin(
+            CartItem,
             and_(
-                Product.product_id == item_data.product_id,
-                Product.is_active == True
+                CartItem.product_id == Product.product_id,
+                CartItem.cart_id == cart_id
             )
+        ).filter(
+            Product.product_id == item_data.product_id,
+            Product.is_active == True
         ).first()
         
-        if not product:
+        if not row:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Producto no encontrado o no disponible"
             )
         
-        # Verificar stock disponible
-        if product.stock < item_data.quantity:
+        if row.quantity is None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Stock insuficiente. Disponible: {product.stock}"
+                detail=f"Stock insuficiente. Disponible: {row.stock}"
             )
         
-        # Verificar si el item ya existe en el carrito
-        existing_item = db.query(CartItem).filter(
-            and_(
-                CartItem.cart_id == cart.cart_id,
-                CartItem.product_id == item_data.product_id
-            )
-        ).first()
-        
-        if existing_item:
-            # Actualizar cantidad
-            new_quantity = existing_item.quantity + item_data.quantity
-            
-            if product.stock < new_quantity:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Stock insuficiente. Disponible: {product.stock}, en carrito: {existing_item.quantity}"
-                )
-            
-            existing_item.quantity = new_quantity
-            db.commit()
-            db.refresh(existing_item)
-            
-            return existing_item
-        else:
-            # Crear nuevo item
-            cart_item = CartItem(
-                cart_id=cart.cart_id,
-                product_id=item_data.product_id,
-                quantity=item_data.quantity
-            )
-            
-            db.add(cart_item)
-            db.commit()
-            db.refresh(cart_item)
-            
-            return cart_item
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Stock insuficiente. Disponible: {row.stock}, en carrito: {row.quantity}"
+        )
     
     @staticmethod
     def update_cart_item(
@@ -174,6 +271,9 @@ class CartService:
             HTTPException 404: Si el item o producto no existe.
             HTTPException 400: Si no hay stock suficiente.
         """
+        if CartService.store is not None:
+            return CartService._update_item_in_store(db, user_id, cart_item_id, update_data)
+        
         # Obtener el item y verificar que pertenece al usuario
         cart_item = db.query(CartItem).join(ShoppingCart).filter(
             and_(
@@ -212,6 +312,110 @@ class CartService:
         
         return cart_item
     
+    @staticmethod
+    def apply_cart_operations(
+        db: Session,
+        user_id: int,
+        batch_data: schemas.CartBatchUpdate
+    ) -> ShoppingCart:
+        """
+        Autor: Luis Flores
+        Descripción: Aplica en lote operaciones 'set' (fijar cantidad) y 'remove' sobre el
+                     carrito. Valida todos los productos y su stock con una sola consulta IN
+                     y aplica todo en una sola transacción: si una operación es inválida no
+                     se aplica ninguna.
+        Parámetros:
+            db (Session): Sesión de base de datos.
+            user_id (int): ID del usuario.
+            batch_data (CartBatchUpdate): Lista de operaciones a aplicar.
+        Retorna:
+            ShoppingCart: Carrito actualizado con items y productos.
+        Excepciones:
+            HTTPException 400: Si hay operaciones repetidas para un producto o falta stock.
+            HTTPException 404: Si un producto no existe o no está disponible.
+        """
+        operations = batch_data.operations
+        
+        product_ids = [operation.product_id for operation in operations]
+        if len(set(product_ids)) != len(product_ids):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Hay más de una operación para el mismo producto"
+            )
+        
+        set_operations = [operation for operation in operations if operation.op == "set"]
+        remove_ids = [operation.product_id for operation in operations if operation.op == "remove"]
+        
+        # Valida todos los productos a fijar con una sola consulta
+        if set_operations:
+            products = {
+                row.product_id: row
+                for row in db.query(
+                    Product.product_id,
+                    Product.name,
+                    Product.stock
+                ).filter(
+                    Product.product_id.in_([operation.product_id for operation in set_operations]),
+                    Product.is_active == True
+                ).all()
+            }
+            
+            for operation in set_operations:
+                product = products.get(operation.product_id)
+                if not product:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail=f"Producto {operation.product_id} no encontrado o no disponible"
+                    )
+                
+                if product.stock < operation.quantity:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Stock insuficiente para {product.name}. Disponible: {product.stock}"
+                    )
+        
+        # El lote se aplica directo en la BD: primero se persisten los cambios pendientes
+        CartService.persist_cart(db, user_id)
+        cart_id = CartService._get_or_create_cart_id(db, user_id)
+        
+        try:
+            if remove_ids:
+                db.query(CartItem).filter(
+                    CartItem.cart_id == cart_id,
+                    CartItem.product_id.in_(remove_ids)
+                ).delete(synchronize_session=False)
+            
+            if set_operations:
+                now = datetime.now(UTC)
+                insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else postgresql_insert
+                statement = insert(CartItem).values([
+                    {
+                        "cart_id": cart_id,
+                        "product_id": operation.product_id,
+                        "quantity": operation.quantity,
+                        "added_at": now,
+                        "updated_at": now
+                    }
+                    for operation in set_operations
+                ])
+                statement = statement.on_conflict_do_update(
+                    index_elements=[CartItem.cart_id, CartItem.product_id],
+                    set_={
+                        "quantity": statement.excluded.quantity,
+                        "updated_at": statement.excluded.updated_at
+                    }
+                )
+                db.execute(statement)
+            
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        
+        CartService.evict_cart(user_id)
+        
+        return CartService.get_cart(db, user_id)
+    
     @staticmethod
     def remove_item_from_cart(
         db: Session,
@@ -230,6 +434,12 @@ class CartService:
         Excepciones:
             HTTPException 404: Si el item no existe en el carrito del usuario.
         """
+        if CartService.store is not None:
+            product_id = CartService._find_store_line(db, user_id, cart_item_id)
+            CartService.store.set_quantity(user_id, product_id, 0)
+            CartService.store.mark_dirty(user_id)
+            return True
+        
         cart_item = db.query(CartItem).join(ShoppingCart).filter(
             and_(
                 CartItem.cart_item_id == cart_item_id,
@@ -261,6 +471,19 @@ class CartService:
         Excepciones:
             HTTPException 404: Si el carrito no existe.
         """
+        if CartService.store is not None:
+            cached = CartService._load_store_cart(db, user_id)
+            if cached is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Carrito no encontrado"
+                )
+            
+            for product_id in cached[1]:
+                CartService.store.set_quantity(user_id, product_id, 0)
+            CartService.store.mark_dirty(user_id)
+            return True
+        
         cart = db.query(ShoppingCart).filter(
             ShoppingCart.user_id == user_id
         ).first()
@@ -282,20 +505,42 @@ class CartService:
         """
         Autor: Luis Flores
         Descripción: Obtiene un resumen rápido del carrito con total de items y precio total.
+                     Se calcula con una sola consulta agregada (SUM) sin cargar los items,
+                     ya que el badge del carrito lo consulta en cada página.
         Parámetros:
             db (Session): Sesión de base de datos.
             user_id (int): ID del usuario.
         Retorna:
             dict: Diccionario con 'total_items' y 'total_price'.
+        Excepciones:
+            HTTPException 404: Si el carrito no existe.
         """
-        cart = CartService.get_cart(db, user_id)
+        if CartService.store is not None:
+            return CartService._summarize_store_cart(db, user_id)
         
-        total_items = sum(item.quantity for item in cart.cart_items)
-        total_price = sum(item.quantity * item.product.price for item in cart.cart_items)
+        row = db.query(
+            ShoppingCart.cart_id,
+            func.coalesce(func.sum(CartItem.quantity), 0).label("total_items"),
+            func.coalesce(func.sum(CartItem.quantity * Product.price), 0).label("total_price")
+        ).outerjoin(
+            CartItem, CartItem.cart_id == ShoppingCart.cart_id
+        ).outerjoin(
+            Product, Product.product_id == CartItem.product_id
+        ).filter(
+            ShoppingCart.user_id == user_id
+        ).group_by(
+            ShoppingCart.cart_id
+        ).first()
+        
+        if not row:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Carrito no encontrado"
+            )
         
         return {
-            "total_items": total_items,
-            "total_price": round(total_price, 2)
+            "total_items": int(row.total_items),
+            "total_price": round(Decimal(row.total_price), 2)
         }
     
     @staticmethod
@@ -304,39 +549,539 @@ class CartService:
         Autor: Luis Flores
         Descripción: Valida que todos los productos en el carrito tengan stock suficiente.
                      Retorna información sobre productos sin stock o con stock insuficiente.
+                     Una sola consulta trae únicamente las líneas con problemas (el carrito
+                     se une por outer join para distinguir un carrito válido de uno inexistente).
         Parámetros:
             db (Session): Sesión de base de datos.
             user_id (int): ID del usuario.
         Retorna:
             dict: Diccionario con 'valid' (bool) y lista de 'issues' con problemas encontrados.
+        Excepciones:
+            HTTPException 404: Si el carrito no existe.
         """
-        cart = CartService.get_cart(db, user_id)
+        if CartService.store is not None:
+            return CartService._validate_store_cart(db, user_id)
+        
+        offending_lines = select(
+            CartItem.cart_id,
+            CartItem.cart_item_id,
+            CartItem.quantity,
+            Product.product_id,
+            Product.name,
+            Product.stock,
+            Product.is_active
+        ).join(
+            Product, Product.product_id == CartItem.product_id
+        ).where(
+            or_(
+                Product.is_active == False,
+                Product.stock < CartItem.quantity
+            )
+        ).subquery()
+        
+        rows = db.query(
+            ShoppingCart.cart_id,
+            offending_lines
+        ).outerjoin(
+            offending_lines, offending_lines.c.cart_id == ShoppingCart.cart_id
+        ).filter(
+            ShoppingCart.user_id == user_id
+        ).order_by(
+            offending_lines.c.cart_item_id
+        ).all()
+        
+        if not rows:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Carrito no encontrado"
+            )
         
         issues = []
         
-        for item in cart.cart_items:
-            product = item.product
+        for row in rows:
+            if row.cart_item_id is None:
+                continue
+            
+            if not row.is_active:
+                issues.append({
+                    "cart_item_id": row.cart_item_id,
+                    "product_id": row.product_id,
+                    "product_name": row.name,
+                    "issue": "Producto no disponible",
+                    "requested": row.quantity,
+                    "available": 0
+                })
+            else:
+                issues.append({
+                    "cart_item_id": row.cart_item_id,
+                    "product_id": row.product_id,
+                    "product_name": row.name,
+                    "issue": "Stock insuficiente",
+                    "requested": row.quantity,
+                    "available": row.stock
+                })
+        
+        return {
+            "valid": len(issues) == 0,
+            "issues": issues
+        }
+    
+    @staticmethod
+    def purge_abandoned_items(
+        db: Session,
+        max_age_days: int,
+        batch_size: int = 1000,
+        max_batches: int = 500
+    ) -> dict:
+        """
+        Autor: Luis Flores
+        Descripción: Elimina las líneas de carrito que no han cambiado en max_age_days días
+                     (carritos abandonados). Trabaja por lotes de IDs con un commit por lote
+                     para no mantener locks largos sobre cart_item. Antes de empezar persiste
+                     los cambios pendientes del store y, al terminar cada lote, descarta del
+                     store los carritos afectados.
+        Parámetros:
+            db (Session): Sesión de base de datos.
+            max_age_days (int): Antigüedad mínima (por updated_at) para eliminar una línea.
+            batch_size (int): Líneas eliminadas por transacción.
+            max_batches (int): Máximo de lotes por ejecución.
+        Retorna:
+            dict: Líneas eliminadas, lotes ejecutados y duración en segundos.
+        """
+        started = time.monotonic()
+        cutoff = datetime.now(UTC) - timedelta(days=max_age_days)
+        
+        CartService.flush_pending_carts(db)
+        
+        deleted = 0
+        batches = 0
+        while batches < max_batches:
+            rows = db.query(
+                CartItem.cart_item_id,
+                ShoppingCart.user_id
+            ).join(
+                ShoppingCart, ShoppingCart.cart_id == CartItem.cart_id
+            ).filter(
+                CartItem.updated_at < cutoff
+            ).order_by(
+                CartItem.updated_at
+            ).limit(batch_size).all()
+            
+            if not rows:
+                break
+            
+            try:
+                deleted += db.query(CartItem).filter(
+                    CartItem.cart_item_id.in_([row.cart_item_id for row in rows]),
+                    CartItem.updated_at < cutoff
+                ).delete(synchronize_session=False)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
             
+            batches += 1
+            for user_id in {row.user_id for row in rows}:
+                CartService.evict_cart(user_id)
+            
+            if len(rows) < batch_size:
+                break
+        
+        return {
+            "deleted": deleted,
+            "batches": batches,
+            "duration_seconds": round(time.monotonic() - started, 3)
+        }
+    
+    # ==================== STORE (WRITE-BEHIND) ====================
+    
+    @staticmethod
+    def persist_cart(db: Session, user_id: int, commit: bool = True) -> None:
+        """
+        Autor: Luis Flores
+        Descripción: Escribe en cart_item las cantidades pendientes del store para un usuario
+                     (UPDATE solo de las líneas que cambiaron, DELETE de las eliminadas e
+                     INSERT de las que se volvieron a agregar después de un DELETE).
+                     Se llama desde el job periódico, al leer el carrito completo y al
+                     iniciar el checkout. Sin store no hace nada.
+        Parámetros:
+            db (Session): Sesión de base de datos.
+            user_id (int): ID del usuario.
+            commit (bool): Si es False solo hace flush, para que los cambios formen parte
+                           de la transacción del llamador (ej. creación de la orden).
+        """
+        store = CartService.store
+        if store is None:
+            return
+        
+        if commit and not store.clear_dirty(user_id):
+            return
+        
+        try:
+            if commit:
+                CartService._flush_store_cart(db, user_id)
+            else:
+                CartService._write_store_cart(db, user_id)
+                db.flush()
+        except Exception:
+            if commit:
+                db.rollback()
+                store.mark_dirty(user_id)
+            raise
+    
+    @staticmethod
+    def flush_pending_carts(db: Session, batch_size: int = 200) -> Dict:
+        """
+        Autor: Luis Flores
+        Descripción: Persiste todos los carritos con cambios pendientes en el store, por lotes.
+                     Los carritos que fallan se vuelven a marcar para el siguiente intento.
+                     Se ejecuta desde el scheduler y al detener la aplicación.
+        Parámetros:
+            db (Session): Sesión de base de datos.
+            batch_size (int): Carritos que se toman del store por lote.
+        Retorna:
+            dict: Carritos persistidos y fallidos.
+        """
+        store = CartService.store
+        stats = {"persisted": 0, "failed": 0}
+        if store is None:
+            return stats
+        
+        failed = []
+        while True:
+            user_ids = store.pop_dirty(batch_size)
+            if not user_ids:
+                break
+            
+            for user_id in user_ids:
+                try:
+                    CartService._flush_store_cart(db, user_id)
+                except Exception:
+                    db.rollback()
+                    failed.append(user_id)
+                    continue
+                
+                stats["persisted"] += 1
+        
+        for user_id in failed:
+            store.mark_dirty(user_id)
+        stats["failed"] = len(failed)
+        
+        return stats
+    
+    @staticmethod
+    def evict_cart(user_id: int) -> None:
+        """
+        Autor: Luis Flores
+        Descripción: Descarta el carrito del store después de modificarlo directo en la BD
+                     (ej. al convertirlo en orden); se vuelve a cargar en el siguiente uso.
+        Parámetros:
+            user_id (int): ID del usuario.
+        """
+        if CartService.store is not None:
+            CartService.store.discard(user_id)
+    
+    @staticmethod
+    def _flush_store_cart(db: Session, user_id: int) -> None:
+        """
+        Persiste con commit las líneas del store y después actualiza en el store los
+        cart_item_id de las líneas eliminadas e insertadas. El rollback queda a cargo del
+        llamador.
+        """
+        deleted, inserted = CartService._write_store_cart(db, user_id)
+        db.commit()
+        
+        store = CartService.store
+        for product_id, cart_item_id in deleted.items():
+            store.clear_line_id_if(user_id, product_id, cart_item_id)
+        for product_id, cart_item_id in inserted.items():
+            store.assign_line_id(user_id, product_id, cart_item_id)
+    
+    @staticmethod
+    def _write_store_cart(db: Session, user_id: int) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """
+        Ejecuta el UPDATE/DELETE de las líneas del store, y el INSERT de las líneas con
+        cantidad pero sin cart_item_id, sin commit. Regresa las líneas eliminadas e
+        insertadas como {product_id: cart_item_id}.
+        """
+        cached = CartService.store.get(user_id)
+        if cached is None:
+            return {}, {}
+        
+        cart_id = cached[0]
+        now = datetime.now(UTC)
+        updates = []
+        deleted = {}
+        readded = []
+        for product_id, (cart_item_id, quantity) in cached[1].items():
+            if cart_item_id is None:
+                # Línea que se volvió a agregar después de persistir su DELETE
+                if quantity > 0:
+                    readded.append({
+                        "cart_id": cart_id,
+                        "product_id": product_id,
+                        "quantity": quantity,
+                        "added_at": now,
+                        "updated_at": now
+                    })
+                continue
+            if quantity > 0:
+                updates.append({"b_cart_item_id": cart_item_id, "b_quantity": quantity})
+            else:
+                deleted[product_id] = cart_item_id
+        
+        if updates:
+            table = CartItem.__table__
+            db.execute(
+                update(table).where(
+                    table.c.cart_item_id == bindparam("b_cart_item_id"),
+                    table.c.quantity != bindparam("b_quantity")
+                ).values(
+                    quantity=bindparam("b_quantity"),
+                    updated_at=now
+                ),
+                updates
+            )
+        
+        if deleted:
+            db.query(CartItem).filter(
+                CartItem.cart_item_id.in_(list(deleted.values()))
+            ).delete(synchronize_session=False)
+        
+        inserted = {}
+        if readded:
+            # Mismo upsert por (cart_id, product_id) que add_item_to_cart, pero con la
+            # cantidad del store (ya validada contra el stock al agregarla)
+            insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else postgresql_insert
+            statement = insert(CartItem).values(readded)
+            statement = statement.on_conflict_do_update(
+                index_elements=[CartItem.cart_id, CartItem.product_id],
+                set_={
+                    "quantity": statement.excluded.quantity,
+                    "updated_at": statement.excluded.updated_at
+                }
+            ).returning(CartItem.product_id, CartItem.cart_item_id)
+            inserted = dict(db.execute(statement).all())
+        
+        return deleted, inserted
+    
+    @staticmethod
+    def _load_store_cart(db: Session, user_id: int) -> Optional[Tuple[int, CartLines]]:
+        """
+        Regresa (cart_id, líneas) del store, cargándolo de la BD con una sola consulta la
+        primera vez. Regresa None si el usuario no tiene carrito.
+        """
+        cached = CartService.store.get(user_id)
+        if cached is not None:
+            return cached
+        
+        rows = db.query(
+            ShoppingCart.cart_id,
+            CartItem.cart_item_id,
+            CartItem.product_id,
+            CartItem.quantity
+        ).outerjoin(
+            CartItem, CartItem.cart_id == ShoppingCart.cart_id
+        ).filter(
+            ShoppingCart.user_id == user_id
+        ).all()
+        
+        if not rows:
+            return None
+        
+        CartService.store.load(user_id, rows[0].cart_id, {
+            row.product_id: (row.cart_item_id, row.quantity)
+            for row in rows if row.cart_item_id is not None
+        })
+        return CartService.store.get(user_id)
+    
+    @staticmethod
+    def _find_store_line(db: Session, user_id: int, cart_item_id: int) -> int:
+        """
+        Regresa el product_id de la línea cart_item_id del usuario o lanza 404.
+        """
+        cached = CartService._load_store_cart(db, user_id)
+        lines = cached[1] if cached else {}
+        for product_id, (line_id, quantity) in lines.items():
+            if line_id == cart_item_id and quantity > 0:
+                return product_id
+        
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Item no encontrado en el carrito"
+        )
+    
+    @staticmethod
+    def _item_with_quantity(db: Session, cart_item_id: int, quantity: int) -> CartItem:
+        """
+        Carga la línea de la BD con la cantidad del store, sin marcarla como modificada
+        (la sesión no la vuelve a escribir).
+        """
+        cart_item = db.get(CartItem, cart_item_id)
+        if cart_item is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Item no encontrado en el carrito"
+            )
+        
+        set_committed_value(cart_item, "quantity", quantity)
+        return cart_item
+    
+    @staticmethod
+    def _add_item_to_store(db: Session, user_id: int, item_data: schemas.CartItemAdd) -> CartItem:
+        """
+        add_item_to_cart con store: una línea nueva se inserta en la BD, un incremento se
+        aplica de forma atómica en el store y se revierte si excede el stock.
+        """
+        store = CartService.store
+        cached = CartService._load_store_cart(db, user_id)
+        line = cached[1].get(item_data.product_id) if cached else None
+        
+        if line is not None and line[0] is None and line[1] > 0:
+            # Línea que se volvió a agregar y aún no tiene fila: se inserta antes de sumar
+            try:
+                CartService._flush_store_cart(db, user_id)
+            except Exception:
+                db.rollback()
+                raise
+            cached = store.get(user_id)
+            line = cached[1].get(item_data.product_id) if cached else None
+        
+        if line is None or line[0] is None:
+            cart_item = CartService._upsert_item(db, user_id, item_data)
+            if cached is None:
+                CartService._load_store_cart(db, user_id)
+            else:
+                store.set_line(user_id, item_data.product_id, cart_item.cart_item_id, cart_item.quantity)
+            return cart_item
+        
+        stock = db.query(Product.stock).filter(
+            Product.product_id == item_data.product_id,
+            Product.is_active == True
+        ).scalar()
+        
+        if stock is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Producto no encontrado o no disponible"
+            )
+        
+        quantity = store.increment(user_id, item_data.product_id, item_data.quantity)
+        if quantity > stock:
+            store.increment(user_id, item_data.product_id, -item_data.quantity)
+            in_cart = quantity - item_data.quantity
+            detail = f"Stock insuficiente. Disponible: {stock}"
+            if in_cart > 0:
+                detail += f", en carrito: {in_cart}"
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+        
+        store.mark_dirty(user_id)
+        return CartService._item_with_quantity(db, line[0], quantity)
+    
+    @staticmethod
+    def _update_item_in_store(
+        db: Session,
+        user_id: int,
+        cart_item_id: int,
+        update_data: schemas.CartItemUpdate
+    ) -> CartItem:
+        """
+        update_cart_item con store: valida el stock y fija la cantidad en el store.
+        """
+        product_id = CartService._find_store_line(db, user_id, cart_item_id)
+        
+        stock = db.query(Product.stock).filter(Product.product_id == product_id).scalar()
+        if stock is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Producto no encontrado"
+            )
+        
+        if stock < update_data.quantity:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Stock insuficiente. Disponible: {stock}"
+            )
+        
+        CartService.store.set_quantity(user_id, product_id, update_data.quantity)
+        CartService.store.mark_dirty(user_id)
+        return CartService._item_with_quantity(db, cart_item_id, update_data.quantity)
+    
+    @staticmethod
+    def _store_lines_with_products(db: Session, user_id: int) -> list:
+        """
+        Regresa las líneas vigentes del store con los datos de su producto (una consulta
+        IN a product), ordenadas por cart_item_id. Lanza 404 si no hay carrito.
+        """
+        cached = CartService._load_store_cart(db, user_id)
+        if cached is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Carrito no encontrado"
+            )
+        
+        lines = {
+            product_id: line for product_id, line in cached[1].items() if line[1] > 0
+        }
+        if not lines:
+            return []
+        
+        products = db.query(
+            Product.product_id,
+            Product.name,
+            Product.price,
+            Product.stock,
+            Product.is_active
+        ).filter(Product.product_id.in_(list(lines))).all()
+        
+        return sorted(
+            [(lines[product.product_id][0], lines[product.product_id][1], product) for product in products],
+            key=lambda line: line[0] or 0
+        )
+    
+    @staticmethod
+    def _summarize_store_cart(db: Session, user_id: int) -> dict:
+        """
+        get_cart_summary con store: totales a partir de las cantidades del store.
+        """
+        total_items = 0
+        total_price = Decimal("0")
+        for _, quantity, product in CartService._store_lines_with_products(db, user_id):
+            total_items += quantity
+            total_price += quantity * product.price
+        
+        return {
+            "total_items": total_items,
+            "total_price": round(Decimal(total_price), 2)
+        }
+    
+    @staticmethod
+    def _validate_store_cart(db: Session, user_id: int) -> dict:
+        """
+        validate_cart_stock con store: mismas reglas sobre las cantidades del store.
+        """
+        issues = []
+        for cart_item_id, quantity, product in CartService._store_lines_with_products(db, user_id):
             if not product.is_active:
                 issues.append({
-                    "cart_item_id": item.cart_item_id,
+                    "cart_item_id": cart_item_id,
                     "product_id": product.product_id,
                     "product_name": product.name,
                     "issue": "Producto no disponible",
-                    "requested": item.quantity,
+                    "requested": quantity,
                     "available": 0
                 })
-            elif product.stock < item.quantity:
+            elif product.stock < quantity:
                 issues.append({
-                    "cart_item_id": item.cart_item_id,
+                    "cart_item_id": cart_item_id,
                     "product_id": product.product_id,
                     "product_name": product.name,
                     "issue": "Stock insuficiente",
-                    "requested": item.quantity,
+                    "requested": quantity,
                     "available": product.stock
                 })
         
         return {
             "valid": len(issues) == 0,
             "issues": issues
-        }
\ No newline at end of file
+        }
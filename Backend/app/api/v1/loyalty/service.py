@@ -2,21 +2,84 @@
 # Fecha: 15-11-2025
 # Descripción: Servicio encargado de gestionar el programa de lealtad, puntos, tiers y cupones
 
+from sqlalchemy import Date, and_, func, insert, literal, null, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import Dict
-from datetime import date, timedelta
+from typing import Dict, List
+from datetime import date, datetime, timedelta, UTC
+import hashlib
+import logging
+import time
 from app.models.user import User
 from app.models.user_loyalty import UserLoyalty
 from app.models.loyalty_tier import LoyaltyTier
 from app.models.point_history import PointHistory
 from app.models.user_coupon import UserCoupon
 from app.models.coupon import Coupon
+from app.models.coupon_issuance_run import CouponIssuanceRun
+from app.models.enum import PointEventType, CouponIssuanceStatus
+from app.core.database import for_update_skip_locked
 from decimal import Decimal
+from app.config import settings
 import random
 import string
 
+logger = logging.getLogger(__name__)
+
+# Intentos de generar cupones aleatorios cuando un código ya existe
+COUPON_CODE_ATTEMPTS = 3
+
+# Códigos de la emisión mensual: una permutación con llave de 50 bits (run_id << 28 | posición)
+# escrita en base 36 con 10 caracteres. Los códigos aleatorios tienen 6, así que no se cruzan.
+SEQUENCE_CODE_LENGTH = 10
+SEQUENCE_HALF_BITS = 25
+SEQUENCE_POSITION_BITS = 28
+SEQUENCE_ROUNDS = 4
+CODE_ALPHABET = string.digits + string.ascii_uppercase
+
 class LoyaltyService:
     
+    def __init__(self):
+        # Tabla de tiers en memoria: tier_id -> datos del tier (cambia muy poco)
+        self._tier_cache = None
+        self._tier_cache_loaded_at = 0.0
+    
+    def get_cached_tiers(self, db: Session) -> Dict[int, Dict]:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Regresa la tabla de tiers desde memoria, recargándola de la base de datos
+            cuando expira (LOYALTY_TIER_CACHE_SECONDS). Evita consultar loyalty_tier
+            en cada checkout.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+
+        Retorna:
+            Dict[int, Dict]: Datos de cada tier indexados por tier_id.
+        """
+        now = time.monotonic()
+        if self._tier_cache is None or now - self._tier_cache_loaded_at > settings.LOYALTY_TIER_CACHE_SECONDS:
+            tiers = db.query(LoyaltyTier).order_by(LoyaltyTier.tier_level).all()
+            self._tier_cache = {
+                tier.tier_id: {
+                    "tier_id": tier.tier_id,
+                    "tier_level": tier.tier_level,
+                    "min_points_required": tier.min_points_required,
+                    "points_multiplier": tier.points_multiplier,
+                    "free_shipping_threshold": tier.free_shipping_threshold,
+                    "monthly_coupons_count": tier.monthly_coupons_count,
+                    "coupon_discount_percentage": tier.coupon_discount_percentage
+                }
+                for tier in tiers
+            }
+            self._tier_cache_loaded_at = now
+        
+        return self._tier_cache
+    
     def get_user_loyalty_status(self, db: Session, cognito_sub: str) -> Dict:
         """
         Autor: Lizbeth Barajas
@@ -103,7 +166,7 @@ class LoyaltyService:
         except Exception as e:
             return {"success": False, "error": f"Error al obtener estado de lealtad: {str(e)}"}
     
-    def add_points(self, db: Session, loyalty_id: int, points: int, order_id: int) -> Dict:
+    def add_points(self, db: Session, loyalty_id: int, points: int, order_id: int, commit: bool = True) -> Dict:
         """
         Autor: Lizbeth Barajas
 
@@ -116,6 +179,8 @@ class LoyaltyService:
             loyalty_id (int): Identificador del registro de lealtad del usuario.
             points (int): Puntos a agregar.
             order_id (int): Identificador de la orden asociada al evento.
+            commit (bool): Si es False solo hace flush y deja el commit (o rollback) al que
+                           llama, p. ej. el worker del outbox que procesa eventos por lote.
 
         Retorna:
             Dict: Resultado de la operación, incluyendo el nuevo total de puntos y expiración.
@@ -152,8 +217,11 @@ class LoyaltyService:
             # Verificar si debe subir de tier
             self._check_tier_upgrade(db, user_loyalty)
             
-            db.commit()
-            db.refresh(user_loyalty)
+            if commit:
+                db.commit()
+                db.refresh(user_loyalty)
+            else:
+                db.flush()
             
             return {
                 "success": True,
@@ -162,7 +230,8 @@ class LoyaltyService:
                 "expiration_date": user_loyalty.points_expiration_date
             }
         except Exception as e:
-            db.rollback()
+            if commit:
+                db.rollback()
             return {"success": False, "error": f"Error al agregar puntos: {str(e)}"}
     
     def expire_points_for_user(self, db: Session, cognito_sub: str) -> Dict:
@@ -248,62 +317,102 @@ class LoyaltyService:
             db.rollback()
             return {"success": False, "error": f"Error al expirar puntos: {str(e)}"}
     
-    def expire_all_points(self, db: Session) -> Dict:
+    def expire_all_points(self, db: Session, batch_size: int = settings.POINTS_EXPIRY_BATCH_SIZE) -> Dict:
         """
         Autor: Lizbeth Barajas
 
         Descripción:
             Proceso masivo que expira los puntos de todos los usuarios cuya fecha de expiración
-            ya venció. Se usa en tareas programadas (cron job).
+            ya venció. Se usa en tareas programadas (cron job). Recorre user_loyalty por rangos
+            de batch_size IDs, cada uno en su propia transacción y sin cargar filas en el ORM:
+            un INSERT INTO point_history ... SELECT registra la expiración de las cuentas con
+            puntos y un UPDATE las resetea al tier 1 (subconsulta). Las cuentas vencidas del
+            rango se reclaman antes con SELECT ... FOR UPDATE SKIP LOCKED, así que varias
+            réplicas pueden correr el job a la vez y cada una expira cuentas distintas. En
+            SQLite el INSERT toma el bloqueo de escritura de la base, que se mantiene hasta el
+            commit del rango.
 
         Parámetros:
             db (Session): Sesión activa de la base de datos.
+            batch_size (int): IDs de user_loyalty por rango.
 
         Retorna:
-            Dict: Estadísticas del proceso, incluyendo usuarios afectados y total de puntos expirados.
+            Dict: Estadísticas del proceso, incluyendo usuarios afectados, total de puntos
+                  expirados y número de lotes.
         """
         try:
             today = date.today()
-            
-            # Obtener todos los usuarios cuya fecha de expiracion ya paso
-            expired_loyalties = db.query(UserLoyalty).filter(
+            started = time.monotonic()
+            expired = and_(
                 UserLoyalty.points_expiration_date.isnot(None),
                 UserLoyalty.points_expiration_date <= today
-            ).all()
+            )
+            tier_1 = select(LoyaltyTier.tier_id).order_by(LoyaltyTier.tier_level).limit(1).scalar_subquery()
             
             users_affected = 0
             total_expired_points = 0
+            batches = 0
             
-            tier_1 = db.query(LoyaltyTier).order_by(LoyaltyTier.tier_level).first()
+            first_id, last_id = db.execute(
+                select(func.min(UserLoyalty.loyalty_id), func.max(UserLoyalty.loyalty_id))
+            ).one()
+            db.commit()
+            if first_id is None:
+                last_id = first_id = 0
             
-            for user_loyalty in expired_loyalties:
-                if user_loyalty.total_points > 0:
-                    # Crear registro de expiracion
-                    expiration_record = PointHistory(
-                        loyalty_id=user_loyalty.loyalty_id,
-                        order_id=None,
-                        points_change=-user_loyalty.total_points,
-                        event_type="expired",
-                        event_date=today
+            for range_start in range(first_id, last_id + 1, batch_size):
+                in_range = UserLoyalty.loyalty_id.between(range_start, range_start + batch_size - 1)
+                
+                # Las cuentas del rango quedan bloqueadas hasta el commit; las que otro
+                # proceso tiene bloqueadas se saltan
+                loyalty_ids = db.execute(
+                    for_update_skip_locked(select(UserLoyalty.loyalty_id).where(in_range, expired), db)
+                ).scalars().all()
+                if not loyalty_ids:
+                    db.commit()
+                    continue
+                claimed = and_(in_range, expired, UserLoyalty.loyalty_id.in_(loyalty_ids))
+                with_points = and_(claimed, UserLoyalty.total_points > 0)
+                
+                # Crear registros de expiracion
+                db.execute(
+                    insert(PointHistory).from_select(
+                        ["loyalty_id", "order_id", "points_change", "event_type", "event_date"],
+                        select(
+                            UserLoyalty.loyalty_id,
+                            null(),
+                            -UserLoyalty.total_points,
+                            literal(PointEventType.EXPIRED, PointHistory.event_type.type),
+                            literal(today, Date)
+                        ).where(with_points)
                     )
-                    db.add(expiration_record)
-                    
-                    total_expired_points += user_loyalty.total_points
-                    users_affected += 1
+                )
+                expired_count, expired_points = db.execute(
+                    select(func.count(), func.coalesce(func.sum(UserLoyalty.total_points), 0)).where(with_points)
+                ).one()
                 
                 # Resetear puntos y tier
-                user_loyalty.total_points = 0
-                user_loyalty.last_points_update = today
-                user_loyalty.points_expiration_date = None
-                user_loyalty.tier_id = tier_1.tier_id
-                user_loyalty.tier_achieved_date = today
-            
-            db.commit()
+                db.execute(
+                    update(UserLoyalty).where(claimed).values(
+                        total_points=0,
+                        last_points_update=today,
+                        points_expiration_date=None,
+                        tier_id=tier_1,
+                        tier_achieved_date=today
+                    ).execution_options(synchronize_session=False)
+                )
+                db.commit()
+                
+                batches += 1
+                users_affected += expired_count
+                total_expired_points += expired_points
             
             return {
                 "success": True,
                 "users_affected": users_affected,
-                "total_expired_points": total_expired_points
+                "total_expired_points": total_expired_points,
+                "batches": batches,
+                "duration_seconds": round(time.monotonic() - started, 3)
             }
         except Exception as e:
             db.rollback()
@@ -445,7 +554,7 @@ class LoyaltyService:
             str: Código generado aleatoriamente.
         """
         characters = string.ascii_uppercase + string.digits
-        # en produccion, verificar la unicidad del codigo
+        # la unicidad la garantiza la restricción de coupon_code (se reintenta con otro código)
         return "".join(random.choice(characters) for _ in range(length))
 
     def generate_monthly_coupons_for_user(self, db: Session, user_id: int):
@@ -466,7 +575,7 @@ class LoyaltyService:
 
         try:
             current_date = date.today()
-            expiration_date = current_date + timedelta(days=30)
+            expiration_date = current_date + timedelta(days=settings.COUPON_VALIDITY_DAYS)
       
             user_loyalty = db.query(UserLoyalty).filter(UserLoyalty.user_id == user_id).first()
             
@@ -485,30 +594,39 @@ class LoyaltyService:
             # El campo discount_value es Decimal(5, 2), por lo que 5% es 5.00
             discount_value = Decimal(discount_percent)
             
-            generated_coupons = []
-            
-            for _ in range(num_coupons):
-                coupon_code = LoyaltyService.generate_random_coupon_code() 
-                
-                new_coupon = Coupon(
-                    coupon_code=coupon_code,
-                    discount_value=discount_value,
-                    start_date=current_date,
-                    expiration_date=expiration_date,
-                    is_active=True
-                )
-                
-                db.add(new_coupon)
-                db.flush()  # Para obtener el coupon_id
-
-                user_coupon_assignment = UserCoupon(
-                    user_id=user_id,
-                    coupon_id=new_coupon.coupon_id,
-                    used_date=None # Inicialmente no ha sido usado
-                )
-                
-                db.add(user_coupon_assignment)
-                generated_coupons.append(coupon_code)
+            # Un INSERT para todos los cupones; si un código aleatorio ya existe se
+            # deshace solo el savepoint y se intenta con códigos nuevos
+            coupon_ids = []
+            for attempt in range(COUPON_CODE_ATTEMPTS):
+                generated_coupons = [LoyaltyService.generate_random_coupon_code() for _ in range(num_coupons)]
+                if not generated_coupons:
+                    break
+                try:
+                    with db.begin_nested():
+                        coupon_ids = db.execute(
+                            insert(Coupon).returning(Coupon.coupon_id),
+                            [
+                                {
+                                    "coupon_code": coupon_code,
+                                    "discount_value": discount_value,
+                                    "start_date": current_date,
+                                    "expiration_date": expiration_date,
+                                    "is_active": True
+                                }
+                                for coupon_code in generated_coupons
+                            ]
+                        ).scalars().all()
+                    break
+                except IntegrityError:
+                    if attempt == COUPON_CODE_ATTEMPTS - 1:
+                        raise
+
+            if coupon_ids:
+                # Inicialmente no han sido usados
+                db.execute(insert(UserCoupon), [
+                    {"user_id": user_id, "coupon_id": coupon_id, "used_date": None}
+                    for coupon_id in coupon_ids
+                ])
 
             db.commit()
             
@@ -518,5 +636,256 @@ class LoyaltyService:
         except Exception as e:
             db.rollback()
             raise Exception(f"Error al generar cupones: {str(e)}")
-    
+
+    @staticmethod
+    def generate_sequence_coupon_code(run_id: int, position: int) -> str:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Código del cupón número `position` de la emisión `run_id`. Una red Feistel de
+            SEQUENCE_ROUNDS rondas (BLAKE2b con la llave COUPON_CODE_SECRET) permuta el número de
+            secuencia, así que dos posiciones distintas nunca dan el mismo código y los
+            códigos no se pueden adivinar a partir de otro. No requiere consultar la base.
+
+        Parámetros:
+            run_id (int): Emisión mensual (coupon_issuance_run).
+            position (int): Posición del cupón dentro de la emisión.
+
+        Retorna:
+            str: Código de SEQUENCE_CODE_LENGTH caracteres.
+        """
+        if position >= 1 << SEQUENCE_POSITION_BITS or run_id >= 1 << (2 * SEQUENCE_HALF_BITS - SEQUENCE_POSITION_BITS):
+            raise ValueError("La secuencia de códigos de cupón se agotó")
+
+        key = hashlib.sha256((settings.COUPON_CODE_SECRET or settings.JWT_SECRET_KEY).encode()).digest()
+        mask = (1 << SEQUENCE_HALF_BITS) - 1
+        value = (run_id << SEQUENCE_POSITION_BITS) | position
+        left, right = value >> SEQUENCE_HALF_BITS, value & mask
+        for round_number in range(SEQUENCE_ROUNDS):
+            digest = hashlib.blake2b(bytes([round_number]) + right.to_bytes(4, "big"), key=key, digest_size=4).digest()
+            left, right = right, left ^ (int.from_bytes(digest, "big") & mask)
+        value = (left << SEQUENCE_HALF_BITS) | right
+
+        code = []
+        for _ in range(SEQUENCE_CODE_LENGTH):
+            value, digit = divmod(value, len(CODE_ALPHABET))
+            code.append(CODE_ALPHABET[digit])
+        return "".join(reversed(code))
+
+    def issue_monthly_coupons(self, db: Session, chunk_size: int = settings.COUPON_ISSUANCE_CHUNK_SIZE) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Emisión mensual de cupones para toda la base de lealtad (cron job del día 1).
+            Recorre a los usuarios activos por user_id en bloques de chunk_size; por bloque,
+            un INSERT ... RETURNING crea todos los cupones y otro INSERT los asigna, con
+            códigos de generate_sequence_coupon_code (sin colisiones ni consultas previas).
+            El avance se guarda en coupon_issuance_run (cursor, usuarios y cupones emitidos)
+            en la misma transacción que los cupones: si el job se interrumpe, la siguiente
+            ejecución del mes continúa donde se quedó, y si corre en varias réplicas cada
+            bloque lo reserva solo una (UPDATE condicional sobre el cursor). Cada usuario
+            recibe sus cupones una sola vez por mes.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            chunk_size (int): Usuarios por bloque (una transacción cada uno).
+
+        Retorna:
+            Dict: Emisión, usuarios procesados, cupones emitidos y bloques de esta ejecución.
+        """
+        try:
+            started = time.monotonic()
+            today = date.today()
+            expiration_date = today + timedelta(days=settings.COUPON_VALIDITY_DAYS)
+            run_id = self._open_coupon_issuance_run(db, today.replace(day=1))
+            
+            users_processed = 0
+            coupons_issued = 0
+            chunks = 0
+            
+            while True:
+                run = db.execute(
+                    select(
+                        CouponIssuanceRun.status,
+                        CouponIssuanceRun.last_user_id,
+                        CouponIssuanceRun.users_processed,
+                        CouponIssuanceRun.coupons_issued,
+                        CouponIssuanceRun.total_users
+                    ).where(CouponIssuanceRun.run_id == run_id)
+                ).one()
+                if run.status == CouponIssuanceStatus.COMPLETED:
+                    db.commit()
+                    break
+                
+                users = db.execute(
+                    self._eligible_users_query().with_only_columns(
+                        UserLoyalty.user_id,
+                        LoyaltyTier.monthly_coupons_count,
+                        LoyaltyTier.coupon_discount_percentage
+                    ).where(
+                        UserLoyalty.user_id > run.last_user_id
+                    ).order_by(UserLoyalty.user_id).limit(chunk_size)
+                ).all()
+                now = datetime.now(UTC)
+                
+                if not users:
+                    db.execute(
+                        update(CouponIssuanceRun).where(
+                            CouponIssuanceRun.run_id == run_id,
+                            CouponIssuanceRun.status == CouponIssuanceStatus.RUNNING
+                        ).values(status=CouponIssuanceStatus.COMPLETED, heartbeat_at=now, finished_at=now)
+                    )
+                    db.commit()
+                    break
+                
+                chunk_coupons = sum(user.monthly_coupons_count for user in users)
+                
+                # Reservar el bloque (cursor y posiciones de código); si otra réplica ya lo
+                # tomó, el cursor cambió y se lee de nuevo
+                reserved = db.execute(
+                    update(CouponIssuanceRun).where(
+                        CouponIssuanceRun.run_id == run_id,
+                        CouponIssuanceRun.status == CouponIssuanceStatus.RUNNING,
+                        CouponIssuanceRun.last_user_id == run.last_user_id
+                    ).values(
+                        last_user_id=users[-1].user_id,
+                        users_processed=CouponIssuanceRun.users_processed + len(users),
+                        coupons_issued=CouponIssuanceRun.coupons_issued + chunk_coupons,
+                        heartbeat_at=now
+                    )
+                )
+                if reserved.rowcount == 0:
+                    db.rollback()
+                    continue
+                
+                coupons = []
+                owners = {}
+                position = run.coupons_issued
+                for user in users:
+                    for _ in range(user.monthly_coupons_count):
+                        coupon_code = self.generate_sequence_coupon_code(run_id, position)
+                        coupons.append({
+                            "coupon_code": coupon_code,
+                            "discount_value": Decimal(user.coupon_discount_percentage),
+                            "start_date": today,
+                            "expiration_date": expiration_date,
+                            "is_active": True
+                        })
+                        owners[coupon_code] = user.user_id
+                        position += 1
+                
+                # RETURNING con el código para asignar cada cupón sin depender del orden
+                inserted = db.execute(
+                    insert(Coupon).returning(Coupon.coupon_id, Coupon.coupon_code),
+                    coupons
+                ).all()
+                db.execute(insert(UserCoupon), [
+                    {"user_id": owners[coupon_code], "coupon_id": coupon_id, "used_date": None}
+                    for coupon_id, coupon_code in inserted
+                ])
+                db.commit()
+                
+                chunks += 1
+                users_processed += len(users)
+                coupons_issued += chunk_coupons
+                done = run.users_processed + len(users)
+                logger.info(
+                    f"Emisión de cupones {run_id}: {done}/{run.total_users} usuarios "
+                    f"({done * 100 // max(run.total_users, 1)}%), {run.coupons_issued + chunk_coupons} cupones"
+                )
+            
+            return {
+                "success": True,
+                "run_id": run_id,
+                "users_processed": users_processed,
+                "coupons_issued": coupons_issued,
+                "chunks": chunks,
+                "duration_seconds": round(time.monotonic() - started, 3)
+            }
+        except Exception as e:
+            db.rollback()
+            return {"success": False, "error": f"Error en la emisión mensual de cupones: {str(e)}"}
+
+    def get_coupon_issuance_runs(self, db: Session, limit: int = 12) -> List[Dict]:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Progreso de las emisiones mensuales de cupones más recientes: usuarios
+            procesados, cupones emitidos, porcentaje terminado y último latido.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            limit (int): Número de emisiones a regresar.
+
+        Retorna:
+            List[Dict]: Emisiones de la más reciente a la más antigua.
+        """
+        runs = db.query(CouponIssuanceRun).order_by(CouponIssuanceRun.period_start.desc()).limit(limit).all()
+        return [
+            {
+                "run_id": run.run_id,
+                "period_start": run.period_start,
+                "status": run.status.value,
+                "total_users": run.total_users,
+                "users_processed": run.users_processed,
+                "coupons_issued": run.coupons_issued,
+                "started_at": run.started_at,
+                "heartbeat_at": run.heartbeat_at,
+                "finished_at": run.finished_at,
+                "progress_percent": (
+                    100.0 if run.status == CouponIssuanceStatus.COMPLETED or not run.total_users
+                    else round(min(run.users_processed * 100 / run.total_users, 100.0), 1)
+                )
+            }
+            for run in runs
+        ]
+
+    # ==================== AUXILIARES ====================
+
+    @staticmethod
+    def _eligible_users_query():
+        """
+        Usuarios activos cuyo tier otorga cupones mensuales.
+        """
+        return select(func.count()).select_from(UserLoyalty).join(
+            LoyaltyTier, LoyaltyTier.tier_id == UserLoyalty.tier_id
+        ).join(
+            User, User.user_id == UserLoyalty.user_id
+        ).where(
+            User.account_status == True,
+            LoyaltyTier.monthly_coupons_count > 0
+        )
+
+    def _open_coupon_issuance_run(self, db: Session, period_start: date) -> int:
+        """
+        Regresa la emisión del mes, creándola si no existe (una sola aunque varias
+        réplicas arranquen a la vez).
+        """
+        run_id = db.execute(
+            select(CouponIssuanceRun.run_id).where(CouponIssuanceRun.period_start == period_start)
+        ).scalar()
+        if run_id is None:
+            total_users = db.execute(self._eligible_users_query()).scalar()
+            upsert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else postgresql_insert
+            db.execute(
+                upsert(CouponIssuanceRun).values(
+                    period_start=period_start,
+                    status=CouponIssuanceStatus.RUNNING,
+                    total_users=total_users,
+                    last_user_id=0,
+                    users_processed=0,
+                    coupons_issued=0,
+                    started_at=datetime.now(UTC),
+                    heartbeat_at=datetime.now(UTC)
+                ).on_conflict_do_nothing(index_elements=["period_start"])
+            )
+            run_id = db.execute(
+                select(CouponIssuanceRun.run_id).where(CouponIssuanceRun.period_start == period_start)
+            ).scalar_one()
+        db.commit()
+        return run_id
+
 loyalty_service = LoyaltyService()
\ No newline at end of file
@@ -11,9 +11,11 @@ from fastapi import (
     Query
 )
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Dict
+from typing import Dict, Optional
+from datetime import date
 from sqlalchemy.orm import Session
 from app.core.database import get_db
+from app.models.enum import OrderStatus
 from app.api.v1.orders import schemas
 from app.api.v1.orders.service import order_service
 
@@ -50,7 +52,10 @@ def get_current_user(token: str = Depends(get_token_from_header)) -> Dict:
 @router.get("", response_model=schemas.OrderListResponse, status_code=status.HTTP_200_OK)
 async def get_my_orders(
     limit: int = Query(50, ge=1, le=100, description="Número de pedidos a retornar"),
-    offset: int = Query(0, ge=0, description="Offset para paginación"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página anterior (next_cursor)"),
+    order_status: Optional[OrderStatus] = Query(None, alias="status", description="Filtrar por estado"),
+    date_from: Optional[date] = Query(None, description="Fecha mínima del pedido (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Fecha máxima del pedido (inclusive)"),
     db: Session = Depends(get_db),
     current_user: Dict = Depends(get_current_user)
 ):
@@ -58,17 +63,20 @@ async def get_my_orders(
     Autor: Lizbeth Barajas
 
     Descripción:
-        Obtiene todos los pedidos pertenecientes al usuario autenticado usando
-        paginación y devuelve los más recientes primero.
+        Obtiene los pedidos pertenecientes al usuario autenticado usando
+        paginación por cursor y devuelve los más recientes primero.
 
     Parámetros:
         limit (int): Cantidad máxima de pedidos a mostrar.
-        offset (int): Cantidad de pedidos a omitir (paginación).
+        cursor (Optional[str]): Cursor devuelto en la página anterior.
+        order_status (Optional[OrderStatus]): Estado por el cual filtrar.
+        date_from (Optional[date]): Fecha mínima del pedido.
+        date_to (Optional[date]): Fecha máxima del pedido.
         db (Session): Conexión activa a la base de datos.
         current_user (Dict): Información decodificada del usuario autenticado.
 
     Retorna:
-        Dict: Lista de pedidos y total encontrado.
+        Dict: Lista de pedidos, total de la página y cursor siguiente.
     """
     cognito_sub = current_user.get("sub")
     
@@ -76,7 +84,10 @@ async def get_my_orders(
         db=db,
         cognito_sub=cognito_sub,
         limit=limit,
-        offset=offset
+        cursor=cursor,
+        order_status=order_status,
+        date_from=date_from,
+        date_to=date_to
     )
     
     if not result.get("success"):
@@ -128,6 +139,8 @@ async def get_order_details(
 
 @router.get("/subscription/all", response_model=schemas.OrderListResponse, status_code=status.HTTP_200_OK)
 async def get_subscription_orders(
+    limit: int = Query(50, ge=1, le=100, description="Número de pedidos a retornar"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página anterior (next_cursor)"),
     db: Session = Depends(get_db),
     current_user: Dict = Depends(get_current_user)
 ):
@@ -136,9 +149,11 @@ async def get_subscription_orders(
 
     Descripción:
         Obtiene únicamente los pedidos marcados como suscripciones que 
-        pertenecen al usuario autenticado.
+        pertenecen al usuario autenticado, paginados por cursor.
 
     Parámetros:
+        limit (int): Cantidad máxima de pedidos a mostrar.
+        cursor (Optional[str]): Cursor devuelto en la página anterior.
         db (Session): Conexión a la base de datos.
         current_user (Dict): Payload del usuario autenticado.
 
@@ -149,7 +164,9 @@ async def get_subscription_orders(
     
     result = order_service.get_subscription_orders(
         db=db,
-        cognito_sub=cognito_sub
+        cognito_sub=cognito_sub,
+        limit=limit,
+        cursor=cursor
     )
     
     if not result.get("success"):
@@ -14,6 +14,7 @@ class OrderItemResponse(BaseModel):
     order_item_id: int
     product_id: int
     product_name: Optional[str] = None
+    image_path: Optional[str] = None
     quantity: int
     unit_price: Decimal
     subtotal: Decimal
@@ -74,6 +75,7 @@ class OrderDetailResponse(BaseModel):
     shipping_cost: Decimal
     total_amount: Decimal
     points_earned: int
+    coupon_code: Optional[str] = None
     
     shipping_address: dict
     
@@ -107,6 +109,7 @@ class OrderDetailResponse(BaseModel):
                         "order_item_id": 1,
                         "product_id": 1,
                         "product_name": "Proteina Whey",
+                        "image_path": "https://example.com/whey.jpg",
                         "quantity": 2,
                         "unit_price": 750.00,
                         "subtotal": 1500.00
@@ -115,20 +118,37 @@ class OrderDetailResponse(BaseModel):
             }
         }
 
+"""
+Schema ligero de orden para el listado (solo columnas de la vista)
+"""
+class OrderListItem(BaseModel):
+    order_id: int
+    is_subscription: bool
+    order_date: datetime
+    order_status: str
+    tracking_number: Optional[str] = None
+    total_amount: Decimal
+    points_earned: int
+    
+    class Config:
+        from_attributes = True
+
 """
 Schema de lista de ordenes
 """
 class OrderListResponse(BaseModel):
     success: bool
-    orders: List[OrderResponse]
+    orders: List[OrderListItem]
     total: int
+    next_cursor: Optional[str] = None
     
     class Config:
         json_schema_extra = {
             "example": {
                 "success": True,
                 "orders": [],
-                "total": 0
+                "total": 0,
+                "next_cursor": None
             }
         }
 
@@ -3,10 +3,12 @@
 # Descripcion: Servicio encargado de gestionar las ordenes, desde su creación 
 #              (que se llama en checkout), hasta las operaciones CRUD
 
-from sqlalchemy.orm import Session
-from typing import Dict, Optional
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import and_, or_, update, case
+from typing import Dict, List, Optional, Tuple
 from decimal import Decimal
-from datetime import datetime, UTC
+from datetime import date, datetime, time, timedelta, UTC
+import base64
 from app.models.user import User
 from app.models.order import Order
 from app.models.order_item import OrderItem
@@ -17,9 +19,17 @@ from app.models.cart_item import CartItem
 from app.models.user_coupon import UserCoupon
 from app.models.enum import OrderStatus
 from app.api.v1.shipping.service import shipping_service
+from app.api.v1.cart.service import CartService
 
 class OrderService:
     
+    # Transiciones permitidas en la actualización masiva de fulfilment. Las cancelaciones
+    # siguen pasando por cancel_order porque deben restaurar inventario.
+    FULFILMENT_TRANSITIONS = {
+        OrderStatus.PAID: (OrderStatus.SHIPPED, OrderStatus.DELIVERED),
+        OrderStatus.SHIPPED: (OrderStatus.DELIVERED,),
+    }
+    
     def create_order_from_cart(
         self,
         db: Session,
@@ -58,6 +68,9 @@ class OrderService:
             Dict: Resultado con estado de éxito, la orden creada y los puntos generados.
         """
         try:
+            # Las cantidades pendientes en el store se escriben dentro de esta transacción
+            CartService.persist_cart(db, user_id, commit=False)
+            
             cart = db.query(ShoppingCart).filter(ShoppingCart.user_id == user_id).first()
             if not cart:
                 return {"success": False, "error": "Carrito no encontrado"}
@@ -141,6 +154,7 @@ class OrderService:
                     user_coupon.order_id = order.order_id
             
             db.flush()
+            CartService.evict_cart(user_id)
             
             return {
                 "success": True,
@@ -150,44 +164,193 @@ class OrderService:
         except Exception as e:
             return {"success": False, "error": f"Error al crear orden: {str(e)}"}
     
+    # Columnas que se proyectan para el listado de pedidos (sin cargar objetos ORM)
+    LIST_COLUMNS = (
+        Order.order_id,
+        Order.is_subscription,
+        Order.order_date,
+        Order.order_status,
+        Order.tracking_number,
+        Order.total_amount,
+        Order.points_earned,
+    )
+    
+    @staticmethod
+    def _encode_cursor(order_date: datetime, order_id: int) -> str:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Codifica la posición (order_date, order_id) del último pedido de una página
+            como un cursor opaco para solicitar la siguiente página.
+
+        Parámetros:
+            order_date (datetime): Fecha del último pedido de la página.
+            order_id (int): ID del último pedido de la página.
+
+        Retorna:
+            str: Cursor codificado en base64 url-safe.
+        """
+        raw = f"{order_date.isoformat()}|{order_id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+    
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Decodifica un cursor generado por _encode_cursor.
+
+        Parámetros:
+            cursor (str): Cursor recibido del cliente.
+
+        Retorna:
+            Tuple[datetime, int]: Fecha e ID del último pedido visto.
+
+        Excepciones:
+            ValueError: Si el cursor no tiene el formato esperado.
+        """
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+            order_date, order_id = raw.split("|")
+            return datetime.fromisoformat(order_date), int(order_id)
+        except Exception:
+            raise ValueError("Cursor inválido")
+    
+    def _list_orders(
+        self,
+        db: Session,
+        user_id: int,
+        limit: int,
+        cursor: Optional[str] = None,
+        order_status: Optional[OrderStatus] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        subscription_only: bool = False
+    ) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Lista pedidos de un usuario con paginación por cursor sobre (order_date, order_id),
+            más recientes primero. Solo proyecta las columnas que necesita la vista de
+            listado y aprovecha el índice (user_id, order_date).
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            user_id (int): ID del usuario dueño de los pedidos.
+            limit (int): Número máximo de pedidos por página.
+            cursor (Optional[str]): Cursor de la página anterior (None para la primera).
+            order_status (Optional[OrderStatus]): Filtra por estado del pedido.
+            date_from (Optional[date]): Fecha mínima (inclusive) del pedido.
+            date_to (Optional[date]): Fecha máxima (inclusive) del pedido.
+            subscription_only (bool): Si es True, solo pedidos de suscripción.
+
+        Retorna:
+            Dict: Lista de pedidos, total de la página y cursor para la siguiente página.
+        """
+        query = db.query(*self.LIST_COLUMNS).filter(Order.user_id == user_id)
+        
+        if subscription_only:
+            query = query.filter(Order.is_subscription == True)
+        
+        if order_status:
+            query = query.filter(Order.order_status == order_status)
+        
+        if date_from:
+            query = query.filter(Order.order_date >= datetime.combine(date_from, time.min))
+        
+        if date_to:
+            query = query.filter(Order.order_date < datetime.combine(date_to + timedelta(days=1), time.min))
+        
+        if cursor:
+            last_date, last_id = self._decode_cursor(cursor)
+            query = query.filter(
+                or_(
+                    Order.order_date < last_date,
+                    and_(Order.order_date == last_date, Order.order_id < last_id)
+                )
+            )
+        
+        # Se pide un registro extra para saber si existe una página siguiente
+        rows = query.order_by(
+            Order.order_date.desc(),
+            Order.order_id.desc()
+        ).limit(limit + 1).all()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        orders = [
+            {
+                "order_id": row.order_id,
+                "is_subscription": row.is_subscription,
+                "order_date": row.order_date,
+                "order_status": row.order_status.value,
+                "tracking_number": row.tracking_number,
+                "total_amount": row.total_amount,
+                "points_earned": row.points_earned
+            }
+            for row in rows
+        ]
+        
+        next_cursor = None
+        if has_more:
+            next_cursor = self._encode_cursor(rows[-1].order_date, rows[-1].order_id)
+        
+        return {
+            "success": True,
+            "orders": orders,
+            "total": len(orders),
+            "next_cursor": next_cursor
+        }
+    
     def get_user_orders(
         self,
         db: Session,
         cognito_sub: str,
         limit: int = 50,
-        offset: int = 0
+        cursor: Optional[str] = None,
+        order_status: Optional[OrderStatus] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
     ) -> Dict:
         """
         Autor: Lizbeth Barajas
 
         Descripción:
-            Obtiene todos los pedidos asociados a un usuario mediante su cognito_sub.
-            Permite paginación y devuelve los pedidos más recientes primero.
+            Obtiene los pedidos asociados a un usuario mediante su cognito_sub.
+            Pagina por cursor y devuelve los pedidos más recientes primero.
 
         Parámetros:
             db (Session): Sesión activa de la base de datos.
             cognito_sub (str): Identificador único del usuario en Cognito.
             limit (int): Número máximo de órdenes a obtener.
-            offset (int): Cantidad de órdenes a omitir para paginación.
+            cursor (Optional[str]): Cursor devuelto por la página anterior.
+            order_status (Optional[OrderStatus]): Filtra por estado del pedido.
+            date_from (Optional[date]): Fecha mínima (inclusive) del pedido.
+            date_to (Optional[date]): Fecha máxima (inclusive) del pedido.
 
         Retorna:
-            Dict: Objeto con estado de éxito, lista de órdenes y total encontrado.
+            Dict: Objeto con estado de éxito, lista de órdenes, total de la página y next_cursor.
         """
         try:
             user = db.query(User).filter(User.cognito_sub == cognito_sub).first()
             if not user or not user.account_status:
                 return {"success": False, "error": "Usuario no encontrado o inactivo"}
             
-            # Obtiene ordenes (mas reciente primero)
-            orders = db.query(Order).filter(
-                Order.user_id == user.user_id
-            ).order_by(Order.order_date.desc()).limit(limit).offset(offset).all()
-            
-            return {
-                "success": True,
-                "orders": orders,
-                "total": len(orders)
-            }
+            return self._list_orders(
+                db,
+                user_id=user.user_id,
+                limit=limit,
+                cursor=cursor,
+                order_status=order_status,
+                date_from=date_from,
+                date_to=date_to
+            )
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
         except Exception as e:
             return {"success": False, "error": f"Error al obtener pedidos: {str(e)}"}
     
@@ -213,7 +376,15 @@ class OrderService:
             if not user or not user.account_status:
                 return {"success": False, "error": "Usuario no encontrado o inactivo"}
             
-            order = db.query(Order).filter(
+            # Carga el agregado completo (items -> producto -> imagenes, direccion
+            # y cupon) con un numero fijo de consultas sin importar cuantos items tenga
+            order = db.query(Order).options(
+                joinedload(Order.address),
+                joinedload(Order.coupon),
+                selectinload(Order.order_items)
+                    .joinedload(OrderItem.product)
+                    .selectinload(Product.product_images)
+            ).filter(
                 Order.order_id == order_id,
                 Order.user_id == user.user_id
             ).first()
@@ -221,30 +392,26 @@ class OrderService:
             if not order:
                 return {"success": False, "error": "Pedido no encontrado"}
             
-            # Obtiene ordenes con todos los items
-            order_items = db.query(OrderItem).filter(
-                OrderItem.order_id == order_id
-            ).all()
-            
             items_with_details = []
-            for item in order_items:
-                product = db.query(Product).filter(
-                    Product.product_id == item.product_id
-                ).first()
+            for item in order.order_items:
+                product = item.product
+                
+                image_path = None
+                if product and product.product_images:
+                    primary = next((img for img in product.product_images if img.is_primary), None)
+                    image_path = primary.image_path if primary else product.product_images[0].image_path
                 
                 items_with_details.append({
                     "order_item_id": item.order_item_id,
                     "product_id": item.product_id,
                     "product_name": product.name if product else "Producto no disponible",
+                    "image_path": image_path,
                     "quantity": item.quantity,
                     "unit_price": float(item.unit_price),
                     "subtotal": float(item.subtotal)
                 })
             
-            # Obtiene direccion
-            address = db.query(Address).filter(
-                Address.address_id == order.address_id
-            ).first()
+            address = order.address
             
             shipping_address = {
                 "recipient_name": address.recipient_name,
@@ -271,6 +438,7 @@ class OrderService:
                     "shipping_cost": float(order.shipping_cost),
                     "total_amount": float(order.total_amount),
                     "points_earned": order.points_earned,
+                    "coupon_code": order.coupon.coupon_code if order.coupon else None,
                     "shipping_address": shipping_address,
                     "items": items_with_details
                 }
@@ -278,21 +446,29 @@ class OrderService:
         except Exception as e:
             return {"success": False, "error": f"Error al obtener pedido: {str(e)}"}
     
-    def get_subscription_orders(self, db: Session, cognito_sub: str) -> Dict:
+    def get_subscription_orders(
+        self,
+        db: Session,
+        cognito_sub: str,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Dict:
         """
         Autor: Lizbeth Barajas
 
         Descripción:
             Obtiene únicamente los pedidos que corresponden a suscripciones del usuario.
             Filtra por órdenes marcadas como suscripción y las devuelve en orden cronológico
-            descendente.
+            descendente, paginadas por cursor.
 
         Parámetros:
             db (Session): Sesión activa de la base de datos.
             cognito_sub (str): Identificador único del usuario en Cognito.
+            limit (int): Número máximo de órdenes a obtener.
+            cursor (Optional[str]): Cursor devuelto por la página anterior.
 
         Retorna:
-            Dict: Lista de órdenes de suscripción y el total encontrado.
+            Dict: Lista de órdenes de suscripción, total de la página y next_cursor.
         """
         try:
             user = db.query(User).filter(User.cognito_sub == cognito_sub).first()
@@ -300,16 +476,15 @@ class OrderService:
                 return {"success": False, "error": "Usuario no encontrado o inactivo"}
             
             # Solo ordenes de suscripcion
-            orders = db.query(Order).filter(
-                Order.user_id == user.user_id,
-                Order.is_subscription == True
-            ).order_by(Order.order_date.desc()).all()
-            
-            return {
-                "success": True,
-                "orders": orders,
-                "total": len(orders)
-            }
+            return self._list_orders(
+                db,
+                user_id=user.user_id,
+                limit=limit,
+                cursor=cursor,
+                subscription_only=True
+            )
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
         except Exception as e:
             return {"success": False, "error": f"Error al obtener pedidos de suscripción: {str(e)}"}
     
@@ -426,6 +601,115 @@ class OrderService:
             db.rollback()
             return {"success": False, "error": f"Error al actualizar estado: {str(e)}"}
     
+    def bulk_update_order_status(
+        self,
+        db: Session,
+        updates: List[Dict],
+        chunk_size: int = 500
+    ) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Aplica cambios de estado de fulfilment (envío y entrega) a muchos pedidos a la vez.
+            Valida todas las transiciones con una sola consulta y aplica los cambios por
+            bloques de chunk_size, con un commit por bloque: dentro del bloque, un
+            UPDATE ... RETURNING por cada transición (estado leído -> nuevo estado). El UPDATE
+            vuelve a verificar el estado leído, para no sobrescribir un pedido que otro
+            proceso cambió entre la validación y la actualización; solo los pedidos que
+            regresa el RETURNING se reportan como actualizados.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            updates (List[Dict]): Cambios a aplicar, cada uno con order_id, new_status y
+                                  tracking_number opcional.
+            chunk_size (int): Número de pedidos por bloque de UPDATE.
+
+        Retorna:
+            Dict: Totales de pedidos actualizados y fallidos, y el resultado de cada pedido
+                  en el mismo orden de la solicitud.
+        """
+        results = [
+            {
+                "order_id": item["order_id"],
+                "success": False,
+                "previous_status": None,
+                "new_status": item["new_status"].value,
+                "error": None
+            }
+            for item in updates
+        ]
+        
+        # Validacion de todas las transiciones en una sola consulta
+        order_ids = {item["order_id"] for item in updates}
+        current_status = dict(
+            db.query(Order.order_id, Order.order_status).filter(
+                Order.order_id.in_(order_ids)
+            ).all()
+        ) if order_ids else {}
+        
+        pending = []
+        seen = set()
+        for item, result in zip(updates, results):
+            order_id = item["order_id"]
+            new_status = item["new_status"]
+            
+            if order_id in seen:
+                result["error"] = "Pedido repetido en la solicitud"
+                continue
+            seen.add(order_id)
+            
+            previous_status = current_status.get(order_id)
+            if previous_status is None:
+                result["error"] = "Pedido no encontrado"
+                continue
+            
+            result["previous_status"] = previous_status.value
+            if new_status != previous_status and new_status not in self.FULFILMENT_TRANSITIONS.get(previous_status, ()):
+                result["error"] = f"Transición no permitida: {previous_status.value} -> {new_status.value}"
+                continue
+            
+            pending.append((result, (order_id, previous_status, new_status, item.get("tracking_number"))))
+        
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            transitions = {}
+            for _, (order_id, previous_status, new_status, tracking_number) in chunk:
+                transitions.setdefault((previous_status, new_status), {})[order_id] = tracking_number
+            try:
+                updated_ids = set()
+                for (previous_status, new_status), tracking_numbers in transitions.items():
+                    # El tracking solo se reemplaza si se envía
+                    tracking = {order_id: number for order_id, number in tracking_numbers.items() if number}
+                    updated_ids.update(db.execute(
+                        update(Order).where(
+                            Order.order_id.in_(list(tracking_numbers)),
+                            Order.order_status == previous_status
+                        ).values(
+                            order_status=new_status,
+                            tracking_number=case(tracking, value=Order.order_id, else_=Order.tracking_number)
+                            if tracking else Order.tracking_number
+                        ).returning(Order.order_id).execution_options(synchronize_session=False)
+                    ).scalars().all())
+                db.commit()
+                for result, (order_id, _, _, _) in chunk:
+                    if order_id in updated_ids:
+                        result["success"] = True
+                    else:
+                        result["error"] = "El estado cambió concurrentemente"
+            except Exception as e:
+                db.rollback()
+                for result, _ in chunk:
+                    result["error"] = f"Error al actualizar estado: {str(e)}"
+        
+        updated = sum(1 for result in results if result["success"])
+        return {
+            "success": True,
+            "updated": updated,
+            "failed": len(results) - updated,
+            "results": results
+        }
+    
     def get_order_status(self, db: Session, cognito_sub: str, order_id: int) -> Dict:
         """
         Autor: Lizbeth Barajas
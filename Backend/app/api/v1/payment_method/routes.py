@@ -112,8 +112,9 @@ async def get_payment_method(
     
     return result["payment_method"]
 
+# Ruta síncrona: llama al SDK de Stripe (bloqueante), FastAPI la ejecuta en su threadpool
 @router.post("/setup-intent", response_model=schemas.SetupIntentResponse, status_code=status.HTTP_200_OK)
-async def create_setup_intent(
+def create_setup_intent(
     db: Session = Depends(get_db),
     current_user: Dict = Depends(get_current_user)
 ):
@@ -183,8 +184,9 @@ async def save_payment_method(
     
     return result["payment_method"]
 
+# Ruta síncrona: llama al SDK de Stripe (bloqueante), FastAPI la ejecuta en su threadpool
 @router.delete("/{payment_id}", response_model=schemas.MessageResponse, status_code=status.HTTP_200_OK)
-async def delete_payment_method(
+def delete_payment_method(
     payment_id: int,
     db: Session = Depends(get_db),
     current_user: Dict = Depends(get_current_user)
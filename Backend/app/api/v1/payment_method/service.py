@@ -9,6 +9,7 @@ from app.models.payment_method import PaymentMethod
 from app.models.user import User
 from app.models.enum import PaymentType
 from app.services.stripe_service import stripe_service
+from app.services.stripe_mirror_service import stripe_mirror_service
 
 class PaymentMethodService:
     
@@ -97,6 +98,10 @@ class PaymentMethodService:
             if not user or not user.account_status:
                 return {"success": False, "error": "Usuario no encontrado o inactivo"}
             
+            if user.stripe_customer_id:
+                # ya tiene customer (si se borra en Stripe, el webhook lo quita)
+                return self._setup_intent_result(user.stripe_customer_id)
+            
             email = user.email
             
             if not email: # si no fue registrado por correo lo intenta obtener en cognito
@@ -111,7 +116,8 @@ class PaymentMethodService:
                 email = f"user_{user.user_id}@befit.internal"
                 print(f"Warning: Generando email interno para user_id {user.user_id}")
          
-            customer_result = stripe_service.get_or_create_customer(
+            customer_result = stripe_mirror_service.get_or_create_customer(
+                db=db,
                 user_id=user.user_id,
                 email=email,
                 name=f"{user.first_name} {user.last_name}"
@@ -122,26 +128,30 @@ class PaymentMethodService:
             
             customer_id = customer_result['customer_id']
             
-            if not user.stripe_customer_id:
-                user.stripe_customer_id = customer_id
-                db.commit()
-            
-            # crea setup intent
-            setup_result = stripe_service.create_setup_intent(customer_id)
+            user.stripe_customer_id = customer_id
+            db.commit()
             
-            if not setup_result.get('success'):
-                return setup_result
-            
-            return {
-                "success": True,
-                "client_secret": setup_result['client_secret'],
-                "setup_intent_id": setup_result['setup_intent_id']
-            }
+            return self._setup_intent_result(customer_id)
             
         except Exception as e:
             db.rollback()
             return {"success": False, "error": f"Error al crear setup intent: {str(e)}"}
     
+    def _setup_intent_result(self, customer_id: str) -> Dict:
+        """
+        Crea el setup intent en Stripe para el customer y arma la respuesta.
+        """
+        setup_result = stripe_service.create_setup_intent(customer_id)
+        
+        if not setup_result.get('success'):
+            return setup_result
+        
+        return {
+            "success": True,
+            "client_secret": setup_result['client_secret'],
+            "setup_intent_id": setup_result['setup_intent_id']
+        }
+    
     def save_payment_method_from_setup(
         self,
         db: Session,
@@ -154,7 +164,8 @@ class PaymentMethodService:
 
         Descripción:
             Guarda un método de pago en la base de datos después de completar un Setup Intent de Stripe.
-            Obtiene la información de la tarjeta desde Stripe y la almacena localmente.
+            Obtiene la información de la tarjeta de la copia local de Stripe (o de Stripe si
+            no está) y la almacena localmente.
 
         Parámetros:
             db (Session): Sesión de base de datos.
@@ -173,7 +184,7 @@ class PaymentMethodService:
             if not user.stripe_customer_id:
                 return {"success": False, "error": "Usuario no tiene customer de Stripe"}
             
-            pm_result = stripe_service.get_payment_method(payment_method_id)
+            pm_result = stripe_mirror_service.get_payment_method(db, payment_method_id)
             if not pm_result.get('success'):
                 return pm_result
             
@@ -19,6 +19,8 @@ from app.models.user import User
 from app.api.v1.payments import schemas
 from app.api.v1.payments.service import payment_process_service
 from app.services.stripe_service import stripe_service
+from app.services.stripe_webhook_service import stripe_webhook_service
+from app.services.idempotency_service import idempotency_service
 from app.config import settings
 
 router = APIRouter()
@@ -72,7 +74,8 @@ async def get_checkout_summary(
 async def create_stripe_checkout(
     checkout_data: schemas.StripeCheckoutRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
 ):
     """
     Autor: Lizbeth Barajas
@@ -81,24 +84,42 @@ async def create_stripe_checkout(
         Crea una sesión de pago en Stripe. Puede usarse para pagos directos
         con tarjeta guardada o para redirigir al usuario al portal de Stripe Checkout.
         Maneja cupones, dirección, métodos de pago guardados y suscripciones.
+        Si se envía el header Idempotency-Key, los reintentos regresan la respuesta
+        original sin volver a cobrar.
 
     Parámetros:
         checkout_data (StripeCheckoutRequest): Información necesaria para iniciar el pago.
         db (Session): Sesión activa de base de datos.
         current_user (User): Usuario autenticado iniciando la compra.
+        idempotency_key (str, opcional): Header Idempotency-Key enviado por el cliente.
 
     Retorna:
         dict: Información del checkout, como URL de Stripe o client_secret.
     """
-    result = await payment_process_service.create_stripe_checkout_session(
+    result = await idempotency_service.execute(
         db=db,
-        cognito_sub=current_user.cognito_sub,
-        address_id=checkout_data.address_id,
-        payment_method_id=checkout_data.payment_method_id,
-        coupon_code=checkout_data.coupon_code,
-        subscription_id=checkout_data.subscription_id
+        user_id=current_user.user_id,
+        endpoint="stripe_checkout",
+        key=idempotency_key,
+        payload=checkout_data,
+        handler=lambda: payment_process_service.create_stripe_checkout_session(
+            db=db,
+            cognito_sub=current_user.cognito_sub,
+            address_id=checkout_data.address_id,
+            payment_method_id=checkout_data.payment_method_id,
+            coupon_code=checkout_data.coupon_code,
+            subscription_id=checkout_data.subscription_id,
+            idempotency_key=idempotency_key
+        )
     )
     
+    # El cobro pudo haberse confirmado: el cliente debe reintentar con la misma Idempotency-Key
+    if result.get("outcome_unknown"):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=result.get("error")
+        )
+    
     if not result.get("success"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -120,10 +141,11 @@ async def stripe_webhook(
     Autor: Lizbeth Barajas
 
     Descripción:
-        Procesa los eventos enviados por Stripe mediante webhooks. Verifica la firma
-        del evento para garantizar la autenticidad y maneja especialmente el evento
-        'checkout.session.completed', generando la orden correspondiente y registrando
-        el pago realizado.
+        Recibe los eventos enviados por Stripe mediante webhooks. Verifica la firma del
+        evento para garantizar la autenticidad, guarda el evento crudo (único por
+        event.id) y responde de inmediato. La orden, el pago y los puntos de
+        'checkout.session.completed' se procesan después en el worker de webhooks, por
+        lo que las re-entregas de Stripe no se procesan dos veces.
 
     Parámetros:
         request (Request): Objeto con el contenido bruto del webhook.
@@ -132,47 +154,46 @@ async def stripe_webhook(
 
     Retorna:
         dict: Confirmación de recepción del webhook.
+
+    Excepciones:
+        HTTPException 400: Si falta la firma o no es válida.
+        HTTPException 500: Si el evento no se pudo guardar (Stripe lo reintentará).
     """
+    payload = await request.body()
+    
+    # Verifica webhook signature
+    if not stripe_signature or not settings.STRIPE_WEBHOOK_SECRET:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No se proporcionó firma de webhook"
+        )
+    
     try:
-        payload = await request.body()
-        
-        # Verifica webhook signature
-        if not stripe_signature or not hasattr(settings, 'STRIPE_WEBHOOK_SECRET'):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="No se proporcionó firma de webhook"
-            )
-        
-        try:
-            event = stripe_service.construct_webhook_event(
-                payload=payload.decode('utf-8'),
-                signature=stripe_signature,
-                secret=settings.STRIPE_WEBHOOK_SECRET
-            )
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Firma de webhook inválida: {str(e)}"
-            )
-        
-        if event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            
-            # Procesa el pago hecho
-            result = await payment_process_service.process_stripe_webhook(
-                db=db,
-                session_id=session.get('id'),
-                payment_intent_id=session.get('payment_intent')
-            )
-            
-            if not result.get("success"):
-                print(f"Error procesando webhook: {result.get('error')}")
-        
-        return {"success": True, "message": "Webhook recibido"}
+        stripe_service.construct_webhook_event(
+            payload=payload.decode('utf-8'),
+            signature=stripe_signature,
+            secret=settings.STRIPE_WEBHOOK_SECRET
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Firma de webhook inválida: {str(e)}"
+        )
     
+    try:
+        is_new = stripe_webhook_service.ingest(db, payload)
     except Exception as e:
-        print(f"Error en webhook: {str(e)}")
-        return {"success": False, "error": str(e)}
+        db.rollback()
+        print(f"Error guardando webhook: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="No se pudo registrar el evento"
+        )
+    
+    return {
+        "success": True,
+        "message": "Webhook recibido" if is_new else "Evento duplicado"
+    }
 
 
 @router.post(
@@ -224,7 +245,8 @@ async def initialize_paypal_checkout(
 async def capture_paypal_payment(
     capture_data: schemas.PayPalCaptureRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
 ):
     """
     Autor: Lizbeth Barajas
@@ -232,22 +254,31 @@ async def capture_paypal_payment(
     Descripción:
         Captura el pago previamente aprobado en PayPal después de que el usuario
         autoriza en la plataforma. Genera la orden en el sistema, asigna puntos y
-        guarda el método de pago si corresponde.
+        guarda el método de pago si corresponde. Si se envía el header
+        Idempotency-Key, los reintentos regresan la respuesta original.
 
     Parámetros:
         capture_data (PayPalCaptureRequest): Contiene paypal_order_id y address_id.
         db (Session): Sesión activa de base de datos.
         current_user (User): Usuario autenticado que completó el proceso de pago.
+        idempotency_key (str, opcional): Header Idempotency-Key enviado por el cliente.
 
     Retorna:
         dict: Resultado de la captura, incluyendo datos de la orden creada.
     """
-    result = await payment_process_service.capture_paypal_payment(
+    result = await idempotency_service.execute(
         db=db,
-        cognito_sub=current_user.cognito_sub,
-        paypal_order_id=capture_data.paypal_order_id,
-        address_id=capture_data.address_id,
-        coupon_code=capture_data.coupon_code,
+        user_id=current_user.user_id,
+        endpoint="paypal_capture",
+        key=idempotency_key,
+        payload=capture_data,
+        handler=lambda: payment_process_service.capture_paypal_payment(
+            db=db,
+            cognito_sub=current_user.cognito_sub,
+            paypal_order_id=capture_data.paypal_order_id,
+            address_id=capture_data.address_id,
+            coupon_code=capture_data.coupon_code,
+        )
     )
     
     if not result.get("success"):
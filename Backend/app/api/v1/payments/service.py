@@ -4,26 +4,30 @@
 #              creación de sesiones de pago, captura de pagos, y generación de órdenes asociadas
 #              incluyendo cálculos de checkout, con integración con Stripe y PayPal
 
+from sqlalchemy import and_
 from sqlalchemy.orm import Session
 from typing import Dict, Optional
 from decimal import Decimal
 from datetime import date
+import hashlib
+import uuid
 from app.models.user import User
 from app.models.address import Address
 from app.models.payment_method import PaymentMethod
 from app.models.product import Product
 from app.models.user_loyalty import UserLoyalty
-from app.models.loyalty_tier import LoyaltyTier
 from app.models.shopping_cart import ShoppingCart
 from app.models.cart_item import CartItem
 from app.models.coupon import Coupon
 from app.models.user_coupon import UserCoupon
-from app.models.enum import OrderStatus, PaymentType
-import stripe
+from app.models.enum import OrderStatus, PaymentType, OutboxEventType
 from app.services.stripe_service import stripe_service
+from app.services.stripe_mirror_service import stripe_mirror_service
 from app.services.paypal_service import paypal_service
+from app.services.outbox_service import outbox_service
 from app.api.v1.orders.service import order_service
 from app.api.v1.loyalty.service import loyalty_service
+from app.api.v1.cart.service import CartService
 from app.config import settings
 
 class PaymentProcessService:
@@ -42,6 +46,9 @@ class PaymentProcessService:
             Calcula el resumen del checkout del carrito del usuario, incluyendo subtotal,
             envío, cupones, descuentos, total y puntos por ganar. Valida stock, dirección
             y reglas del programa de lealtad.
+            El carrito y sus productos se leen en una sola consulta, el tier sale de la
+            tabla de tiers en memoria y el cupón se valida con un solo join, por lo que
+            el número de consultas no depende de cuántos productos tenga el carrito.
 
         Parámetros:
             db (Session): Sesión activa de la base de datos.
@@ -50,101 +57,121 @@ class PaymentProcessService:
             coupon_code (str, opcional): Código de cupón a aplicar.
 
         Retorna:
-            dict: Resultado del cálculo, incluyendo resumen y coupon_id si aplica.
+            dict: Resultado del cálculo, incluyendo resumen (para la respuesta), montos
+                  exactos en Decimal (para crear la orden) y coupon_id si aplica.
         """
         try:
-            cart = db.query(ShoppingCart).filter(ShoppingCart.user_id == user_id).first()
-            if not cart:
+            # Cambios del carrito pendientes en el store (write-behind) se persisten al iniciar el checkout
+            CartService.persist_cart(db, user_id)
+            
+            # Carrito + items + productos en una sola consulta
+            cart_rows = db.query(
+                ShoppingCart.cart_id,
+                CartItem.quantity,
+                Product.product_id,
+                Product.name,
+                Product.price,
+                Product.stock,
+                Product.is_active
+            ).outerjoin(
+                CartItem, CartItem.cart_id == ShoppingCart.cart_id
+            ).outerjoin(
+                Product, Product.product_id == CartItem.product_id
+            ).filter(
+                ShoppingCart.user_id == user_id
+            ).all()
+            
+            if not cart_rows:
                 return {"success": False, "error": "Carrito no encontrado"}
             
-            cart_items = db.query(CartItem).filter(CartItem.cart_id == cart.cart_id).all()
-            if not cart_items:
+            if cart_rows[0].quantity is None:
                 return {"success": False, "error": "El carrito está vacío"}
             
             # Valida direccion
-            address = db.query(Address).filter(
+            address_exists = db.query(Address.address_id).filter(
                 Address.address_id == address_id,
                 Address.user_id == user_id
             ).first()
-            if not address:
+            if not address_exists:
                 return {"success": False, "error": "Dirección no encontrada"}
             
             # Calcula subtotal y checa stock
             subtotal = Decimal('0.00')
-            for cart_item in cart_items:
-                product = db.query(Product).filter(
-                    Product.product_id == cart_item.product_id
-                ).first()
-                
-                if not product or not product.is_active:
+            for row in cart_rows:
+                if row.product_id is None or not row.is_active:
                     return {"success": False, "error": f"Producto no disponible"}
                 
-                if product.stock < cart_item.quantity:
-                    return {"success": False, "error": f"Stock insuficiente para {product.name}"}
+                if row.stock < row.quantity:
+                    return {"success": False, "error": f"Stock insuficiente para {row.name}"}
                 
-                subtotal += product.price * cart_item.quantity
+                subtotal += row.price * row.quantity
             
-            # Calculos de shipping (depende de loyalty tier)
-            user_loyalty = db.query(UserLoyalty).filter(
+            # Calculos de shipping (depende de loyalty tier, leído de la tabla en memoria)
+            tier_id = db.query(UserLoyalty.tier_id).filter(
                 UserLoyalty.user_id == user_id
-            ).first()
+            ).scalar()
             
             shipping_cost = Decimal('150.00')  # Default shipping
             
-            if user_loyalty:
-                tier = db.query(LoyaltyTier).filter(
-                    LoyaltyTier.tier_id == user_loyalty.tier_id
-                ).first()
-                
-                if tier:
-                    # Nivel 3: Envío gratis siempre (free_shipping_threshold = 0)
-                    if tier.free_shipping_threshold == 0:
-                        shipping_cost = Decimal('0.00')
-                    # Nivel 2: Envío gratis si supera el threshold
-                    elif tier.free_shipping_threshold > 0 and subtotal >= tier.free_shipping_threshold:
-                        shipping_cost = Decimal('0.00')
-                    # Nivel 1: Envío de $150 siempre
-                    else:
-                        shipping_cost = Decimal('150.00')
+            tier = loyalty_service.get_cached_tiers(db).get(tier_id) if tier_id else None
+            if tier:
+                threshold = tier["free_shipping_threshold"]
+                # Nivel 3: Envío gratis siempre (free_shipping_threshold = 0)
+                if threshold == 0:
+                    shipping_cost = Decimal('0.00')
+                # Nivel 2: Envío gratis si supera el threshold
+                elif threshold > 0 and subtotal >= threshold:
+                    shipping_cost = Decimal('0.00')
+                # Nivel 1: Envío de $150 siempre
+                else:
+                    shipping_cost = Decimal('150.00')
             
             # Calcula desceunto si hay cupon
             discount_amount = Decimal('0.00')
             coupon_id = None
             
             if coupon_code:
-                # Verifica que el cupón exista y esté activo
-                coupon = db.query(Coupon).filter(
+                # Cupón activo + asignación al usuario en una sola consulta
+                coupon_row = db.query(
+                    Coupon.coupon_id,
+                    Coupon.discount_value,
+                    Coupon.start_date,
+                    Coupon.expiration_date,
+                    UserCoupon.user_coupon_id,
+                    UserCoupon.used_date
+                ).outerjoin(
+                    UserCoupon,
+                    and_(
+                        UserCoupon.coupon_id == Coupon.coupon_id,
+                        UserCoupon.user_id == user_id
+                    )
+                ).filter(
                     Coupon.coupon_code == coupon_code,
                     Coupon.is_active == True
                 ).first()
                 
-                if not coupon:
+                if not coupon_row:
                     return {"success": False, "error": "Cupón no válido"}
                 
                 # Verifica que el cupón esté asignado al usuario
-                user_coupon = db.query(UserCoupon).filter(
-                    UserCoupon.user_id == user_id,
-                    UserCoupon.coupon_id == coupon.coupon_id
-                ).first()
-                
-                if not user_coupon:
+                if coupon_row.user_coupon_id is None:
                     return {"success": False, "error": "Este cupón no está asignado a tu cuenta"}
                 
                 # Verifica que el cupón no haya sido usado
-                if user_coupon.used_date is not None:
+                if coupon_row.used_date is not None:
                     return {"success": False, "error": "Este cupón ya ha sido utilizado"}
                 
                 # Valida fechas del cupón
                 today = date.today()
-                if coupon.expiration_date and coupon.expiration_date < today:
+                if coupon_row.expiration_date and coupon_row.expiration_date < today:
                     return {"success": False, "error": "El cupón ha expirado"}
               
-                if coupon.start_date and coupon.start_date > today:
+                if coupon_row.start_date and coupon_row.start_date > today:
                     return {"success": False, "error": "El cupón aún no es válido"}
                 
                 # Calcula descuento (discount_value es porcentaje)
-                discount_amount = subtotal * (coupon.discount_value / Decimal('100.00'))
-                coupon_id = coupon.coupon_id
+                discount_amount = subtotal * (coupon_row.discount_value / Decimal('100.00'))
+                coupon_id = coupon_row.coupon_id
             
             # Total
             total_amount = subtotal + shipping_cost - discount_amount
@@ -159,14 +186,30 @@ class PaymentProcessService:
                     "shipping_cost": float(shipping_cost),
                     "discount_amount": float(discount_amount),
                     "total_amount": float(total_amount),
-                    "items_count": len(cart_items),
+                    "items_count": len(cart_rows),
                     "points_to_earn": points_to_earn
                 },
+                "amounts": {
+                    "subtotal": subtotal,
+                    "shipping_cost": shipping_cost,
+                    "discount_amount": discount_amount,
+                    "total_amount": total_amount
+                },
                 "coupon_id": coupon_id
             }
         except Exception as e:
             return {"success": False, "error": f"Error al calcular resumen: {str(e)}"}
     
+    @staticmethod
+    def _checkout_charge_key(user_id: int, idempotency_key: Optional[str]) -> str:
+        """
+        Llave de idempotencia del cobro en Stripe: derivada de la Idempotency-Key del
+        cliente (hash, porque Stripe limita la longitud) o única para este checkout.
+        """
+        if idempotency_key:
+            return "checkout-" + hashlib.sha256(f"{user_id}:{idempotency_key}".encode()).hexdigest()
+        return f"checkout-{user_id}-{uuid.uuid4().hex}"
+    
     async def create_stripe_checkout_session(
         self,
         db: Session,
@@ -174,7 +217,8 @@ class PaymentProcessService:
         address_id: int,
         payment_method_id: Optional[int] = None,
         coupon_code: Optional[str] = None,
-        subscription_id: Optional[int] = None
+        subscription_id: Optional[int] = None,
+        idempotency_key: Optional[str] = None
     ) -> Dict:
         """
         Autor: Lizbeth Barajas
@@ -190,6 +234,9 @@ class PaymentProcessService:
             payment_method_id (int, opcional): ID del método de pago guardado.
             coupon_code (str, opcional): Cupón aplicado en la compra.
             subscription_id (int, opcional): Identificador de suscripción.
+            idempotency_key (str, opcional): Idempotency-Key de la petición; de ella se deriva
+                la llave del cobro en Stripe, así que el reintento del cliente concilia
+                el cobro anterior en lugar de repetirlo.
 
         Retorna:
             dict: Resultado del proceso, incluyendo URL de Stripe o client secret.
@@ -207,8 +254,7 @@ class PaymentProcessService:
                 return summary_result
             
             summary = summary_result["summary"]
-            coupon_id = summary_result.get("coupon_id")
-            total_amount = Decimal(str(summary["total_amount"]))
+            total_amount = summary_result["amounts"]["total_amount"]
             
             # si es con pago guardado
             if payment_method_id:
@@ -217,9 +263,9 @@ class PaymentProcessService:
                     user=user,
                     address_id=address_id,
                     payment_method_id=payment_method_id,
-                    summary=summary,
-                    coupon_id=coupon_id,
-                    subscription_id=subscription_id
+                    summary_result=summary_result,
+                    subscription_id=subscription_id,
+                    idempotency_key=idempotency_key
                 )
             
             # si es con tarjeta nueva - nuevo checkout en stripe
@@ -236,7 +282,7 @@ class PaymentProcessService:
                 if subscription_id:
                     metadata["subscription_id"] = str(subscription_id)
                 
-                stripe_session = stripe_service.create_checkout_session(
+                stripe_session = await stripe_service.create_checkout_session_async(
                     amount=int(total_amount * 100),
                     currency="mxn",
                     product_name="Compra BeFit",
@@ -266,9 +312,9 @@ class PaymentProcessService:
         user: User,
         address_id: int,
         payment_method_id: int,
-        summary: dict,
-        coupon_id: Optional[int],
-        subscription_id: Optional[int]
+        summary_result: Dict,
+        subscription_id: Optional[int],
+        idempotency_key: Optional[str] = None
     ) -> Dict:
         """
         Autor: Lizbeth Barajas
@@ -282,9 +328,10 @@ class PaymentProcessService:
             user (User): Instancia del usuario realizando la compra.
             address_id (int): Dirección seleccionada para envío.
             payment_method_id (int): ID del método de pago guardado.
-            summary (dict): Resumen del checkout previamente calculado.
-            coupon_id (int, opcional): ID del cupón aplicado.
+            summary_result (dict): Resultado de calculate_checkout_summary previamente calculado.
             subscription_id (int, opcional): ID de la suscripción asociada.
+            idempotency_key (str, opcional): Idempotency-Key de la petición. Sin ella, la
+                llave del cobro en Stripe es única por checkout.
 
         Retorna:
             dict: Resultado del proceso, incluyendo order_id y puntos generados.
@@ -302,9 +349,10 @@ class PaymentProcessService:
                 return {"success": False, "error": "Usuario no tiene customer de Stripe"}
             
             # cargo a la tarjeta guardada
-            total_amount = Decimal(str(summary["total_amount"]))
+            amounts = summary_result["amounts"]
+            total_amount = amounts["total_amount"]
             
-            payment_result = stripe_service.create_payment_intent_with_saved_card(
+            payment_result = await stripe_service.create_payment_intent_with_saved_card_async(
                 amount=int(total_amount * 100),
                 currency="mxn",
                 customer_id=user.stripe_customer_id,
@@ -313,9 +361,18 @@ class PaymentProcessService:
                 metadata={
                     "user_id": str(user.user_id),
                     "address_id": str(address_id)
-                }
+                },
+                idempotency_key=self._checkout_charge_key(user.user_id, idempotency_key)
             )
             
+            # El cobro pudo haberse confirmado en Stripe: no se reporta como fallido
+            if payment_result.get('outcome_unknown'):
+                return {
+                    "success": False,
+                    "outcome_unknown": True,
+                    "error": "No se pudo confirmar el cobro con Stripe; reintenta con la misma Idempotency-Key"
+                }
+            
             # Maneja casos donde se requiere autenticación adicional (3D Secure)
             if not payment_result.get('success'):
                 if payment_result.get('requires_action'):
@@ -336,12 +393,12 @@ class PaymentProcessService:
                 user_id=user.user_id,
                 address_id=address_id,
                 payment_id=saved_payment.payment_id,
-                subtotal=Decimal(str(summary["subtotal"])),
-                shipping_cost=Decimal(str(summary["shipping_cost"])),
-                discount_amount=Decimal(str(summary["discount_amount"])),
+                subtotal=amounts["subtotal"],
+                shipping_cost=amounts["shipping_cost"],
+                discount_amount=amounts["discount_amount"],
                 total_amount=total_amount,
                 order_status=OrderStatus.PAID,
-                coupon_id=coupon_id,
+                coupon_id=summary_result.get("coupon_id"),
                 subscription_id=subscription_id
             )
             
@@ -352,19 +409,13 @@ class PaymentProcessService:
             order = order_result["order"]
             points_earned = order_result["points_earned"]
             
-            # Logica de puntos - loyalty program
-            if points_earned > 0:
-                user_loyalty = db.query(UserLoyalty).filter(
-                    UserLoyalty.user_id == user.user_id
-                ).first()
-                
-                if user_loyalty:
-                    loyalty_service.add_points(
-                        db=db,
-                        loyalty_id=user_loyalty.loyalty_id,
-                        points=points_earned,
-                        order_id=order.order_id
-                    )
+            # Logica de puntos - loyalty program (la aplica el worker del outbox)
+            outbox_service.enqueue(
+                db,
+                OutboxEventType.ORDER_PAID,
+                order.order_id,
+                {"user_id": user.user_id, "points": points_earned}
+            )
             
             db.commit()
             db.refresh(order)
@@ -405,7 +456,7 @@ class PaymentProcessService:
             dict: Resultado del proceso con información de la orden generada.
         """
         try:
-            session = stripe_service.retrieve_session(session_id)
+            session = await stripe_service.retrieve_session_async(session_id)
             if not session:
                 return {"success": False, "error": "Sesión no encontrada"}
             
@@ -430,13 +481,15 @@ class PaymentProcessService:
             if not summary_result.get("success"):
                 return summary_result
             
-            summary = summary_result["summary"]
+            amounts = summary_result["amounts"]
             coupon_id = summary_result.get("coupon_id")
             
-            payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+            payment_intent = await stripe_service.retrieve_payment_intent_async(payment_intent_id)
+            if not payment_intent:
+                return {"success": False, "error": "No se pudo obtener el pago de Stripe durante webhook"}
             payment_method_id = payment_intent.payment_method
 
-            pm_data = stripe_service.get_payment_method(payment_method_id)
+            pm_data = await stripe_mirror_service.get_payment_method_async(db, payment_method_id)
 
             if not pm_data["success"]:
                 return {"success": False, "error": "No se pudo obtener sesión de Stripe durante webhook"}
@@ -478,10 +531,10 @@ class PaymentProcessService:
                 user_id=user_id,
                 address_id=address_id,
                 payment_id=payment_method_record.payment_id,
-                subtotal=Decimal(str(summary["subtotal"])),
-                shipping_cost=Decimal(str(summary["shipping_cost"])),
-                discount_amount=Decimal(str(summary["discount_amount"])),
-                total_amount=Decimal(str(summary["total_amount"])),
+                subtotal=amounts["subtotal"],
+                shipping_cost=amounts["shipping_cost"],
+                discount_amount=amounts["discount_amount"],
+                total_amount=amounts["total_amount"],
                 order_status=OrderStatus.PAID,
                 coupon_id=coupon_id,
                 subscription_id=subscription_id
@@ -494,22 +547,13 @@ class PaymentProcessService:
             order = order_result["order"]
             points_earned = order_result["points_earned"]
             
-            # Logica de puntos - loyalty program
-            if points_earned > 0:
-                user_loyalty = db.query(UserLoyalty).filter(
-                    UserLoyalty.user_id == user_id
-                ).first()
-                
-                if user_loyalty:
-                    loyalty_result = loyalty_service.add_points(
-                        db=db,
-                        loyalty_id=user_loyalty.loyalty_id,
-                        points=points_earned,
-                        order_id=order.order_id
-                    )
-                    
-                    if not loyalty_result.get("success"):
-                        print(f"Error al agregar puntos: {loyalty_result.get('error')}")
+            # Logica de puntos - loyalty program (la aplica el worker del outbox)
+            outbox_service.enqueue(
+                db,
+                OutboxEventType.ORDER_PAID,
+                order.order_id,
+                {"user_id": user_id, "points": points_earned}
+            )
             
             db.commit()
             db.refresh(order)
@@ -518,7 +562,7 @@ class PaymentProcessService:
                 "success": True,
                 "message": "Pago procesado exitosamente",
                 "order_id": order.order_id,
-                "total_amount": float(summary["total_amount"]),
+                "total_amount": float(amounts["total_amount"]),
                 "points_earned": points_earned
             }
         except Exception as e:
@@ -553,15 +597,7 @@ class PaymentProcessService:
             if not user or not user.account_status:
                 return {"success": False, "error": "Usuario no encontrado o inactivo"}
             
-            cart = db.query(ShoppingCart).filter(ShoppingCart.user_id == user.user_id).first()
-            if not cart:
-                return {"success": False, "error": "Carrito no encontrado"}
-            
-            cart_items = db.query(CartItem).filter(CartItem.cart_id == cart.cart_id).all()
-            if not cart_items:
-                return {"success": False, "error": "El carrito está vacío"}
-            
-            # Calcula resumen
+            # Calcula resumen (valida también carrito vacío o inexistente)
             summary_result = self.calculate_checkout_summary(
                 db, user.user_id, address_id, coupon_code
             )
@@ -569,7 +605,7 @@ class PaymentProcessService:
                 return summary_result
             
             summary = summary_result["summary"]
-            total_amount = Decimal(str(summary["total_amount"]))
+            total_amount = summary_result["amounts"]["total_amount"]
             
             # Crea orden en paypal
             paypal_response = await paypal_service.create_order(
@@ -642,7 +678,7 @@ class PaymentProcessService:
             if not summary_result.get("success"):
                 return summary_result
             
-            summary = summary_result["summary"]
+            amounts = summary_result["amounts"]
             coupon_id = summary_result.get("coupon_id")
             
             # Crea registro
@@ -660,10 +696,10 @@ class PaymentProcessService:
                 user_id=user.user_id,
                 address_id=address_id,
                 payment_id=paypal_payment.payment_id,
-                subtotal=Decimal(str(summary["subtotal"])),
-                shipping_cost=Decimal(str(summary["shipping_cost"])),
-                discount_amount=Decimal(str(summary["discount_amount"])),
-                total_amount=Decimal(str(summary["total_amount"])),
+                subtotal=amounts["subtotal"],
+                shipping_cost=amounts["shipping_cost"],
+                discount_amount=amounts["discount_amount"],
+                total_amount=amounts["total_amount"],
                 order_status=OrderStatus.PAID,
                 coupon_id=coupon_id,
                 subscription_id=None
@@ -676,22 +712,13 @@ class PaymentProcessService:
             order = order_result["order"]
             points_earned = order_result["points_earned"]
             
-            # Logica de puntos - loyalty program
-            if points_earned > 0:
-                user_loyalty = db.query(UserLoyalty).filter(
-                    UserLoyalty.user_id == user.user_id
-                ).first()
-                
-                if user_loyalty:
-                    loyalty_result = loyalty_service.add_points(
-                        db=db,
-                        loyalty_id=user_loyalty.loyalty_id,
-                        points=points_earned,
-                        order_id=order.order_id
-                    )
-                    
-                    if not loyalty_result.get("success"):
-                        print(f"Error al agregar puntos: {loyalty_result.get('error')}")
+            # Logica de puntos - loyalty program (la aplica el worker del outbox)
+            outbox_service.enqueue(
+                db,
+                OutboxEventType.ORDER_PAID,
+                order.order_id,
+                {"user_id": user.user_id, "points": points_earned}
+            )
             
             db.commit()
             db.refresh(order)
@@ -700,7 +727,7 @@ class PaymentProcessService:
                 "success": True,
                 "message": "Pago PayPal procesado exitosamente",
                 "order_id": order.order_id,
-                "total_amount": float(summary["total_amount"]),
+                "total_amount": float(amounts["total_amount"]),
                 "points_earned": points_earned
             }
         except Exception as e:
@@ -12,6 +12,7 @@ from app.models.product import Product
 from app.models.product_image import ProductImage
 from app.models.review import Review
 from app.api.v1.products import schemas
+from app.services.subscription_catalog_service import subscription_catalog_service
 
 
 class ProductService:
@@ -114,6 +115,7 @@ class ProductService:
         
         db.commit()
         db.refresh(db_product)
+        subscription_catalog_service.invalidate()
         
         return db_product
     
@@ -144,6 +146,7 @@ class ProductService:
         
         db.commit()
         db.refresh(product)
+        subscription_catalog_service.invalidate()
         
         return product
     
@@ -164,6 +167,7 @@ class ProductService:
         product = ProductService.get_product_by_id(db, product_id)
         product.is_active = False
         db.commit()
+        subscription_catalog_service.invalidate()
         return True
     
     @staticmethod
@@ -183,6 +187,7 @@ class ProductService:
         product = ProductService.get_product_by_id(db, product_id)
         db.delete(product)
         db.commit()
+        subscription_catalog_service.invalidate()
         return True
 
 
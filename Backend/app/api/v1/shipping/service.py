@@ -17,6 +17,7 @@ from app.models.product import Product as ProductModel
 from app.models.enum import OrderStatus
 from app.models.cart_item import CartItem as CartItemModel
 from app.models.shopping_cart import ShoppingCart as ShoppingCartModel
+from app.api.v1.cart.service import CartService
 
 class ShippingService:
     """
@@ -29,6 +30,8 @@ class ShippingService:
         tracking_number = ShippingService.generate_tracking_number()
         total_subtotal = Decimal("0.0")
         order_item_models = [] # lista para guardar los items del carrito
+        # persiste los cambios pendientes del carrito (write-behind) antes de leerlo
+        CartService.persist_cart(db, order_in.user_id, commit=False)
         # obtiene el carrito del usuario
         cart = db.query(ShoppingCartModel).filter(ShoppingCartModel.user_id == order_in.user_id).first()
 
@@ -97,6 +100,7 @@ class ShippingService:
             for cart_item in cart_items:
                 db.delete(cart_item)
             db.commit()
+            CartService.evict_cart(order_in.user_id)
             db.refresh(new_order) # Obtiene new_order.order_id
         except Exception as e:
             db.rollback()
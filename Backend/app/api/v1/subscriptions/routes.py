@@ -3,7 +3,7 @@
 # Descripción: Rutas API para gestión de suscripciones mensuales.
 #              Define todos los endpoints REST para operaciones de suscripción.
 
-from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi import APIRouter, Depends, Query, status, HTTPException
 from sqlalchemy.orm import Session
 
 from app.api.deps import get_db, get_current_user
@@ -362,29 +362,35 @@ def update_subscription_payment_method(
     response_model=schemas.SubscriptionHistoryResponse
 )
 def get_subscription_history(
+    page: int = Query(1, ge=1),
+    limit: int = Query(12, ge=1, le=100),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Autor: Luis Flores y Lizbeth Barajas
-    Descripción: Obtiene el historial completo de órdenes de la suscripción del usuario.
-                 Incluye todas las órdenes generadas, totales y detalles de envío.
+    Descripción: Obtiene el historial de órdenes de la suscripción del usuario.
+                 Incluye las órdenes generadas (paginadas), totales y detalles de envío.
     Parámetros:
+        page (int): Número de página (inicia en 1).
+        limit (int): Órdenes por página (1-100).
         current_user (User): Usuario autenticado obtenido del token JWT.
         db (Session): Sesión de base de datos inyectada.
     Retorna:
-        SubscriptionHistoryResponse: Historial completo con suscripción y todas sus órdenes.
+        SubscriptionHistoryResponse: Historial con suscripción, totales y una página de órdenes.
     Excepciones:
         HTTPException 400: Si no se encuentra suscripción o hay error.
     
     Incluye:
-    - Todas las órdenes generadas por la suscripción
-    - Total gastado
+    - Órdenes generadas por la suscripción, de la más reciente a la más antigua
+    - Total de órdenes, total gastado y fecha de la última entrega
     - Detalles de cada entrega
     """
     result = subscription_service.get_subscription_history(
         db=db,
-        user_id=current_user.user_id
+        user_id=current_user.user_id,
+        page=page,
+        limit=limit
     )
     
     if not result.get("success"):
@@ -438,5 +444,9 @@ def get_subscription_history(
         subscription=subscription_response,
         orders=orders_response,
         total_orders=result["total_orders"],
-        total_spent=result["total_spent"]
+        total_spent=result["total_spent"],
+        last_delivery_date=result["last_delivery_date"],
+        page=result["page"],
+        limit=result["limit"],
+        total_pages=result["total_pages"]
     )
\ No newline at end of file
@@ -194,14 +194,22 @@ class SubscriptionHistoryResponse(BaseModel):
                  Incluye la información de la suscripción y todas sus órdenes generadas.
     Atributos:
         subscription (SubscriptionResponse): Información completa de la suscripción.
-        orders (list[SubscriptionOrderHistory]): Lista de todas las órdenes generadas.
+        orders (list[SubscriptionOrderHistory]): Órdenes de la página solicitada.
         total_orders (int): Cantidad total de órdenes realizadas.
         total_spent (Decimal): Monto total gastado en todas las órdenes.
+        last_delivery_date (Optional[date]): Fecha de la orden más reciente.
+        page (int): Página actual.
+        limit (int): Órdenes por página.
+        total_pages (int): Total de páginas.
     """
     subscription: SubscriptionResponse
     orders: list[SubscriptionOrderHistory]
     total_orders: int
     total_spent: Decimal
+    last_delivery_date: Optional[date] = None
+    page: int = 1
+    limit: int = 12
+    total_pages: int = 0
     
     class Config:
         json_schema_extra = {
@@ -214,6 +222,10 @@ class SubscriptionHistoryResponse(BaseModel):
                 },
                 "orders": [],
                 "total_orders": 3,
-                "total_spent": 1497.00
+                "total_spent": 1497.00,
+                "last_delivery_date": "2024-11-17",
+                "page": 1,
+                "limit": 12,
+                "total_pages": 1
             }
         }
\ No newline at end of file
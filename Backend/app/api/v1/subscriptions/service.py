@@ -2,13 +2,28 @@
 # Fecha: 17/11/2025
 # Descripción: Servicio de lógica de negocio para gestión de suscripciones,
 #              cobros recurrentes, selección de productos y manejo de estados.
+#              Los cobros del job se procesan por bloques en un pool de hilos, cada uno
+#              con su propia sesión y transacción, y quedan registrados en el ledger
+#              billing_run / billing_run_item para poder reanudar una ejecución interrumpida.
+#              Varias réplicas pueden correr el job a la vez: cada una reclama bloques del
+#              ledger con SELECT ... FOR UPDATE SKIP LOCKED.
 
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from typing import Dict, List
-from datetime import date, timedelta
+from sqlalchemy import and_, exists, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta, UTC
 from decimal import Decimal
 
+from app.config import settings
+from app.core.database import SessionLocal, for_update_skip_locked
+
 from app.models.subscription import Subscription
 from app.models.user import User
 from app.models.fitness_profile import FitnessProfile
@@ -17,8 +32,18 @@ from app.models.product import Product
 from app.models.order import Order
 from app.models.order_item import OrderItem
 from app.models.address import Address
-from app.models.enum import SubscriptionStatus, OrderStatus, PaymentType
+from app.models.billing_run import BillingRun
+from app.models.billing_run_item import BillingRunItem
+from app.models.enum import (
+    SubscriptionStatus,
+    OrderStatus,
+    PaymentType,
+    BillingRunStatus,
+    BillingItemStatus
+)
 from app.services.stripe_service import stripe_service
+from app.services.resilience import RateLimiter
+from app.services.subscription_catalog_service import subscription_catalog_service
 
 
 class SubscriptionService:
@@ -342,16 +367,21 @@ class SubscriptionService:
             return {"success": False, "error": f"Error al actualizar método de pago: {str(e)}"}
     
     @staticmethod
-    def get_subscription_history(db: Session, user_id: int) -> Dict:
+    def get_subscription_history(db: Session, user_id: int, page: int = 1, limit: int = 12) -> Dict:
         """
         Autor: Luis Flores y Lizbeth Barajas
-        Descripción: Obtiene el historial completo de órdenes generadas por la suscripción del usuario.
-                     Incluye totales gastados y cantidad de órdenes.
+        Descripción: Obtiene el historial de órdenes generadas por la suscripción del usuario.
+                     Los totales (cantidad de órdenes, total gastado y última entrega) se
+                     calculan con una sola consulta agregada y las órdenes se regresan
+                     paginadas, de la más reciente a la más antigua.
         Parámetros:
             db (Session): Sesión de base de datos de SQLAlchemy.
             user_id (int): ID del usuario del cual se obtendrá el historial.
+            page (int): Número de página (inicia en 1).
+            limit (int): Órdenes por página.
         Retorna:
-            Dict: Diccionario con subscription, orders, total_orders y total_spent.
+            Dict: Diccionario con subscription, orders (la página pedida), total_orders,
+                  total_spent, last_delivery_date, page, limit y total_pages.
         """
         try:
             # Obtener suscripción
@@ -362,20 +392,32 @@ class SubscriptionService:
             if not subscription:
                 return {"success": False, "error": "No se encontró suscripción"}
             
-            # Obtener todas las órdenes de la suscripción
-            orders = db.query(Order).filter(
+            # Totales de todas las órdenes de la suscripción
+            total_orders, total_spent, last_delivery = db.query(
+                func.count(Order.order_id),
+                func.coalesce(func.sum(Order.total_amount), 0),
+                func.max(Order.order_date)
+            ).filter(
                 Order.subscription_id == subscription.subscription_id
-            ).order_by(Order.order_date.desc()).all()
+            ).one()
             
-            total_orders = len(orders)
-            total_spent = sum(order.total_amount for order in orders)
+            # Página de órdenes
+            orders = db.query(Order).filter(
+                Order.subscription_id == subscription.subscription_id
+            ).order_by(
+                Order.order_date.desc(), Order.order_id.desc()
+            ).offset((page - 1) * limit).limit(limit).all()
             
             return {
                 "success": True,
                 "subscription": subscription,
                 "orders": orders,
                 "total_orders": total_orders,
-                "total_spent": total_spent
+                "total_spent": Decimal(total_spent),
+                "last_delivery_date": last_delivery.date() if last_delivery else None,
+                "page": page,
+                "limit": limit,
+                "total_pages": -(-total_orders // limit)
             }
             
         except Exception as e:
@@ -385,55 +427,34 @@ class SubscriptionService:
     def _select_products_for_subscription(
         db: Session,
         fitness_profile: FitnessProfile
-    ) -> List[Product]:
+    ) -> List[Dict]:
         """
         Autor: Luis Flores y Lizbeth Barajas
         Descripción: Selecciona hasta 3 productos personalizados basándose en el perfil fitness del usuario.
                      Prioriza productos que coincidan con el plan recomendado y objetivos fitness.
+                     Lee del catálogo en memoria (subscription_catalog_service), sin consultar
+                     la tabla de productos por cada suscripción.
         Parámetros:
             db (Session): Sesión de base de datos de SQLAlchemy.
             fitness_profile (FitnessProfile): Perfil fitness del usuario con atributos y recomendaciones.
         Retorna:
-            List[Product]: Lista de hasta 3 productos seleccionados para la suscripción.
+            List[Dict]: Lista de hasta 3 productos (product_id, name, price) seleccionados para la suscripción.
         """
         attributes = fitness_profile.attributes or {}
-        recommended_plan = attributes.get("recommended_plan", "")
-        
-        # Buscar productos que coincidan con el plan recomendado
-        selected_products = []
-        
-        if recommended_plan:
-            products = db.query(Product).filter(
-                and_(
-                    Product.is_active == True,
-                    Product.stock > 0,
-                    Product.name.ilike(f"%{recommended_plan}%")
-                )
-            ).limit(3).all()
-            
-            selected_products.extend(products)
-        
-        # Si no se encontraron suficientes productos por nombre, buscar por objetivos
-        if len(selected_products) < 3:
-            fitness_objectives = attributes.get("fitness_objectives", [])
-            
-            additional_products = db.query(Product).filter(
-                and_(
-                    Product.is_active == True,
-                    Product.stock > 0,
-                    Product.fitness_objectives.contains(fitness_objectives)
-                )
-            ).limit(3 - len(selected_products)).all()
-            
-            selected_products.extend(additional_products)
-        
-        return selected_products[:3]  # Máximo 3 productos por suscripción
+        return subscription_catalog_service.select_products(
+            db,
+            recommended_plan=attributes.get("recommended_plan", ""),
+            fitness_objectives=attributes.get("fitness_objectives", [])
+        )
     
     @staticmethod
     def _process_subscription_charge(
         db: Session,
         subscription: Subscription,
-        user: User
+        user: User,
+        next_delivery_date: Optional[date] = None,
+        billing_item: Optional[BillingRunItem] = None,
+        worker_id: Optional[str] = None
     ) -> Dict:
         """
         Autor: Luis Flores y Lizbeth Barajas
@@ -444,9 +465,18 @@ class SubscriptionService:
             db (Session): Sesión de base de datos de SQLAlchemy.
             subscription (Subscription): Objeto de suscripción a cobrar.
             user (User): Usuario propietario de la suscripción.
+            next_delivery_date (date, opcional): Próxima fecha de entrega que se guarda en la
+                                                 misma transacción que la orden si el cobro es exitoso.
+            billing_item (BillingRunItem, opcional): Registro del ledger del cobro; su llave de
+                                                     idempotencia se envía a Stripe y su resultado
+                                                     se guarda en la misma transacción.
+            worker_id (str, opcional): Worker que tiene reclamado el registro. El resultado solo
+                                       se guarda si el registro sigue en CHARGING a su nombre;
+                                       si otro worker lo reclamó, la transacción se revierte.
         Retorna:
             Dict: Diccionario con success, order_id y message si fue exitoso.
-                  En caso de error, incluye el mensaje de error.
+                  En caso de error, incluye el mensaje de error (y lease_lost si el
+                  registro ya no era de este worker o el periodo ya se había cobrado).
         """
         try:
             # Verificar que tiene stripe_customer_id
@@ -483,17 +513,22 @@ class SubscriptionService:
             if not default_address:
                 return {"success": False, "error": "Usuario no tiene dirección de envío registrada"}
             
+            # La descripción usa el periodo del ledger: al reintentar con la misma llave de
+            # idempotencia (otro día u otro mes) los parámetros enviados a Stripe no cambian
+            period = billing_item.period_date if billing_item else date.today()
+            
             # Realizar cobro con Stripe
             charge_result = stripe_service.create_payment_intent_with_saved_card(
                 amount=int(subscription.price * 100),  # Convertir a centavos
                 currency="mxn",
                 customer_id=user.stripe_customer_id,
                 payment_method_id=payment_method.provider_ref,
-                description=f"Suscripción mensual BeFit - {date.today().strftime('%B %Y')}",
+                description=f"Suscripción mensual BeFit - {period.strftime('%B %Y')}",
                 metadata={
                     "subscription_id": str(subscription.subscription_id),
                     "user_id": str(user.user_id)
-                }
+                },
+                idempotency_key=billing_item.idempotency_key if billing_item else None
             )
             
             if not charge_result.get("success"):
@@ -504,6 +539,14 @@ class SubscriptionService:
                 if subscription.failed_payment_attempts >= 3:
                     subscription.subscription_status = SubscriptionStatus.PAUSED
                 
+                if billing_item and not SubscriptionService._settle_billing_item(
+                    db, billing_item, worker_id,
+                    status=BillingItemStatus.FAILED,
+                    error=f"Error en el cobro: {charge_result.get('error')}"
+                ):
+                    db.rollback()
+                    return SubscriptionService._lease_lost_result()
+                
                 db.commit()
                 return {
                     "success": False,
@@ -511,7 +554,7 @@ class SubscriptionService:
                 }
             
             # Crear la orden
-            subtotal = sum(product.price for product in products)
+            subtotal = sum(product["price"] for product in products)
             
             new_order = Order(
                 user_id=user.user_id,
@@ -534,22 +577,54 @@ class SubscriptionService:
             for product in products:
                 order_item = OrderItem(
                     order_id=new_order.order_id,
-                    product_id=product.product_id,
+                    product_id=product["product_id"],
                     quantity=1,
-                    unit_price=product.price,
-                    subtotal=product.price
+                    unit_price=product["price"],
+                    subtotal=product["price"]
                 )
                 db.add(order_item)
                 
-                # Reducir stock
-                product.stock -= 1
+                # Reducir stock en SQL (otros cobros del job pueden tomar el mismo producto a la vez)
+                db.query(Product).filter(
+                    Product.product_id == product["product_id"]
+                ).update({Product.stock: Product.stock - 1}, synchronize_session=False)
             
             # Actualizar suscripción
-            subscription.last_payment_date = date.today()
-            subscription.failed_payment_attempts = 0  # Resetear intentos fallidos
+            if billing_item:
+                # Solo avanza si el periodo sigue sin cobrarse; si otro cobro ya lo avanzó,
+                # esta orden sería duplicada y se revierte
+                advanced = db.execute(
+                    update(Subscription).where(
+                        Subscription.subscription_id == subscription.subscription_id,
+                        Subscription.next_delivery_date == billing_item.period_date
+                    ).values(
+                        last_payment_date=date.today(),
+                        failed_payment_attempts=0,  # Resetear intentos fallidos
+                        next_delivery_date=next_delivery_date or billing_item.period_date
+                    ).execution_options(synchronize_session=False)
+                ).rowcount
+                if not advanced:
+                    db.rollback()
+                    return SubscriptionService._lease_lost_result()
+            else:
+                subscription.last_payment_date = date.today()
+                subscription.failed_payment_attempts = 0  # Resetear intentos fallidos
+                if next_delivery_date:
+                    subscription.next_delivery_date = next_delivery_date
+            
+            # Si otro worker reclamó el registro, su orden es la que cuenta: se revierte esta
+            if billing_item and not SubscriptionService._settle_billing_item(
+                db, billing_item, worker_id,
+                status=BillingItemStatus.SUCCEEDED,
+                order_id=new_order.order_id,
+                error=None
+            ):
+                db.rollback()
+                return SubscriptionService._lease_lost_result()
             
             db.commit()
             db.refresh(new_order)
+            subscription_catalog_service.record_shipment([product["product_id"] for product in products])
             
             return {
                 "success": True,
@@ -562,66 +637,435 @@ class SubscriptionService:
             return {"success": False, "error": f"Error procesando cobro: {str(e)}"}
     
     @staticmethod
-    def process_due_subscriptions(db: Session) -> Dict:
+    def _settle_billing_item(
+        db: Session,
+        billing_item: BillingRunItem,
+        worker_id: Optional[str],
+        **values
+    ) -> bool:
+        """
+        Guarda el resultado del cobro en el ledger solo si el registro sigue en CHARGING y
+        reclamado por este worker (el lease se revisa en la misma transacción que la orden).
+        Regresa False si ninguna fila cambió.
+        """
+        settled = db.execute(
+            update(BillingRunItem).where(
+                BillingRunItem.item_id == billing_item.item_id,
+                BillingRunItem.claimed_by == (worker_id or billing_item.claimed_by),
+                BillingRunItem.status == BillingItemStatus.CHARGING
+            ).values(**values).execution_options(synchronize_session=False)
+        ).rowcount
+        return settled > 0
+
+    @staticmethod
+    def _lease_lost_result() -> Dict:
+        return {
+            "success": False,
+            "lease_lost": True,
+            "error": "El cobro ya lo tomó o registró otro worker; no se guardó el resultado"
+        }
+
+    @staticmethod
+    def _billing_idempotency_key(subscription: Subscription) -> str:
+        """
+        Llave de idempotencia del cobro: determinista por suscripción, periodo (fecha de
+        entrega que se cobra) e intento fallido, para que reanudar un cobro interrumpido
+        no cobre dos veces y un reintento de otro día sea un cobro nuevo.
+        """
+        return (
+            f"subscription-{subscription.subscription_id}-"
+            f"{subscription.next_delivery_date.strftime('%Y%m%d')}-"
+            f"{subscription.failed_payment_attempts}"
+        )
+
+    @staticmethod
+    def _open_billing_run(db: Session, today: date, max_items: Optional[int]) -> Tuple[BillingRun, bool]:
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Obtiene la ejecución de cobro a usar. Todos los workers (réplicas de la
+                     app o procesos) se unen a la ejecución RUNNING, incluida una que quedó
+                     interrumpida; si no hay, se crea una. El índice único parcial
+                     uq_billing_run_running solo permite una RUNNING: si dos workers la crean
+                     a la vez, el INSERT del segundo falla y se une a la del primero.
+        Parámetros:
+            db (Session): Sesión de base de datos de SQLAlchemy.
+            today (date): Fecha de cobro.
+            max_items (int, opcional): Máximo de suscripciones de una ejecución nueva.
+        Retorna:
+            Tuple[BillingRun, bool]: Ejecución y si ya existía (se unió a ella).
+        """
+        while True:
+            running = db.query(BillingRun).filter(
+                BillingRun.status == BillingRunStatus.RUNNING
+            ).first()
+            if running:
+                return running, True
+
+            try:
+                run = BillingRun(billing_date=today, status=BillingRunStatus.RUNNING, max_items=max_items or None)
+                db.add(run)
+                db.commit()
+                return run, False
+            except IntegrityError:
+                # Otro worker la creó a la vez: se vuelve a leer para unirse a la suya
+                db.rollback()
+
+    @staticmethod
+    def _enqueue_due_subscriptions(db: Session, run: BillingRun, limit: int) -> int:
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Agrega al ledger de la ejecución el siguiente bloque de suscripciones
+                     activas con cobro pendiente que todavía no se intentaron en la fecha de
+                     cobro, con su llave de idempotencia. Si otro worker agregó las mismas
+                     suscripciones a la vez, la restricción única (run_id, subscription_id)
+                     descarta los duplicados.
+        Parámetros:
+            db (Session): Sesión de base de datos de SQLAlchemy.
+            run (BillingRun): Ejecución actual.
+            limit (int): Máximo de suscripciones del bloque.
+        Retorna:
+            int: Suscripciones vencidas encontradas (0 cuando ya no queda ninguna).
+        """
+        attempted_today = exists().where(
+            BillingRunItem.subscription_id == Subscription.subscription_id,
+            BillingRunItem.run_id == BillingRun.run_id,
+            BillingRun.billing_date == run.billing_date
+        )
+        due_subscriptions = db.query(Subscription).filter(
+            and_(
+                Subscription.subscription_status == SubscriptionStatus.ACTIVE,
+                Subscription.next_delivery_date <= run.billing_date,
+                ~attempted_today
+            )
+        ).order_by(Subscription.subscription_id).limit(limit).all()
+
+        if not due_subscriptions:
+            return 0
+
+        insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else postgresql_insert
+        now = datetime.now(UTC).replace(tzinfo=None)
+        db.execute(
+            insert(BillingRunItem).values([
+                {
+                    "run_id": run.run_id,
+                    "subscription_id": subscription.subscription_id,
+                    "period_date": subscription.next_delivery_date,
+                    "idempotency_key": SubscriptionService._billing_idempotency_key(subscription),
+                    "status": BillingItemStatus.PENDING,
+                    "attempts": 0,
+                    "updated_at": now
+                }
+                for subscription in due_subscriptions
+            ]).on_conflict_do_nothing(index_elements=[BillingRunItem.run_id, BillingRunItem.subscription_id])
+        )
+        db.commit()
+        return len(due_subscriptions)
+
+    @staticmethod
+    def _claim_billing_items(db: Session, run: BillingRun, limit: int, worker_id: str) -> List[int]:
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Reclama para este worker hasta `limit` cobros abiertos de la ejecución
+                     (PENDING, o CHARGING de un worker que murió) que nadie tenga reclamados o
+                     cuyo lease ya venció. En PostgreSQL el SELECT usa FOR UPDATE SKIP LOCKED,
+                     así que workers simultáneos toman bloques distintos sin esperarse; en
+                     SQLite el UPDATE repite la condición y solo regresa las filas que sí
+                     quedaron a nombre de este worker.
+        Parámetros:
+            db (Session): Sesión de base de datos de SQLAlchemy.
+            run (BillingRun): Ejecución actual.
+            limit (int): Máximo de cobros a reclamar.
+            worker_id (str): Identificador del worker (host:pid).
+        Retorna:
+            List[int]: IDs de los registros reclamados.
+        """
+        now = datetime.now(UTC).replace(tzinfo=None)
+        claimable = and_(
+            BillingRunItem.run_id == run.run_id,
+            BillingRunItem.status.in_([BillingItemStatus.PENDING, BillingItemStatus.CHARGING]),
+            or_(BillingRunItem.claimed_until.is_(None), BillingRunItem.claimed_until < now)
+        )
+        candidates = for_update_skip_locked(
+            select(BillingRunItem.item_id).where(claimable).order_by(BillingRunItem.item_id).limit(limit),
+            db
+        )
+        claimed = db.execute(
+            update(BillingRunItem).where(
+                BillingRunItem.item_id.in_(candidates.scalar_subquery()),
+                claimable
+            ).values(
+                claimed_by=worker_id,
+                claimed_until=now + timedelta(seconds=settings.SUBSCRIPTION_BILLING_CLAIM_LEASE_SECONDS)
+            ).returning(BillingRunItem.item_id)
+        ).scalars().all()
+        db.commit()
+        return sorted(claimed)
+
+    @staticmethod
+    def _charge_due_subscription(
+        item_id: int,
+        today: date,
+        session_factory: Callable[[], Session],
+        limiter: RateLimiter,
+        worker_id: str
+    ) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Cobra una suscripción del ledger con su propia sesión y transacción, para
+                     que un error solo afecte a esa suscripción. Antes de llamar a Stripe el
+                     registro pasa a CHARGING, solo si sigue reclamado por este worker; el
+                     resultado (SUCCEEDED con la orden o FAILED) se guarda en la misma
+                     transacción que el cobro. Si la suscripción ya no está activa o el
+                     periodo ya se cobró (ejecución reanudada), se omite.
+        Parámetros:
+            item_id (int): ID del registro del ledger (billing_run_item).
+            today (date): Fecha del cobro.
+            session_factory (Callable): Fábrica de sesiones de base de datos.
+            limiter (RateLimiter): Límite de cobros por segundo a Stripe.
+            worker_id (str): Worker que reclamó el registro.
+        Retorna:
+            Dict: outcome ("successful", "failed" o "skipped"), error y latencia en ms.
+        """
+        limiter.acquire()
+        started = time.monotonic()
+        db = session_factory()
+        subscription_id = user_id = None
+        try:
+            item = db.get(BillingRunItem, item_id)
+            if (
+                item is None
+                or item.claimed_by != worker_id
+                or item.status not in (BillingItemStatus.PENDING, BillingItemStatus.CHARGING)
+            ):
+                return {"item_id": item_id, "outcome": "skipped"}
+            subscription_id = item.subscription_id
+
+            subscription = db.get(Subscription, item.subscription_id)
+            if (
+                not subscription
+                or subscription.subscription_status != SubscriptionStatus.ACTIVE
+                or subscription.next_delivery_date != item.period_date
+            ):
+                # Un periodo que ya avanzó se cobró antes del reinicio
+                already_charged = subscription is not None and subscription.next_delivery_date > item.period_date
+                item.status = BillingItemStatus.SUCCEEDED if already_charged else BillingItemStatus.SKIPPED
+                db.commit()
+                return {"item_id": item_id, "outcome": "skipped"}
+
+            user_id = subscription.user_id
+            # Si el lease venció y otro worker lo reclamó, este ya no lo cobra
+            taken = db.execute(
+                update(BillingRunItem).where(
+                    BillingRunItem.item_id == item_id,
+                    BillingRunItem.claimed_by == worker_id,
+                    BillingRunItem.status.in_([BillingItemStatus.PENDING, BillingItemStatus.CHARGING])
+                ).values(
+                    status=BillingItemStatus.CHARGING,
+                    attempts=BillingRunItem.attempts + 1,
+                    # El lease se renueva al empezar cada cobro, no solo al reclamar el bloque
+                    claimed_until=datetime.now(UTC).replace(tzinfo=None)
+                    + timedelta(seconds=settings.SUBSCRIPTION_BILLING_CLAIM_LEASE_SECONDS)
+                ).execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+            if not taken:
+                return {"item_id": item_id, "outcome": "skipped"}
+            item = db.get(BillingRunItem, item_id, populate_existing=True)
+
+            charge_result = SubscriptionService._process_subscription_charge(
+                db=db,
+                subscription=subscription,
+                user=subscription.user,
+                next_delivery_date=today + timedelta(days=30),
+                billing_item=item,
+                worker_id=worker_id
+            )
+            if charge_result.get("lease_lost"):
+                return {"item_id": item_id, "outcome": "skipped"}
+
+            # Validaciones que fallaron antes de cobrar (sin tarjeta, sin dirección, etc.)
+            if not charge_result.get("success"):
+                db.execute(
+                    update(BillingRunItem).where(
+                        BillingRunItem.item_id == item_id,
+                        BillingRunItem.claimed_by == worker_id,
+                        BillingRunItem.status == BillingItemStatus.CHARGING
+                    ).values(status=BillingItemStatus.FAILED, error=charge_result.get("error"))
+                    .execution_options(synchronize_session=False)
+                )
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            charge_result = {"success": False, "error": f"Error procesando cobro: {str(e)}"}
+            try:
+                db.query(BillingRunItem).filter(
+                    BillingRunItem.item_id == item_id,
+                    BillingRunItem.claimed_by == worker_id,
+                    BillingRunItem.status == BillingItemStatus.CHARGING
+                ).update({"status": BillingItemStatus.FAILED, "error": charge_result["error"]})
+                db.commit()
+            except Exception:
+                db.rollback()
+        finally:
+            db.close()
+
+        return {
+            "item_id": item_id,
+            "subscription_id": subscription_id,
+            "user_id": user_id,
+            "outcome": "successful" if charge_result.get("success") else "failed",
+            "error": charge_result.get("error"),
+            "latency_ms": (time.monotonic() - started) * 1000
+        }
+
+    @staticmethod
+    def process_due_subscriptions(
+        db: Session,
+        session_factory: Callable[[], Session] = SessionLocal,
+        workers: int = settings.SUBSCRIPTION_BILLING_WORKERS,
+        chunk_size: int = settings.SUBSCRIPTION_BILLING_CHUNK_SIZE,
+        rate_limit_per_second: float = settings.SUBSCRIPTION_BILLING_RATE_LIMIT_PER_SECOND,
+        max_items: int = settings.SUBSCRIPTION_BILLING_MAX_ITEMS_PER_RUN,
+        worker_id: Optional[str] = None
+    ) -> Dict:
         """
         Autor: Luis Flores y Lizbeth Barajas
         Descripción: CRON JOB - Procesa todas las suscripciones que tienen cobro pendiente hoy.
                      Esta función debe ejecutarse diariamente a medianoche para gestionar
                      los cobros automáticos y actualizar las fechas de próxima entrega.
+                     Cada ejecución queda en billing_run y cada cobro en billing_run_item
+                     con una llave de idempotencia determinista. Puede correr a la vez en
+                     varias réplicas o procesos: todos se unen a la misma ejecución y cada
+                     uno reclama bloques de chunk_size cobros (SKIP LOCKED) con un lease, así
+                     que ninguna suscripción se cobra dos veces. Si un worker muere, al vencer
+                     su lease otro retoma sus cobros y reenvía los que quedaron a medias con la
+                     misma llave. Si la ejecución reanudada era de un día anterior, al
+                     cerrarla se abre en la misma llamada la de hoy para cobrar también las
+                     suscripciones que vencieron después. Cada worker cobra en un pool de
+                     `workers` hilos, sin exceder rate_limit_per_second cobros por segundo.
+                     Con max_items cada ejecución cobra aproximadamente ese número (para
+                     correr el job más seguido en porciones pequeñas).
         Parámetros:
-            db (Session): Sesión de base de datos de SQLAlchemy.
+            db (Session): Sesión de base de datos de SQLAlchemy (ledger y selección de bloques).
+            session_factory (Callable): Fábrica de sesiones para cada cobro.
+            workers (int): Cobros simultáneos.
+            chunk_size (int): Suscripciones por bloque.
+            rate_limit_per_second (float): Cobros por segundo a Stripe (0 = sin límite).
+            max_items (int): Máximo de suscripciones de una ejecución nueva (0 = todas).
+            worker_id (str, opcional): Identificador del worker (por defecto host:pid).
         Retorna:
-            Dict: Diccionario con success y results detallando total procesado,
-                  exitosos, fallidos y lista de errores.
+            Dict: Diccionario con success y results detallando la ejecución (y run_ids si se
+                  cobraron varias), total procesado, exitosos, fallidos, lista de errores,
+                  throughput y latencia por bloque.
         """
         try:
             today = date.today()
-            
-            # Obtener suscripciones activas que tienen cobro hoy
-            due_subscriptions = db.query(Subscription).filter(
-                and_(
-                    Subscription.subscription_status == SubscriptionStatus.ACTIVE,
-                    Subscription.next_delivery_date <= today
-                )
-            ).all()
-            
+            started = time.monotonic()
+            worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+            run, resumed = SubscriptionService._open_billing_run(db, today, max_items)
+
+            limiter = RateLimiter(rate_limit_per_second)
             results = {
+                "run_id": run.run_id,
+                "run_ids": [],
+                "resumed": resumed,
+                "worker_id": worker_id,
                 "total_processed": 0,
                 "successful": 0,
                 "failed": 0,
-                "errors": []
+                "skipped": 0,
+                "errors": [],
+                "chunks": []
             }
-            
-            for subscription in due_subscriptions:
-                user = subscription.user
-                
-                charge_result = SubscriptionService._process_subscription_charge(
-                    db=db,
-                    subscription=subscription,
-                    user=user
-                )
-                
-                results["total_processed"] += 1
-                
-                if charge_result.get("success"):
-                    results["successful"] += 1
-                    # Actualizar próxima fecha de entrega (+30 días)
-                    subscription.next_delivery_date = today + timedelta(days=30)
-                else:
-                    results["failed"] += 1
-                    results["errors"].append({
-                        "subscription_id": subscription.subscription_id,
-                        "user_id": subscription.user_id,
-                        "error": charge_result.get("error")
-                    })
-            
-            db.commit()
-            
+            latencies = []
+
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="subscription-billing") as executor:
+                while True:
+                    results["run_ids"].append(run.run_id)
+                    while True:
+                        chunk_ids = SubscriptionService._claim_billing_items(db, run, chunk_size, worker_id)
+                        if not chunk_ids:
+                            limit = chunk_size
+                            if run.max_items:
+                                enqueued = db.query(func.count(BillingRunItem.item_id)).filter(
+                                    BillingRunItem.run_id == run.run_id
+                                ).scalar()
+                                limit = min(chunk_size, run.max_items - enqueued)
+                            if limit <= 0 or not SubscriptionService._enqueue_due_subscriptions(db, run, limit):
+                                break
+                            continue
+
+                        chunk_started = time.monotonic()
+                        outcomes = list(executor.map(
+                            lambda item_id: SubscriptionService._charge_due_subscription(
+                                item_id, today, session_factory, limiter, worker_id
+                            ),
+                            chunk_ids
+                        ))
+
+                        chunk = {"size": len(chunk_ids), "successful": 0, "failed": 0, "skipped": 0}
+                        for outcome in outcomes:
+                            chunk[outcome["outcome"]] += 1
+                            results[outcome["outcome"]] += 1
+                            if outcome["outcome"] == "skipped":
+                                continue
+
+                            results["total_processed"] += 1
+                            latencies.append(outcome["latency_ms"])
+                            if outcome["outcome"] == "failed":
+                                results["errors"].append({
+                                    "item_id": outcome["item_id"],
+                                    "subscription_id": outcome["subscription_id"],
+                                    "user_id": outcome["user_id"],
+                                    "error": outcome["error"]
+                                })
+
+                        chunk["duration_seconds"] = round(time.monotonic() - chunk_started, 3)
+                        results["chunks"].append(chunk)
+
+                        run.heartbeat_at = datetime.now(UTC).replace(tzinfo=None)
+                        db.commit()
+
+                    # Solo se cierra cuando ya no quedan cobros abiertos (de este u otros workers)
+                    open_items = exists().where(
+                        BillingRunItem.run_id == run.run_id,
+                        BillingRunItem.status.in_([BillingItemStatus.PENDING, BillingItemStatus.CHARGING])
+                    )
+                    db.execute(
+                        update(BillingRun).where(
+                            BillingRun.run_id == run.run_id,
+                            BillingRun.status == BillingRunStatus.RUNNING,
+                            ~open_items
+                        ).values(
+                            status=BillingRunStatus.COMPLETED,
+                            finished_at=datetime.now(UTC).replace(tzinfo=None)
+                        ).execution_options(synchronize_session=False)
+                    )
+                    db.commit()
+
+                    # Si la ejecución reanudada era de un día anterior y ya se cerró, las
+                    # suscripciones que vencieron desde entonces se cobran en una nueva
+                    db.refresh(run)
+                    if run.status == BillingRunStatus.RUNNING or run.billing_date >= today:
+                        break
+                    run, _ = SubscriptionService._open_billing_run(db, today, max_items)
+
+            duration = time.monotonic() - started
+            chunk_durations = [chunk["duration_seconds"] for chunk in results["chunks"]]
+            latencies.sort()
+
+            results["duration_seconds"] = round(duration, 3)
+            results["throughput_per_second"] = round(results["total_processed"] / duration, 2) if duration else 0
+            results["avg_chunk_seconds"] = round(sum(chunk_durations) / len(chunk_durations), 3) if chunk_durations else None
+            results["max_chunk_seconds"] = max(chunk_durations) if chunk_durations else None
+            results["p95_charge_ms"] = round(latencies[int(0.95 * (len(latencies) - 1))], 1) if latencies else None
+
             return {
                 "success": True,
                 "results": results
             }
-            
+
         except Exception as e:
             db.rollback()
             return {
@@ -629,5 +1073,54 @@ class SubscriptionService:
                 "error": f"Error procesando suscripciones: {str(e)}"
             }
 
+    @staticmethod
+    def get_billing_runs(db: Session, limit: int = 20, run_id: Optional[int] = None) -> List[Dict]:
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Progreso de las ejecuciones de cobro más recientes (o de una): cobros
+                     del ledger por estado, porcentaje terminado y último latido.
+        Parámetros:
+            db (Session): Sesión de base de datos de SQLAlchemy.
+            limit (int): Número de ejecuciones a regresar.
+            run_id (int, opcional): Solo esta ejecución.
+        Retorna:
+            List[Dict]: Ejecuciones de la más reciente a la más antigua.
+        """
+        query = db.query(BillingRun)
+        if run_id is not None:
+            query = query.filter(BillingRun.run_id == run_id)
+        runs = query.order_by(BillingRun.run_id.desc()).limit(limit).all()
+        if not runs:
+            return []
+
+        counts = {run.run_id: {status.value: 0 for status in BillingItemStatus} for run in runs}
+        for item_run_id, item_status, count in db.query(
+            BillingRunItem.run_id,
+            BillingRunItem.status,
+            func.count(BillingRunItem.item_id)
+        ).filter(
+            BillingRunItem.run_id.in_(counts.keys())
+        ).group_by(BillingRunItem.run_id, BillingRunItem.status).all():
+            counts[item_run_id][item_status.value] = count
+
+        open_statuses = (BillingItemStatus.PENDING.value, BillingItemStatus.CHARGING.value)
+        result = []
+        for run in runs:
+            total = sum(counts[run.run_id].values())
+            done = total - sum(counts[run.run_id][status] for status in open_statuses)
+            result.append({
+                "run_id": run.run_id,
+                "billing_date": run.billing_date,
+                "status": run.status.value,
+                "max_items": run.max_items,
+                "started_at": run.started_at,
+                "heartbeat_at": run.heartbeat_at,
+                "finished_at": run.finished_at,
+                "counts": counts[run.run_id],
+                "total_items": total,
+                "progress_percent": round(done * 100 / total, 1) if total else 100.0
+            })
+        return result
+
 
 subscription_service = SubscriptionService()
\ No newline at end of file
@@ -36,6 +36,7 @@ class Settings(BaseSettings):
     COGNITO_REGION: str  # Obligatorio
     COGNITO_USER_POOL_ID: str  # Obligatorio
     COGNITO_CLIENT_ID: str  # Obligatorio
+    COGNITO_ENDPOINT_URL: Optional[str] = None  # Solo para apuntar a un servidor local de pruebas
     
     # ============ AWS S3 ============
     S3_BUCKET_NAME: str  # Obligatorio
@@ -49,11 +50,100 @@ class Settings(BaseSettings):
     STRIPE_API_KEY: str  # Obligatorio
     STRIPE_SECRET_KEY: str  # Obligatorio
     STRIPE_WEBHOOK_SECRET: str  # Obligatorio para validar webhooks
+    STRIPE_API_BASE: Optional[str] = None  # Solo para apuntar a un servidor local de pruebas
+    STRIPE_TIMEOUT_SECONDS: float = 15.0  # Límite por llamada a Stripe (cliente async)
+    STRIPE_MAX_NETWORK_RETRIES: int = 2  # Reintentos del SDK ante errores de red (idempotentes)
     
     # ============ PAYPAL ============
     PAYPAL_CLIENT_ID: str  # Obligatorio
     PAYPAL_CLIENT_SECRET: str  # Obligatorio
     PAYPAL_API_BASE_URL: str  # Obligatorio
+    PAYPAL_TOKEN_EXPIRY_MARGIN_SECONDS: int = 60  # El token en cache se descarta este tiempo antes de vencer
+    PAYPAL_TOKEN_REFRESH_AHEAD_SECONDS: int = 600  # Con menos vigencia que esto se renueva en segundo plano
+    PAYPAL_HTTP_MAX_CONNECTIONS: int = 100  # Conexiones simultáneas del cliente compartido
+    PAYPAL_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 50  # Conexiones ociosas que se conservan abiertas
+    PAYPAL_HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    PAYPAL_HTTP_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    PAYPAL_HTTP_READ_TIMEOUT_SECONDS: float = 30.0
+    PAYPAL_HTTP_POOL_TIMEOUT_SECONDS: float = 5.0  # Espera máxima por una conexión libre del pool
+    PAYPAL_HTTP2: bool = False  # Requiere httpx[http2]
+    PAYPAL_HTTP_RETRIES: int = 2  # Reintentos ante fallos de conexión
+    
+    # ============ RESILIENCIA (proveedores externos) ============
+    REQUEST_DEADLINE_SECONDS: float = 25.0  # Tiempo total que una petición HTTP puede esperar a proveedores
+    RESILIENCE_FAILURE_THRESHOLD: int = 5  # Fallos transitorios consecutivos que abren el circuito
+    RESILIENCE_OPEN_SECONDS: float = 30.0  # Tiempo con el circuito abierto antes de volver a probar
+    RESILIENCE_HALF_OPEN_MAX_CALLS: int = 1  # Llamadas de prueba con el circuito medio abierto
+    RESILIENCE_MAX_RETRIES: int = 2  # Reintentos de operaciones idempotentes ante fallos transitorios
+    RESILIENCE_BACKOFF_BASE_SECONDS: float = 0.2
+    RESILIENCE_BACKOFF_MAX_SECONDS: float = 2.0
+    RESILIENCE_LATENCY_WINDOW: int = 500  # Intentos recientes usados para las latencias por proveedor
+    STRIPE_MAX_CONCURRENT_CALLS: int = 50  # Bulkhead: llamadas simultáneas por proveedor
+    PAYPAL_MAX_CONCURRENT_CALLS: int = 50
+    S3_MAX_CONCURRENT_CALLS: int = 20
+    S3_TIMEOUT_SECONDS: float = 10.0
+    COGNITO_MAX_CONCURRENT_CALLS: int = 30
+    COGNITO_TIMEOUT_SECONDS: float = 5.0
+    
+    # ============ IDEMPOTENCIA (checkout/pagos) ============
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24  # Tiempo que se conserva la respuesta de una Idempotency-Key
+    IDEMPOTENCY_MEMORY_CACHE: bool = True  # Cache en memoria delante de la tabla idempotency_key
+    IDEMPOTENCY_MEMORY_CACHE_SIZE: int = 10000
+    IDEMPOTENCY_WAIT_TIMEOUT_SECONDS: float = 30.0  # Espera máxima de un duplicado concurrente
+    
+    # ============ OUTBOX (efectos posteriores al pago) ============
+    OUTBOX_POLL_SECONDS: int = 10  # Frecuencia del worker que procesa la tabla outbox_event
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_MAX_BATCHES_PER_RUN: int = 50  # Límite de lotes por ejecución del worker
+    OUTBOX_MAX_ATTEMPTS: int = 5  # Después de estos intentos el evento queda en FAILED
+    OUTBOX_RETRY_BASE_SECONDS: int = 30  # Espera base del backoff exponencial entre intentos
+    
+    # ============ WEBHOOKS DE STRIPE ============
+    STRIPE_WEBHOOK_POLL_SECONDS: int = 2  # Frecuencia del worker que procesa stripe_webhook_event
+    STRIPE_WEBHOOK_WORKERS: int = 8  # Eventos (de clientes distintos) procesados en paralelo
+    STRIPE_WEBHOOK_BATCH_SIZE: int = 100  # Eventos tomados por lote
+    STRIPE_WEBHOOK_MAX_BATCHES_PER_RUN: int = 50
+    STRIPE_WEBHOOK_MAX_ATTEMPTS: int = 8  # Después de estos intentos el evento queda en FAILED
+    STRIPE_WEBHOOK_RETRY_BASE_SECONDS: int = 15  # Espera base del backoff exponencial
+    STRIPE_WEBHOOK_RETRY_MAX_SECONDS: int = 3600
+    STRIPE_WEBHOOK_LEASE_SECONDS: int = 300  # Tiempo tras el cual un evento en PROCESSING se puede retomar
+    
+    # ============ SUSCRIPCIONES (cobro recurrente) ============
+    SUBSCRIPTION_BILLING_WORKERS: int = 8  # Cobros simultáneos; cada uno usa una conexión del pool de la BD
+    SUBSCRIPTION_BILLING_CHUNK_SIZE: int = 100  # Suscripciones cargadas y repartidas por bloque
+    SUBSCRIPTION_BILLING_RATE_LIMIT_PER_SECOND: float = 20.0  # Cobros por segundo a Stripe (0 = sin límite)
+    SUBSCRIPTION_BILLING_MAX_ITEMS_PER_RUN: int = 0  # Suscripciones por ejecución (0 = todas las vencidas)
+    SUBSCRIPTION_BILLING_INTERVAL_MINUTES: int = 0  # Correr el job cada N minutos en lugar de diario a las 00:30
+    SUBSCRIPTION_BILLING_CLAIM_LEASE_SECONDS: int = 300  # Tiempo que un worker retiene los cobros que reclamó; debe exceder lo que tarda un bloque
+    SUBSCRIPTION_CATALOG_CACHE_SECONDS: int = 300  # Vigencia del catálogo plan -> productos en memoria
+    
+    # ============ CARRITO ============
+    CART_STORE_BACKEND: str = "database"  # database | memory | redis (write-behind)
+    CART_STORE_REDIS_URL: str = "redis://localhost:6379/0"
+    CART_STORE_FLUSH_SECONDS: int = 5  # Frecuencia con la que se persisten los carritos modificados
+    CART_STORE_FLUSH_BATCH_SIZE: int = 200  # Carritos persistidos por ejecución del job
+    CART_STORE_TTL_SECONDS: int = 604800  # Vigencia de un carrito sin actividad en Redis (7 días)
+    CART_ABANDONED_MAX_AGE_DAYS: int = 90  # Líneas sin cambios por más tiempo se eliminan
+    CART_PURGE_BATCH_SIZE: int = 1000  # Líneas eliminadas por transacción
+    CART_PURGE_MAX_BATCHES: int = 500  # Límite de lotes por ejecución del job
+    
+    # ============ PROGRAMA DE LEALTAD ============
+    LOYALTY_TIER_CACHE_SECONDS: int = 300  # Vigencia de la tabla de tiers en memoria
+    POINTS_EXPIRY_BATCH_SIZE: int = 5000  # IDs de user_loyalty por rango; cada rango se expira en una transacción
+    COUPON_ISSUANCE_CHUNK_SIZE: int = 1000  # Usuarios por transacción en la emisión mensual de cupones
+    COUPON_VALIDITY_DAYS: int = 30  # Vigencia de los cupones mensuales
+    COUPON_CODE_SECRET: Optional[str] = None  # Llave de la secuencia de códigos de cupón (por defecto JWT_SECRET_KEY)
+    
+    # ============ PROVEEDORES SIMULADOS (benchmarks/fake_providers) ============
+    FAKE_PROVIDERS_HOST: str = "127.0.0.1"
+    FAKE_STRIPE_PORT: int = 12111
+    FAKE_PAYPAL_PORT: int = 12112
+    FAKE_COGNITO_PORT: int = 12113
+    FAKE_PROVIDER_LATENCY_SECONDS: float = 0.05  # Latencia base de cada respuesta
+    FAKE_PROVIDER_JITTER_SECONDS: float = 0.0  # Latencia extra aleatoria (0..jitter)
+    FAKE_PROVIDER_FAILURE_RATE: float = 0.0  # Fracción de peticiones que fallan
+    FAKE_PROVIDER_FAILURE_STATUS: int = 500
+    FAKE_STRIPE_WEBHOOK_URL: Optional[str] = None  # Endpoint del backend que recibe los webhooks simulados
     
     # ============ CORS ============
     #BACKEND_CORS_ORIGINS: list = ["http://localhost:3000", "http://localhost:8000"]
@@ -4,7 +4,8 @@
 # Soporta SQLite (desarrollo) y PostgreSQL/MySQL (producción)
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy import Select
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
 from typing import Generator
 from app.config import settings
 import logging
@@ -73,6 +74,25 @@ def get_db() -> Generator:
         db.close()
 
 
+def for_update_skip_locked(statement: Select, db: Session) -> Select:
+    """
+    Agrega FOR UPDATE SKIP LOCKED a un SELECT que reclama filas para procesarlas (cobros,
+    expiración de puntos), de modo que varios workers tomen lotes distintos sin esperarse.
+    SQLite no tiene bloqueo por fila: ahí se regresa sin cambios y la exclusión la da el
+    UPDATE que reclama las filas repitiendo la condición (SQLite serializa las escrituras).
+    
+    Args:
+        statement: SELECT de las filas a reclamar (con su ORDER BY y LIMIT)
+        db: Sesión con la que se ejecutará
+        
+    Returns:
+        Select: El mismo SELECT, con bloqueo en las bases que lo soportan
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        return statement
+    return statement.with_for_update(skip_locked=True)
+
+
 # Log de inicialización
 if settings.DEBUG:
     logger.info(f"✅ Base de datos configurada correctamente")
@@ -1,5 +1,8 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from app.services.scheduler import start_scheduler, stop_scheduler
+from app.services.resilience import deadline
+from app.services.stripe_service import stripe_service
+from app.services.paypal_service import paypal_service
 from app.config import settings
 from contextlib import asynccontextmanager
 import logging
@@ -25,6 +28,9 @@ async def lifespan(app: FastAPI):
         logger.info("Scheduler inicializado correctamente")
     except Exception as e:
         logger.error(f"Error al inicializar scheduler: {e}")
+    
+    # Cliente HTTP compartido de PayPal
+    await paypal_service.start()
         
     yield
     
@@ -37,6 +43,18 @@ async def lifespan(app: FastAPI):
         logger.info("Scheduler detenido correctamente")
     except Exception as e:
         logger.error(f"Error al detener scheduler: {e}")
+    
+    # Cerrar las conexiones del cliente async de Stripe
+    try:
+        await stripe_service.close()
+    except Exception as e:
+        logger.error(f"Error al cerrar cliente de Stripe: {e}")
+    
+    # Cerrar las conexiones del cliente de PayPal
+    try:
+        await paypal_service.close()
+    except Exception as e:
+        logger.error(f"Error al cerrar cliente de PayPal: {e}")
         
     logger.info("Aplicación detenida")
 
@@ -59,6 +77,16 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def provider_deadline(request: Request, call_next):
+    """
+    Limita el tiempo total que una petición puede esperar a proveedores externos; las
+    llamadas a Stripe, PayPal, S3 y Cognito que hace la petición comparten este deadline.
+    """
+    with deadline(settings.REQUEST_DEADLINE_SECONDS):
+        return await call_next(request)
+
+
 # Esto es una prueba para probar el comando de uvicorn
 @app.get("/")
 def root():
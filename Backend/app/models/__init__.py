@@ -17,6 +17,14 @@ from .review import Review
 from .loyalty_tier import LoyaltyTier
 from .user_loyalty import UserLoyalty
 from .point_history import PointHistory
+from .idempotency_key import IdempotencyKey
+from .outbox_event import OutboxEvent
+from .stripe_webhook_event import StripeWebhookEvent
+from .stripe_customer import StripeCustomer
+from .stripe_payment_method import StripePaymentMethod
+from .billing_run import BillingRun
+from .billing_run_item import BillingRunItem
+from .coupon_issuance_run import CouponIssuanceRun
 
 __all__ = [
     "UserRole",
@@ -26,6 +34,13 @@ __all__ = [
     "SubscriptionStatus",
     "OrderStatus",
     "PointEventType",
+    "IdempotencyStatus",
+    "OutboxEventType",
+    "OutboxStatus",
+    "WebhookEventStatus",
+    "BillingRunStatus",
+    "BillingItemStatus",
+    "CouponIssuanceStatus",
     "User",
     "FitnessProfile",
     "Address",
@@ -43,5 +58,13 @@ __all__ = [
     "LoyaltyTier",
     "UserLoyalty",
     "PointHistory",
+    "IdempotencyKey",
+    "OutboxEvent",
+    "StripeWebhookEvent",
+    "StripeCustomer",
+    "StripePaymentMethod",
+    "BillingRun",
+    "BillingRunItem",
+    "CouponIssuanceRun",
     "Base",
 ]
\ No newline at end of file
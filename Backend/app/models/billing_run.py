@@ -0,0 +1,36 @@
+from sqlalchemy import Integer, Date, DateTime, Enum, Index, text
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from typing import Optional, List
+from datetime import date, datetime, UTC
+from app.core.database import Base
+from .enum import BillingRunStatus
+
+class BillingRun(Base):
+    __tablename__ = "billing_run"
+
+    # Keys
+    run_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+
+    # Attributes
+    billing_date: Mapped[date] = mapped_column(Date, nullable=False) # Subscriptions due on or before this date are charged
+    status: Mapped[BillingRunStatus] = mapped_column(Enum(BillingRunStatus, native_enum=False), nullable=False, default=BillingRunStatus.RUNNING)
+    max_items: Mapped[Optional[int]] = mapped_column(Integer, nullable=True) # Slice size, None = every due subscription
+    started_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC)) # Updated after each chunk
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    # Relationships
+    items: Mapped[List["BillingRunItem"]] = relationship("BillingRunItem", back_populates="run", cascade="all, delete-orphan")
+
+    # Constraints
+    __table_args__ = (
+        Index("ix_billing_run_status_started_at", "status", "started_at"),
+        # At most one RUNNING run: workers that start at the same time join the same one
+        Index(
+            "uq_billing_run_running", "status", unique=True,
+            postgresql_where=text("status = 'RUNNING'"), sqlite_where=text("status = 'RUNNING'")
+        ),
+    )
+
+    def __repr__(self) -> str:
+        return f"<BillingRun(run_id={self.run_id}, billing_date={self.billing_date}, status={self.status})>"
@@ -0,0 +1,37 @@
+from sqlalchemy import Integer, String, Text, Date, DateTime, Enum, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from typing import Optional
+from datetime import date, datetime, UTC
+from app.core.database import Base
+from .enum import BillingItemStatus
+
+class BillingRunItem(Base):
+    __tablename__ = "billing_run_item"
+
+    # Keys
+    item_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    run_id: Mapped[int] = mapped_column(ForeignKey("billing_run.run_id", ondelete="CASCADE"), nullable=False)
+    subscription_id: Mapped[int] = mapped_column(ForeignKey("subscription.subscription_id", ondelete="CASCADE"), nullable=False, index=True)
+    order_id: Mapped[Optional[int]] = mapped_column(ForeignKey("order.order_id", ondelete="SET NULL"), nullable=True)
+
+    # Attributes
+    period_date: Mapped[date] = mapped_column(Date, nullable=False) # subscription.next_delivery_date being charged
+    idempotency_key: Mapped[str] = mapped_column(String(255), nullable=False, index=True) # Sent to Stripe, one charge per subscription, period and attempt
+    status: Mapped[BillingItemStatus] = mapped_column(Enum(BillingItemStatus, native_enum=False), nullable=False, default=BillingItemStatus.PENDING)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0) # Times the charge was sent (a resumed run resends with the same key)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    claimed_by: Mapped[Optional[str]] = mapped_column(String(100), nullable=True) # Worker (host:pid) holding the item
+    claimed_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True) # Lease, once expired another worker can take the item
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
+
+    # Relationships
+    run: Mapped["BillingRun"] = relationship("BillingRun", back_populates="items")
+
+    # Constraints
+    __table_args__ = (
+        UniqueConstraint("run_id", "subscription_id", name="uq_billing_run_item_run_subscription"),
+        Index("ix_billing_run_item_run_status", "run_id", "status"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<BillingRunItem(item_id={self.item_id}, subscription_id={self.subscription_id}, status={self.status})>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, ForeignKey, DateTime
+from sqlalchemy import Integer, ForeignKey, DateTime, UniqueConstraint, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime, UTC
 from app.core.database import Base
@@ -13,12 +13,18 @@ class CartItem(Base):
 
     # Attributes
     quantity: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
-    added_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now(UTC))
-    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now(UTC), onupdate=datetime.now(UTC))
+    added_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC)) # Callables: evaluated per row, not once at import
 
     # Relationships
     shopping_cart: Mapped["ShoppingCart"] = relationship("ShoppingCart", back_populates="cart_items")
     product: Mapped["Product"] = relationship("Product", back_populates="cart_items")
 
+    # Constraints
+    __table_args__ = (
+        UniqueConstraint("cart_id", "product_id", name="uq_cart_item_cart_product"), # One line per product, quantities are added up
+        Index("ix_cart_item_updated_at", "updated_at"), # Abandoned lines purge scans by age
+    )
+
     def __repr__(self) -> str:
         return f"<CartItem(cart_item_id={self.cart_item_id}, product_id={self.product_id}, quantity={self.quantity})>"
@@ -0,0 +1,26 @@
+from sqlalchemy import Integer, Date, DateTime, Enum
+from sqlalchemy.orm import Mapped, mapped_column
+from typing import Optional
+from datetime import date, datetime, UTC
+from app.core.database import Base
+from .enum import CouponIssuanceStatus
+
+class CouponIssuanceRun(Base):
+    __tablename__ = "coupon_issuance_run"
+
+    # Keys
+    run_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+
+    # Attributes
+    period_start: Mapped[date] = mapped_column(Date, unique=True, nullable=False) # First day of the month being issued
+    status: Mapped[CouponIssuanceStatus] = mapped_column(Enum(CouponIssuanceStatus, native_enum=False), nullable=False, default=CouponIssuanceStatus.RUNNING)
+    total_users: Mapped[int] = mapped_column(Integer, nullable=False, default=0) # Eligible users when the run started
+    last_user_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0) # Cursor: users up to this id already have their coupons
+    users_processed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    coupons_issued: Mapped[int] = mapped_column(Integer, nullable=False, default=0) # Also the next position in the code sequence
+    started_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC)) # Updated after each chunk
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<CouponIssuanceRun(run_id={self.run_id}, period_start={self.period_start}, status={self.status})>"
@@ -40,4 +40,44 @@ class OrderStatus(str, Enum):
 class PointEventType(str, Enum):
     """Point history event type enum"""
     EARNED = "earned"
-    EXPIRED = "expired"
\ No newline at end of file
+    EXPIRED = "expired"
+
+class IdempotencyStatus(str, Enum):
+    """Idempotency key processing status enum"""
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+
+class OutboxEventType(str, Enum):
+    """Outbox event type enum"""
+    ORDER_PAID = "order_paid"
+
+class OutboxStatus(str, Enum):
+    """Outbox event processing status enum"""
+    PENDING = "pending"
+    PROCESSED = "processed"
+    FAILED = "failed"
+
+class WebhookEventStatus(str, Enum):
+    """Incoming provider webhook event processing status enum"""
+    PENDING = "pending"
+    PROCESSING = "processing"
+    PROCESSED = "processed"
+    FAILED = "failed"
+
+class BillingRunStatus(str, Enum):
+    """Subscription billing run status enum"""
+    RUNNING = "running"
+    COMPLETED = "completed"
+
+class CouponIssuanceStatus(str, Enum):
+    """Monthly coupon issuance run status enum"""
+    RUNNING = "running"
+    COMPLETED = "completed"
+
+class BillingItemStatus(str, Enum):
+    """Subscription charge status within a billing run enum"""
+    PENDING = "pending"
+    CHARGING = "charging"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    SKIPPED = "skipped"
@@ -0,0 +1,30 @@
+from sqlalchemy import String, DateTime, ForeignKey, Enum, JSON, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+from typing import Optional
+from datetime import datetime, UTC
+from app.core.database import Base
+from .enum import IdempotencyStatus
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_key"
+
+    # Keys
+    idempotency_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.user_id", ondelete="CASCADE"), nullable=False)
+
+    # Attributes
+    endpoint: Mapped[str] = mapped_column(String(100), nullable=False)
+    key: Mapped[str] = mapped_column(String(255), nullable=False)
+    request_hash: Mapped[str] = mapped_column(String(64), nullable=False) # SHA-256 of the request body
+    status: Mapped[IdempotencyStatus] = mapped_column(Enum(IdempotencyStatus, native_enum=False), nullable=False, default=IdempotencyStatus.PROCESSING)
+    response_body: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now(UTC))
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+    # Constraints
+    __table_args__ = (
+        UniqueConstraint("user_id", "endpoint", "key", name="uq_idempotency_user_endpoint_key"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<IdempotencyKey(idempotency_id={self.idempotency_id}, endpoint={self.endpoint}, status={self.status})>"
@@ -1,4 +1,4 @@
-from sqlalchemy import DateTime, Boolean, String, Numeric, Integer, ForeignKey, Enum, CheckConstraint
+from sqlalchemy import DateTime, Boolean, String, Numeric, Integer, ForeignKey, Enum, CheckConstraint, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from typing import Optional, List
 from datetime import datetime, UTC
@@ -45,6 +45,10 @@ class Order(Base):
             "(is_subscription = true AND subscription_id IS NOT NULL) OR (is_subscription = false)",
             name="check_subscription_order"
         ),
+        # Order history listing: filter by user, keyset pagination on (order_date, order_id)
+        Index("ix_order_user_id_order_date", "user_id", "order_date"),
+        # Subscription history: aggregates and pages of one subscription's orders
+        Index("ix_order_subscription_id_order_date", "subscription_id", "order_date"),
     )
 
     def __repr__(self) -> str:
@@ -0,0 +1,32 @@
+from sqlalchemy import Integer, String, Text, DateTime, Enum, JSON, UniqueConstraint, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from typing import Optional
+from datetime import datetime, UTC
+from app.core.database import Base
+from .enum import OutboxEventType, OutboxStatus
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_event"
+
+    # Keys
+    outbox_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+
+    # Attributes
+    event_type: Mapped[OutboxEventType] = mapped_column(Enum(OutboxEventType, native_enum=False), nullable=False)
+    aggregate_id: Mapped[int] = mapped_column(Integer, nullable=False) # ID of the entity that produced the event (order_id)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    status: Mapped[OutboxStatus] = mapped_column(Enum(OutboxStatus, native_enum=False), nullable=False, default=OutboxStatus.PENDING)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now(UTC))
+    available_at: Mapped[datetime] = mapped_column(DateTime, nullable=False) # Next time the worker may pick it up (retry backoff)
+    processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    # Constraints
+    __table_args__ = (
+        UniqueConstraint("event_type", "aggregate_id", name="uq_outbox_event_type_aggregate"), # One side effect per order
+        Index("ix_outbox_event_status_available_at", "status", "available_at"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<OutboxEvent(outbox_id={self.outbox_id}, event_type={self.event_type}, status={self.status})>"
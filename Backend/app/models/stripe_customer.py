@@ -0,0 +1,22 @@
+from sqlalchemy import String, Boolean, DateTime, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+from typing import Optional
+from datetime import datetime, UTC
+from app.core.database import Base
+
+class StripeCustomer(Base):
+    __tablename__ = "stripe_customer"
+
+    # Keys
+    customer_id: Mapped[str] = mapped_column(String(255), primary_key=True) # Stripe customer.id (cus_xxx)
+    user_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, index=True) # From metadata.user_id, no FK: the customer may outlive the user
+
+    # Attributes
+    email: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, index=True)
+    name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    deleted: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    source_created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False) # event.created of the last applied change, older events are ignored
+    synced_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+
+    def __repr__(self) -> str:
+        return f"<StripeCustomer(customer_id={self.customer_id}, email={self.email}, deleted={self.deleted})>"
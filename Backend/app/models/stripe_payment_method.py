@@ -0,0 +1,25 @@
+from sqlalchemy import String, Integer, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+from typing import Optional
+from datetime import datetime, UTC
+from app.core.database import Base
+
+class StripePaymentMethod(Base):
+    __tablename__ = "stripe_payment_method"
+
+    # Keys
+    payment_method_id: Mapped[str] = mapped_column(String(255), primary_key=True) # Stripe payment_method.id (pm_xxx)
+    customer_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, index=True) # None once detached
+
+    # Attributes
+    type: Mapped[str] = mapped_column(String(50), nullable=False, default="card")
+    brand: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
+    last4: Mapped[Optional[str]] = mapped_column(String(4), nullable=True)
+    exp_month: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    exp_year: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    funding: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+    source_created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False) # event.created of the last applied change, older events are ignored
+    synced_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+
+    def __repr__(self) -> str:
+        return f"<StripePaymentMethod(payment_method_id={self.payment_method_id}, customer_id={self.customer_id}, last4={self.last4})>"
@@ -0,0 +1,34 @@
+from sqlalchemy import Integer, String, Text, DateTime, Enum, JSON, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from typing import Optional
+from datetime import datetime, UTC
+from app.core.database import Base
+from .enum import WebhookEventStatus
+
+class StripeWebhookEvent(Base):
+    __tablename__ = "stripe_webhook_event"
+
+    # Keys
+    webhook_event_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    event_id: Mapped[str] = mapped_column(String(255), nullable=False, unique=True) # Stripe event.id (evt_xxx), deduplicates redeliveries
+
+    # Attributes
+    event_type: Mapped[str] = mapped_column(String(100), nullable=False)
+    ordering_key: Mapped[str] = mapped_column(String(255), nullable=False) # Events with the same key (customer) are processed in order
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False) # Raw verified event
+    status: Mapped[WebhookEventStatus] = mapped_column(Enum(WebhookEventStatus, native_enum=False), nullable=False, default=WebhookEventStatus.PENDING)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    stripe_created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False) # event.created, used for ordering and lag
+    received_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    available_at: Mapped[datetime] = mapped_column(DateTime, nullable=False) # Retry backoff, or lease expiry while PROCESSING
+    processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    # Constraints
+    __table_args__ = (
+        Index("ix_stripe_webhook_event_status_available_at", "status", "available_at"),
+        Index("ix_stripe_webhook_event_ordering", "ordering_key", "stripe_created_at", "webhook_event_id"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<StripeWebhookEvent(event_id={self.event_id}, event_type={self.event_type}, status={self.status})>"
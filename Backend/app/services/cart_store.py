@@ -0,0 +1,343 @@
+# Autor: Luis Flores
+# Fecha: 22-11-25
+# Descripción: Almacenamiento del estado "caliente" del carrito (cantidades por producto)
+#              fuera de la base de datos. Los cambios de cantidad se escriben aquí y se
+#              persisten a shopping_cart/cart_item de forma diferida (write-behind) por el
+#              scheduler y al iniciar el checkout. Hay una implementación en memoria del
+#              proceso (una sola instancia del backend) y otra sobre Redis (compartida
+#              entre réplicas).
+
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+
+# product_id -> (cart_item_id, cantidad). Una cantidad 0 indica que la línea está
+# eliminada pero el DELETE todavía no se ha persistido.
+CartLines = Dict[int, Tuple[Optional[int], int]]
+
+
+class CartStore(ABC):
+    """
+    Autor: Luis Flores
+    Descripción: Interfaz del almacenamiento de carritos. Cada carrito se identifica por
+                 user_id y guarda su cart_id y sus líneas; los usuarios con cambios sin
+                 persistir quedan en un conjunto de "sucios".
+    """
+
+    @abstractmethod
+    def load(self, user_id: int, cart_id: int, lines: CartLines) -> None:
+        """
+        Carga en el store el carrito leído de la base de datos.
+        """
+
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[Tuple[int, CartLines]]:
+        """
+        Regresa (cart_id, líneas) o None si el carrito no está cargado.
+        """
+
+    @abstractmethod
+    def increment(self, user_id: int, product_id: int, delta: int) -> int:
+        """
+        Suma delta a la cantidad de una línea de forma atómica y regresa la nueva cantidad.
+        """
+
+    @abstractmethod
+    def set_line(self, user_id: int, product_id: int, cart_item_id: Optional[int], quantity: int) -> None:
+        """
+        Fija el cart_item_id y la cantidad de una línea.
+        """
+
+    @abstractmethod
+    def set_quantity(self, user_id: int, product_id: int, quantity: int) -> None:
+        """
+        Fija la cantidad de una línea existente (0 = eliminada, pendiente de persistir).
+        """
+
+    @abstractmethod
+    def clear_line_id_if(self, user_id: int, product_id: int, cart_item_id: int) -> None:
+        """
+        Se llama cuando el DELETE de cart_item_id ya se persistió. Si la línea sigue en
+        cantidad 0 se quita; si se volvió a agregar mientras tanto y aún apunta a
+        cart_item_id, se deja sin cart_item_id para que el siguiente flush la inserte.
+        Ambas revisiones son atómicas.
+        """
+
+    @abstractmethod
+    def assign_line_id(self, user_id: int, product_id: int, cart_item_id: int) -> None:
+        """
+        Guarda el cart_item_id de una línea que el flush insertó, solo si la línea existe
+        y sigue sin cart_item_id.
+        """
+
+    @abstractmethod
+    def discard(self, user_id: int) -> None:
+        """
+        Elimina el carrito del store (se vuelve a cargar de la base de datos al usarse).
+        """
+
+    @abstractmethod
+    def mark_dirty(self, user_id: int) -> None:
+        """
+        Marca el carrito con cambios pendientes de persistir.
+        """
+
+    @abstractmethod
+    def clear_dirty(self, user_id: int) -> bool:
+        """
+        Quita la marca de cambios pendientes. Regresa True si el carrito estaba marcado.
+        """
+
+    @abstractmethod
+    def pop_dirty(self, count: int) -> List[int]:
+        """
+        Toma (y desmarca) hasta count usuarios con cambios pendientes.
+        """
+
+
+class InMemoryCartStore(CartStore):
+    """
+    Autor: Luis Flores
+    Descripción: Store en memoria del proceso. Solo es válido con una única instancia del
+                 backend; los cambios pendientes se persisten al detener la aplicación.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user_id -> {"cart_id": int, "lines": {product_id: [cart_item_id, cantidad]}}
+        self._carts: Dict[int, Dict] = {}
+        self._dirty: set = set()
+
+    def load(self, user_id: int, cart_id: int, lines: CartLines) -> None:
+        with self._lock:
+            self._carts.setdefault(user_id, {
+                "cart_id": cart_id,
+                "lines": {product_id: list(line) for product_id, line in lines.items()}
+            })
+
+    def get(self, user_id: int) -> Optional[Tuple[int, CartLines]]:
+        with self._lock:
+            cart = self._carts.get(user_id)
+            if cart is None:
+                return None
+            return cart["cart_id"], {
+                product_id: (line[0], line[1]) for product_id, line in cart["lines"].items()
+            }
+
+    def increment(self, user_id: int, product_id: int, delta: int) -> int:
+        with self._lock:
+            line = self._carts[user_id]["lines"].setdefault(product_id, [None, 0])
+            line[1] += delta
+            return line[1]
+
+    def set_line(self, user_id: int, product_id: int, cart_item_id: Optional[int], quantity: int) -> None:
+        with self._lock:
+            self._carts[user_id]["lines"][product_id] = [cart_item_id, quantity]
+
+    def set_quantity(self, user_id: int, product_id: int, quantity: int) -> None:
+        with self._lock:
+            self._carts[user_id]["lines"][product_id][1] = quantity
+
+    def clear_line_id_if(self, user_id: int, product_id: int, cart_item_id: int) -> None:
+        with self._lock:
+            cart = self._carts.get(user_id)
+            line = cart["lines"].get(product_id) if cart else None
+            if line is None:
+                return
+            if line[1] == 0:
+                del cart["lines"][product_id]
+            elif line[0] == cart_item_id:
+                line[0] = None
+
+    def assign_line_id(self, user_id: int, product_id: int, cart_item_id: int) -> None:
+        with self._lock:
+            cart = self._carts.get(user_id)
+            line = cart["lines"].get(product_id) if cart else None
+            if line is not None and line[0] is None:
+                line[0] = cart_item_id
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            self._carts.pop(user_id, None)
+            self._dirty.discard(user_id)
+
+    def mark_dirty(self, user_id: int) -> None:
+        with self._lock:
+            self._dirty.add(user_id)
+
+    def clear_dirty(self, user_id: int) -> bool:
+        with self._lock:
+            was_dirty = user_id in self._dirty
+            self._dirty.discard(user_id)
+            return was_dirty
+
+    def pop_dirty(self, count: int) -> List[int]:
+        with self._lock:
+            users = []
+            while self._dirty and len(users) < count:
+                users.append(self._dirty.pop())
+            return users
+
+
+class RedisCartStore(CartStore):
+    """
+    Autor: Luis Flores
+    Descripción: Store sobre Redis (o cualquier servidor con el mismo protocolo). Por cada
+                 usuario guarda tres hashes: cart:{user_id}:meta (cart_id),
+                 cart:{user_id}:qty (product_id -> cantidad) y cart:{user_id}:ids
+                 (product_id -> cart_item_id). Los incrementos usan HINCRBY, por lo que
+                 son atómicos entre réplicas.
+    """
+
+    DIRTY_KEY = "cart:dirty"
+
+    def __init__(self, client, ttl_seconds: int = settings.CART_STORE_TTL_SECONDS):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def _keys(user_id: int) -> Tuple[str, str, str]:
+        return f"cart:{user_id}:meta", f"cart:{user_id}:qty", f"cart:{user_id}:ids"
+
+    def _touch(self, pipe, user_id: int) -> None:
+        for key in self._keys(user_id):
+            pipe.expire(key, self.ttl_seconds)
+
+    def load(self, user_id: int, cart_id: int, lines: CartLines) -> None:
+        meta_key, qty_key, ids_key = self._keys(user_id)
+        # Si otra petición ya lo cargó (y quizá lo modificó) no se sobrescribe
+        if not self.client.hsetnx(meta_key, "cart_id", cart_id):
+            return
+
+        pipe = self.client.pipeline()
+        if lines:
+            pipe.hset(qty_key, mapping={product_id: line[1] for product_id, line in lines.items()})
+            pipe.hset(ids_key, mapping={product_id: line[0] for product_id, line in lines.items()})
+        self._touch(pipe, user_id)
+        pipe.execute()
+
+    def get(self, user_id: int) -> Optional[Tuple[int, CartLines]]:
+        meta_key, qty_key, ids_key = self._keys(user_id)
+        pipe = self.client.pipeline()
+        pipe.hget(meta_key, "cart_id")
+        pipe.hgetall(qty_key)
+        pipe.hgetall(ids_key)
+        cart_id, quantities, ids = pipe.execute()
+
+        if cart_id is None:
+            return None
+
+        lines = {}
+        for product_id, quantity in quantities.items():
+            cart_item_id = ids.get(product_id)
+            lines[int(product_id)] = (
+                int(cart_item_id) if cart_item_id is not None else None,
+                int(quantity)
+            )
+        return int(cart_id), lines
+
+    def increment(self, user_id: int, product_id: int, delta: int) -> int:
+        _, qty_key, _ = self._keys(user_id)
+        pipe = self.client.pipeline()
+        pipe.hincrby(qty_key, product_id, delta)
+        self._touch(pipe, user_id)
+        return int(pipe.execute()[0])
+
+    def set_line(self, user_id: int, product_id: int, cart_item_id: Optional[int], quantity: int) -> None:
+        _, qty_key, ids_key = self._keys(user_id)
+        pipe = self.client.pipeline()
+        pipe.hset(qty_key, product_id, quantity)
+        if cart_item_id is not None:
+            pipe.hset(ids_key, product_id, cart_item_id)
+        self._touch(pipe, user_id)
+        pipe.execute()
+
+    def set_quantity(self, user_id: int, product_id: int, quantity: int) -> None:
+        _, qty_key, _ = self._keys(user_id)
+        pipe = self.client.pipeline()
+        pipe.hset(qty_key, product_id, quantity)
+        self._touch(pipe, user_id)
+        pipe.execute()
+
+    def clear_line_id_if(self, user_id: int, product_id: int, cart_item_id: int) -> None:
+        from redis.exceptions import WatchError
+
+        _, qty_key, ids_key = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(qty_key, ids_key)
+                    quantity = pipe.hget(qty_key, product_id)
+                    line_id = pipe.hget(ids_key, product_id)
+                    if quantity is None or (int(quantity) != 0 and line_id != str(cart_item_id)):
+                        pipe.unwatch()
+                        return
+                    pipe.multi()
+                    if int(quantity) == 0:
+                        pipe.hdel(qty_key, product_id)
+                    pipe.hdel(ids_key, product_id)
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def assign_line_id(self, user_id: int, product_id: int, cart_item_id: int) -> None:
+        from redis.exceptions import WatchError
+
+        _, qty_key, ids_key = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(qty_key, ids_key)
+                    if pipe.hget(qty_key, product_id) is None or pipe.hexists(ids_key, product_id):
+                        pipe.unwatch()
+                        return
+                    pipe.multi()
+                    pipe.hset(ids_key, product_id, cart_item_id)
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def discard(self, user_id: int) -> None:
+        pipe = self.client.pipeline()
+        pipe.delete(*self._keys(user_id))
+        pipe.srem(self.DIRTY_KEY, user_id)
+        pipe.execute()
+
+    def mark_dirty(self, user_id: int) -> None:
+        self.client.sadd(self.DIRTY_KEY, user_id)
+
+    def clear_dirty(self, user_id: int) -> bool:
+        return bool(self.client.srem(self.DIRTY_KEY, user_id))
+
+    def pop_dirty(self, count: int) -> List[int]:
+        return [int(user_id) for user_id in self.client.spop(self.DIRTY_KEY, count) or []]
+
+
+def create_cart_store() -> Optional[CartStore]:
+    """
+    Autor: Luis Flores
+
+    Descripción:
+        Crea el store configurado en CART_STORE_BACKEND. Con "database" (valor por
+        defecto) no hay store y el carrito se lee y escribe directo en la base de datos.
+
+    Retorna:
+        Optional[CartStore]: Store configurado o None.
+    """
+    backend = settings.CART_STORE_BACKEND.lower()
+
+    if backend == "memory":
+        return InMemoryCartStore()
+
+    if backend == "redis":
+        # Dependencia opcional: solo se requiere si se usa este backend
+        import redis
+
+        client = redis.Redis.from_url(settings.CART_STORE_REDIS_URL, decode_responses=True)
+        return RedisCartStore(client)
+
+    return None
@@ -0,0 +1,322 @@
+# Autor: Lizbeth Barajas
+# Fecha: 20-11-25
+# Descripción: Servicio de idempotencia para los endpoints de checkout y pagos. Guarda la
+#              respuesta asociada a un header Idempotency-Key en la tabla idempotency_key
+#              (con un cache opcional en memoria) para que los reintentos del cliente
+#              no vuelvan a cobrar ni a crear órdenes duplicadas.
+
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta, UTC
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.idempotency_key import IdempotencyKey
+from app.models.enum import IdempotencyStatus
+
+
+def _utcnow() -> datetime:
+    """
+    Fecha actual en UTC sin zona horaria (así se guarda en columnas DateTime).
+    """
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+class IdempotencyService:
+
+    def __init__(
+        self,
+        ttl_hours: int = settings.IDEMPOTENCY_KEY_TTL_HOURS,
+        memory_cache: bool = settings.IDEMPOTENCY_MEMORY_CACHE,
+        memory_cache_size: int = settings.IDEMPOTENCY_MEMORY_CACHE_SIZE,
+        wait_timeout: float = settings.IDEMPOTENCY_WAIT_TIMEOUT_SECONDS,
+        poll_interval: float = 0.2
+    ):
+        self.ttl = timedelta(hours=ttl_hours)
+        self.memory_cache = memory_cache
+        self.memory_cache_size = memory_cache_size
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        # cache_key -> (request_hash, expires_at, response)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        # cache_key -> [lock, peticiones usando el lock]; serializa duplicados concurrentes
+        # dentro del proceso
+        self._locks: Dict[str, list] = {}
+
+    @staticmethod
+    def hash_request(payload: Any) -> str:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Calcula un hash estable del cuerpo de la petición para detectar que una misma
+            Idempotency-Key se reutilice con datos distintos.
+
+        Parámetros:
+            payload (Any): Cuerpo de la petición (dict o modelo serializable).
+
+        Retorna:
+            str: Hash SHA-256 en hexadecimal.
+        """
+        encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    async def execute(
+        self,
+        db: Session,
+        user_id: int,
+        endpoint: str,
+        key: Optional[str],
+        payload: Any,
+        handler: Callable[[], Awaitable[Dict]]
+    ) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Ejecuta el handler una sola vez por (usuario, endpoint, Idempotency-Key).
+            Los reintentos reciben la respuesta guardada; los duplicados concurrentes
+            esperan a que termine la primera ejecución en lugar de correr en paralelo.
+            Si no se envía key, el handler se ejecuta normalmente. Un resultado con
+            outcome_unknown (cobro sin confirmar) no se guarda.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            user_id (int): ID del usuario que hace la petición.
+            endpoint (str): Nombre lógico del endpoint (ej. "stripe_checkout").
+            key (Optional[str]): Valor del header Idempotency-Key.
+            payload (Any): Cuerpo de la petición, para validar que el reintento es idéntico.
+            handler (Callable): Corrutina que ejecuta la operación y regresa su resultado.
+
+        Retorna:
+            Dict: Resultado de la operación (nuevo o guardado).
+
+        Excepciones:
+            HTTPException 422: Si la key se reutiliza con un cuerpo distinto.
+            HTTPException 409: Si otra ejecución con la misma key sigue en proceso.
+        """
+        if not key:
+            return await handler()
+
+        cache_key = f"{user_id}:{endpoint}:{key}"
+        request_hash = self.hash_request(payload)
+
+        cached = self._get_cached(cache_key, request_hash)
+        if cached is not None:
+            return cached
+
+        lock_entry = self._locks.setdefault(cache_key, [asyncio.Lock(), 0])
+        lock_entry[1] += 1
+        lock = lock_entry[0]
+        try:
+            async with lock:
+                # Un duplicado que esperaba el lock encuentra aquí la respuesta ya guardada
+                cached = self._get_cached(cache_key, request_hash)
+                if cached is not None:
+                    return cached
+
+                record = self._claim(db, user_id, endpoint, key, request_hash)
+                if record is not None:
+                    response = await self._wait_for_completion(db, record.idempotency_id)
+                    self._set_cached(cache_key, request_hash, response)
+                    return response
+
+                try:
+                    result = await handler()
+                except Exception:
+                    self._release(db, user_id, endpoint, key)
+                    raise
+
+                # Un cobro cuyo resultado se desconoce no se guarda: el reintento con la
+                # misma key vuelve a ejecutar el handler y concilia el cobro con el proveedor
+                if isinstance(result, dict) and result.get("outcome_unknown"):
+                    self._release(db, user_id, endpoint, key)
+                    return result
+
+                response = jsonable_encoder(result)
+                self._complete(db, user_id, endpoint, key, response)
+                self._set_cached(cache_key, request_hash, response)
+                return result
+        finally:
+            lock_entry[1] -= 1
+            if lock_entry[1] == 0:
+                self._locks.pop(cache_key, None)
+
+    def purge_expired(self, db: Session) -> int:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Elimina las keys cuya respuesta ya expiró. Se ejecuta desde el scheduler.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+
+        Retorna:
+            int: Número de registros eliminados.
+        """
+        deleted = db.query(IdempotencyKey).filter(
+            IdempotencyKey.expires_at < _utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+
+        now = _utcnow()
+        for cache_key in [k for k, (_, expires_at, _) in self._cache.items() if expires_at < now]:
+            self._cache.pop(cache_key, None)
+
+        return deleted
+
+    # ==================== AUXILIARES ====================
+
+    def _claim(
+        self,
+        db: Session,
+        user_id: int,
+        endpoint: str,
+        key: str,
+        request_hash: str
+    ) -> Optional[IdempotencyKey]:
+        """
+        Registra la key en estado PROCESSING. Regresa None si esta ejecución es la dueña
+        de la key, o el registro existente si otra petición ya la había reclamado.
+        """
+        now = _utcnow()
+        for _ in range(2):
+            try:
+                db.add(IdempotencyKey(
+                    user_id=user_id,
+                    endpoint=endpoint,
+                    key=key,
+                    request_hash=request_hash,
+                    status=IdempotencyStatus.PROCESSING,
+                    created_at=now,
+                    expires_at=now + self.ttl
+                ))
+                db.commit()
+                return None
+            except IntegrityError:
+                db.rollback()
+
+            existing = self._get_record(db, user_id, endpoint, key)
+            if existing is None:
+                continue  # Se liberó entre el insert y la consulta, reintentar
+
+            if existing.request_hash != request_hash:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="La Idempotency-Key ya se usó con una petición diferente"
+                )
+
+            if existing.expires_at < now:
+                # La respuesta anterior expiró: la key puede volver a usarse
+                db.delete(existing)
+                db.commit()
+                continue
+
+            return existing
+
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="No se pudo registrar la Idempotency-Key, intenta de nuevo"
+        )
+
+    async def _wait_for_completion(self, db: Session, idempotency_id: int) -> Dict:
+        """
+        Espera (sin bloquear el event loop) a que la ejecución que reclamó la key
+        guarde su respuesta, y la regresa.
+        """
+        deadline = asyncio.get_running_loop().time() + self.wait_timeout
+        while True:
+            db.expire_all()
+            record = db.query(IdempotencyKey).filter(
+                IdempotencyKey.idempotency_id == idempotency_id
+            ).first()
+
+            if record is None:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="La petición original con esta Idempotency-Key falló, intenta de nuevo"
+                )
+
+            if record.status == IdempotencyStatus.COMPLETED:
+                return record.response_body
+
+            if asyncio.get_running_loop().time() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Una petición con esta Idempotency-Key sigue en proceso"
+                )
+
+            await asyncio.sleep(self.poll_interval)
+
+    def _complete(self, db: Session, user_id: int, endpoint: str, key: str, response: Dict) -> None:
+        """
+        Guarda la respuesta de la ejecución y marca la key como COMPLETED.
+        """
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.endpoint == endpoint,
+            IdempotencyKey.key == key
+        ).update({
+            IdempotencyKey.status: IdempotencyStatus.COMPLETED,
+            IdempotencyKey.response_body: response
+        }, synchronize_session=False)
+        db.commit()
+
+    def _release(self, db: Session, user_id: int, endpoint: str, key: str) -> None:
+        """
+        Elimina la key cuando la ejecución lanzó una excepción, para permitir reintentos.
+        """
+        db.rollback()
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.endpoint == endpoint,
+            IdempotencyKey.key == key
+        ).delete(synchronize_session=False)
+        db.commit()
+
+    @staticmethod
+    def _get_record(db: Session, user_id: int, endpoint: str, key: str) -> Optional[IdempotencyKey]:
+        return db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.endpoint == endpoint,
+            IdempotencyKey.key == key
+        ).first()
+
+    def _get_cached(self, cache_key: str, request_hash: str) -> Optional[Dict]:
+        if not self.memory_cache or cache_key not in self._cache:
+            return None
+
+        cached_hash, expires_at, response = self._cache[cache_key]
+        if expires_at < _utcnow():
+            self._cache.pop(cache_key, None)
+            return None
+
+        if cached_hash != request_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="La Idempotency-Key ya se usó con una petición diferente"
+            )
+
+        self._cache.move_to_end(cache_key)
+        return response
+
+    def _set_cached(self, cache_key: str, request_hash: str, response: Dict) -> None:
+        if not self.memory_cache:
+            return
+
+        self._cache[cache_key] = (request_hash, _utcnow() + self.ttl, response)
+        self._cache.move_to_end(cache_key)
+        while len(self._cache) > self.memory_cache_size:
+            self._cache.popitem(last=False)
+
+
+# instancia de uso
+idempotency_service = IdempotencyService()
@@ -0,0 +1,202 @@
+# Autor: Lizbeth Barajas
+# Fecha: 21-11-25
+# Descripción: Outbox transaccional para los efectos posteriores a un pago (puntos de lealtad,
+#              ascenso de tier y futuras notificaciones). Los flujos de pago solo registran el
+#              evento en la misma transacción que la orden; un worker del scheduler procesa la
+#              tabla outbox_event por lotes fuera de la petición.
+
+from datetime import datetime, timedelta, UTC
+from typing import Callable, Dict, List
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.outbox_event import OutboxEvent
+from app.models.user_loyalty import UserLoyalty
+from app.models.enum import OutboxEventType, OutboxStatus
+from app.api.v1.loyalty.service import loyalty_service
+
+
+def _utcnow() -> datetime:
+    """
+    Fecha actual en UTC sin zona horaria (así se guarda en columnas DateTime).
+    """
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+class OutboxService:
+
+    def __init__(self):
+        # event_type -> handlers que se ejecutan (en orden) por cada evento
+        self._handlers: Dict[OutboxEventType, List[Callable[[Session, OutboxEvent], None]]] = {}
+        self.register_handler(OutboxEventType.ORDER_PAID, self._apply_order_points)
+
+    def register_handler(
+        self,
+        event_type: OutboxEventType,
+        handler: Callable[[Session, OutboxEvent], None]
+    ) -> None:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Registra un handler para un tipo de evento (p. ej. notificaciones). Los handlers
+            de un mismo evento se aplican juntos: si alguno falla, ninguno queda guardado y
+            el evento se reintenta completo.
+
+        Parámetros:
+            event_type (OutboxEventType): Tipo de evento.
+            handler (Callable): Función (db, event) que aplica el efecto sin hacer commit;
+                                debe lanzar una excepción si falla.
+        """
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def enqueue(
+        self,
+        db: Session,
+        event_type: OutboxEventType,
+        aggregate_id: int,
+        payload: Dict
+    ) -> OutboxEvent:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Agrega un evento a la sesión sin hacer commit, para que se guarde en la misma
+            transacción que la orden que lo produce.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            event_type (OutboxEventType): Tipo de evento.
+            aggregate_id (int): ID de la entidad que produce el evento (order_id).
+            payload (Dict): Datos necesarios para aplicar el efecto.
+
+        Retorna:
+            OutboxEvent: Evento agregado a la sesión.
+        """
+        now = _utcnow()
+        event = OutboxEvent(
+            event_type=event_type,
+            aggregate_id=aggregate_id,
+            payload=payload,
+            status=OutboxStatus.PENDING,
+            attempts=0,
+            created_at=now,
+            available_at=now
+        )
+        db.add(event)
+        return event
+
+    def process_batch(self, db: Session, batch_size: int = settings.OUTBOX_BATCH_SIZE) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Toma un lote de eventos pendientes (SKIP LOCKED en PostgreSQL, para que varios
+            workers no tomen los mismos) y los aplica. Cada evento corre en un savepoint;
+            los que fallan se reprograman con backoff exponencial o quedan en FAILED al
+            agotar los intentos. Todo el lote se confirma con un solo commit.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            batch_size (int): Máximo de eventos a procesar.
+
+        Retorna:
+            Dict: Eventos tomados, procesados, reprogramados y fallidos definitivamente.
+        """
+        now = _utcnow()
+        events = db.query(OutboxEvent).filter(
+            OutboxEvent.status == OutboxStatus.PENDING,
+            OutboxEvent.available_at <= now
+        ).order_by(
+            OutboxEvent.outbox_id
+        ).limit(batch_size).with_for_update(skip_locked=True).all()
+
+        stats = {"claimed": len(events), "processed": 0, "retried": 0, "failed": 0}
+
+        for event in events:
+            try:
+                with db.begin_nested():
+                    for handler in self._handlers.get(event.event_type, []):
+                        handler(db, event)
+                event.status = OutboxStatus.PROCESSED
+                event.processed_at = now
+                event.last_error = None
+                stats["processed"] += 1
+            except Exception as e:
+                event.attempts += 1
+                event.last_error = str(e)[:2000]
+                if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    event.status = OutboxStatus.FAILED
+                    stats["failed"] += 1
+                else:
+                    delay = settings.OUTBOX_RETRY_BASE_SECONDS * (2 ** (event.attempts - 1))
+                    event.available_at = now + timedelta(seconds=delay)
+                    stats["retried"] += 1
+
+        db.commit()
+        return stats
+
+    def drain(
+        self,
+        db: Session,
+        batch_size: int = settings.OUTBOX_BATCH_SIZE,
+        max_batches: int = settings.OUTBOX_MAX_BATCHES_PER_RUN
+    ) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Procesa lotes hasta vaciar los eventos disponibles o llegar a max_batches.
+            Se ejecuta periódicamente desde el scheduler.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            batch_size (int): Eventos por lote.
+            max_batches (int): Máximo de lotes por ejecución.
+
+        Retorna:
+            Dict: Totales acumulados de la ejecución.
+        """
+        totals = {"batches": 0, "claimed": 0, "processed": 0, "retried": 0, "failed": 0}
+        for _ in range(max_batches):
+            stats = self.process_batch(db, batch_size)
+            totals["batches"] += 1
+            for key in ("claimed", "processed", "retried", "failed"):
+                totals[key] += stats[key]
+            if stats["claimed"] < batch_size:
+                break
+
+        return totals
+
+    # ==================== HANDLERS ====================
+
+    @staticmethod
+    def _apply_order_points(db: Session, event: OutboxEvent) -> None:
+        """
+        Abona los puntos de una orden pagada (y el posible ascenso de tier) mediante
+        loyalty_service.add_points, sin commit.
+        """
+        points = event.payload.get("points", 0)
+        if points <= 0:
+            return
+
+        loyalty_id = db.query(UserLoyalty.loyalty_id).filter(
+            UserLoyalty.user_id == event.payload["user_id"]
+        ).scalar()
+        if loyalty_id is None:
+            return
+
+        result = loyalty_service.add_points(
+            db=db,
+            loyalty_id=loyalty_id,
+            points=points,
+            order_id=event.aggregate_id,
+            commit=False
+        )
+        if not result.get("success"):
+            raise RuntimeError(result.get("error"))
+
+
+# instancia de uso
+outbox_service = OutboxService()
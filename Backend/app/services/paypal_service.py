@@ -1,20 +1,113 @@
 # Autor: Gabriel Vilchis
 # Fecha: 13-11-25
 # Descripción: Servicio para la integración con PayPal, incluyendo autenticación,
-#              creación de órdenes y captura de pagos.
+#              creación de órdenes y captura de pagos. Las llamadas pasan por la política
+#              de resiliencia "paypal" (circuit breaker, bulkhead, reintentos y deadline).
 
+import asyncio
+import time
+import uuid
+import weakref
 import httpx
 from app.config import settings
+from app.services.resilience import ProviderUnavailableError, get_policy
 from base64 import b64encode
 
+
+def _is_transient_paypal_error(error: Exception) -> bool:
+    """
+    Errores de red y respuestas 5xx/429 de PayPal.
+    """
+    if isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and (
+        error.response.status_code >= 500 or error.response.status_code == 429
+    )
+
 class PayPalService:
     def __init__(self):
         # configuraciones de paypal
         self.base_url = settings.PAYPAL_API_BASE_URL # esta en sandbox
         self.client_id = settings.PAYPAL_CLIENT_ID
         self.client_secret = settings.PAYPAL_CLIENT_SECRET
-        self.client = httpx.AsyncClient()
+        # Cliente compartido; se crea en start() (lifespan de la app) y se cierra en close()
+        self.client = None
         self.access_token = None
+        # Momento (time.monotonic) en que vence el token en cache
+        self.token_expires_at = 0.0
+        # Un lock por event loop para que solo una corrutina pida el token a la vez
+        self._token_locks = weakref.WeakKeyDictionary()
+        self._refresh_task = None
+        self.policy = get_policy(
+            "paypal",
+            timeout_seconds=settings.PAYPAL_HTTP_READ_TIMEOUT_SECONDS,
+            max_concurrent=settings.PAYPAL_MAX_CONCURRENT_CALLS,
+            is_transient=_is_transient_paypal_error
+        )
+
+    def build_client(self) -> httpx.AsyncClient:
+        """
+        Autor: Gabriel Vilchis
+
+        Descripción: Crea el cliente HTTP para PayPal con los límites del pool, keep-alive y
+                     timeouts de la configuración. El transporte reintenta solo los fallos de
+                     conexión (la petición no llegó a enviarse), por lo que es seguro para POST.
+
+        Parámetros: Ninguno.
+
+        Retorna:
+            httpx.AsyncClient: Cliente configurado.
+        """
+        limits = httpx.Limits(
+            max_connections=settings.PAYPAL_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.PAYPAL_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.PAYPAL_HTTP_KEEPALIVE_EXPIRY_SECONDS
+        )
+        timeout = httpx.Timeout(
+            connect=settings.PAYPAL_HTTP_CONNECT_TIMEOUT_SECONDS,
+            read=settings.PAYPAL_HTTP_READ_TIMEOUT_SECONDS,
+            write=settings.PAYPAL_HTTP_READ_TIMEOUT_SECONDS,
+            pool=settings.PAYPAL_HTTP_POOL_TIMEOUT_SECONDS
+        )
+        # HTTP/2 requiere el paquete opcional h2 (httpx[http2])
+        transport = httpx.AsyncHTTPTransport(
+            retries=settings.PAYPAL_HTTP_RETRIES,
+            http2=settings.PAYPAL_HTTP2,
+            limits=limits
+        )
+        return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+    async def start(self) -> None:
+        """
+        Autor: Gabriel Vilchis
+
+        Descripción: Crea el cliente compartido. Se llama al iniciar la aplicación.
+
+        Parámetros: Ninguno.
+        """
+        if self.client is None:
+            self.client = self.build_client()
+
+    async def close(self) -> None:
+        """
+        Autor: Gabriel Vilchis
+
+        Descripción: Cierra las conexiones del cliente compartido. Se llama al detener
+                     la aplicación.
+
+        Parámetros: Ninguno.
+        """
+        if self.client is not None:
+            client, self.client = self.client, None
+            await client.aclose()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Cliente compartido; si la app no lo inició (scripts, pruebas) se crea al usarse.
+        """
+        if self.client is None:
+            self.client = self.build_client()
+        return self.client
 
     def get_auth_header(self):
         """
@@ -36,14 +129,36 @@ class PayPalService:
         """
         Autor: Gabriel Vilchis
 
-        Descripción: Solicita a PayPal un token de acceso OAuth2 utilizando las credenciales
-                     del cliente. El token se almacena internamente para futuras peticiones.
+        Descripción: Regresa el token de acceso OAuth2 de PayPal. El token se guarda en cache
+                     hasta PAYPAL_TOKEN_EXPIRY_MARGIN_SECONDS antes de su expires_in; cuando le
+                     quedan menos de PAYPAL_TOKEN_REFRESH_AHEAD_SECONDS se renueva en segundo
+                     plano mientras se sigue usando el vigente. Si varias peticiones necesitan
+                     un token nuevo al mismo tiempo, solo una lo solicita a PayPal.
 
         Parámetros: Ninguno.
 
         Retorna:
             str: Token de acceso proporcionado por PayPal.
         """
+        token = self.access_token
+        remaining = self.token_expires_at - time.monotonic()
+
+        if token and remaining > settings.PAYPAL_TOKEN_EXPIRY_MARGIN_SECONDS:
+            if remaining < settings.PAYPAL_TOKEN_REFRESH_AHEAD_SECONDS:
+                self._schedule_refresh()
+            return token
+
+        async with self._token_lock():
+            # Otra corrutina pudo haberlo renovado mientras se esperaba el lock
+            remaining = self.token_expires_at - time.monotonic()
+            if self.access_token and remaining > settings.PAYPAL_TOKEN_EXPIRY_MARGIN_SECONDS:
+                return self.access_token
+            return await self._request_token()
+
+    async def _request_token(self):
+        """
+        Solicita un token nuevo a PayPal y lo guarda en cache junto con su vencimiento.
+        """
         token_url = f"{self.base_url}/v1/oauth2/token"
 
         headers = {
@@ -52,13 +167,77 @@ class PayPalService:
         }
         data = {"grant_type": "client_credentials"}
 
-        response = await self.client.post(token_url, headers=headers, data=data)
+        requested_at = time.monotonic()
+        response = await self._post(token_url, idempotent=True, headers=headers, data=data)
         response.raise_for_status()
         token_data = response.json()
         self.access_token = token_data.get("access_token")
+        self.token_expires_at = requested_at + int(token_data.get("expires_in", 0))
 
         return self.access_token
-    
+
+    def _token_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        lock = self._token_locks.get(loop)
+        if lock is None:
+            lock = self._token_locks[loop] = asyncio.Lock()
+        return lock
+
+    def _schedule_refresh(self) -> None:
+        """
+        Renueva el token en segundo plano si no hay ya una renovación en curso.
+        """
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_ahead())
+
+    async def _refresh_ahead(self) -> None:
+        async with self._token_lock():
+            if self.token_expires_at - time.monotonic() >= settings.PAYPAL_TOKEN_REFRESH_AHEAD_SECONDS:
+                return
+            try:
+                await self._request_token()
+            except (httpx.HTTPError, ProviderUnavailableError, TimeoutError):
+                # El token vigente sigue sirviendo; se reintenta en la siguiente petición
+                pass
+
+    async def _post(self, url: str, idempotent: bool, **kwargs) -> httpx.Response:
+        """
+        POST a través de la política de resiliencia. Las respuestas 5xx y 429 se tratan
+        como fallos del proveedor (cuentan para el circuito y se reintentan si la
+        operación es idempotente).
+        """
+        async def attempt() -> httpx.Response:
+            response = await self._get_client().post(url, **kwargs)
+            if response.status_code >= 500 or response.status_code == 429:
+                response.raise_for_status()
+            return response
+
+        return await self.policy.call_async(attempt, idempotent=idempotent)
+
+    async def _authorized_post(self, url: str, request_id: str = None, **kwargs) -> httpx.Response:
+        """
+        POST con el token en cache. Si PayPal responde 401 (token revocado o vencido
+        antes de tiempo), se obtiene un token nuevo y se reintenta una sola vez. Con
+        request_id se envía PayPal-Request-Id, que hace idempotente la operación y
+        permite reintentarla ante fallos transitorios.
+        """
+        headers = {"Content-Type": "application/json"}
+        if request_id:
+            headers["PayPal-Request-Id"] = request_id
+        for _ in range(2):
+            token = await self.get_access_token()
+            headers["Authorization"] = f"Bearer {token}"
+            response = await self._post(url, idempotent=bool(request_id), headers=headers, **kwargs)
+            if response.status_code != 401:
+                break
+            # Solo se descarta si nadie lo ha renovado ya
+            if self.access_token == token:
+                self.token_expires_at = 0.0
+
+        response.raise_for_status()
+        return response
+
     async def create_order(self, amount: float, currency: str = "MXN", return_url: str = None, cancel_url: str = None):
         """
         Autor: Gabriel Vilchis
@@ -75,13 +254,7 @@ class PayPalService:
         Retorna:
             dict: Información de la orden creada, proveniente de PayPal.
         """
-        token = await self.get_access_token()
-
         order_url = f"{self.base_url}/v2/checkout/orders"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {token}"
-        }
 
         return_url = return_url or f"{settings.APP_URL}/success"
         #cancel_url = cancel_url or f"{settings.APP_URL}/cancel"
@@ -101,8 +274,7 @@ class PayPalService:
             }
         }
 
-        response = await self.client.post(order_url, headers=headers, json=body)
-        response.raise_for_status()
+        response = await self._authorized_post(order_url, request_id=str(uuid.uuid4()), json=body)
         return response.json()
     
     async def capture_order(self, order_id: str):
@@ -118,16 +290,9 @@ class PayPalService:
         Retorna:
             dict: Datos de la captura del pago devueltos por PayPal.
         """
-        token = await self.get_access_token()
-
         capture_url = f"{self.base_url}/v2/checkout/orders/{order_id}/capture"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {token}"
-        }
 
-        response = await self.client.post(capture_url, headers=headers)
-        response.raise_for_status()
+        response = await self._authorized_post(capture_url, request_id=f"capture-{order_id}")
 
         return response.json()
     
@@ -0,0 +1,493 @@
+# Autor: Lizbeth Barajas
+# Fecha: 24-11-25
+# Descripción: Capa de resiliencia para las llamadas a proveedores externos (Stripe, PayPal,
+#              S3 y Cognito). Cada proveedor tiene una política con circuit breaker (deja de
+#              llamar a un proveedor caído por un tiempo), bulkhead (límite de llamadas
+#              simultáneas; las que exceden fallan de inmediato en lugar de acumular hilos y
+#              conexiones a la base de datos), reintentos con backoff exponencial y jitter
+#              (solo para operaciones idempotentes) y un deadline por petición que se
+#              propaga con contextvars a todas las llamadas que hace esa petición.
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Momento (time.monotonic) en que vence la petición actual; None = sin deadline
+_deadline: ContextVar[Optional[float]] = ContextVar("provider_deadline", default=None)
+
+# Códigos de error de AWS que indican saturación (se reintentan)
+AWS_THROTTLING_CODES = {
+    "Throttling", "ThrottlingException", "TooManyRequestsException",
+    "RequestLimitExceeded", "SlowDown", "InternalErrorException", "ServiceUnavailable"
+}
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class ProviderUnavailableError(Exception):
+    """
+    La llamada no se hizo (o se abandonó) para proteger al backend del proveedor.
+    """
+
+
+class CircuitOpenError(ProviderUnavailableError):
+    pass
+
+
+class BulkheadFullError(ProviderUnavailableError):
+    pass
+
+
+class DeadlineExceededError(ProviderUnavailableError, TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Autor: Lizbeth Barajas
+
+    Descripción:
+        Fija el tiempo máximo restante para las llamadas a proveedores dentro del bloque.
+        Si ya había un deadline más cercano, se conserva ese.
+
+    Parámetros:
+        seconds (float): Segundos a partir de ahora.
+    """
+    candidate = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(candidate if current is None else min(current, candidate))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def without_deadline():
+    """
+    Autor: Lizbeth Barajas
+
+    Descripción:
+        Quita el deadline de la petición dentro del bloque. Solo para conciliar una
+        operación cuyo resultado se desconoce (ej. un cobro que venció el tiempo), donde
+        responder tarde es preferible a dejar el cobro sin registrar.
+    """
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """
+    Segundos que le quedan al deadline actual, o None si no hay deadline.
+    """
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+def is_transient_boto_error(error: Exception) -> bool:
+    """
+    Fallos de red, timeouts, 5xx y throttling de AWS (los errores de negocio, como
+    credenciales inválidas, no cuentan como falla del proveedor).
+    """
+    from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+    if isinstance(error, (BotoConnectionError, HTTPClientError, TimeoutError)):
+        return True
+    if isinstance(error, ClientError):
+        response = error.response or {}
+        status_code = response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return status_code >= 500 or response.get("Error", {}).get("Code") in AWS_THROTTLING_CODES
+    return False
+
+
+class ResiliencePolicy:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Circuit breaker, bulkhead, reintentos y métricas de un proveedor. Es
+                 segura entre hilos (rutas síncronas en el threadpool) y corrutinas.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout_seconds: float,
+        max_concurrent: int,
+        is_transient: Callable[[Exception], bool],
+        max_retries: int = settings.RESILIENCE_MAX_RETRIES,
+        failure_threshold: int = settings.RESILIENCE_FAILURE_THRESHOLD,
+        open_seconds: float = settings.RESILIENCE_OPEN_SECONDS,
+        half_open_max_calls: int = settings.RESILIENCE_HALF_OPEN_MAX_CALLS
+    ):
+        self.name = name
+        self.timeout_seconds = timeout_seconds
+        self.max_concurrent = max_concurrent
+        self.is_transient = is_transient
+        self.max_retries = max_retries
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._state = CircuitState.CLOSED
+        self._open_until = 0.0
+        self._consecutive_failures = 0
+        self._half_open_calls = 0
+        self._in_flight = 0
+        self._latencies = deque(maxlen=settings.RESILIENCE_LATENCY_WINDOW)
+        self._counters = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0,
+            "short_circuited": 0, "bulkhead_rejected": 0, "deadline_exceeded": 0
+        }
+
+    # ==================== LLAMADAS ====================
+
+    def call(self, operation: Callable[[], Any], idempotent: bool = False) -> Any:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Ejecuta una llamada síncrona al proveedor. El límite de tiempo de cada intento
+            lo aplica el cliente del proveedor (su timeout configurado); aquí se verifica
+            el deadline antes de cada intento y de cada espera entre reintentos.
+
+        Parámetros:
+            operation (Callable): Función sin argumentos que hace la llamada.
+            idempotent (bool): Si se puede repetir sin efectos duplicados (solo entonces
+                               se reintenta ante fallos transitorios).
+
+        Retorna:
+            Any: Resultado de operation.
+
+        Excepciones:
+            ProviderUnavailableError: Circuito abierto, bulkhead lleno o deadline vencido.
+            Exception: El último error de operation.
+        """
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        for attempt in range(attempts):
+            self._attempt_budget(None)
+            started = self._acquire()
+            try:
+                result = operation()
+            except Exception as e:
+                delay = self._after_failure(e, started, attempt, attempts)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            except BaseException:
+                self._abandon(started)
+                raise
+            else:
+                self._release(started, failure=False)
+                return result
+
+    async def call_async(
+        self,
+        operation: Callable[[], Awaitable[Any]],
+        idempotent: bool = False,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Versión async de call. Cada intento se limita al menor entre el timeout del
+            proveedor (o el indicado) y lo que le queda al deadline de la petición.
+
+        Parámetros:
+            operation (Callable): Función sin argumentos que regresa la corrutina de la llamada.
+            idempotent (bool): Si se puede repetir sin efectos duplicados.
+            timeout (float, opcional): Límite por intento en lugar del del proveedor.
+
+        Retorna:
+            Any: Resultado de la corrutina.
+        """
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        for attempt in range(attempts):
+            budget = self._attempt_budget(timeout)
+            started = self._acquire()
+            try:
+                result = await asyncio.wait_for(operation(), budget)
+            except Exception as e:
+                delay = self._after_failure(e, started, attempt, attempts)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            except BaseException:
+                # Cancelación (cliente desconectado, wait_for externo, apagado): se libera
+                # el lugar sin contarlo como éxito ni como fallo
+                self._abandon(started)
+                raise
+            else:
+                self._release(started, failure=False)
+                return result
+
+    # ==================== ESTADO ====================
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def get_metrics(self) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Estado del circuito, llamadas en curso, contadores y latencias (ms) de los
+            últimos RESILIENCE_LATENCY_WINDOW intentos.
+
+        Retorna:
+            Dict: Métricas del proveedor.
+        """
+        with self._lock:
+            now = time.monotonic()
+            latencies = sorted(self._latencies)
+            state = self._current_state(now)
+            metrics = {
+                "provider": self.name,
+                "state": state.value,
+                "open_remaining_seconds": round(max(self._open_until - now, 0), 3) if state == CircuitState.OPEN else 0,
+                "consecutive_failures": self._consecutive_failures,
+                "in_flight": self._in_flight,
+                "max_concurrent": self.max_concurrent,
+                **self._counters
+            }
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 1)
+
+        metrics["latency_ms"] = {
+            "avg": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99)
+        }
+        return metrics
+
+    def reset(self) -> None:
+        """
+        Regresa el circuito a CLOSED y limpia contadores (pruebas y operación manual).
+        """
+        with self._lock:
+            self._state = CircuitState.CLOSED
+            self._consecutive_failures = 0
+            self._half_open_calls = 0
+            self._latencies.clear()
+            for key in self._counters:
+                self._counters[key] = 0
+
+    # ==================== AUXILIARES ====================
+
+    def _current_state(self, now: float) -> CircuitState:
+        # Debe llamarse con el lock tomado
+        if self._state == CircuitState.OPEN and now >= self._open_until:
+            self._state = CircuitState.HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def _attempt_budget(self, timeout: Optional[float]) -> float:
+        budget = timeout or self.timeout_seconds
+        remaining = remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                with self._lock:
+                    self._counters["deadline_exceeded"] += 1
+                raise DeadlineExceededError(f"Se agotó el tiempo de la petición antes de llamar a {self.name}")
+            budget = min(budget, remaining)
+        return budget
+
+    def _acquire(self) -> float:
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CircuitState.OPEN or (
+                state == CircuitState.HALF_OPEN and self._half_open_calls >= self.half_open_max_calls
+            ):
+                self._counters["short_circuited"] += 1
+                raise CircuitOpenError(f"{self.name} no disponible temporalmente (circuito abierto)")
+
+            if self._in_flight >= self.max_concurrent:
+                self._counters["bulkhead_rejected"] += 1
+                raise BulkheadFullError(f"{self.name} saturado: demasiadas llamadas simultáneas")
+
+            if state == CircuitState.HALF_OPEN:
+                self._half_open_calls += 1
+            self._in_flight += 1
+            self._counters["calls"] += 1
+            return time.monotonic()
+
+    def _release(self, started: float, failure: bool) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._latencies.append(time.monotonic() - started)
+
+            if not failure:
+                self._counters["successes"] += 1
+                self._consecutive_failures = 0
+                if self._state == CircuitState.HALF_OPEN:
+                    self._state = CircuitState.CLOSED
+                    logger.info(f"Circuito de {self.name} cerrado")
+                return
+
+            self._counters["failures"] += 1
+            self._consecutive_failures += 1
+            if self._state == CircuitState.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != CircuitState.OPEN:
+                    logger.warning(
+                        f"Circuito de {self.name} abierto por {self.open_seconds}s "
+                        f"tras {self._consecutive_failures} fallos consecutivos"
+                    )
+                self._state = CircuitState.OPEN
+                self._open_until = time.monotonic() + self.open_seconds
+
+    def _abandon(self, started: float) -> None:
+        """
+        Libera el lugar de un intento interrumpido (cancelación, KeyboardInterrupt) sin
+        registrar un resultado, para que el circuito no cambie por él.
+        """
+        with self._lock:
+            self._in_flight -= 1
+            self._latencies.append(time.monotonic() - started)
+            if self._state == CircuitState.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def _after_failure(self, error: Exception, started: float, attempt: int, attempts: int) -> Optional[float]:
+        """
+        Registra el fallo de un intento y regresa la espera antes del siguiente, o None si
+        no se debe reintentar.
+        """
+        transient = isinstance(error, TimeoutError) or self.is_transient(error)
+        # Un error de negocio (tarjeta rechazada, credenciales inválidas) indica que el
+        # proveedor responde bien
+        self._release(started, failure=transient)
+
+        if not transient or attempt + 1 >= attempts or self.state == CircuitState.OPEN:
+            return None
+
+        delay = random.uniform(0, min(
+            settings.RESILIENCE_BACKOFF_MAX_SECONDS,
+            settings.RESILIENCE_BACKOFF_BASE_SECONDS * (2 ** attempt)
+        ))
+        remaining = remaining_time()
+        if remaining is not None and remaining <= delay:
+            return None
+
+        with self._lock:
+            self._counters["retries"] += 1
+        return delay
+
+
+class ResilientClient:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Envuelve un cliente de boto3 para que cada operación del API pase por la
+                 política del proveedor. El resto de atributos (exceptions, meta) se delegan.
+    """
+
+    def __init__(self, client, policy: ResiliencePolicy, idempotent_operations: tuple = ()):
+        self._client = client
+        self._policy = policy
+        self._idempotent_operations = set(idempotent_operations)
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._client, name)
+        api_name = self._client.meta.method_to_api_mapping.get(name)
+        if api_name is None:
+            return attribute
+
+        idempotent = api_name in self._idempotent_operations
+
+        def call(*args, **kwargs):
+            return self._policy.call(lambda: attribute(*args, **kwargs), idempotent=idempotent)
+
+        return call
+
+
+class RateLimiter:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Token bucket compartido entre hilos para no exceder un número de llamadas
+                 por segundo a un proveedor (ej. los cobros del job de suscripciones contra
+                 el límite de Stripe). acquire() bloquea el hilo hasta que hay un token.
+    """
+
+    def __init__(self, rate_per_second: float, burst: Optional[int] = None):
+        self.rate_per_second = rate_per_second
+        self.capacity = burst or max(1, int(rate_per_second))
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Toma un token, esperando si el bucket está vacío. Un rate <= 0 no limita.
+        Regresa los segundos que se esperó.
+        """
+        if self.rate_per_second <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.rate_per_second
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate_per_second
+            time.sleep(delay)
+            waited += delay
+
+
+_policies: Dict[str, ResiliencePolicy] = {}
+
+
+def get_policy(name: str, **kwargs) -> ResiliencePolicy:
+    """
+    Autor: Lizbeth Barajas
+
+    Descripción:
+        Regresa la política del proveedor, creándola la primera vez con los argumentos
+        dados. Es compartida por todas las instancias del servicio en el proceso.
+
+    Parámetros:
+        name (str): Nombre del proveedor (ej. "stripe").
+        **kwargs: Argumentos de ResiliencePolicy.
+
+    Retorna:
+        ResiliencePolicy: Política del proveedor.
+    """
+    if name not in _policies:
+        _policies[name] = ResiliencePolicy(name, **kwargs)
+    return _policies[name]
+
+
+def get_metrics() -> List[Dict]:
+    """
+    Métricas de todos los proveedores registrados.
+    """
+    return [policy.get_metrics() for policy in _policies.values()]
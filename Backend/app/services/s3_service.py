@@ -3,19 +3,38 @@
 # Descripción: Este servicio define la clase S3Service, la cual proporciona métodos para manejar
 # imágenes dentro de un bucket de Amazon S3
 import boto3, re, io
+from botocore.config import Config
 from botocore.exceptions import ClientError
 #import uuid
 from PIL import Image
 from app.config import settings
+from app.services.resilience import ResilientClient, get_policy, is_transient_boto_error
 from typing import Dict
 
 class S3Service:
     def __init__(self):
-        self.s3_client = boto3.client(
+        # Política compartida por todas las instancias (circuit breaker, bulkhead, reintentos)
+        self.policy = get_policy(
             's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_REGION
+            timeout_seconds=settings.S3_TIMEOUT_SECONDS,
+            max_concurrent=settings.S3_MAX_CONCURRENT_CALLS,
+            is_transient=is_transient_boto_error
+        )
+        self.s3_client = ResilientClient(
+            boto3.client(
+                's3',
+                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                region_name=settings.AWS_REGION,
+                config=Config(
+                    connect_timeout=settings.S3_TIMEOUT_SECONDS,
+                    read_timeout=settings.S3_TIMEOUT_SECONDS,
+                    retries={'total_max_attempts': 1}
+                )
+            ),
+            self.policy,
+            # Escribir o borrar la misma llave dos veces deja el mismo resultado
+            idempotent_operations=('PutObject', 'DeleteObject', 'GetObject', 'HeadObject')
         )
         self.bucket_name = settings.S3_BUCKET_NAME
 
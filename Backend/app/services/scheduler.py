@@ -5,12 +5,18 @@ Este archivo maneja todas las tareas que se ejecutan automaticamente en interval
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from sqlalchemy.orm import Session
 from datetime import datetime
 import logging
 from app.core.database import SessionLocal
 from app.api.v1.loyalty.service import loyalty_service
 from app.api.v1.subscriptions.service import subscription_service
+from app.services.idempotency_service import idempotency_service
+from app.services.outbox_service import outbox_service
+from app.services.stripe_webhook_service import stripe_webhook_service
+from app.api.v1.cart.service import CartService
+from app.config import settings
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -26,7 +32,7 @@ def get_db_session() -> Session:
 def expire_points_daily_job():
     """
     Job que expira puntos de todos los usuarios diariamente
-    Se ejecuta a medianoche (00:00) todos los dias
+    Se ejecuta a medianoche (00:00) todos los dias (puede correr en varias réplicas a la vez)
     """
     logger.info("="*50)
     logger.info(f"[{datetime.now()}] Iniciando job: Expiración de puntos")
@@ -40,7 +46,8 @@ def expire_points_daily_job():
             logger.info(
                 f"Expiración completada exitosamente:\n"
                 f"  - Usuarios afectados: {result.get('users_affected', 0)}\n"
-                f"  - Total de puntos expirados: {result.get('total_expired_points', 0)}"
+                f"  - Total de puntos expirados: {result.get('total_expired_points', 0)}\n"
+                f"  - Lotes: {result.get('batches', 0)} en {result.get('duration_seconds', 0)}s"
             )
         else:
             error_msg = result.get('error', 'Error desconocido')
@@ -59,7 +66,10 @@ def process_subscriptions_daily_job():
     Job que procesa los cobros de suscripciones diarias
     Se ejecuta a las 00:30 todos los días
     
-    Procesa todas las suscripciones activas que tienen fecha de cobro hoy:
+    Procesa todas las suscripciones activas que tienen fecha de cobro hoy, por bloques
+    y en paralelo (SUBSCRIPTION_BILLING_WORKERS, SUBSCRIPTION_BILLING_RATE_LIMIT_PER_SECOND).
+    Cada réplica corre su propio scheduler; todas se reparten los cobros de la misma
+    ejecución reclamando bloques con SKIP LOCKED:
     - Realiza cobro con Stripe
     - Crea orden automática con productos seleccionados
     - Actualiza próxima fecha de entrega
@@ -77,9 +87,16 @@ def process_subscriptions_daily_job():
             results_data = result.get("results", {})
             logger.info(
                 f"Procesamiento de suscripciones completado:\n"
+                f"  - Ejecución: {results_data.get('run_id')}"
+                f"{' (en curso, unido)' if results_data.get('resumed') else ''} "
+                f"desde el worker {results_data.get('worker_id')}\n"
                 f"  - Total procesadas: {results_data.get('total_processed', 0)}\n"
                 f"  - Exitosas: {results_data.get('successful', 0)}\n"
-                f"  - Fallidas: {results_data.get('failed', 0)}"
+                f"  - Fallidas: {results_data.get('failed', 0)}\n"
+                f"  - Bloques: {len(results_data.get('chunks', []))} "
+                f"(promedio {results_data.get('avg_chunk_seconds')}s, máximo {results_data.get('max_chunk_seconds')}s)\n"
+                f"  - Throughput: {results_data.get('throughput_per_second', 0)} cobros/s "
+                f"en {results_data.get('duration_seconds', 0)}s (p95 por cobro {results_data.get('p95_charge_ms')} ms)"
             )
             
             # Registrar errores específicos si los hay
@@ -102,6 +119,148 @@ def process_subscriptions_daily_job():
         logger.info(f"Job de suscripciones finalizado\n")
 
 
+def purge_idempotency_keys_daily_job():
+    """
+    Job que elimina las Idempotency-Key expiradas de checkout y pagos
+    Se ejecuta a las 03:00 todos los dias
+    """
+    logger.info(f"[{datetime.now()}] Iniciando job: Limpieza de Idempotency-Keys")
+    
+    db = get_db_session()
+    try:
+        deleted = idempotency_service.purge_expired(db)
+        logger.info(f"Idempotency-Keys expiradas eliminadas: {deleted}")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Excepción en job de limpieza de Idempotency-Keys: {str(e)}", exc_info=True)
+    finally:
+        db.close()
+
+
+def process_outbox_job():
+    """
+    Job que aplica los efectos posteriores a los pagos registrados en outbox_event
+    (puntos de lealtad, ascenso de tier, notificaciones)
+    Se ejecuta cada OUTBOX_POLL_SECONDS segundos
+    """
+    db = get_db_session()
+    try:
+        result = outbox_service.drain(db)
+        if result["claimed"]:
+            logger.info(
+                f"Outbox procesado: {result['processed']} aplicados, "
+                f"{result['retried']} reprogramados, {result['failed']} fallidos "
+                f"({result['batches']} lotes)"
+            )
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Excepción en job de outbox: {str(e)}", exc_info=True)
+    finally:
+        db.close()
+
+
+def process_stripe_webhooks_job():
+    """
+    Job que procesa los webhooks de Stripe guardados en stripe_webhook_event
+    (ordenes y pagos de checkout.session.completed, etc.)
+    Se ejecuta cada STRIPE_WEBHOOK_POLL_SECONDS segundos
+    """
+    try:
+        result = stripe_webhook_service.drain()
+        if result["claimed"]:
+            logger.info(
+                f"Webhooks de Stripe: {result['processed']} procesados, "
+                f"{result['retried']} reprogramados, {result['failed']} fallidos "
+                f"({result['batches']} lotes, lag promedio {result['avg_lag_seconds']}s, "
+                f"máximo {result['max_lag_seconds']}s)"
+            )
+    except Exception as e:
+        logger.error(f"Excepción en job de webhooks de Stripe: {str(e)}", exc_info=True)
+
+
+def flush_carts_job():
+    """
+    Job que persiste en shopping_cart/cart_item los carritos modificados en el store
+    (write-behind). Solo se registra si CART_STORE_BACKEND no es "database"
+    Se ejecuta cada CART_STORE_FLUSH_SECONDS segundos y al detener la aplicacion
+    """
+    db = get_db_session()
+    try:
+        result = CartService.flush_pending_carts(db, settings.CART_STORE_FLUSH_BATCH_SIZE)
+        if result["persisted"] or result["failed"]:
+            logger.info(
+                f"Carritos persistidos: {result['persisted']}, fallidos: {result['failed']}"
+            )
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Excepción en job de persistencia de carritos: {str(e)}", exc_info=True)
+    finally:
+        db.close()
+
+
+def purge_abandoned_carts_daily_job():
+    """
+    Job que elimina las líneas de carrito sin cambios en CART_ABANDONED_MAX_AGE_DAYS días
+    Se ejecuta a las 03:30 todos los dias, por lotes con transacciones cortas
+    """
+    logger.info(f"[{datetime.now()}] Iniciando job: Limpieza de carritos abandonados")
+    
+    db = get_db_session()
+    try:
+        result = CartService.purge_abandoned_items(
+            db,
+            max_age_days=settings.CART_ABANDONED_MAX_AGE_DAYS,
+            batch_size=settings.CART_PURGE_BATCH_SIZE,
+            max_batches=settings.CART_PURGE_MAX_BATCHES
+        )
+        logger.info(
+            f"Limpieza de carritos completada:\n"
+            f"  - Líneas eliminadas: {result['deleted']}\n"
+            f"  - Lotes: {result['batches']}\n"
+            f"  - Duración: {result['duration_seconds']}s"
+        )
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Excepción en job de limpieza de carritos: {str(e)}", exc_info=True)
+    finally:
+        db.close()
+
+
+def issue_monthly_coupons_job():
+    """
+    Job que emite los cupones mensuales de toda la base de lealtad según el tier
+    Se ejecuta el día 1 de cada mes a la 01:00, por bloques de COUPON_ISSUANCE_CHUNK_SIZE
+    usuarios; si se interrumpe o corre en varias réplicas, continúa la emisión del mes
+    sin repetir usuarios
+    """
+    logger.info("="*50)
+    logger.info(f"[{datetime.now()}] Iniciando job: Emisión mensual de cupones")
+    logger.info("="*50)
+    
+    db = get_db_session()
+    try:
+        result = loyalty_service.issue_monthly_coupons(db)
+        
+        if result.get("success"):
+            logger.info(
+                f"Emisión de cupones completada:\n"
+                f"  - Emisión: {result.get('run_id')}\n"
+                f"  - Usuarios procesados: {result.get('users_processed', 0)}\n"
+                f"  - Cupones emitidos: {result.get('coupons_issued', 0)}\n"
+                f"  - Bloques: {result.get('chunks', 0)} en {result.get('duration_seconds', 0)}s"
+            )
+        else:
+            error_msg = result.get('error', 'Error desconocido')
+            logger.error(f"Error en emisión de cupones: {error_msg}")
+            
+    except Exception as e:
+        logger.error(f"Excepción fatal en job de cupones: {str(e)}", exc_info=True)
+    finally:
+        db.close()
+        logger.info("="*50)
+        logger.info(f"Job de cupones finalizado\n")
+
+
 # ==================== SCHEDULER ====================
 
 # Variable global para mantener referencia al scheduler
@@ -140,15 +299,75 @@ def start_scheduler():
         replace_existing=True
     )
     
-    # Job 2: Procesamiento de suscripciones (00:30)
+    # Job 2: Procesamiento de suscripciones (00:30, o cada SUBSCRIPTION_BILLING_INTERVAL_MINUTES
+    # en porciones de SUBSCRIPTION_BILLING_MAX_ITEMS_PER_RUN)
     _scheduler.add_job(
         func=process_subscriptions_daily_job,
-        trigger=CronTrigger(hour=0, minute=30),
+        trigger=(
+            IntervalTrigger(minutes=settings.SUBSCRIPTION_BILLING_INTERVAL_MINUTES)
+            if settings.SUBSCRIPTION_BILLING_INTERVAL_MINUTES > 0
+            else CronTrigger(hour=0, minute=30)
+        ),
         id='process_subscriptions_daily',
         name='Procesamiento diario de suscripciones',
         replace_existing=True
     )
     
+    # Job 3: Limpieza de Idempotency-Keys expiradas (03:00)
+    _scheduler.add_job(
+        func=purge_idempotency_keys_daily_job,
+        trigger=CronTrigger(hour=3, minute=0),
+        id='purge_idempotency_keys_daily',
+        name='Limpieza diaria de Idempotency-Keys',
+        replace_existing=True
+    )
+    
+    # Job 4: Efectos posteriores a pagos desde el outbox (cada OUTBOX_POLL_SECONDS)
+    _scheduler.add_job(
+        func=process_outbox_job,
+        trigger=IntervalTrigger(seconds=settings.OUTBOX_POLL_SECONDS),
+        id='process_outbox',
+        name='Procesamiento del outbox de pagos',
+        replace_existing=True
+    )
+    
+    # Job 5: Procesamiento de webhooks de Stripe (cada STRIPE_WEBHOOK_POLL_SECONDS)
+    _scheduler.add_job(
+        func=process_stripe_webhooks_job,
+        trigger=IntervalTrigger(seconds=settings.STRIPE_WEBHOOK_POLL_SECONDS),
+        id='process_stripe_webhooks',
+        name='Procesamiento de webhooks de Stripe',
+        replace_existing=True
+    )
+    
+    # Job 6: Persistencia diferida de carritos (cada CART_STORE_FLUSH_SECONDS)
+    if CartService.store is not None:
+        _scheduler.add_job(
+            func=flush_carts_job,
+            trigger=IntervalTrigger(seconds=settings.CART_STORE_FLUSH_SECONDS),
+            id='flush_carts',
+            name='Persistencia de carritos modificados',
+            replace_existing=True
+        )
+    
+    # Job 7: Limpieza de líneas de carritos abandonados (03:30)
+    _scheduler.add_job(
+        func=purge_abandoned_carts_daily_job,
+        trigger=CronTrigger(hour=3, minute=30),
+        id='purge_abandoned_carts_daily',
+        name='Limpieza diaria de carritos abandonados',
+        replace_existing=True
+    )
+    
+    # Job 8: Emisión mensual de cupones (día 1, 01:00)
+    _scheduler.add_job(
+        func=issue_monthly_coupons_job,
+        trigger=CronTrigger(day=1, hour=1, minute=0),
+        id='issue_monthly_coupons',
+        name='Emisión mensual de cupones',
+        replace_existing=True
+    )
+    
     # Iniciar el scheduler
     _scheduler.start()
     logger.info("Scheduler iniciado correctamente")
@@ -173,6 +392,9 @@ def stop_scheduler():
         logger.info("Deteniendo scheduler...")
         _scheduler.shutdown(wait=True)
         _scheduler = None
+        # Los carritos que siguen pendientes en el store se persisten antes de salir
+        if CartService.store is not None:
+            flush_carts_job()
         logger.info("Scheduler detenido correctamente")
     else:
         logger.warning("El scheduler no estaba corriendo")
@@ -219,4 +441,12 @@ def run_process_subscriptions_now():
     Para testing y debugging - NO prod
     """
     logger.info("Ejecutando procesamiento de suscripciones manualmente (testing)...")
-    process_subscriptions_daily_job()
\ No newline at end of file
+    process_subscriptions_daily_job()
+
+def run_issue_coupons_now():
+    """
+    Ejecuta el job de emisión mensual de cupones inmediatamente
+    Para testing y debugging - NO prod
+    """
+    logger.info("Ejecutando emisión de cupones manualmente (testing)...")
+    issue_monthly_coupons_job()
@@ -0,0 +1,265 @@
+# Autor: Lizbeth Barajas
+# Fecha: 24-11-25
+# Descripción: Copia local de los customers y métodos de pago de Stripe (tablas
+#              stripe_customer y stripe_payment_method). Se mantiene al día con los
+#              webhooks customer.* y payment_method.* que procesa stripe_webhook_service,
+#              de modo que buscar el customer de un correo o los datos de una tarjeta es
+#              una lectura local; a Stripe solo se llama cuando el dato no está en la copia
+#              y el resultado se guarda. Cada fila recuerda el event.created del último
+#              cambio aplicado, así que los eventos atrasados o re-entregados no pisan datos
+#              más nuevos.
+
+from datetime import datetime, UTC
+from typing import Dict, Optional
+
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models.stripe_customer import StripeCustomer
+from app.models.stripe_payment_method import StripePaymentMethod
+from app.models.user import User
+from app.services.stripe_service import stripe_service
+
+CUSTOMER_EVENTS = ("customer.created", "customer.updated", "customer.deleted")
+PAYMENT_METHOD_EVENTS = (
+    "payment_method.attached",
+    "payment_method.updated",
+    "payment_method.automatically_updated",
+    "payment_method.detached"
+)
+
+
+def _utcnow() -> datetime:
+    """
+    Fecha actual en UTC sin zona horaria (así se guarda en columnas DateTime).
+    """
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+def _event_created(event: Dict) -> datetime:
+    """
+    event.created de Stripe (epoch) como fecha UTC sin zona horaria.
+    """
+    created = event.get("created")
+    return datetime.fromtimestamp(created, UTC).replace(tzinfo=None) if created else _utcnow()
+
+
+class StripeMirrorService:
+
+    # ==================== LECTURAS ====================
+
+    def get_or_create_customer(self, db: Session, user_id: int, email: str, name: str) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Igual que stripe_service.get_or_create_customer, pero busca primero el customer
+            del correo en la copia local. Solo si no está se consulta (o crea) en Stripe y
+            el resultado se guarda en la copia.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            user_id (int): ID interno del usuario.
+            email (str): Correo del usuario.
+            name (str): Nombre del usuario.
+
+        Retorna:
+            dict: Estado de la operación y el customer_id en Stripe.
+        """
+        customer = db.query(StripeCustomer).filter(
+            StripeCustomer.email == email,
+            StripeCustomer.deleted.is_(False)
+        ).order_by(StripeCustomer.source_created_at.desc()).first()
+        if customer:
+            return {"success": True, "customer_id": customer.customer_id}
+
+        result = stripe_service.get_or_create_customer(user_id=user_id, email=email, name=name)
+        if result.get("success"):
+            self._upsert_customer(db, {
+                "customer_id": result["customer_id"],
+                "user_id": user_id,
+                "email": email,
+                "name": name,
+                "deleted": False
+            }, _utcnow())
+            db.commit()
+        return result
+
+    def get_payment_method(self, db: Session, payment_method_id: str) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Igual que stripe_service.get_payment_method, pero lee la tarjeta de la copia
+            local; si no está, la obtiene de Stripe y la guarda.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            payment_method_id (str): ID del método de pago (pm_xxx).
+
+        Retorna:
+            dict: Información del método de pago o error.
+        """
+        local = self._local_payment_method(db, payment_method_id)
+        if local:
+            return local
+
+        result = stripe_service.get_payment_method(payment_method_id)
+        self._store_payment_method_result(db, result)
+        return result
+
+    async def get_payment_method_async(self, db: Session, payment_method_id: str) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Versión async de get_payment_method (usa el cliente async de Stripe en un miss).
+            No hace commit: la fila nueva se guarda con la transacción del llamador.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            payment_method_id (str): ID del método de pago (pm_xxx).
+
+        Retorna:
+            dict: Información del método de pago o error.
+        """
+        local = self._local_payment_method(db, payment_method_id)
+        if local:
+            return local
+
+        result = await stripe_service.get_payment_method_async(payment_method_id)
+        self._store_payment_method_result(db, result, commit=False)
+        return result
+
+    # ==================== HANDLERS DE WEBHOOKS ====================
+
+    async def handle_customer_event(self, db: Session, event: Dict) -> None:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Aplica customer.created/updated/deleted a la copia local. Al borrarse un
+            customer en Stripe también se quita de los usuarios que lo tenían, para que
+            el siguiente setup intent cree uno nuevo.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            event (Dict): Evento de Stripe.
+        """
+        customer = event["data"]["object"]
+        deleted = event["type"] == "customer.deleted" or bool(customer.get("deleted"))
+        user_id = (customer.get("metadata") or {}).get("user_id")
+
+        self._upsert_customer(db, {
+            "customer_id": customer["id"],
+            "user_id": int(user_id) if user_id and str(user_id).isdigit() else None,
+            "email": customer.get("email"),
+            "name": customer.get("name"),
+            "deleted": deleted
+        }, _event_created(event))
+
+        if deleted:
+            db.execute(
+                update(User).where(
+                    User.stripe_customer_id == customer["id"]
+                ).values(stripe_customer_id=None)
+            )
+        db.commit()
+
+    async def handle_payment_method_event(self, db: Session, event: Dict) -> None:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Aplica payment_method.attached/updated/automatically_updated/detached a la
+            copia local (en detached el customer queda vacío).
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            event (Dict): Evento de Stripe.
+        """
+        payment_method = event["data"]["object"]
+        card = payment_method.get("card") or {}
+
+        self._upsert_payment_method(db, {
+            "payment_method_id": payment_method["id"],
+            "customer_id": None if event["type"] == "payment_method.detached" else payment_method.get("customer"),
+            "type": payment_method.get("type") or "card",
+            "brand": card.get("brand"),
+            "last4": card.get("last4"),
+            "exp_month": card.get("exp_month"),
+            "exp_year": card.get("exp_year"),
+            "funding": card.get("funding")
+        }, _event_created(event))
+        db.commit()
+
+    # ==================== AUXILIARES ====================
+
+    @staticmethod
+    def _upsert(db: Session, model, key, values: Dict, source_created_at: datetime) -> None:
+        """
+        INSERT ... ON CONFLICT DO UPDATE que solo sobrescribe la fila si el cambio no es
+        más viejo que el último aplicado.
+        """
+        insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else postgresql_insert
+        values = {**values, "source_created_at": source_created_at, "synced_at": _utcnow()}
+        statement = insert(model).values(**values)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={name: statement.excluded[name] for name in values if name != key.key},
+            where=model.source_created_at <= statement.excluded.source_created_at
+        ))
+
+    def _upsert_customer(self, db: Session, values: Dict, source_created_at: datetime) -> None:
+        self._upsert(db, StripeCustomer, StripeCustomer.customer_id, values, source_created_at)
+
+    def _upsert_payment_method(self, db: Session, values: Dict, source_created_at: datetime) -> None:
+        self._upsert(db, StripePaymentMethod, StripePaymentMethod.payment_method_id, values, source_created_at)
+
+    @staticmethod
+    def _local_payment_method(db: Session, payment_method_id: str) -> Optional[Dict]:
+        """
+        Tarjeta de la copia local con el mismo formato que stripe_service.get_payment_method,
+        o None si no está (o está incompleta).
+        """
+        payment_method = db.get(StripePaymentMethod, payment_method_id)
+        if not payment_method or payment_method.last4 is None or payment_method.exp_year is None:
+            return None
+        return {
+            "success": True,
+            "payment_method": {
+                "id": payment_method.payment_method_id,
+                "type": payment_method.type,
+                "customer": payment_method.customer_id,
+                "card": {
+                    "brand": payment_method.brand,
+                    "last4": payment_method.last4,
+                    "exp_month": payment_method.exp_month,
+                    "exp_year": payment_method.exp_year,
+                    "funding": payment_method.funding
+                }
+            }
+        }
+
+    def _store_payment_method_result(self, db: Session, result: Dict, commit: bool = True) -> None:
+        """
+        Guarda en la copia local la tarjeta obtenida de Stripe en un miss. Es el estado
+        actual, así que los webhooks anteriores que lleguen después se ignoran.
+        """
+        if not result or not result.get("success"):
+            return
+        payment_method = result["payment_method"]
+        self._upsert_payment_method(db, {
+            "payment_method_id": payment_method["id"],
+            "customer_id": payment_method.get("customer"),
+            "type": payment_method.get("type") or "card",
+            **payment_method["card"]
+        }, _utcnow())
+        if commit:
+            db.commit()
+
+
+# instancia de uso
+stripe_mirror_service = StripeMirrorService()
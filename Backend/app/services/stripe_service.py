@@ -2,16 +2,50 @@
 # Fecha: 13-11-25
 # Descripción: Servicio para integración con Stripe. Maneja sesiones de pago,
 #              creación de clientes, intents de setup, cobros con tarjeta guardada,
-#              métodos de pago, webhooks y más.
-
+#              métodos de pago, webhooks y más. Los métodos *_async usan el cliente
+#              HTTP asíncrono del SDK (httpx, con conexiones reutilizadas) para no
+#              bloquear el event loop en las rutas async de pagos. Todas las llamadas
+#              pasan por la política de resiliencia "stripe" (circuit breaker, bulkhead,
+#              reintentos de lecturas y deadline de la petición).
+
+import asyncio
+import weakref
 import stripe
 from typing import Dict, Optional
 from app.config import settings
+from app.services.resilience import get_policy, without_deadline
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
+if settings.STRIPE_API_BASE:
+    stripe.api_base = settings.STRIPE_API_BASE
+# Cliente HTTP de la API síncrona con el mismo límite que la async (por defecto son 80s)
+stripe.default_http_client = stripe.RequestsClient(timeout=settings.STRIPE_TIMEOUT_SECONDS)
+
+
+def _is_transient_stripe_error(error: Exception) -> bool:
+    """
+    Errores de red, límite de peticiones y errores 5xx de Stripe. Los errores de tarjeta
+    o de petición inválida no cuentan como falla del proveedor.
+    """
+    if isinstance(error, (stripe.APIConnectionError, stripe.RateLimitError)):
+        return True
+    return isinstance(error, stripe.APIError) or (
+        isinstance(error, stripe.StripeError) and (error.http_status or 0) >= 500
+    )
 
 class StripeService:
     
+    def __init__(self):
+        # Un cliente async por event loop (el de la API y el del worker de webhooks); las
+        # conexiones httpx quedan ligadas al loop que las abrió
+        self._async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self.policy = get_policy(
+            "stripe",
+            timeout_seconds=settings.STRIPE_TIMEOUT_SECONDS,
+            max_concurrent=settings.STRIPE_MAX_CONCURRENT_CALLS,
+            is_transient=_is_transient_stripe_error
+        )
+    
     def create_checkout_session(
         self,
         amount: int,
@@ -40,33 +74,17 @@ class StripeService:
             dict: ID de la sesión y URL del checkout, o None en caso de error.
         """
         try:
-            session_params = {
-                'payment_method_types': ['card'],
-                'line_items': [{
-                    'price_data': {
-                        'currency': currency,
-                        'product_data': {
-                            'name': product_name,
-                        },
-                        'unit_amount': amount,
-                    },
-                    'quantity': 1,
-                }],
-                'mode': 'payment',
-                'success_url': success_url,
-                'cancel_url': cancel_url,
-            }
-            
-            if metadata:
-                session_params['metadata'] = metadata
+            session_params = self._checkout_session_params(
+                amount, currency, product_name, success_url, cancel_url, metadata
+            )
             
-            session = stripe.checkout.Session.create(**session_params)
+            session = self.policy.call(lambda: stripe.checkout.Session.create(**session_params))
             
             return {
                 'id': session.id,
                 'url': session.url
             }
-        except stripe.error.StripeError as e:
+        except stripe.StripeError as e:
             print(f"Stripe error creating checkout session: {str(e)}")
             return None
         except Exception as e:
@@ -90,22 +108,25 @@ class StripeService:
             dict: Estado de la operación y el customer_id en Stripe.
         """
         try:
-            customers = stripe.Customer.list(email=email, limit=1)
+            customers = self.policy.call(
+                lambda: stripe.Customer.list(email=email, limit=1),
+                idempotent=True
+            )
             
             if customers.data:
                 customer = customers.data[0]
             else:
-                customer = stripe.Customer.create(
+                customer = self.policy.call(lambda: stripe.Customer.create(
                     email=email,
                     name=name,
                     metadata={'user_id': str(user_id)}
-                )
+                ))
             
             return {
                 'success': True,
                 'customer_id': customer.id
             }
-        except stripe.error.StripeError as e:
+        except stripe.StripeError as e:
             return {
                 'success': False,
                 'error': f"Stripe error: {str(e)}"
@@ -131,18 +152,18 @@ class StripeService:
             dict: Client secret y ID del setup intent.
         """
         try:
-            setup_intent = stripe.SetupIntent.create(
+            setup_intent = self.policy.call(lambda: stripe.SetupIntent.create(
                 customer=customer_id,
                 payment_method_types=['card'],
                 usage='off_session',
-            )
+            ))
             
             return {
                 'success': True,
                 'client_secret': setup_intent.client_secret,
                 'setup_intent_id': setup_intent.id
             }
-        except stripe.error.StripeError as e:
+        except stripe.StripeError as e:
             return {
                 'success': False,
                 'error': f"Stripe error: {str(e)}"
@@ -167,23 +188,12 @@ class StripeService:
             dict: Información del método de pago o error.
         """
         try:
-            payment_method = stripe.PaymentMethod.retrieve(payment_method_id)
-            
-            return {
-                'success': True,
-                'payment_method': {
-                    'id': payment_method.id,
-                    'type': payment_method.type,
-                    'card': {
-                        'brand': payment_method.card.brand,
-                        'last4': payment_method.card.last4,
-                        'exp_month': payment_method.card.exp_month,
-                        'exp_year': payment_method.card.exp_year,
-                        'funding': payment_method.card.funding
-                    }
-                }
-            }
-        except stripe.error.StripeError as e:
+            payment_method = self.policy.call(
+                lambda: stripe.PaymentMethod.retrieve(payment_method_id),
+                idempotent=True
+            )
+            return self._payment_method_result(payment_method)
+        except stripe.StripeError as e:
             return {
                 'success': False,
                 'error': f"Stripe error: {str(e)}"
@@ -201,7 +211,8 @@ class StripeService:
         customer_id: str,
         payment_method_id: str,
         description: str = None,
-        metadata: Dict = None
+        metadata: Dict = None,
+        idempotency_key: Optional[str] = None
     ) -> Dict:
         """
         Autor: Lizbeth Barajas
@@ -217,53 +228,30 @@ class StripeService:
             payment_method_id (str): ID del método de pago guardado.
             description (str): Descripción opcional del pago.
             metadata (dict): Datos adicionales opcionales.
+            idempotency_key (str, opcional): Llave de idempotencia de Stripe; repetir el cobro
+                                             con la misma llave regresa el mismo Payment Intent
+                                             en lugar de cobrar otra vez (y permite reintentarlo).
 
         Retorna:
             dict: Resultado del pago y estatus final.
         """
         try:
-            payment_intent_params = {
-                'amount': amount,
-                'currency': currency,
-                'customer': customer_id,
-                'payment_method': payment_method_id,
-                'off_session': True,
-                'confirm': True,
-            }
-            
-            if description:
-                payment_intent_params['description'] = description
-            
-            if metadata:
-                payment_intent_params['metadata'] = metadata
-            
-            payment_intent = stripe.PaymentIntent.create(**payment_intent_params)
-            
-            if payment_intent.status == 'succeeded':
-                return {
-                    'success': True,
-                    'payment_intent_id': payment_intent.id,
-                    'status': 'succeeded'
-                }
-            elif payment_intent.status == 'requires_action':
-                return {
-                    'success': False,
-                    'requires_action': True,
-                    'client_secret': payment_intent.client_secret,
-                    'payment_intent_id': payment_intent.id
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': f'Payment status: {payment_intent.status}'
-                }
-                
-        except stripe.error.CardError as e:
+            payment_intent_params = self._payment_intent_params(
+                amount, currency, customer_id, payment_method_id, description, metadata
+            )
+            if idempotency_key:
+                payment_intent_params['idempotency_key'] = idempotency_key
+            payment_intent = self.policy.call(
+                lambda: stripe.PaymentIntent.create(**payment_intent_params),
+                idempotent=bool(idempotency_key)
+            )
+            return self._payment_intent_result(payment_intent)
+        except stripe.CardError as e:
             return {
                 'success': False,
                 'error': e.user_message or str(e)
             }
-        except stripe.error.StripeError as e:
+        except stripe.StripeError as e:
             return {
                 'success': False,
                 'error': f"Stripe error: {str(e)}"
@@ -288,9 +276,9 @@ class StripeService:
             dict: Lista de métodos de pago.
         """
         try:
-            payment_methods = stripe.PaymentMethod.list(
-                customer=customer_id,
-                type='card'
+            payment_methods = self.policy.call(
+                lambda: stripe.PaymentMethod.list(customer=customer_id, type='card'),
+                idempotent=True
             )
             
             cards = []
@@ -307,7 +295,7 @@ class StripeService:
                 'success': True,
                 'payment_methods': cards
             }
-        except stripe.error.StripeError as e:
+        except stripe.StripeError as e:
             return {
                 'success': False,
                 'error': f"Stripe error: {str(e)}"
@@ -332,13 +320,13 @@ class StripeService:
             dict: Estado de la operación.
         """
         try:
-            stripe.PaymentMethod.detach(payment_method_id)
+            self.policy.call(lambda: stripe.PaymentMethod.detach(payment_method_id))
             
             return {
                 'success': True,
                 'message': 'Payment method removed'
             }
-        except stripe.error.StripeError as e:
+        except stripe.StripeError as e:
             return {
                 'success': False,
                 'error': f"Stripe error: {str(e)}"
@@ -363,9 +351,12 @@ class StripeService:
             dict: Objeto de la sesión o None.
         """
         try:
-            session = stripe.checkout.Session.retrieve(session_id)
+            session = self.policy.call(
+                lambda: stripe.checkout.Session.retrieve(session_id),
+                idempotent=True
+            )
             return session
-        except stripe.error.StripeError as e:
+        except stripe.StripeError as e:
             print(f"Stripe error retrieving session: {str(e)}")
             return None
         except Exception as e:
@@ -398,7 +389,7 @@ class StripeService:
             return event
         except ValueError as e:
             raise ValueError(f"Invalid payload: {str(e)}")
-        except stripe.error.SignatureVerificationError as e:
+        except stripe.SignatureVerificationError as e:
             raise ValueError(f"Invalid signature: {str(e)}")
     
     def charge_saved_card(
@@ -425,7 +416,10 @@ class StripeService:
             dict: Resultado del pago.
         """
         try:
-            customer = stripe.Customer.retrieve(customer_id)
+            customer = self.policy.call(
+                lambda: stripe.Customer.retrieve(customer_id),
+                idempotent=True
+            )
             default_payment_method = customer.invoice_settings.default_payment_method
             
             if not default_payment_method:
@@ -442,7 +436,7 @@ class StripeService:
                 description=description
             )
             
-        except stripe.error.StripeError as e:
+        except stripe.StripeError as e:
             return {
                 'success': False,
                 'error': f"Stripe error: {str(e)}"
@@ -453,4 +447,357 @@ class StripeService:
                 'error': str(e)
             }
 
+    # ==================== CLIENTE ASYNC ====================
+    
+    def _get_async_client(self) -> stripe.StripeClient:
+        """
+        Regresa el StripeClient del event loop actual, con el cliente HTTP async (httpx)
+        del SDK. Un solo cliente por loop mantiene el pool de conexiones keep-alive.
+        """
+        loop = asyncio.get_running_loop()
+        entry = self._async_clients.get(loop)
+        if entry is None:
+            http_client = stripe.HTTPXClient(timeout=settings.STRIPE_TIMEOUT_SECONDS)
+            client = stripe.StripeClient(
+                settings.STRIPE_SECRET_KEY,
+                base_addresses={"api": settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else None,
+                max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+                http_client=http_client
+            )
+            entry = (client, http_client)
+            self._async_clients[loop] = entry
+        return entry[0]
+    
+    async def _call_async(self, operation, timeout: Optional[float] = None, idempotent: bool = False):
+        """
+        Ejecuta una llamada async al SDK a través de la política de resiliencia. El límite
+        de tiempo de cada intento incluye los reintentos de red del SDK.
+        """
+        return await self.policy.call_async(operation, idempotent=idempotent, timeout=timeout)
+    
+    async def close(self) -> None:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Cierra las conexiones del cliente async del event loop actual. Se llama al
+            detener la aplicación y al terminar cada ejecución del worker de webhooks.
+        """
+        entry = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[1].close_async()
+    
+    async def create_checkout_session_async(
+        self,
+        amount: int,
+        currency: str,
+        product_name: str,
+        success_url: str,
+        cancel_url: str,
+        metadata: Optional[Dict] = None,
+        timeout: Optional[float] = None
+    ) -> Optional[Dict]:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Versión async de create_checkout_session: no bloquea el event loop mientras
+            espera a Stripe.
+
+        Parámetros:
+            amount, currency, product_name, success_url, cancel_url, metadata:
+                Igual que create_checkout_session.
+            timeout (float, opcional): Límite de la llamada en segundos
+                                       (por defecto STRIPE_TIMEOUT_SECONDS).
+
+        Retorna:
+            dict: ID de la sesión y URL del checkout, o None en caso de error.
+        """
+        try:
+            session = await self._call_async(
+                lambda: self._get_async_client().v1.checkout.sessions.create_async(
+                    params=self._checkout_session_params(
+                        amount, currency, product_name, success_url, cancel_url, metadata
+                    )
+                ),
+                timeout
+            )
+            
+            return {
+                'id': session.id,
+                'url': session.url
+            }
+        except asyncio.TimeoutError:
+            print("Stripe timeout creating checkout session")
+            return None
+        except stripe.StripeError as e:
+            print(f"Stripe error creating checkout session: {str(e)}")
+            return None
+        except Exception as e:
+            print(f"Error creating checkout session: {str(e)}")
+            return None
+    
+    async def create_payment_intent_with_saved_card_async(
+        self,
+        amount: int,
+        currency: str,
+        customer_id: str,
+        payment_method_id: str,
+        description: str = None,
+        metadata: Dict = None,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None
+    ) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Versión async de create_payment_intent_with_saved_card. Con idempotency_key el
+            cobro se reintenta ante fallos transitorios y, si vence el tiempo (el cobro pudo
+            haberse confirmado en Stripe), se concilia repitiéndolo con la misma llave fuera
+            del deadline de la petición: Stripe regresa el Payment Intent original en lugar
+            de cobrar otra vez. Si tampoco así se obtiene respuesta, el resultado lleva
+            outcome_unknown para que el llamador no lo trate como un cobro fallido.
+
+        Parámetros:
+            amount, currency, customer_id, payment_method_id, description, metadata:
+                Igual que create_payment_intent_with_saved_card.
+            timeout (float, opcional): Límite de la llamada en segundos.
+            idempotency_key (str, opcional): Llave de idempotencia de Stripe.
+
+        Retorna:
+            dict: Resultado del pago y estatus final.
+        """
+        params = self._payment_intent_params(
+            amount, currency, customer_id, payment_method_id, description, metadata
+        )
+        options = {'idempotency_key': idempotency_key} if idempotency_key else None
+        
+        def create():
+            return self._get_async_client().v1.payment_intents.create_async(params=params, options=options)
+        
+        reconciling = False
+        try:
+            try:
+                payment_intent = await self._call_async(create, timeout, idempotent=bool(idempotency_key))
+            except (asyncio.TimeoutError, stripe.APIConnectionError):
+                if not idempotency_key:
+                    raise
+                reconciling = True
+                with without_deadline():
+                    payment_intent = await self._call_async(create, idempotent=True)
+            return self._payment_intent_result(payment_intent)
+        except (asyncio.TimeoutError, stripe.APIConnectionError) as e:
+            return {
+                'success': False,
+                'error': 'Stripe timeout' if isinstance(e, asyncio.TimeoutError) else f"Stripe error: {str(e)}",
+                'outcome_unknown': bool(idempotency_key)
+            }
+        except stripe.CardError as e:
+            return {
+                'success': False,
+                'error': e.user_message or str(e)
+            }
+        except stripe.StripeError as e:
+            return {
+                'success': False,
+                'error': f"Stripe error: {str(e)}",
+                'outcome_unknown': reconciling and _is_transient_stripe_error(e)
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'outcome_unknown': reconciling
+            }
+    
+    async def retrieve_session_async(self, session_id: str, timeout: Optional[float] = None):
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Versión async de retrieve_session.
+
+        Parámetros:
+            session_id (str): ID de la sesión.
+            timeout (float, opcional): Límite de la llamada en segundos.
+
+        Retorna:
+            dict: Objeto de la sesión o None.
+        """
+        try:
+            return await self._call_async(
+                lambda: self._get_async_client().v1.checkout.sessions.retrieve_async(session_id),
+                timeout,
+                idempotent=True
+            )
+        except (asyncio.TimeoutError, stripe.StripeError) as e:
+            print(f"Stripe error retrieving session: {str(e) or 'timeout'}")
+            return None
+        except Exception as e:
+            print(f"Error retrieving session: {str(e)}")
+            return None
+    
+    async def retrieve_payment_intent_async(self, payment_intent_id: str, timeout: Optional[float] = None):
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Recupera un Payment Intent por ID sin bloquear el event loop.
+
+        Parámetros:
+            payment_intent_id (str): ID del intent (pi_xxx).
+            timeout (float, opcional): Límite de la llamada en segundos.
+
+        Retorna:
+            PaymentIntent: Objeto del intent o None.
+        """
+        try:
+            return await self._call_async(
+                lambda: self._get_async_client().v1.payment_intents.retrieve_async(payment_intent_id),
+                timeout,
+                idempotent=True
+            )
+        except (asyncio.TimeoutError, stripe.StripeError) as e:
+            print(f"Stripe error retrieving payment intent: {str(e) or 'timeout'}")
+            return None
+        except Exception as e:
+            print(f"Error retrieving payment intent: {str(e)}")
+            return None
+    
+    async def get_payment_method_async(self, payment_method_id: str, timeout: Optional[float] = None) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Versión async de get_payment_method.
+
+        Parámetros:
+            payment_method_id (str): ID del método de pago (pm_xxx).
+            timeout (float, opcional): Límite de la llamada en segundos.
+
+        Retorna:
+            dict: Información del método de pago o error.
+        """
+        try:
+            payment_method = await self._call_async(
+                lambda: self._get_async_client().v1.payment_methods.retrieve_async(payment_method_id),
+                timeout,
+                idempotent=True
+            )
+            return self._payment_method_result(payment_method)
+        except asyncio.TimeoutError:
+            return {
+                'success': False,
+                'error': 'Stripe timeout'
+            }
+        except stripe.StripeError as e:
+            return {
+                'success': False,
+                'error': f"Stripe error: {str(e)}"
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    # ==================== AUXILIARES ====================
+    
+    @staticmethod
+    def _checkout_session_params(
+        amount: int,
+        currency: str,
+        product_name: str,
+        success_url: str,
+        cancel_url: str,
+        metadata: Optional[Dict]
+    ) -> Dict:
+        session_params = {
+            'payment_method_types': ['card'],
+            'line_items': [{
+                'price_data': {
+                    'currency': currency,
+                    'product_data': {
+                        'name': product_name,
+                    },
+                    'unit_amount': amount,
+                },
+                'quantity': 1,
+            }],
+            'mode': 'payment',
+            'success_url': success_url,
+            'cancel_url': cancel_url,
+        }
+        
+        if metadata:
+            session_params['metadata'] = metadata
+        
+        return session_params
+    
+    @staticmethod
+    def _payment_intent_params(
+        amount: int,
+        currency: str,
+        customer_id: str,
+        payment_method_id: str,
+        description: Optional[str],
+        metadata: Optional[Dict]
+    ) -> Dict:
+        payment_intent_params = {
+            'amount': amount,
+            'currency': currency,
+            'customer': customer_id,
+            'payment_method': payment_method_id,
+            'off_session': True,
+            'confirm': True,
+        }
+        
+        if description:
+            payment_intent_params['description'] = description
+        
+        if metadata:
+            payment_intent_params['metadata'] = metadata
+        
+        return payment_intent_params
+    
+    @staticmethod
+    def _payment_intent_result(payment_intent) -> Dict:
+        if payment_intent.status == 'succeeded':
+            return {
+                'success': True,
+                'payment_intent_id': payment_intent.id,
+                'status': 'succeeded'
+            }
+        elif payment_intent.status == 'requires_action':
+            return {
+                'success': False,
+                'requires_action': True,
+                'client_secret': payment_intent.client_secret,
+                'payment_intent_id': payment_intent.id
+            }
+        else:
+            return {
+                'success': False,
+                'error': f'Payment status: {payment_intent.status}'
+            }
+    
+    @staticmethod
+    def _payment_method_result(payment_method) -> Dict:
+        return {
+            'success': True,
+            'payment_method': {
+                'id': payment_method.id,
+                'type': payment_method.type,
+                'customer': payment_method.customer,
+                'card': {
+                    'brand': payment_method.card.brand,
+                    'last4': payment_method.card.last4,
+                    'exp_month': payment_method.card.exp_month,
+                    'exp_year': payment_method.card.exp_year,
+                    'funding': payment_method.card.funding
+                }
+            }
+        }
+
 stripe_service = StripeService()
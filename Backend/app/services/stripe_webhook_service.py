@@ -0,0 +1,393 @@
+# Autor: Lizbeth Barajas
+# Fecha: 22-11-25
+# Descripción: Ingesta y procesamiento diferido de webhooks de Stripe. La ruta del webhook
+#              solo verifica la firma, guarda el evento crudo en stripe_webhook_event (único
+#              por event.id, por lo que las re-entregas de Stripe se descartan) y responde 200.
+#              Un worker del scheduler procesa los eventos con un pool de corrutinas: eventos
+#              de clientes distintos en paralelo y, para un mismo cliente, en orden. Los
+#              fallos se reintentan con backoff exponencial.
+
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta, UTC
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, or_, select, update, exists, func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, aliased
+
+from app.config import settings
+from app.core.database import SessionLocal
+from app.models.stripe_webhook_event import StripeWebhookEvent
+from app.models.enum import WebhookEventStatus
+from app.services.stripe_service import stripe_service
+from app.services.stripe_mirror_service import (
+    CUSTOMER_EVENTS,
+    PAYMENT_METHOD_EVENTS,
+    stripe_mirror_service
+)
+
+# Estados que todavía bloquean a los eventos posteriores del mismo cliente
+OPEN_STATUSES = (WebhookEventStatus.PENDING, WebhookEventStatus.PROCESSING)
+
+WebhookHandler = Callable[[Session, Dict], Awaitable[None]]
+
+
+def _utcnow() -> datetime:
+    """
+    Fecha actual en UTC sin zona horaria (así se guarda en columnas DateTime).
+    """
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+class StripeWebhookService:
+
+    def __init__(self):
+        # event_type -> handlers async (db, evento) que se ejecutan en orden
+        self._handlers: Dict[str, List[WebhookHandler]] = {}
+        # Métricas de la última ejecución del worker en este proceso
+        self.last_run: Dict = {}
+        self.register_handler("checkout.session.completed", self._handle_checkout_completed)
+        # Copia local de customers y métodos de pago
+        for event_type in CUSTOMER_EVENTS:
+            self.register_handler(event_type, stripe_mirror_service.handle_customer_event)
+        for event_type in PAYMENT_METHOD_EVENTS:
+            self.register_handler(event_type, stripe_mirror_service.handle_payment_method_event)
+
+    def register_handler(self, event_type: str, handler: WebhookHandler) -> None:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Registra un handler para un tipo de evento de Stripe. Los eventos sin handler
+            se marcan como procesados sin hacer nada.
+
+        Parámetros:
+            event_type (str): Tipo de evento de Stripe (ej. "checkout.session.completed").
+            handler (Callable): Corrutina (db, evento) que aplica el efecto y hace commit;
+                                debe lanzar una excepción si falla para que se reintente.
+        """
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def ingest(self, db: Session, payload: bytes) -> bool:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Guarda un evento ya verificado. Si el event.id ya existe (re-entrega de Stripe)
+            no hace nada.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            payload (bytes): Cuerpo crudo del webhook (evento verificado).
+
+        Retorna:
+            bool: True si el evento es nuevo, False si es duplicado.
+        """
+        event = json.loads(payload)
+        now = _utcnow()
+
+        insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else postgresql_insert
+        statement = insert(StripeWebhookEvent).values(
+            event_id=event["id"],
+            event_type=event["type"],
+            ordering_key=self._ordering_key(event),
+            payload=event,
+            status=WebhookEventStatus.PENDING,
+            attempts=0,
+            stripe_created_at=datetime.fromtimestamp(event.get("created") or now.timestamp(), UTC).replace(tzinfo=None),
+            received_at=now,
+            available_at=now
+        ).on_conflict_do_nothing(
+            index_elements=[StripeWebhookEvent.event_id]
+        ).returning(StripeWebhookEvent.webhook_event_id)
+
+        inserted = db.execute(statement).scalar() is not None
+        db.commit()
+        return inserted
+
+    def claim_batch(self, db: Session, batch_size: int = settings.STRIPE_WEBHOOK_BATCH_SIZE) -> List[int]:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Reclama los eventos listos para procesar: solo el primer evento abierto de cada
+            cliente (para respetar el orden) cuyo backoff ya venció. Los marca PROCESSING con
+            un lease de STRIPE_WEBHOOK_LEASE_SECONDS; si el worker muere, el evento se
+            retoma al vencer el lease. El UPDATE repite la condición, por lo que dos
+            instancias no reclaman el mismo evento.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+            batch_size (int): Máximo de eventos a reclamar.
+
+        Retorna:
+            List[int]: IDs (webhook_event_id) reclamados.
+        """
+        now = _utcnow()
+        event = StripeWebhookEvent
+        earlier = aliased(StripeWebhookEvent)
+
+        claimable = and_(
+            event.status.in_(OPEN_STATUSES),
+            event.available_at <= now
+        )
+        earlier_open_event = exists().where(
+            earlier.ordering_key == event.ordering_key,
+            earlier.status.in_(OPEN_STATUSES),
+            or_(
+                earlier.stripe_created_at < event.stripe_created_at,
+                and_(
+                    earlier.stripe_created_at == event.stripe_created_at,
+                    earlier.webhook_event_id < event.webhook_event_id
+                )
+            )
+        )
+
+        candidate_ids = db.execute(
+            select(event.webhook_event_id).where(
+                claimable,
+                ~earlier_open_event
+            ).order_by(
+                event.stripe_created_at,
+                event.webhook_event_id
+            ).limit(batch_size)
+        ).scalars().all()
+
+        if not candidate_ids:
+            return []
+
+        claimed = db.execute(
+            update(event).where(
+                event.webhook_event_id.in_(candidate_ids),
+                claimable
+            ).values(
+                status=WebhookEventStatus.PROCESSING,
+                available_at=now + timedelta(seconds=settings.STRIPE_WEBHOOK_LEASE_SECONDS)
+            ).returning(event.webhook_event_id)
+        ).scalars().all()
+        db.commit()
+
+        return list(claimed)
+
+    async def process_event(
+        self,
+        webhook_event_id: int,
+        session_factory: Callable[[], Session] = SessionLocal
+    ) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Procesa un evento reclamado con su propia sesión. Si algún handler falla, el
+            evento vuelve a PENDING con backoff exponencial (con jitter) o queda en FAILED
+            al agotar STRIPE_WEBHOOK_MAX_ATTEMPTS.
+
+        Parámetros:
+            webhook_event_id (int): ID del evento reclamado.
+            session_factory (Callable): Fábrica de sesiones de base de datos.
+
+        Retorna:
+            Dict: Resultado ("processed", "retried" o "failed") y lag en segundos desde
+                  que Stripe creó el evento.
+        """
+        db = session_factory()
+        try:
+            event = db.get(StripeWebhookEvent, webhook_event_id)
+            if event is None or event.status != WebhookEventStatus.PROCESSING:
+                return {"outcome": "skipped", "lag_seconds": None}
+
+            payload = event.payload
+            event_type = event.event_type
+            try:
+                for handler in self._handlers.get(event_type, []):
+                    await handler(db, payload)
+                error = None
+            except Exception as e:
+                db.rollback()
+                error = str(e)[:2000] or e.__class__.__name__
+
+            event = db.get(StripeWebhookEvent, webhook_event_id, populate_existing=True)
+            now = _utcnow()
+
+            if error is None:
+                event.status = WebhookEventStatus.PROCESSED
+                event.processed_at = now
+                event.last_error = None
+                outcome = "processed"
+            else:
+                event.attempts += 1
+                event.last_error = error
+                if event.attempts >= settings.STRIPE_WEBHOOK_MAX_ATTEMPTS:
+                    event.status = WebhookEventStatus.FAILED
+                    outcome = "failed"
+                else:
+                    delay = min(
+                        settings.STRIPE_WEBHOOK_RETRY_BASE_SECONDS * (2 ** (event.attempts - 1)),
+                        settings.STRIPE_WEBHOOK_RETRY_MAX_SECONDS
+                    )
+                    event.status = WebhookEventStatus.PENDING
+                    event.available_at = now + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+                    outcome = "retried"
+
+            lag_seconds = (now - event.stripe_created_at).total_seconds()
+            db.commit()
+
+            return {"outcome": outcome, "lag_seconds": lag_seconds}
+        finally:
+            db.close()
+
+    async def drain_async(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        workers: int = settings.STRIPE_WEBHOOK_WORKERS,
+        batch_size: int = settings.STRIPE_WEBHOOK_BATCH_SIZE,
+        max_batches: int = settings.STRIPE_WEBHOOK_MAX_BATCHES_PER_RUN
+    ) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Reclama y procesa lotes de eventos con hasta `workers` eventos en paralelo,
+            hasta vaciar la cola o llegar a max_batches.
+
+        Parámetros:
+            session_factory (Callable): Fábrica de sesiones (una por evento).
+            workers (int): Eventos procesados en paralelo.
+            batch_size (int): Eventos por lote.
+            max_batches (int): Máximo de lotes por ejecución.
+
+        Retorna:
+            Dict: Totales de la ejecución y lag promedio/máximo de los eventos procesados.
+        """
+        started = _utcnow()
+        semaphore = asyncio.Semaphore(workers)
+        totals = {"batches": 0, "claimed": 0, "processed": 0, "retried": 0, "failed": 0}
+        lags = []
+
+        async def run(webhook_event_id: int) -> Dict:
+            async with semaphore:
+                return await self.process_event(webhook_event_id, session_factory)
+
+        for _ in range(max_batches):
+            db = session_factory()
+            try:
+                claimed = self.claim_batch(db, batch_size)
+            finally:
+                db.close()
+
+            if not claimed:
+                break
+
+            totals["batches"] += 1
+            totals["claimed"] += len(claimed)
+            for result in await asyncio.gather(*(run(webhook_event_id) for webhook_event_id in claimed)):
+                if result["outcome"] in totals:
+                    totals[result["outcome"]] += 1
+                if result["outcome"] == "processed":
+                    lags.append(result["lag_seconds"])
+
+        totals["avg_lag_seconds"] = round(sum(lags) / len(lags), 3) if lags else None
+        totals["max_lag_seconds"] = round(max(lags), 3) if lags else None
+        totals["started_at"] = started
+        totals["duration_seconds"] = round((_utcnow() - started).total_seconds(), 3)
+        self.last_run = totals
+        return totals
+
+    def drain(self, session_factory: Callable[[], Session] = SessionLocal) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Punto de entrada síncrono para el scheduler: ejecuta drain_async en un event
+            loop propio y cierra al final las conexiones de Stripe de ese loop.
+
+        Parámetros:
+            session_factory (Callable): Fábrica de sesiones de base de datos.
+
+        Retorna:
+            Dict: Totales de la ejecución.
+        """
+        async def run() -> Dict:
+            try:
+                return await self.drain_async(session_factory)
+            finally:
+                await stripe_service.close()
+
+        return asyncio.run(run())
+
+    def get_metrics(self, db: Session) -> Dict:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Métricas de la cola: eventos por estado, antigüedad del evento pendiente más
+            viejo (lag actual) y resultados de la última ejecución del worker.
+
+        Parámetros:
+            db (Session): Sesión activa de la base de datos.
+
+        Retorna:
+            Dict: Métricas de la cola de webhooks.
+        """
+        counts = {status.value: 0 for status in WebhookEventStatus}
+        for status, count in db.query(
+            StripeWebhookEvent.status,
+            func.count(StripeWebhookEvent.webhook_event_id)
+        ).group_by(StripeWebhookEvent.status).all():
+            counts[status.value] = count
+
+        oldest_open = db.query(func.min(StripeWebhookEvent.received_at)).filter(
+            StripeWebhookEvent.status.in_(OPEN_STATUSES)
+        ).scalar()
+
+        return {
+            "counts": counts,
+            "oldest_pending_age_seconds": (
+                round((_utcnow() - oldest_open).total_seconds(), 3) if oldest_open else 0
+            ),
+            "last_run": self.last_run or None
+        }
+
+    # ==================== AUXILIARES ====================
+
+    @staticmethod
+    def _ordering_key(event: Dict) -> str:
+        """
+        Clave de orden del evento: el customer de Stripe, el user_id de la metadata o,
+        si no hay ninguno, el propio evento (sin orden relativo con otros).
+        """
+        data_object = (event.get("data") or {}).get("object") or {}
+        if data_object.get("object") == "customer" and data_object.get("id"):
+            return f"cus:{data_object['id']}"
+        if data_object.get("customer"):
+            return f"cus:{data_object['customer']}"
+        user_id = (data_object.get("metadata") or {}).get("user_id")
+        if user_id:
+            return f"user:{user_id}"
+        return f"evt:{event['id']}"
+
+    # ==================== HANDLERS ====================
+
+    @staticmethod
+    async def _handle_checkout_completed(db: Session, event: Dict) -> None:
+        """
+        Crea la orden y registra el pago de una sesión de checkout completada.
+        """
+        # Import local: el módulo de pagos importa este servicio desde sus rutas
+        from app.api.v1.payments.service import payment_process_service
+
+        session = event["data"]["object"]
+        result = await payment_process_service.process_stripe_webhook(
+            db=db,
+            session_id=session.get("id"),
+            payment_intent_id=session.get("payment_intent")
+        )
+        if not result.get("success"):
+            raise RuntimeError(result.get("error"))
+
+
+# instancia de uso
+stripe_webhook_service = StripeWebhookService()
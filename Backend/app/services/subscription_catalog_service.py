@@ -0,0 +1,149 @@
+# Autor: Lizbeth Barajas
+# Fecha: 25-11-25
+# Descripción: Catálogo en memoria para armar las cajas de suscripción. Guarda los productos
+#              activos con stock y, por plan (BeStrong, BeLean, ...), su lista ordenada de
+#              productos, de modo que crear una suscripción o cobrarla en el job no consulta
+#              la tabla product por cada suscriptor. Se recarga al vencer
+#              SUBSCRIPTION_CATALOG_CACHE_SECONDS (cambios hechos por otras réplicas o por
+#              ventas) y se invalida en cuanto se crea, edita o desactiva un producto. El stock
+#              de la copia se descuenta con cada caja enviada para no elegir productos agotados.
+
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.product import Product
+
+# Productos por caja de suscripción
+BOX_SIZE = 3
+
+
+class SubscriptionCatalogService:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._products: Optional[Dict[int, Dict]] = None
+        self._ranked_by_plan: Dict[str, List[int]] = {}
+        self._loaded_at = 0.0
+
+    def select_products(self, db: Session, recommended_plan: str, fitness_objectives: List[str]) -> List[Dict]:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Elige hasta BOX_SIZE productos con stock para una caja: primero los del plan
+            recomendado (nombre que contiene el plan, mejor calificados primero) y, si no
+            alcanzan, los que cubren todos los objetivos fitness del perfil, sin repetir.
+
+        Parámetros:
+            db (Session): Sesión activa (solo se usa si hay que recargar el catálogo).
+            recommended_plan (str): Plan recomendado del perfil fitness.
+            fitness_objectives (List[str]): Objetivos fitness del perfil.
+
+        Retorna:
+            List[Dict]: product_id, name y price de cada producto elegido.
+        """
+        with self._lock:
+            self._ensure_loaded(db)
+
+            candidates = self._ranked_for_plan(recommended_plan) if recommended_plan else []
+            if len([pid for pid in candidates if self._products[pid]["stock"] > 0]) < BOX_SIZE:
+                objectives = set(fitness_objectives or [])
+                candidates = candidates + [
+                    product_id for product_id, product in self._products.items()
+                    if objectives <= product["fitness_objectives"] and product_id not in candidates
+                ]
+
+            selected = [
+                self._products[product_id] for product_id in candidates
+                if self._products[product_id]["stock"] > 0
+            ][:BOX_SIZE]
+            return [
+                {"product_id": product["product_id"], "name": product["name"], "price": product["price"]}
+                for product in selected
+            ]
+
+    def record_shipment(self, product_ids: List[int]) -> None:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Descuenta una unidad de cada producto de la copia en memoria después de guardar
+            una caja, para que un producto que se agota deje de elegirse sin recargar.
+
+        Parámetros:
+            product_ids (List[int]): Productos enviados en la caja.
+        """
+        with self._lock:
+            if self._products is None:
+                return
+            for product_id in product_ids:
+                if product_id in self._products:
+                    self._products[product_id]["stock"] -= 1
+
+    def invalidate(self) -> None:
+        """
+        Autor: Lizbeth Barajas
+
+        Descripción:
+            Descarta el catálogo en memoria para que se recargue en la siguiente consulta.
+            Se llama cuando cambia el catálogo de productos.
+        """
+        with self._lock:
+            self._products = None
+            self._ranked_by_plan = {}
+
+    # ==================== AUXILIARES ====================
+
+    def _ensure_loaded(self, db: Session) -> None:
+        """
+        Carga los productos activos con stock (una consulta) cuando no hay copia o venció.
+        """
+        now = time.monotonic()
+        if self._products is not None and now - self._loaded_at <= settings.SUBSCRIPTION_CATALOG_CACHE_SECONDS:
+            return
+
+        rows = db.query(
+            Product.product_id,
+            Product.name,
+            Product.price,
+            Product.stock,
+            Product.fitness_objectives,
+            Product.average_rating
+        ).filter(
+            Product.is_active == True,
+            Product.stock > 0
+        ).order_by(Product.product_id).all()
+
+        self._products = {
+            row.product_id: {
+                "product_id": row.product_id,
+                "name": row.name,
+                "price": row.price,
+                "stock": row.stock,
+                "fitness_objectives": set(row.fitness_objectives or []),
+                "rating": row.average_rating
+            }
+            for row in rows
+        }
+        self._ranked_by_plan = {}
+        self._loaded_at = now
+
+    def _ranked_for_plan(self, recommended_plan: str) -> List[int]:
+        """
+        Productos cuyo nombre contiene el plan, mejor calificados primero; se calcula una
+        vez por plan y por carga del catálogo.
+        """
+        key = recommended_plan.lower()
+        if key not in self._ranked_by_plan:
+            matches = [product for product in self._products.values() if key in product["name"].lower()]
+            matches.sort(key=lambda product: (-(product["rating"] or 0), product["product_id"]))
+            self._ranked_by_plan[key] = [product["product_id"] for product in matches]
+        return self._ranked_by_plan[key]
+
+
+# instancia de uso
+subscription_catalog_service = SubscriptionCatalogService()
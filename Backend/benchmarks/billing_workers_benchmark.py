@@ -0,0 +1,173 @@
+# Autor: Lizbeth Barajas
+# Fecha: 25-11-25
+# Descripción: Benchmark del job de cobro de suscripciones con varios workers (procesos),
+#              como cuando cada réplica de la app corre su propio scheduler. Cada worker
+#              reclama bloques del ledger (SKIP LOCKED en PostgreSQL, UPDATE condicional en
+#              SQLite) y cobra contra el Stripe simulado de benchmarks.fake_providers con
+#              latencia fija. Reporta el throughput por número de workers y verifica que no
+#              haya cobros duplicados (un PaymentIntent y una orden por suscripción).
+#              Con SQLite las escrituras se serializan: el throughput escala mientras domina
+#              la latencia de Stripe; con PostgreSQL los workers reclaman bloques sin esperarse.
+#
+# Uso (desde Backend/):
+#   python -m benchmarks.billing_workers_benchmark --subscriptions 200 --workers 1 2 4 --latency 0.3
+#   DATABASE_URL=postgresql://... python -m benchmarks.billing_workers_benchmark
+
+import argparse
+import multiprocessing
+import os
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+STANDIN_HOST = "127.0.0.1"
+STANDIN_PORT = int(os.environ.get("FAKE_STRIPE_PORT", 12111))
+os.environ["STRIPE_API_BASE"] = f"http://{STANDIN_HOST}:{STANDIN_PORT}"
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite:///billing_workers_benchmark.db")
+
+from app.core.database import Base, SessionLocal, engine
+from app.api.v1.subscriptions.service import subscription_service
+from app.models.user import User
+from app.models.address import Address
+from app.models.fitness_profile import FitnessProfile
+from app.models.payment_method import PaymentMethod
+from app.models.product import Product
+from app.models.subscription import Subscription
+from app.models.order import Order
+from app.models.billing_run_item import BillingRunItem
+from app.models.enum import UserRole, AuthType, Gender, PaymentType, SubscriptionStatus, BillingItemStatus
+from benchmarks.fake_providers import FaultConfig, build_stripe_app, read_stats, serve_in_process
+
+
+def seed(total: int) -> None:
+    """
+    Base de datos vacía con `total` suscripciones vencidas hoy y los productos del plan.
+    """
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        for name in ("Plan Fuerza Proteína", "Plan Fuerza Creatina", "Plan Fuerza Glutamina"):
+            db.add(Product(
+                name=name, description="Producto de suscripción", brand="BeFit",
+                category="Suplementos", physical_activities=[], fitness_objectives=[],
+                nutritional_value="N/A", price=Decimal("200.00"), stock=total * 2, is_active=True
+            ))
+
+        for index in range(total):
+            user = User(
+                cognito_sub=f"billing-{index}", email=f"billing{index}@befit.test",
+                first_name="Billing", last_name=str(index), gender=Gender.FEMALE,
+                date_of_birth=date(1995, 1, 1), auth_type=AuthType.EMAIL,
+                role=UserRole.USER, account_status=True, stripe_customer_id=f"cus_{index}"
+            )
+            db.add(user)
+            db.flush()
+            profile = FitnessProfile(
+                user_id=user.user_id, test_date=date.today(),
+                attributes={"recommended_plan": "Plan Fuerza"}
+            )
+            payment_method = PaymentMethod(
+                user_id=user.user_id, payment_type=PaymentType.CREDIT_CARD,
+                provider_ref=f"pm_{index}", last_four="4242", expiration_date="12/30", is_default=True
+            )
+            db.add_all([profile, payment_method, Address(
+                user_id=user.user_id, address_name="Casa", address_line1="Calle 1",
+                country="México", state="Chihuahua", city="Ciudad Juárez", zip_code="32000",
+                recipient_name="Billing", phone_number="6560000000", is_default=True
+            )])
+            db.flush()
+            db.add(Subscription(
+                user_id=user.user_id, profile_id=profile.profile_id,
+                payment_method_id=payment_method.payment_id,
+                subscription_status=SubscriptionStatus.ACTIVE,
+                start_date=date.today() - timedelta(days=30),
+                next_delivery_date=date.today(), price=Decimal("499.00")
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_worker(worker_id: str, threads: int, chunk_size: int, results) -> None:
+    """
+    Un worker (proceso) del job, como el scheduler de una réplica.
+    """
+    db = SessionLocal()
+    try:
+        result = subscription_service.process_due_subscriptions(
+            db, workers=threads, chunk_size=chunk_size, rate_limit_per_second=0, worker_id=worker_id
+        )
+        results.put((worker_id, result))
+    finally:
+        db.close()
+
+
+def run(processes: int, threads: int, chunk_size: int) -> tuple:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [
+        context.Process(target=run_worker, args=(f"worker-{n}", threads, chunk_size, results))
+        for n in range(processes)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    outputs = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return outputs, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del cobro de suscripciones con varios workers")
+    parser.add_argument("--subscriptions", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Procesos a comparar")
+    parser.add_argument("--threads", type=int, default=2, help="Hilos de cobro por proceso")
+    parser.add_argument("--chunk-size", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3, help="Latencia simulada de Stripe (s)")
+    args = parser.parse_args()
+
+    standin = serve_in_process(
+        build_stripe_app, STANDIN_HOST, STANDIN_PORT,
+        faults=FaultConfig(latency_seconds=args.latency)
+    )
+    try:
+        for processes in args.workers:
+            seed(args.subscriptions)
+            read_stats(os.environ["STRIPE_API_BASE"], reset=True)
+
+            outputs, elapsed = run(processes, args.threads, args.chunk_size)
+
+            failed = [output for _, output in outputs if not output.get("success")]
+            assert not failed, f"Un worker falló: {failed[0].get('error')}"
+            charges = read_stats(os.environ["STRIPE_API_BASE"])["requests"].get("POST /v1/payment_intents", 0)
+            db = SessionLocal()
+            try:
+                orders = db.query(Order).count()
+                succeeded = db.query(BillingRunItem).filter(
+                    BillingRunItem.status == BillingItemStatus.SUCCEEDED
+                ).count()
+            finally:
+                db.close()
+            assert charges == orders == succeeded == args.subscriptions, (
+                f"Cobros duplicados o faltantes: {charges} PaymentIntents, {orders} órdenes, "
+                f"{succeeded} cobros exitosos para {args.subscriptions} suscripciones"
+            )
+
+            # Sin contar el arranque de los procesos (importar la app)
+            job_seconds = max(output["results"]["duration_seconds"] for _, output in outputs)
+            per_worker = ", ".join(
+                f"{worker_id}={output['results']['successful']}" for worker_id, output in sorted(outputs)
+            )
+            print(
+                f"{processes:>2} workers x {args.threads} hilos | {args.subscriptions} cobros en {job_seconds:6.2f}s "
+                f"({elapsed:6.2f}s con arranque) | {args.subscriptions / job_seconds:7.1f} cobros/s | {per_worker}"
+            )
+    finally:
+        standin.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# Autor: Lizbeth Barajas
+# Fecha: 25-11-25
+# Descripción: Benchmark de la emisión mensual de cupones para toda la base de lealtad.
+#              Compara la versión anterior (generate_monthly_coupons_for_user por usuario:
+#              un flush por cupón y un commit por usuario) contra LoyaltyService.issue_monthly_coupons
+#              (bloques de usuarios con INSERT ... RETURNING y códigos de la secuencia con llave).
+#              Reporta tiempo, usuarios y cupones por segundo, y verifica que cada usuario
+#              tenga los cupones de su tier y que no haya códigos repetidos (la versión
+#              anterior reintenta las colisiones de sus códigos de 6 caracteres y las cuenta).
+#
+# Uso (desde Backend/):
+#   python -m benchmarks.coupon_issuance_benchmark --users 100000 --chunk-size 1000
+#   python -m benchmarks.coupon_issuance_benchmark --users 1000000 --skip-legacy
+#   DATABASE_URL=postgresql://... python -m benchmarks.coupon_issuance_benchmark
+
+import argparse
+import os
+import random
+import string
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///coupon_issuance_benchmark.db")
+
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+
+from app.core.database import Base, SessionLocal, engine
+from app.api.v1.loyalty.service import loyalty_service
+from app.models.user import User
+from app.models.user_loyalty import UserLoyalty
+from app.models.loyalty_tier import LoyaltyTier
+from app.models.coupon import Coupon
+from app.models.user_coupon import UserCoupon
+from app.models.enum import UserRole, AuthType, Gender
+
+SEED_CHUNK = 20000
+# (nivel, puntos mínimos, cupones por mes, % de descuento)
+TIERS = ((1, 0, 1, 5), (2, 100, 3, 10), (3, 500, 5, 15))
+
+
+def seed(users: int) -> int:
+    """
+    Base de datos vacía con `users` cuentas de lealtad repartidas entre los tres tiers.
+    Regresa los cupones esperados.
+    """
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    today = date.today()
+
+    with engine.begin() as connection:
+        connection.execute(insert(LoyaltyTier), [
+            {"tier_id": level, "tier_level": level, "min_points_required": min_points, "points_multiplier": 1,
+             "free_shipping_threshold": 1000, "monthly_coupons_count": coupons, "coupon_discount_percentage": discount}
+            for level, min_points, coupons, discount in TIERS
+        ])
+
+    expected = 0
+    for chunk_start in range(1, users + 1, SEED_CHUNK):
+        ids = range(chunk_start, min(users, chunk_start + SEED_CHUNK - 1) + 1)
+        rows, loyalties = [], []
+        for user_id in ids:
+            level, min_points, coupons, _ = TIERS[user_id % 3]
+            expected += coupons
+            rows.append({
+                "user_id": user_id, "role": UserRole.USER, "email": f"coupons{user_id}@befit.test",
+                "auth_type": AuthType.EMAIL, "cognito_sub": f"coupons-{user_id}", "first_name": "Coupons",
+                "last_name": str(user_id), "gender": Gender.FEMALE, "date_of_birth": date(1995, 1, 1),
+                "account_status": True
+            })
+            loyalties.append({
+                "loyalty_id": user_id, "user_id": user_id, "tier_id": level, "total_points": min_points,
+                "tier_achieved_date": today, "last_points_update": today
+            })
+        with engine.begin() as connection:
+            connection.execute(insert(User), rows)
+            connection.execute(insert(UserLoyalty), loyalties)
+
+    return expected
+
+
+def legacy_issue_monthly_coupons(db) -> dict:
+    """
+    Versión anterior: generate_monthly_coupons_for_user para cada usuario, como referencia.
+    """
+    characters = string.ascii_uppercase + string.digits
+    today = date.today()
+    coupons_issued = 0
+    collisions = 0
+    user_ids = [user_id for user_id, in db.query(UserLoyalty.user_id).order_by(UserLoyalty.user_id)]
+    for user_id in user_ids:
+        user_loyalty = db.query(UserLoyalty).filter(UserLoyalty.user_id == user_id).first()
+        tier = user_loyalty.loyalty_tier
+        for _ in range(tier.monthly_coupons_count):
+            # La versión anterior abortaba con la primera colisión de códigos de 6 caracteres;
+            # aquí se reintenta en un savepoint para poder contarlas
+            while True:
+                coupon = Coupon(
+                    coupon_code="".join(random.choice(characters) for _ in range(6)),
+                    discount_value=Decimal(tier.coupon_discount_percentage),
+                    start_date=today, expiration_date=today + timedelta(days=30), is_active=True
+                )
+                try:
+                    with db.begin_nested():
+                        db.add(coupon)
+                        db.flush()
+                    break
+                except IntegrityError:
+                    collisions += 1
+            db.add(UserCoupon(user_id=user_id, coupon_id=coupon.coupon_id, used_date=None))
+            coupons_issued += 1
+        db.commit()
+    return {"success": True, "coupons_issued": coupons_issued, "collisions": collisions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la emisión mensual de cupones")
+    parser.add_argument("--users", type=int, default=100_000, help="Cuentas de lealtad")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Usuarios por bloque de la versión por bloques")
+    parser.add_argument("--skip-legacy", action="store_true", help="No correr la versión por usuario (lenta)")
+    args = parser.parse_args()
+
+    variants = ([] if args.skip_legacy else [("por usuario", legacy_issue_monthly_coupons)]) + [
+        ("por bloques", lambda db: loyalty_service.issue_monthly_coupons(db, chunk_size=args.chunk_size))
+    ]
+    for name, issue in variants:
+        expected = seed(args.users)
+        db = SessionLocal()
+        try:
+            started = time.perf_counter()
+            result = issue(db)
+            elapsed = time.perf_counter() - started
+            assert result["success"], result.get("error")
+
+            coupons, codes = db.query(func.count(Coupon.coupon_id), func.count(Coupon.coupon_code.distinct())).one()
+            assignments = db.query(func.count(UserCoupon.user_coupon_id)).scalar()
+        finally:
+            db.close()
+
+        assert result["coupons_issued"] == coupons == codes == assignments == expected, (
+            f"Cupones inconsistentes: {result['coupons_issued']} emitidos, {coupons} cupones, "
+            f"{codes} códigos distintos, {assignments} asignaciones, {expected} esperados"
+        )
+        print(
+            f"{name:<12} {args.users} usuarios | {coupons} cupones en {elapsed:7.2f}s | "
+            f"{args.users / elapsed:8.0f} usuarios/s | {coupons / elapsed:8.0f} cupones/s | "
+            f"{result.get('collisions', 0)} colisiones de código"
+        )
+
+
+if __name__ == "__main__":
+    main()
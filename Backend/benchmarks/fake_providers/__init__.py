@@ -0,0 +1,33 @@
+# Autor: Lizbeth Barajas
+# Fecha: 23-11-25
+# Descripción: Servidores locales que imitan a Stripe, PayPal y Cognito para pruebas de
+#              carga y de regresión sin llamadas reales. Para apuntar el backend a ellos:
+#
+#   python -m benchmarks.fake_providers --latency 0.1 --failure-rate 0.01
+#
+#   STRIPE_API_BASE=http://127.0.0.1:12111
+#   PAYPAL_API_BASE_URL=http://127.0.0.1:12112
+#   COGNITO_ENDPOINT_URL=http://127.0.0.1:12113
+
+from benchmarks.fake_providers.faults import (
+    FaultConfig,
+    free_port,
+    read_stats,
+    serve_in_process,
+    serve_in_thread
+)
+from benchmarks.fake_providers.stripe_server import build_stripe_app, sign_payload
+from benchmarks.fake_providers.paypal_server import build_paypal_app
+from benchmarks.fake_providers.cognito_server import build_cognito_app
+
+__all__ = [
+    "FaultConfig",
+    "free_port",
+    "read_stats",
+    "serve_in_process",
+    "serve_in_thread",
+    "build_stripe_app",
+    "sign_payload",
+    "build_paypal_app",
+    "build_cognito_app",
+]
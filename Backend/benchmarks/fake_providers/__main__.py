@@ -0,0 +1,82 @@
+# Autor: Lizbeth Barajas
+# Fecha: 23-11-25
+# Descripción: Levanta los tres servidores simulados (cada uno en su proceso) con la
+#              latencia y los fallos de la configuración FAKE_* o de los argumentos, e
+#              imprime las variables de entorno para apuntar el backend a ellos.
+#
+# Uso (desde Backend/):
+#   python -m benchmarks.fake_providers --latency 0.1 --jitter 0.05 --failure-rate 0.01 \
+#       --user cliente@befit.test:Password123!
+
+import argparse
+import time
+
+from app.config import settings
+from benchmarks.fake_providers import (
+    FaultConfig,
+    build_cognito_app,
+    build_paypal_app,
+    build_stripe_app,
+    serve_in_process
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidores simulados de Stripe, PayPal y Cognito")
+    parser.add_argument("--host", default=settings.FAKE_PROVIDERS_HOST)
+    parser.add_argument("--latency", type=float, default=settings.FAKE_PROVIDER_LATENCY_SECONDS)
+    parser.add_argument("--jitter", type=float, default=settings.FAKE_PROVIDER_JITTER_SECONDS)
+    parser.add_argument("--failure-rate", type=float, default=settings.FAKE_PROVIDER_FAILURE_RATE)
+    parser.add_argument("--failure-status", type=int, default=settings.FAKE_PROVIDER_FAILURE_STATUS)
+    parser.add_argument("--webhook-url", default=settings.FAKE_STRIPE_WEBHOOK_URL,
+                        help="Endpoint del backend para checkout.session.completed")
+    parser.add_argument("--user", action="append", default=[],
+                        help="Usuario confirmado de Cognito como email:contraseña (repetible)")
+    args = parser.parse_args()
+
+    faults = FaultConfig(
+        latency_seconds=args.latency,
+        jitter_seconds=args.jitter,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status
+    )
+    urls = {
+        "stripe": f"http://{args.host}:{settings.FAKE_STRIPE_PORT}",
+        "paypal": f"http://{args.host}:{settings.FAKE_PAYPAL_PORT}",
+        "cognito": f"http://{args.host}:{settings.FAKE_COGNITO_PORT}"
+    }
+
+    processes = [
+        serve_in_process(
+            build_stripe_app, args.host, settings.FAKE_STRIPE_PORT,
+            faults=faults, webhook_secret=settings.STRIPE_WEBHOOK_SECRET, webhook_url=args.webhook_url
+        ),
+        serve_in_process(build_paypal_app, args.host, settings.FAKE_PAYPAL_PORT, faults=faults),
+        serve_in_process(
+            build_cognito_app, args.host, settings.FAKE_COGNITO_PORT,
+            faults=faults,
+            public_url=urls["cognito"],
+            user_pool_id=settings.COGNITO_USER_POOL_ID,
+            client_id=settings.COGNITO_CLIENT_ID,
+            users=dict(user.split(":", 1) for user in args.user)
+        )
+    ]
+
+    print("Servidores simulados listos. Variables para el backend:")
+    print(f"  STRIPE_API_BASE={urls['stripe']}")
+    print(f"  PAYPAL_API_BASE_URL={urls['paypal']}")
+    print(f"  COGNITO_ENDPOINT_URL={urls['cognito']}")
+    print("Latencia/fallos en caliente: PUT <url>/_fake/faults | contadores: GET <url>/_fake/stats")
+
+    try:
+        while all(process.is_alive() for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# Autor: Lizbeth Barajas
+# Fecha: 23-11-25
+# Descripción: Servidor que imita el user pool de Cognito: el JWKS público
+#              (/{user_pool_id}/.well-known/jwks.json) y las operaciones del protocolo JSON de
+#              cognito-idp que usa CognitoService (InitiateAuth, SignUp, ConfirmSignUp,
+#              GetUser, GlobalSignOut). Los tokens son JWT RS256 firmados con una llave
+#              generada al iniciar, por lo que CognitoService.verify_token los valida igual
+#              que los reales al configurar COGNITO_ENDPOINT_URL.
+
+import time
+import uuid
+from typing import Dict, Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from jose import jwk, jwt
+
+from benchmarks.fake_providers.faults import FaultConfig, install_faults
+
+TARGET_PREFIX = "AWSCognitoIdentityProviderService."
+
+
+def _cognito_error(status_code: int, error_type: str = "InternalErrorException", message: str = "Error simulado") -> Dict:
+    return {"__type": error_type, "message": message}
+
+
+def _error_response(error_type: str, message: str) -> JSONResponse:
+    return JSONResponse(_cognito_error(400, error_type, message), status_code=400)
+
+
+def build_cognito_app(
+    faults: Optional[FaultConfig] = None,
+    public_url: str = "http://127.0.0.1:12113",
+    user_pool_id: str = "us-east-1_fake",
+    client_id: str = "fake-client-id",
+    users: Optional[Dict[str, str]] = None,
+    token_ttl_seconds: int = 3600
+) -> FastAPI:
+    """
+    Autor: Lizbeth Barajas
+
+    Descripción:
+        Construye el servidor simulado de Cognito.
+
+    Parámetros:
+        faults (FaultConfig): Latencia e inyección de fallos.
+        public_url (str): URL con la que el backend llega al servidor (COGNITO_ENDPOINT_URL);
+                          el issuer de los tokens es "{public_url}/{user_pool_id}".
+        user_pool_id (str): ID del user pool (COGNITO_USER_POOL_ID del backend).
+        client_id (str): App client (COGNITO_CLIENT_ID del backend); audiencia del id token.
+        users (Dict[str, str]): Usuarios confirmados iniciales (email -> contraseña).
+        token_ttl_seconds (int): Vigencia de los tokens emitidos.
+
+    Retorna:
+        FastAPI: Servidor simulado.
+    """
+    app = FastAPI(title="Cognito simulado")
+    install_faults(app, faults or FaultConfig(), lambda status_code: _cognito_error(status_code))
+
+    issuer = f"{public_url.rstrip('/')}/{user_pool_id}"
+    kid = uuid.uuid4().hex
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    public_jwk = jwk.construct(
+        private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+        ),
+        "RS256"
+    ).to_dict()
+    public_jwk.update(kid=kid, use="sig")
+
+    # email -> {"password", "sub", "attributes", "confirmed"}
+    accounts: Dict[str, Dict] = {}
+    # refresh token / access token -> email
+    refresh_tokens: Dict[str, str] = {}
+    access_tokens: Dict[str, str] = {}
+
+    def add_account(email: str, password: str, attributes: Dict, confirmed: bool) -> Dict:
+        accounts[email] = {
+            "password": password,
+            "sub": str(uuid.uuid4()),
+            "attributes": {"email": email, "custom:role": "user", **attributes},
+            "confirmed": confirmed
+        }
+        return accounts[email]
+
+    for email, password in (users or {}).items():
+        add_account(email, password, {}, confirmed=True)
+
+    def issue_tokens(email: str, include_refresh: bool) -> Dict:
+        account = accounts[email]
+        now = int(time.time())
+        common = {"sub": account["sub"], "iss": issuer, "iat": now, "auth_time": now, "exp": now + token_ttl_seconds}
+        id_token = jwt.encode(
+            {**common, **account["attributes"], "aud": client_id, "token_use": "id",
+             "cognito:username": account["sub"], "email_verified": True},
+            private_pem, algorithm="RS256", headers={"kid": kid}
+        )
+        access_token = jwt.encode(
+            {**common, "client_id": client_id, "token_use": "access",
+             "scope": "aws.cognito.signin.user.admin", "username": account["sub"]},
+            private_pem, algorithm="RS256", headers={"kid": kid}
+        )
+        access_tokens[access_token] = email
+
+        result = {
+            "AccessToken": access_token,
+            "IdToken": id_token,
+            "ExpiresIn": token_ttl_seconds,
+            "TokenType": "Bearer"
+        }
+        if include_refresh:
+            refresh_token = uuid.uuid4().hex
+            refresh_tokens[refresh_token] = email
+            result["RefreshToken"] = refresh_token
+        return {"AuthenticationResult": result, "ChallengeParameters": {}}
+
+    @app.get(f"/{user_pool_id}/.well-known/jwks.json")
+    async def jwks():
+        return {"keys": [public_jwk]}
+
+    @app.post("/")
+    async def cognito_api(request: Request):
+        target = request.headers.get("X-Amz-Target", "").removeprefix(TARGET_PREFIX)
+        body = await request.json()
+
+        if body.get("ClientId", client_id) != client_id:
+            return _error_response("ResourceNotFoundException", "User pool client does not exist.")
+
+        if target == "InitiateAuth":
+            parameters = body.get("AuthParameters", {})
+            if body.get("AuthFlow") == "REFRESH_TOKEN_AUTH":
+                email = refresh_tokens.get(parameters.get("REFRESH_TOKEN"))
+                if not email:
+                    return _error_response("NotAuthorizedException", "Invalid Refresh Token")
+                return issue_tokens(email, include_refresh=False)
+
+            account = accounts.get(parameters.get("USERNAME"))
+            if not account or account["password"] != parameters.get("PASSWORD"):
+                return _error_response("NotAuthorizedException", "Incorrect username or password.")
+            if not account["confirmed"]:
+                return _error_response("UserNotConfirmedException", "User is not confirmed.")
+            return issue_tokens(parameters["USERNAME"], include_refresh=True)
+
+        if target == "SignUp":
+            email = body["Username"]
+            if email in accounts:
+                return _error_response("UsernameExistsException", "An account with the given email already exists.")
+            attributes = {item["Name"]: item["Value"] for item in body.get("UserAttributes", [])}
+            account = add_account(email, body["Password"], attributes, confirmed=False)
+            return {"UserConfirmed": False, "UserSub": account["sub"]}
+
+        if target == "ConfirmSignUp":
+            account = accounts.get(body.get("Username"))
+            if not account:
+                return _error_response("UserNotFoundException", "Username/client id combination not found.")
+            # Cualquier código es válido
+            account["confirmed"] = True
+            return {}
+
+        if target in ("GetUser", "GlobalSignOut"):
+            email = access_tokens.get(body.get("AccessToken"))
+            if not email:
+                return _error_response("NotAuthorizedException", "Invalid Access Token")
+            if target == "GlobalSignOut":
+                for token in [token for token, owner in access_tokens.items() if owner == email]:
+                    del access_tokens[token]
+                return {}
+            account = accounts[email]
+            return {
+                "Username": account["sub"],
+                "UserAttributes": [
+                    {"Name": name, "Value": str(value)}
+                    for name, value in {"sub": account["sub"], **account["attributes"]}.items()
+                ]
+            }
+
+        return _error_response("InvalidParameterException", f"Operación no soportada: {target}")
+
+    return app
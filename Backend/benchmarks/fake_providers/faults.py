@@ -0,0 +1,171 @@
+# Autor: Lizbeth Barajas
+# Fecha: 23-11-25
+# Descripción: Piezas comunes de los servidores simulados: latencia e inyección de fallos
+#              configurables (también en caliente vía /_fake/faults), contadores de
+#              peticiones y conexiones (/_fake/stats) y utilidades para levantarlos en un
+#              hilo o en otro proceso.
+
+import asyncio
+import multiprocessing
+import random
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+
+# Cuerpo de error con el formato del proveedor a partir del código HTTP
+ErrorBody = Callable[[int], Dict]
+
+
+class FaultConfig(BaseModel):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Comportamiento simulado de un proveedor. Cada petición espera
+                 latency_seconds más un extra aleatorio de hasta jitter_seconds y, con
+                 probabilidad failure_rate, responde failure_status en lugar del resultado.
+    """
+    latency_seconds: float = Field(0.0, ge=0)
+    jitter_seconds: float = Field(0.0, ge=0)
+    failure_rate: float = Field(0.0, ge=0, le=1)
+    failure_status: int = Field(500, ge=400, le=599)
+
+
+def install_faults(app: FastAPI, faults: FaultConfig, error_body: ErrorBody) -> None:
+    """
+    Autor: Lizbeth Barajas
+
+    Descripción:
+        Agrega al servidor simulado la latencia/fallos de `faults` y las rutas de control
+        /_fake/faults (GET/PUT) y /_fake/stats (GET, con ?reset=true para reiniciar).
+
+    Parámetros:
+        app (FastAPI): Servidor simulado.
+        faults (FaultConfig): Configuración inicial (se modifica en caliente).
+        error_body (Callable): Cuerpo de error con el formato del proveedor.
+    """
+    stats = {"requests": {}, "failures": 0, "connections": set()}
+
+    @app.middleware("http")
+    async def simulate_provider(request: Request, call_next):
+        if request.url.path.startswith("/_fake"):
+            return await call_next(request)
+
+        route = f"{request.method} {request.url.path}"
+        stats["requests"][route] = stats["requests"].get(route, 0) + 1
+        if request.client:
+            stats["connections"].add((request.client.host, request.client.port))
+
+        delay = faults.latency_seconds + random.uniform(0, faults.jitter_seconds)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if faults.failure_rate and random.random() < faults.failure_rate:
+            stats["failures"] += 1
+            return JSONResponse(error_body(faults.failure_status), status_code=faults.failure_status)
+
+        return await call_next(request)
+
+    @app.get("/_fake/faults")
+    async def read_faults():
+        return faults
+
+    @app.put("/_fake/faults")
+    async def update_faults(new_faults: FaultConfig):
+        for field, value in new_faults.model_dump().items():
+            setattr(faults, field, value)
+        return faults
+
+    @app.get("/_fake/stats")
+    async def read_stats(reset: bool = False):
+        result = {
+            "requests": dict(stats["requests"]),
+            "failures": stats["failures"],
+            "connections": len(stats["connections"])
+        }
+        if reset:
+            stats.update(requests={}, failures=0, connections=set())
+        return result
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    """
+    Puerto TCP libre en el host (para pruebas que levantan servidores).
+    """
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app: FastAPI, host: str, port: int) -> uvicorn.Server:
+    """
+    Autor: Lizbeth Barajas
+
+    Descripción:
+        Levanta el servidor en un hilo del proceso actual y espera a que acepte
+        conexiones. Para detenerlo: server.should_exit = True.
+
+    Parámetros:
+        app (FastAPI): Servidor simulado.
+        host (str): Host donde escucha.
+        port (int): Puerto donde escucha.
+
+    Retorna:
+        uvicorn.Server: Servidor en ejecución.
+    """
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _run_app(factory: Callable[..., FastAPI], kwargs: Dict, host: str, port: int) -> None:
+    uvicorn.run(factory(**kwargs), host=host, port=port, log_level="warning")
+
+
+def serve_in_process(
+    factory: Callable[..., FastAPI],
+    host: str,
+    port: int,
+    **kwargs
+) -> multiprocessing.Process:
+    """
+    Autor: Lizbeth Barajas
+
+    Descripción:
+        Levanta el servidor en otro proceso (no compite por el GIL con el cliente que se
+        está midiendo) y espera a que responda. Para detenerlo: process.terminate().
+
+    Parámetros:
+        factory (Callable): Función que construye el servidor (ej. build_paypal_app).
+        host (str): Host donde escucha.
+        port (int): Puerto donde escucha.
+        **kwargs: Argumentos para factory.
+
+    Retorna:
+        multiprocessing.Process: Proceso del servidor.
+    """
+    process = multiprocessing.Process(target=_run_app, args=(factory, kwargs, host, port), daemon=True)
+    process.start()
+    while True:
+        try:
+            httpx.get(f"http://{host}:{port}/_fake/faults")
+            return process
+        except httpx.ConnectError:
+            if not process.is_alive():
+                raise RuntimeError(f"El servidor simulado en el puerto {port} no inició")
+            time.sleep(0.1)
+
+
+def read_stats(base_url: str, reset: bool = False) -> Optional[Dict]:
+    """
+    Contadores de un servidor simulado (peticiones por ruta, fallos inyectados y
+    conexiones TCP distintas).
+    """
+    return httpx.get(f"{base_url}/_fake/stats", params={"reset": reset}).json()
@@ -0,0 +1,117 @@
+# Autor: Gabriel Vilchis
+# Fecha: 23-11-25
+# Descripción: Servidor que imita los endpoints de PayPal que usa PayPalService: token
+#              OAuth2 (client_credentials), creación, consulta y captura de órdenes. Las
+#              órdenes se guardan en memoria y las peticiones sin un token emitido por
+#              este servidor (o vencido) responden 401.
+
+import time
+import uuid
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from benchmarks.fake_providers.faults import FaultConfig, install_faults
+
+
+def _paypal_error(status_code: int, name: str = "INTERNAL_SERVER_ERROR", message: str = "Error simulado") -> Dict:
+    return {"name": name, "message": message, "debug_id": uuid.uuid4().hex[:13]}
+
+
+def build_paypal_app(faults: Optional[FaultConfig] = None, token_ttl_seconds: int = 32400) -> FastAPI:
+    """
+    Autor: Gabriel Vilchis
+
+    Descripción:
+        Construye el servidor simulado de PayPal.
+
+    Parámetros:
+        faults (FaultConfig): Latencia e inyección de fallos.
+        token_ttl_seconds (int): Vigencia (expires_in) de los tokens emitidos.
+
+    Retorna:
+        FastAPI: Servidor simulado.
+    """
+    app = FastAPI(title="PayPal simulado")
+    install_faults(app, faults or FaultConfig(), lambda status_code: _paypal_error(status_code))
+    tokens: Dict[str, float] = {}
+    orders: Dict[str, Dict] = {}
+
+    def unauthorized(request: Request) -> Optional[JSONResponse]:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if tokens.get(token, 0) < time.monotonic():
+            return JSONResponse(
+                {"error": "invalid_token", "error_description": "Token signature verification failed"},
+                status_code=401
+            )
+        return None
+
+    @app.post("/v1/oauth2/token")
+    async def create_token(request: Request):
+        if not request.headers.get("Authorization", "").startswith("Basic "):
+            return JSONResponse(
+                {"error": "invalid_client", "error_description": "Client Authentication failed"},
+                status_code=401
+            )
+        token = f"A21AA{uuid.uuid4().hex}"
+        tokens[token] = time.monotonic() + token_ttl_seconds
+        return {
+            "scope": "https://uri.paypal.com/services/payments/payment",
+            "access_token": token,
+            "token_type": "Bearer",
+            "app_id": "APP-FAKE",
+            "expires_in": token_ttl_seconds
+        }
+
+    @app.post("/v2/checkout/orders", status_code=201)
+    async def create_order(request: Request):
+        error = unauthorized(request)
+        if error:
+            return error
+
+        body = await request.json()
+        order_id = uuid.uuid4().hex[:17].upper()
+        orders[order_id] = {
+            "id": order_id,
+            "status": "CREATED",
+            "intent": body.get("intent", "CAPTURE"),
+            "purchase_units": body.get("purchase_units", []),
+            "links": [
+                {"href": f"/v2/checkout/orders/{order_id}", "rel": "self", "method": "GET"},
+                {"href": f"https://www.sandbox.paypal.com/checkoutnow?token={order_id}", "rel": "approve", "method": "GET"},
+                {"href": f"/v2/checkout/orders/{order_id}/capture", "rel": "capture", "method": "POST"}
+            ]
+        }
+        return orders[order_id]
+
+    @app.get("/v2/checkout/orders/{order_id}")
+    async def retrieve_order(order_id: str, request: Request):
+        error = unauthorized(request)
+        if error:
+            return error
+        if order_id not in orders:
+            return JSONResponse(_paypal_error(404, "RESOURCE_NOT_FOUND", "The specified resource does not exist."), status_code=404)
+        return orders[order_id]
+
+    @app.post("/v2/checkout/orders/{order_id}/capture", status_code=201)
+    async def capture_order(order_id: str, request: Request):
+        error = unauthorized(request)
+        if error:
+            return error
+        order = orders.get(order_id)
+        if not order:
+            return JSONResponse(_paypal_error(404, "RESOURCE_NOT_FOUND", "The specified resource does not exist."), status_code=404)
+        if order["status"] == "COMPLETED":
+            return JSONResponse(_paypal_error(422, "UNPROCESSABLE_ENTITY", "ORDER_ALREADY_CAPTURED"), status_code=422)
+
+        order["status"] = "COMPLETED"
+        for unit in order["purchase_units"]:
+            unit["payments"] = {"captures": [{
+                "id": uuid.uuid4().hex[:17].upper(),
+                "status": "COMPLETED",
+                "amount": unit.get("amount")
+            }]}
+        return order
+
+    return app
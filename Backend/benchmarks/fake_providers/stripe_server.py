@@ -0,0 +1,330 @@
+# Autor: Lizbeth Barajas
+# Fecha: 23-11-25
+# Descripción: Servidor que imita los endpoints de la API de Stripe que usa StripeService:
+#              Customers, SetupIntents, PaymentMethods, PaymentIntents y Checkout Sessions.
+#              Guarda los objetos en memoria. /_fake/checkout/sessions/{id}/complete simula
+#              que el cliente pagó la sesión y envía el webhook checkout.session.completed
+#              firmado con el secreto de webhooks, igual que Stripe.
+
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from benchmarks.fake_providers.faults import FaultConfig, install_faults
+
+TEST_CARD = {
+    "brand": "visa",
+    "last4": "4242",
+    "exp_month": 12,
+    "exp_year": 2030,
+    "funding": "credit",
+    "country": "MX"
+}
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def _stripe_error(status_code: int, message: str = "Error simulado", code: Optional[str] = None) -> Dict:
+    error_type = "invalid_request_error" if status_code < 500 else "api_error"
+    return {"error": {"type": error_type, "code": code, "message": message}}
+
+
+def _not_found(object_id: str) -> JSONResponse:
+    return JSONResponse(
+        _stripe_error(404, f"No such object: '{object_id}'", "resource_missing"),
+        status_code=404
+    )
+
+
+def _nest(pairs: List) -> Dict:
+    """
+    Convierte los parámetros con corchetes del SDK (metadata[user_id]=1,
+    line_items[0][quantity]=1) en diccionarios y listas anidados.
+    """
+    result: Dict = {}
+    for key, value in pairs:
+        parts = key.replace("]", "").split("[")
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+
+    def to_lists(node):
+        if isinstance(node, dict):
+            if node and all(key.isdigit() for key in node):
+                return [to_lists(node[key]) for key in sorted(node, key=int)]
+            return {key: to_lists(value) for key, value in node.items()}
+        return node
+
+    return to_lists(result)
+
+
+async def _params(request: Request) -> Dict:
+    pairs = parse_qsl((await request.body()).decode(), keep_blank_values=True)
+    pairs += list(request.query_params.multi_items())
+    return _nest(pairs)
+
+
+def _list(url: str, data: List[Dict], limit: Optional[str]) -> Dict:
+    limit = int(limit or 10)
+    return {"object": "list", "url": url, "has_more": len(data) > limit, "data": data[:limit]}
+
+
+def sign_payload(payload: bytes, secret: str, timestamp: Optional[int] = None) -> str:
+    """
+    Autor: Lizbeth Barajas
+
+    Descripción:
+        Encabezado Stripe-Signature de un webhook: t=<timestamp>,v1=<HMAC-SHA256 de
+        "<timestamp>.<payload>" con el secreto>, el formato que valida
+        stripe.Webhook.construct_event.
+
+    Parámetros:
+        payload (bytes): Cuerpo del webhook.
+        secret (str): Secreto de webhooks (whsec_...).
+        timestamp (int): Momento de la firma; por defecto, ahora.
+
+    Retorna:
+        str: Valor del encabezado Stripe-Signature.
+    """
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def build_stripe_app(
+    faults: Optional[FaultConfig] = None,
+    webhook_secret: str = "whsec_fake",
+    webhook_url: Optional[str] = None
+) -> FastAPI:
+    """
+    Autor: Lizbeth Barajas
+
+    Descripción:
+        Construye el servidor simulado de Stripe.
+
+    Parámetros:
+        faults (FaultConfig): Latencia e inyección de fallos.
+        webhook_secret (str): Secreto con el que se firman los webhooks.
+        webhook_url (str): URL del backend a la que se envían los webhooks; sin ella
+                           solo se regresan en la respuesta de /complete.
+
+    Retorna:
+        FastAPI: Servidor simulado.
+    """
+    app = FastAPI(title="Stripe simulado")
+    install_faults(app, faults or FaultConfig(), lambda status_code: _stripe_error(status_code))
+    objects: Dict[str, Dict] = {}
+
+    def store(obj: Dict) -> Dict:
+        objects[obj["id"]] = obj
+        return obj
+
+    def new_payment_method(customer: Optional[str] = None) -> Dict:
+        return store({
+            "id": _new_id("pm"),
+            "object": "payment_method",
+            "type": "card",
+            "customer": customer,
+            "card": dict(TEST_CARD),
+            "created": int(time.time())
+        })
+
+    # ==================== CUSTOMERS ====================
+
+    @app.post("/v1/customers")
+    async def create_customer(request: Request):
+        params = await _params(request)
+        return store({
+            "id": _new_id("cus"),
+            "object": "customer",
+            "email": params.get("email"),
+            "name": params.get("name"),
+            "metadata": params.get("metadata", {}),
+            "created": int(time.time())
+        })
+
+    @app.get("/v1/customers")
+    async def list_customers(request: Request):
+        params = await _params(request)
+        customers = [
+            obj for obj in objects.values()
+            if obj["object"] == "customer"
+            and (not params.get("email") or obj["email"] == params["email"])
+        ]
+        return _list("/v1/customers", customers, params.get("limit"))
+
+    @app.get("/v1/customers/{customer_id}")
+    async def retrieve_customer(customer_id: str):
+        customer = objects.get(customer_id)
+        return customer if customer else _not_found(customer_id)
+
+    # ==================== SETUP INTENTS ====================
+
+    @app.post("/v1/setup_intents")
+    async def create_setup_intent(request: Request):
+        params = await _params(request)
+        setup_intent_id = _new_id("seti")
+        return store({
+            "id": setup_intent_id,
+            "object": "setup_intent",
+            "client_secret": f"{setup_intent_id}_secret_{uuid.uuid4().hex[:16]}",
+            "customer": params.get("customer"),
+            "status": "requires_payment_method",
+            "usage": params.get("usage", "off_session")
+        })
+
+    # ==================== PAYMENT METHODS ====================
+
+    @app.post("/v1/payment_methods")
+    async def create_payment_method(request: Request):
+        params = await _params(request)
+        return new_payment_method(params.get("customer"))
+
+    @app.get("/v1/payment_methods")
+    async def list_payment_methods(request: Request):
+        params = await _params(request)
+        payment_methods = [
+            obj for obj in objects.values()
+            if obj["object"] == "payment_method" and obj["customer"] == params.get("customer")
+        ]
+        return _list("/v1/payment_methods", payment_methods, params.get("limit"))
+
+    @app.get("/v1/payment_methods/{payment_method_id}")
+    async def retrieve_payment_method(payment_method_id: str):
+        payment_method = objects.get(payment_method_id)
+        return payment_method if payment_method else _not_found(payment_method_id)
+
+    @app.post("/v1/payment_methods/{payment_method_id}/attach")
+    async def attach_payment_method(payment_method_id: str, request: Request):
+        payment_method = objects.get(payment_method_id)
+        if not payment_method:
+            return _not_found(payment_method_id)
+        payment_method["customer"] = (await _params(request)).get("customer")
+        return payment_method
+
+    @app.post("/v1/payment_methods/{payment_method_id}/detach")
+    async def detach_payment_method(payment_method_id: str):
+        payment_method = objects.get(payment_method_id)
+        if not payment_method:
+            return _not_found(payment_method_id)
+        payment_method["customer"] = None
+        return payment_method
+
+    # ==================== PAYMENT INTENTS ====================
+
+    @app.post("/v1/payment_intents")
+    async def create_payment_intent(request: Request):
+        params = await _params(request)
+        confirmed = params.get("confirm") == "true"
+        return store({
+            "id": _new_id("pi"),
+            "object": "payment_intent",
+            "amount": int(params.get("amount", 0)),
+            "currency": params.get("currency", "mxn"),
+            "customer": params.get("customer"),
+            "payment_method": params.get("payment_method"),
+            "description": params.get("description"),
+            "metadata": params.get("metadata", {}),
+            "status": "succeeded" if confirmed else "requires_confirmation",
+            "created": int(time.time())
+        })
+
+    @app.get("/v1/payment_intents/{payment_intent_id}")
+    async def retrieve_payment_intent(payment_intent_id: str):
+        payment_intent = objects.get(payment_intent_id)
+        return payment_intent if payment_intent else _not_found(payment_intent_id)
+
+    # ==================== CHECKOUT SESSIONS ====================
+
+    @app.post("/v1/checkout/sessions")
+    async def create_checkout_session(request: Request):
+        params = await _params(request)
+        line_items = params.get("line_items", [])
+        amount_total = sum(
+            int(item.get("price_data", {}).get("unit_amount", 0)) * int(item.get("quantity", 1))
+            for item in line_items
+        )
+        session_id = _new_id("cs_test")
+        return store({
+            "id": session_id,
+            "object": "checkout.session",
+            "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+            "mode": params.get("mode", "payment"),
+            "amount_total": amount_total,
+            "currency": line_items[0].get("price_data", {}).get("currency", "mxn") if line_items else "mxn",
+            "customer": params.get("customer"),
+            "metadata": params.get("metadata", {}),
+            "payment_intent": None,
+            "payment_status": "unpaid",
+            "status": "open",
+            "success_url": params.get("success_url"),
+            "cancel_url": params.get("cancel_url"),
+            "created": int(time.time())
+        })
+
+    @app.get("/v1/checkout/sessions/{session_id}")
+    async def retrieve_checkout_session(session_id: str):
+        session = objects.get(session_id)
+        return session if session else _not_found(session_id)
+
+    @app.post("/_fake/checkout/sessions/{session_id}/complete")
+    async def complete_checkout_session(session_id: str):
+        """
+        Simula el pago de la sesión: crea el PaymentMethod y el PaymentIntent y envía el
+        webhook firmado (si hay webhook_url).
+        """
+        session = objects.get(session_id)
+        if not session:
+            return _not_found(session_id)
+
+        payment_method = new_payment_method(session["customer"])
+        payment_intent = store({
+            "id": _new_id("pi"),
+            "object": "payment_intent",
+            "amount": session["amount_total"],
+            "currency": session["currency"],
+            "customer": session["customer"],
+            "payment_method": payment_method["id"],
+            "metadata": session["metadata"],
+            "status": "succeeded",
+            "created": int(time.time())
+        })
+        session.update(payment_intent=payment_intent["id"], payment_status="paid", status="complete")
+
+        event = {
+            "id": _new_id("evt"),
+            "object": "event",
+            "type": "checkout.session.completed",
+            "created": int(time.time()),
+            "livemode": False,
+            "data": {"object": dict(session)}
+        }
+        payload = json.dumps(event).encode()
+        signature = sign_payload(payload, webhook_secret)
+
+        delivered_status = None
+        if webhook_url:
+            async with httpx.AsyncClient() as client:
+                response = await client.post(
+                    webhook_url,
+                    content=payload,
+                    headers={"Content-Type": "application/json", "Stripe-Signature": signature}
+                )
+            delivered_status = response.status_code
+
+        return {"event": event, "signature": signature, "delivered_status": delivered_status}
+
+    return app
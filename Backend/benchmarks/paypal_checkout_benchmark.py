@@ -0,0 +1,104 @@
+# Autor: Gabriel Vilchis
+# Fecha: 23-11-25
+# Descripción: Prueba de carga de PayPalService contra un servidor local que imita la API
+#              de PayPal (benchmarks.fake_providers) con latencia fija.
+#              Compara el cliente anterior (httpx.AsyncClient() sin configurar y un token
+#              nuevo por petición) contra el cliente compartido configurado en settings con
+#              el token en cache. Reporta throughput, latencias y conexiones TCP abiertas.
+#
+# Uso (desde Backend/):
+#   python -m benchmarks.paypal_checkout_benchmark --requests 500 --concurrency 50 --latency 0.3
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+STANDIN_HOST = "127.0.0.1"
+STANDIN_PORT = int(os.environ.get("FAKE_PAYPAL_PORT", 12112))
+STANDIN_URL = f"http://{STANDIN_HOST}:{STANDIN_PORT}"
+os.environ["PAYPAL_API_BASE_URL"] = STANDIN_URL
+
+import httpx
+
+from app.services.paypal_service import PayPalService
+from benchmarks.fake_providers import FaultConfig, build_paypal_app, read_stats, serve_in_process
+
+
+class LegacyPayPalService(PayPalService):
+    """
+    Comportamiento anterior: cliente sin configurar y un token nuevo en cada petición.
+    """
+
+    def build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient()
+
+    async def get_access_token(self):
+        return await self._request_token()
+
+
+async def run_checkouts(service: PayPalService, total: int, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                order = await service.create_order(510.0)
+                await service.capture_order(order["id"])
+            except httpx.HTTPError as e:
+                errors.append(e.__class__.__name__)
+                return
+            latencies.append(time.perf_counter() - started)
+
+    await service.start()
+    try:
+        await asyncio.gather(*(one() for _ in range(total)))
+    finally:
+        await service.close()
+    return latencies, errors
+
+
+def report(name: str, latencies: list, errors: list, elapsed: float) -> None:
+    stats = read_stats(STANDIN_URL, reset=True)
+    tokens = stats["requests"].get("POST /v1/oauth2/token", 0)
+    ordered = sorted(latencies)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(
+        f"{name:<7} {len(latencies):>5} checkouts en {elapsed:6.2f}s | "
+        f"{len(latencies) / elapsed:8.1f} checkouts/s | "
+        f"p50 {statistics.median(ordered) * 1000:7.1f} ms | p95 {p95 * 1000:7.1f} ms | "
+        f"tokens {tokens:>5} | conexiones {stats['connections']:>4} | errores {len(errors)}"
+    )
+
+
+CLIENTS = {"legacy": LegacyPayPalService, "shared": PayPalService}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del cliente de PayPal")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.3, help="Latencia simulada de PayPal (s)")
+    parser.add_argument("--clients", default="legacy,shared", help="Clientes a medir, separados por coma")
+    args = parser.parse_args()
+
+    standin = serve_in_process(
+        build_paypal_app, STANDIN_HOST, STANDIN_PORT,
+        faults=FaultConfig(latency_seconds=args.latency)
+    )
+    try:
+        for name in args.clients.split(","):
+            service = CLIENTS[name]()
+            started = time.perf_counter()
+            latencies, errors = asyncio.run(run_checkouts(service, args.requests, args.concurrency))
+            report(name, latencies, errors, time.perf_counter() - started)
+    finally:
+        standin.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# Autor: Lizbeth Barajas
+# Fecha: 25-11-25
+# Descripción: Benchmark de la expiración masiva de puntos (LoyaltyService.expire_all_points)
+#              con muchas cuentas de lealtad. Compara la versión anterior por ORM (carga todas
+#              las cuentas vencidas, un PointHistory por cuenta y una sola transacción) contra
+#              la versión por conjuntos (INSERT ... SELECT y UPDATE por rangos de IDs). Reporta
+#              tiempo, cuentas por segundo y memoria pico del proceso, y verifica que ambas
+#              dejen el mismo historial.
+#
+# Uso (desde Backend/):
+#   python -m benchmarks.points_expiry_benchmark --rows 1000000 --batch-size 5000
+#   python -m benchmarks.points_expiry_benchmark --rows 1000000 --skip-orm
+#   DATABASE_URL=postgresql://... python -m benchmarks.points_expiry_benchmark
+
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///points_expiry_benchmark.db")
+
+from sqlalchemy import func, insert
+
+from app.core.database import Base, SessionLocal, engine
+from app.api.v1.loyalty.service import loyalty_service
+from app.models.user import User
+from app.models.user_loyalty import UserLoyalty
+from app.models.loyalty_tier import LoyaltyTier
+from app.models.point_history import PointHistory
+from app.models.enum import UserRole, AuthType, Gender
+
+SEED_CHUNK = 20000
+
+
+def seed(rows: int, expired_ratio: float) -> int:
+    """
+    Base de datos vacía con `rows` cuentas de lealtad en el tier 2; la fracción
+    expired_ratio tiene los puntos vencidos (una de cada diez sin puntos).
+    Regresa cuántas cuentas vencidas tienen puntos.
+    """
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    today = date.today()
+    expired_every = max(1, round(1 / expired_ratio)) if expired_ratio else 0
+    expected = 0
+
+    with engine.begin() as connection:
+        connection.execute(insert(LoyaltyTier), [
+            {"tier_level": 1, "min_points_required": 0, "points_multiplier": 1, "free_shipping_threshold": 1000,
+             "monthly_coupons_count": 1, "coupon_discount_percentage": 5},
+            {"tier_level": 2, "min_points_required": 100, "points_multiplier": 1, "free_shipping_threshold": 800,
+             "monthly_coupons_count": 2, "coupon_discount_percentage": 10}
+        ])
+
+    for chunk_start in range(1, rows + 1, SEED_CHUNK):
+        ids = range(chunk_start, min(rows, chunk_start + SEED_CHUNK - 1) + 1)
+        users, loyalties = [], []
+        for user_id in ids:
+            users.append({
+                "user_id": user_id, "role": UserRole.USER, "email": f"points{user_id}@befit.test",
+                "auth_type": AuthType.EMAIL, "cognito_sub": f"points-{user_id}", "first_name": "Points",
+                "last_name": str(user_id), "gender": Gender.FEMALE, "date_of_birth": date(1995, 1, 1),
+                "account_status": True
+            })
+            expired = bool(expired_every) and user_id % expired_every == 0
+            points = 0 if user_id % 10 == 0 else 150
+            expected += 1 if expired and points else 0
+            loyalties.append({
+                "loyalty_id": user_id, "user_id": user_id, "tier_id": 2, "total_points": points,
+                "points_expiration_date": today - timedelta(days=1) if expired else today + timedelta(days=90),
+                "tier_achieved_date": today - timedelta(days=200), "last_points_update": today - timedelta(days=200)
+            })
+        with engine.begin() as connection:
+            connection.execute(insert(User), users)
+            connection.execute(insert(UserLoyalty), loyalties)
+
+    return expected
+
+
+def orm_expire_all_points(db) -> dict:
+    """
+    Versión anterior de expire_all_points, como referencia.
+    """
+    today = date.today()
+    expired_loyalties = db.query(UserLoyalty).filter(
+        UserLoyalty.points_expiration_date.isnot(None),
+        UserLoyalty.points_expiration_date <= today
+    ).all()
+    users_affected = 0
+    total_expired_points = 0
+    tier_1 = db.query(LoyaltyTier).order_by(LoyaltyTier.tier_level).first()
+    for user_loyalty in expired_loyalties:
+        if user_loyalty.total_points > 0:
+            db.add(PointHistory(
+                loyalty_id=user_loyalty.loyalty_id, order_id=None,
+                points_change=-user_loyalty.total_points, event_type="expired", event_date=today
+            ))
+            total_expired_points += user_loyalty.total_points
+            users_affected += 1
+        user_loyalty.total_points = 0
+        user_loyalty.last_points_update = today
+        user_loyalty.points_expiration_date = None
+        user_loyalty.tier_id = tier_1.tier_id
+        user_loyalty.tier_achieved_date = today
+    db.commit()
+    return {"success": True, "users_affected": users_affected, "total_expired_points": total_expired_points}
+
+
+def peak_memory_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_variant(name: str, args: argparse.Namespace, results) -> None:
+    """
+    Corre una versión en su propio proceso para que la memoria pico sea solo suya.
+    """
+    try:
+        results.put(_measure(name, args))
+    except BaseException as e:
+        results.put(("error", f"{name}: {e!r}"))
+        raise
+
+
+def _measure(name: str, args: argparse.Namespace) -> tuple:
+    started = time.perf_counter()
+    expected = seed(args.rows, args.expired_ratio)
+    seed_seconds = time.perf_counter() - started
+
+    expire = orm_expire_all_points if name == "orm" else (
+        lambda db: loyalty_service.expire_all_points(db, batch_size=args.batch_size)
+    )
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        result = expire(db)
+        elapsed = time.perf_counter() - started
+        assert result["success"], result.get("error")
+
+        history = db.query(func.count(PointHistory.point_history_id), func.sum(PointHistory.points_change)).one()
+        pending = db.query(func.count(UserLoyalty.loyalty_id)).filter(
+            UserLoyalty.points_expiration_date <= date.today()
+        ).scalar()
+    finally:
+        db.close()
+
+    assert result["users_affected"] == history[0] == expected and pending == 0, (
+        f"Historial inconsistente: {result['users_affected']} afectadas, {history[0]} registros, "
+        f"{expected} esperadas, {pending} cuentas vencidas sin procesar"
+    )
+    assert -history[1] == result["total_expired_points"]
+    return name, expected, seed_seconds, elapsed, result["users_affected"], peak_memory_mb()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la expiración masiva de puntos")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Cuentas de lealtad")
+    parser.add_argument("--expired-ratio", type=float, default=0.5, help="Fracción de cuentas vencidas")
+    parser.add_argument("--batch-size", type=int, default=5000, help="IDs por rango de la versión por conjuntos")
+    parser.add_argument("--skip-orm", action="store_true", help="No correr la versión por ORM (lenta con 1M)")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    for name in ([] if args.skip_orm else ["orm"]) + ["conjuntos"]:
+        results = context.Queue()
+        process = context.Process(target=run_variant, args=(name, args, results))
+        process.start()
+        outcome = results.get()
+        process.join()
+        if outcome[0] == "error":
+            raise SystemExit(f"La corrida falló: {outcome[1]}")
+        name, expected, seed_seconds, elapsed, affected, memory_mb = outcome
+        print(
+            f"{name:<10} {args.rows} cuentas ({expected} vencidas con puntos, semilla {seed_seconds:.1f}s) | "
+            f"{affected} expiradas en {elapsed:7.2f}s | {affected / elapsed:9.0f} cuentas/s | "
+            f"memoria pico {memory_mb:6.0f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Autor: Lizbeth Barajas
+# Fecha: 22-11-25
+# Descripción: Benchmark de creación de sesiones de Stripe Checkout desde un solo worker
+#              (un event loop). Compara la ruta síncrona del SDK llamada desde código async
+#              (bloquea el loop: las peticiones se atienden una a una) contra la ruta async
+#              de StripeService (cliente httpx con conexiones reutilizadas).
+#              Usa el Stripe simulado de benchmarks.fake_providers con latencia fija, por
+#              lo que no hace llamadas reales.
+#
+# Uso (desde Backend/):
+#   python -m benchmarks.stripe_checkout_benchmark --requests 200 --concurrency 50 --latency 0.1
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+STANDIN_HOST = "127.0.0.1"
+STANDIN_PORT = int(os.environ.get("FAKE_STRIPE_PORT", 12111))
+os.environ["STRIPE_API_BASE"] = f"http://{STANDIN_HOST}:{STANDIN_PORT}"
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_benchmark")
+
+from app.services.stripe_service import stripe_service
+from benchmarks.fake_providers import FaultConfig, build_stripe_app, serve_in_process
+
+
+def session_kwargs(index: int) -> dict:
+    return {
+        "amount": 51000,
+        "currency": "mxn",
+        "product_name": "Compra BeFit",
+        "success_url": "http://localhost:3000/order-success?session_id={CHECKOUT_SESSION_ID}",
+        "cancel_url": "http://localhost:3000/checkout",
+        "metadata": {"user_id": str(index)}
+    }
+
+
+async def run_sync_path(total: int, concurrency: int) -> list:
+    """
+    Llama a la versión síncrona desde corrutinas, como hacían las rutas de pago.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(index: int):
+        async with semaphore:
+            started = time.perf_counter()
+            result = stripe_service.create_checkout_session(**session_kwargs(index))
+            latencies.append(time.perf_counter() - started)
+            assert result, "La sesión no se creó"
+
+    await asyncio.gather(*(one(index) for index in range(total)))
+    return latencies
+
+
+async def run_async_path(total: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(index: int):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await stripe_service.create_checkout_session_async(**session_kwargs(index))
+            latencies.append(time.perf_counter() - started)
+            assert result, "La sesión no se creó"
+
+    await asyncio.gather(*(one(index) for index in range(total)))
+    await stripe_service.close()
+    return latencies
+
+
+def report(name: str, latencies: list, elapsed: float) -> None:
+    ordered = sorted(latencies)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(
+        f"{name:<6} {len(latencies):>5} sesiones en {elapsed:6.2f}s | "
+        f"{len(latencies) / elapsed:8.1f} sesiones/s | "
+        f"p50 {statistics.median(ordered) * 1000:7.1f} ms | p95 {p95 * 1000:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de checkout de Stripe por worker")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.1, help="Latencia simulada de Stripe (s)")
+    args = parser.parse_args()
+
+    standin = serve_in_process(
+        build_stripe_app, STANDIN_HOST, STANDIN_PORT,
+        faults=FaultConfig(latency_seconds=args.latency)
+    )
+    try:
+        for name, runner in (("sync", run_sync_path), ("async", run_async_path)):
+            started = time.perf_counter()
+            latencies = asyncio.run(runner(args.requests, args.concurrency))
+            report(name, latencies, time.perf_counter() - started)
+    finally:
+        standin.terminate()
+
+
+if __name__ == "__main__":
+    main()
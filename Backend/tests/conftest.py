@@ -6,7 +6,7 @@
 import pytest
 import os
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from datetime import date
@@ -20,7 +20,9 @@ from app.models.product import Product
 from app.models.product_image import ProductImage
 from app.models.shopping_cart import ShoppingCart
 from app.models.cart_item import CartItem
-from app.models.enum import UserRole, AuthType, Gender
+from app.models.address import Address
+from app.models.payment_method import PaymentMethod
+from app.models.enum import UserRole, AuthType, Gender, PaymentType
 from app.core.security import hash_password
 
 # Configurar variable de entorno para modo de prueba
@@ -256,6 +258,83 @@ def test_cart(db, test_user):
     return cart
 
 
+@pytest.fixture
+def test_address(db, test_user):
+    """
+    Autor: Luis Flores
+    Descripción: Fixture que crea una dirección de envío predeterminada para el usuario de prueba.
+    Parámetros:
+        db (Session): Sesión de base de datos.
+        test_user (User): Usuario de prueba.
+    Retorna:
+        Address: Dirección de prueba creada.
+    """
+    address = Address(
+        user_id=test_user.user_id,
+        address_name="Casa",
+        address_line1="Calle Ejemplo 1234",
+        country="México",
+        state="Chihuahua",
+        city="Ciudad Juárez",
+        zip_code="32000",
+        recipient_name="Test User",
+        phone_number="6561234567",
+        is_default=True
+    )
+    db.add(address)
+    db.commit()
+    db.refresh(address)
+    return address
+
+
+@pytest.fixture
+def test_payment_method(db, test_user):
+    """
+    Autor: Luis Flores
+    Descripción: Fixture que crea una tarjeta guardada para el usuario de prueba.
+    Parámetros:
+        db (Session): Sesión de base de datos.
+        test_user (User): Usuario de prueba.
+    Retorna:
+        PaymentMethod: Método de pago de prueba creado.
+    """
+    payment_method = PaymentMethod(
+        user_id=test_user.user_id,
+        payment_type=PaymentType.CREDIT_CARD,
+        provider_ref="pm_test_123",
+        last_four="4242",
+        expiration_date="12/30",
+        is_default=True
+    )
+    db.add(payment_method)
+    db.commit()
+    db.refresh(payment_method)
+    return payment_method
+
+
+@pytest.fixture
+def query_counter(db):
+    """
+    Autor: Luis Flores
+    Descripción: Fixture que cuenta las sentencias SQL ejecutadas contra la base de datos
+                 de prueba. Útil para verificar que un servicio no tenga consultas N+1.
+    Parámetros:
+        db (Session): Sesión de base de datos.
+    Retorna:
+        list: Lista con el SQL de cada sentencia ejecutada (se puede reiniciar con clear()).
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 @pytest.fixture
 def mock_cognito_token():
     """
@@ -6,12 +6,16 @@
 import pytest
 from sqlalchemy.orm import Session
 from decimal import Decimal  # <-- IMPORTADO
+from datetime import datetime, timedelta, UTC
 from app.api.v1.cart.service import CartService
 from app.api.v1.cart import schemas
 from app.models.shopping_cart import ShoppingCart
 from app.models.cart_item import CartItem
 from app.models.product import Product
 from app.models.user import User
+from app.models.order_item import OrderItem
+from app.api.v1.orders.service import order_service
+from app.services.cart_store import InMemoryCartStore, RedisCartStore
 
 
 # ==================== PRUEBAS UNITARIAS ====================
@@ -131,6 +135,124 @@ class TestCartServiceUnit:
         
         assert "stock insuficiente" in str(exc_info.value).lower()
     
+    def test_add_item_increment_exceeds_stock(self, db: Session, test_cart: ShoppingCart, test_product: Product):
+        """
+        Autor: Luis Flores
+        Descripción: Prueba unitaria que verifica que el incremento se rechace si la cantidad
+                     acumulada supera el stock, sin modificar la línea existente.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_product (Product): Producto de prueba (stock 50).
+        """
+        # Arrange
+        CartService.add_item_to_cart(
+            db, test_cart.user_id, schemas.CartItemAdd(product_id=test_product.product_id, quantity=30)
+        )
+        
+        # Act & Assert
+        with pytest.raises(Exception) as exc_info:
+            CartService.add_item_to_cart(
+                db, test_cart.user_id, schemas.CartItemAdd(product_id=test_product.product_id, quantity=30)
+            )
+        
+        assert "en carrito: 30" in str(exc_info.value).lower()
+        items = db.query(CartItem).filter(CartItem.cart_id == test_cart.cart_id).all()
+        assert len(items) == 1
+        assert items[0].quantity == 30
+    
+    def test_add_item_single_upsert(self, db: Session, test_cart: ShoppingCart, test_product: Product, query_counter):
+        """
+        Autor: Luis Flores
+        Descripción: Prueba unitaria que verifica que agregar e incrementar usen un solo
+                     INSERT ... ON CONFLICT y nunca dupliquen la línea del producto.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_product (Product): Producto de prueba.
+            query_counter (list): Sentencias SQL ejecutadas.
+        """
+        # Arrange
+        item_data = schemas.CartItemAdd(product_id=test_product.product_id, quantity=1)
+        user_id = test_cart.user_id
+        query_counter.clear()
+        
+        # Act
+        for _ in range(3):
+            CartService.add_item_to_cart(db, user_id, item_data)
+        
+        # Assert
+        upserts = [sql for sql in query_counter if "ON CONFLICT" in sql]
+        assert len(upserts) == 3
+        assert not any(sql.lstrip().upper().startswith("UPDATE") for sql in query_counter)
+        items = db.query(CartItem).filter(CartItem.cart_id == test_cart.cart_id).all()
+        assert len(items) == 1
+        assert items[0].quantity == 3
+    
+    def test_apply_cart_operations(self, db: Session, test_cart: ShoppingCart, test_product: Product):
+        """
+        Autor: Luis Flores
+        Descripción: Prueba unitaria que verifica que el lote fije cantidades de productos
+                     existentes y nuevos y quite productos en una sola transacción.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_product (Product): Producto de prueba.
+        """
+        # Arrange - carrito con test_product (2) y otro producto que se quitará
+        other = Product(
+            name="Creatina Test", description="Test", brand="Test", category="Test",
+            physical_activities=["test"], fitness_objectives=["test"], nutritional_value="Test",
+            price=Decimal('300.00'), stock=5, is_active=True
+        )
+        new = Product(
+            name="BCAA Test", description="Test", brand="Test", category="Test",
+            physical_activities=["test"], fitness_objectives=["test"], nutritional_value="Test",
+            price=Decimal('250.00'), stock=5, is_active=True
+        )
+        db.add_all([other, new])
+        db.commit()
+        for product_id in (test_product.product_id, other.product_id):
+            CartService.add_item_to_cart(db, test_cart.user_id, schemas.CartItemAdd(product_id=product_id, quantity=2))
+        
+        batch = schemas.CartBatchUpdate(operations=[
+            {"op": "set", "product_id": test_product.product_id, "quantity": 5},
+            {"op": "set", "product_id": new.product_id, "quantity": 3},
+            {"op": "remove", "product_id": other.product_id}
+        ])
+        
+        # Act
+        cart = CartService.apply_cart_operations(db, test_cart.user_id, batch)
+        
+        # Assert
+        quantities = {item.product_id: item.quantity for item in cart.cart_items}
+        assert quantities == {test_product.product_id: 5, new.product_id: 3}
+    
+    def test_apply_cart_operations_all_or_nothing(self, db: Session, test_cart: ShoppingCart, test_product: Product):
+        """
+        Autor: Luis Flores
+        Descripción: Prueba unitaria que verifica que si una operación no tiene stock
+                     suficiente no se aplique ninguna del lote.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_product (Product): Producto de prueba (stock 50).
+        """
+        # Arrange
+        CartService.add_item_to_cart(db, test_cart.user_id, schemas.CartItemAdd(product_id=test_product.product_id, quantity=2))
+        batch = schemas.CartBatchUpdate(operations=[
+            {"op": "remove", "product_id": test_product.product_id},
+            {"op": "set", "product_id": 999999, "quantity": 1}
+        ])
+        
+        # Act & Assert
+        with pytest.raises(Exception) as exc_info:
+            CartService.apply_cart_operations(db, test_cart.user_id, batch)
+        
+        assert "no encontrado" in str(exc_info.value).lower()
+        items = db.query(CartItem).filter(CartItem.cart_id == test_cart.cart_id).all()
+        assert [(item.product_id, item.quantity) for item in items] == [(test_product.product_id, 2)]
+    
     def test_update_cart_item(self, db: Session, test_cart: ShoppingCart, test_product: Product):
         """
         Autor: Luis Flores
@@ -292,6 +414,313 @@ class TestCartServiceUnit:
         assert len(validation["issues"]) > 0
         assert validation["issues"][0]["issue"] == "Stock insuficiente"
 
+    
+    def test_summary_and_validation_single_query(self, db: Session, test_cart: ShoppingCart, test_product: Product, query_counter):
+        """
+        Autor: Luis Flores
+        Descripción: Prueba unitaria que verifica que el resumen y la validación de stock
+                     usen una sola consulta cada uno y que la validación regrese solo las
+                     líneas con problemas.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_product (Product): Producto de prueba (precio 899.99, stock 50).
+            query_counter (list): Sentencias SQL ejecutadas.
+        """
+        # Arrange - una línea válida, una sin stock y una de producto inactivo
+        low_stock = Product(
+            name="Creatina Test", description="Test", brand="Test", category="Test",
+            physical_activities=["test"], fitness_objectives=["test"], nutritional_value="Test",
+            price=Decimal('100.00'), stock=10, is_active=True
+        )
+        inactive = Product(
+            name="BCAA Test", description="Test", brand="Test", category="Test",
+            physical_activities=["test"], fitness_objectives=["test"], nutritional_value="Test",
+            price=Decimal('50.00'), stock=10, is_active=True
+        )
+        db.add_all([low_stock, inactive])
+        db.commit()
+        for product_id, quantity in ((test_product.product_id, 2), (low_stock.product_id, 5), (inactive.product_id, 1)):
+            CartService.add_item_to_cart(db, test_cart.user_id, schemas.CartItemAdd(product_id=product_id, quantity=quantity))
+        low_stock.stock = 3
+        inactive.is_active = False
+        db.commit()
+        user_id = test_cart.user_id
+        low_stock_id = low_stock.product_id
+        inactive_id = inactive.product_id
+        query_counter.clear()
+        
+        # Act
+        summary = CartService.get_cart_summary(db, user_id)
+        validation = CartService.validate_cart_stock(db, user_id)
+        
+        # Assert
+        assert len(query_counter) == 2
+        assert summary == {"total_items": 8, "total_price": Decimal('2349.98')}
+        assert validation["valid"] is False
+        assert [(issue["product_id"], issue["issue"], issue["available"]) for issue in validation["issues"]] == [
+            (low_stock_id, "Stock insuficiente", 3),
+            (inactive_id, "Producto no disponible", 0)
+        ]
+    
+    def test_summary_and_validation_without_cart(self, db: Session, test_user: User):
+        """
+        Autor: Luis Flores
+        Descripción: Prueba unitaria que verifica el error 404 cuando el usuario no tiene carrito.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba sin carrito.
+        """
+        with pytest.raises(Exception) as summary_exc:
+            CartService.get_cart_summary(db, test_user.user_id)
+        with pytest.raises(Exception) as validation_exc:
+            CartService.validate_cart_stock(db, test_user.user_id)
+        
+        assert "carrito no encontrado" in str(summary_exc.value).lower()
+        assert "carrito no encontrado" in str(validation_exc.value).lower()
+    
+    def test_purge_abandoned_items(self, db: Session, test_cart: ShoppingCart, test_product: Product, test_admin: User):
+        """
+        Autor: Luis Flores
+        Descripción: Prueba unitaria que verifica que la limpieza elimina por lotes solo las
+                     líneas sin cambios en el periodo configurado.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_cart (ShoppingCart): Carrito de prueba (con una línea reciente).
+            test_product (Product): Producto de prueba.
+            test_admin (User): Usuario con un carrito abandonado.
+        """
+        old_date = datetime.now(UTC) - timedelta(days=120)
+        other = Product(
+            name="Creatina Test",
+            description="Producto adicional",
+            brand="Test Brand",
+            category="Creatinas",
+            physical_activities=["crossfit"],
+            fitness_objectives=["recovery"],
+            nutritional_value="5g por servida",
+            price=Decimal("10.00"),
+            stock=5,
+            is_active=True
+        )
+        abandoned_cart = ShoppingCart(user_id=test_admin.user_id)
+        db.add_all([other, abandoned_cart])
+        db.flush()
+        
+        for product_id in (test_product.product_id, other.product_id):
+            db.add(CartItem(
+                cart_id=abandoned_cart.cart_id,
+                product_id=product_id,
+                quantity=1,
+                added_at=old_date,
+                updated_at=old_date
+            ))
+        db.add(CartItem(cart_id=test_cart.cart_id, product_id=test_product.product_id, quantity=2))
+        db.commit()
+        
+        result = CartService.purge_abandoned_items(db, max_age_days=90, batch_size=1)
+        
+        assert result["deleted"] == 2
+        assert result["batches"] == 2
+        assert result["duration_seconds"] >= 0
+        remaining = db.query(CartItem).all()
+        assert [item.cart_id for item in remaining] == [test_cart.cart_id]
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cart_store(request, monkeypatch):
+    """
+    Autor: Luis Flores
+    Descripción: Fixture que activa el store de carritos (write-behind) en CartService,
+                 en memoria y sobre un servidor Redis simulado con fakeredis.
+    """
+    if request.param == "memory":
+        store = InMemoryCartStore()
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        store = RedisCartStore(fakeredis.FakeRedis(decode_responses=True))
+    
+    monkeypatch.setattr(CartService, "store", store)
+    return store
+
+
+def _db_quantities(db: Session, cart_id: int) -> dict:
+    """
+    Lee directamente de la BD las cantidades por producto del carrito.
+    """
+    db.expire_all()
+    return {
+        item.product_id: item.quantity
+        for item in db.query(CartItem).filter(CartItem.cart_id == cart_id).all()
+    }
+
+
+class TestCartStoreWriteBehind:
+    """
+    Autor: Luis Flores
+    Descripción: Pruebas del carrito con store: las cantidades se acumulan en el store y se
+                 persisten a cart_item por el job, al leer el carrito y al crear la orden.
+    """
+    
+    def test_increments_are_written_behind(self, db: Session, test_cart: ShoppingCart, test_product: Product, cart_store):
+        """
+        Autor: Luis Flores
+        Descripción: Verifica que una línea nueva se inserta de inmediato y que los
+                     incrementos solo llegan a la BD al ejecutar el flush.
+        """
+        user_id = test_cart.user_id
+        item_data = schemas.CartItemAdd(product_id=test_product.product_id, quantity=2)
+        
+        first = CartService.add_item_to_cart(db, user_id, item_data)
+        second = CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(
+            product_id=test_product.product_id, quantity=3
+        ))
+        
+        assert second.cart_item_id == first.cart_item_id
+        assert second.quantity == 5
+        assert _db_quantities(db, test_cart.cart_id) == {test_product.product_id: 2}
+        assert CartService.get_cart_summary(db, user_id)["total_items"] == 5
+        
+        stats = CartService.flush_pending_carts(db)
+        
+        assert stats == {"persisted": 1, "failed": 0}
+        assert _db_quantities(db, test_cart.cart_id) == {test_product.product_id: 5}
+    
+    def test_stock_check_rolls_back_increment(self, db: Session, test_cart: ShoppingCart, test_product: Product, cart_store):
+        """
+        Autor: Luis Flores
+        Descripción: Verifica que un incremento que excede el stock se revierte en el store.
+        """
+        from fastapi import HTTPException
+        
+        user_id = test_cart.user_id
+        CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(
+            product_id=test_product.product_id, quantity=40
+        ))
+        
+        with pytest.raises(HTTPException) as exc_info:
+            CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(
+                product_id=test_product.product_id, quantity=20
+            ))
+        
+        assert exc_info.value.status_code == 400
+        assert "en carrito: 40" in exc_info.value.detail
+        assert CartService.get_cart_summary(db, user_id)["total_items"] == 40
+    
+    def test_update_remove_and_get_cart_persist(self, db: Session, test_cart: ShoppingCart, test_product: Product, cart_store):
+        """
+        Autor: Luis Flores
+        Descripción: Verifica que update y remove se aplican en el store y que get_cart
+                     los persiste antes de leer.
+        """
+        user_id = test_cart.user_id
+        other = Product(
+            name="Otro producto",
+            description="Producto adicional",
+            brand="Test Brand",
+            category="Proteínas",
+            physical_activities=["crossfit"],
+            fitness_objectives=["recovery"],
+            nutritional_value="10g proteína por servida",
+            price=Decimal("10.00"),
+            stock=5,
+            is_active=True
+        )
+        db.add(other)
+        db.commit()
+        
+        item = CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(
+            product_id=test_product.product_id, quantity=1
+        ))
+        other_item = CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(
+            product_id=other.product_id, quantity=2
+        ))
+        
+        CartService.update_cart_item(db, user_id, item.cart_item_id, schemas.CartItemUpdate(quantity=4))
+        CartService.remove_item_from_cart(db, user_id, other_item.cart_item_id)
+        
+        validation = CartService.validate_cart_stock(db, user_id)
+        assert validation["valid"] is True
+        assert _db_quantities(db, test_cart.cart_id) == {
+            test_product.product_id: 1,
+            other.product_id: 2
+        }
+        
+        cart = CartService.get_cart(db, user_id)
+        
+        assert [(line.product_id, line.quantity) for line in cart.cart_items] == [(test_product.product_id, 4)]
+        assert cart_store.get(user_id)[1] == {test_product.product_id: (item.cart_item_id, 4)}
+    
+    def test_line_readded_during_flush_is_inserted_again(self, db: Session, test_cart: ShoppingCart, test_product: Product, cart_store, monkeypatch):
+        """
+        Autor: Luis Flores
+        Descripción: Verifica que una línea eliminada que se vuelve a agregar mientras el
+                     flush persiste su DELETE no se queda con el cart_item_id borrado: el
+                     store la deja sin id y el siguiente flush la inserta de nuevo.
+        """
+        user_id = test_cart.user_id
+        product_id = test_product.product_id
+        item = CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(product_id=product_id, quantity=2))
+        deleted_id = item.cart_item_id
+        CartService.remove_item_from_cart(db, user_id, deleted_id)
+        
+        write_store_cart = CartService._write_store_cart
+        
+        def write_then_readd(db, user_id):
+            written = write_store_cart(db, user_id)
+            monkeypatch.setattr(CartService, "_write_store_cart", staticmethod(write_store_cart))
+            # Otra petición vuelve a agregar el producto antes de que el DELETE haga commit
+            CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(product_id=product_id, quantity=1))
+            return written
+        
+        monkeypatch.setattr(CartService, "_write_store_cart", staticmethod(write_then_readd))
+        
+        CartService.persist_cart(db, user_id)
+        assert _db_quantities(db, test_cart.cart_id) == {}
+        assert cart_store.get(user_id)[1] == {product_id: (None, 1)}
+        
+        assert CartService.flush_pending_carts(db) == {"persisted": 1, "failed": 0}
+        assert _db_quantities(db, test_cart.cart_id) == {product_id: 1}
+        readded_id = cart_store.get(user_id)[1][product_id][0]
+        assert readded_id is not None
+        
+        again = CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(product_id=product_id, quantity=2))
+        CartService.flush_pending_carts(db)
+        assert (again.cart_item_id, again.quantity) == (readded_id, 3)
+        assert _db_quantities(db, test_cart.cart_id) == {product_id: 3}
+    
+    def test_order_uses_pending_quantities(self, db: Session, test_cart: ShoppingCart, test_product: Product, test_address, test_payment_method, cart_store):
+        """
+        Autor: Luis Flores
+        Descripción: Verifica que la orden se crea con las cantidades del store y que el
+                     carrito se descarta del store después.
+        """
+        user_id = test_cart.user_id
+        CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(
+            product_id=test_product.product_id, quantity=1
+        ))
+        CartService.add_item_to_cart(db, user_id, schemas.CartItemAdd(
+            product_id=test_product.product_id, quantity=2
+        ))
+        
+        result = order_service.create_order_from_cart(
+            db=db,
+            user_id=user_id,
+            address_id=test_address.address_id,
+            payment_id=test_payment_method.payment_id,
+            subtotal=Decimal("2699.97"),
+            shipping_cost=Decimal("0.00"),
+            discount_amount=Decimal("0.00"),
+            total_amount=Decimal("2699.97")
+        )
+        db.commit()
+        
+        assert result["success"] is True
+        order_item = db.query(OrderItem).filter(OrderItem.order_id == result["order"].order_id).one()
+        assert order_item.quantity == 3
+        assert cart_store.get(user_id) is None
+        assert CartService.get_cart_summary(db, user_id)["total_items"] == 0
+
 
 # ==================== PRUEBAS DE INTEGRACIÓN ====================
 
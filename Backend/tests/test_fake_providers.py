@@ -0,0 +1,106 @@
+# Autor: Lizbeth Barajas
+# Fecha: 23/11/2025
+# Descripción: Pruebas de los servidores simulados de proveedores (benchmarks.fake_providers):
+#             firma de webhooks de Stripe, inyección de fallos y la integración de
+#             CognitoService con el Cognito simulado vía COGNITO_ENDPOINT_URL.
+
+import json
+import stripe
+from fastapi.testclient import TestClient
+from app.config import settings
+from app.api.v1.auth.service import CognitoService
+from benchmarks.fake_providers import (
+    FaultConfig,
+    build_cognito_app,
+    build_stripe_app,
+    free_port,
+    serve_in_thread
+)
+
+
+class TestFakeProvidersUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas de los servidores simulados de Stripe y Cognito.
+    """
+
+    def test_stripe_checkout_completion_sends_signed_event(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que al completar una sesión simulada se genera el evento
+                     checkout.session.completed con una firma que valida el SDK de Stripe.
+        """
+        client = TestClient(build_stripe_app(webhook_secret="whsec_test"))
+
+        session = client.post("/v1/checkout/sessions", data={
+            "mode": "payment",
+            "line_items[0][price_data][currency]": "mxn",
+            "line_items[0][price_data][unit_amount]": "51000",
+            "line_items[0][quantity]": "2",
+            "metadata[user_id]": "7"
+        }).json()
+        assert session["amount_total"] == 102000
+        assert session["metadata"] == {"user_id": "7"}
+
+        result = client.post(f"/_fake/checkout/sessions/{session['id']}/complete").json()
+        event = stripe.Webhook.construct_event(
+            json.dumps(result["event"]), result["signature"], "whsec_test"
+        )
+
+        assert event["type"] == "checkout.session.completed"
+        payment_intent = client.get(f"/v1/payment_intents/{event['data']['object']['payment_intent']}").json()
+        assert payment_intent["status"] == "succeeded"
+        assert client.get(f"/v1/payment_methods/{payment_intent['payment_method']}").json()["card"]["last4"] == "4242"
+
+    def test_failure_injection(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que con failure_rate=1 todas las peticiones fallan con el
+                     estado configurado, que se puede cambiar en caliente y que se cuentan.
+        """
+        client = TestClient(build_stripe_app(FaultConfig(failure_rate=1, failure_status=503)))
+
+        failed = client.post("/v1/customers", data={"email": "cliente@befit.test"})
+        assert failed.status_code == 503
+        assert failed.json()["error"]["type"] == "api_error"
+
+        client.put("/_fake/faults", json={"failure_rate": 0})
+        assert client.post("/v1/customers", data={"email": "cliente@befit.test"}).status_code == 200
+
+        stats = client.get("/_fake/stats").json()
+        assert stats["requests"]["POST /v1/customers"] == 2
+        assert stats["failures"] == 1
+
+    def test_cognito_service_against_fake(self, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que con COGNITO_ENDPOINT_URL apuntando al Cognito simulado,
+                     CognitoService inicia sesión con boto3 y valida el id token con el JWKS.
+        Parámetros:
+            monkeypatch: Fixture de pytest para cambiar la configuración.
+        """
+        port = free_port()
+        endpoint_url = f"http://127.0.0.1:{port}"
+        server = serve_in_thread(build_cognito_app(
+            public_url=endpoint_url,
+            user_pool_id=settings.COGNITO_USER_POOL_ID,
+            client_id=settings.COGNITO_CLIENT_ID,
+            users={"cliente@befit.test": "Password123!"}
+        ), "127.0.0.1", port)
+
+        try:
+            monkeypatch.setattr(settings, "COGNITO_ENDPOINT_URL", endpoint_url)
+            monkeypatch.setattr(CognitoService, "_jwks_cache", None)
+            service = CognitoService()
+
+            assert service.sign_in("cliente@befit.test", "incorrecta") == {
+                "success": False, "error": "Credenciales inválidas"
+            }
+
+            tokens = service.sign_in("cliente@befit.test", "Password123!")
+            payload = service.verify_token(tokens["id_token"])
+
+            assert payload["email"] == "cliente@befit.test"
+            assert service.refresh_token(tokens["refresh_token"])["success"] is True
+        finally:
+            server.should_exit = True
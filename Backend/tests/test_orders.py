@@ -0,0 +1,376 @@
+# Autor: Lizbeth Barajas
+# Fecha: 20/11/2025
+# Descripción: Archivo de pruebas para el módulo de órdenes. Incluye pruebas unitarias
+#             del servicio de órdenes sobre la base de datos de prueba.
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from decimal import Decimal
+from datetime import datetime, timedelta, UTC
+from app.api.v1.orders.service import order_service
+from app.models.order import Order
+from app.models.order_item import OrderItem
+from app.models.product import Product
+from app.models.product_image import ProductImage
+from app.models.user import User
+from app.models.enum import OrderStatus
+
+
+def _create_products(db: Session, count: int) -> list:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Crea productos activos con una imagen principal cada uno.
+    Parámetros:
+        db (Session): Sesión de base de datos de prueba.
+        count (int): Número de productos a crear.
+    Retorna:
+        list: Productos creados.
+    """
+    products = []
+    for i in range(count):
+        product = Product(
+            name=f"Producto Orden {i+1}",
+            description="Test",
+            brand="Test",
+            category="Test",
+            physical_activities=["test"],
+            fitness_objectives=["test"],
+            nutritional_value="Test",
+            price=Decimal('100.00'),
+            stock=10,
+            is_active=True
+        )
+        db.add(product)
+        db.flush()
+        db.add(ProductImage(
+            product_id=product.product_id,
+            image_path=f"https://example.com/producto-{i+1}.jpg",
+            is_primary=True
+        ))
+        products.append(product)
+    db.commit()
+    return products
+
+
+def _create_order(
+    db: Session,
+    user: User,
+    address,
+    payment_method,
+    products: list,
+    order_date: datetime = None,
+    order_status: OrderStatus = OrderStatus.PAID
+) -> Order:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Crea una orden pagada con un item por cada producto recibido.
+    Parámetros:
+        db (Session): Sesión de base de datos de prueba.
+        user (User): Usuario dueño de la orden.
+        address (Address): Dirección de envío.
+        payment_method (PaymentMethod): Método de pago utilizado.
+        products (list): Productos que formarán los items de la orden.
+        order_date (datetime): Fecha de la orden (por defecto ahora).
+        order_status (OrderStatus): Estado de la orden.
+    Retorna:
+        Order: Orden creada.
+    """
+    subtotal = sum((p.price for p in products), Decimal('0.00'))
+    order = Order(
+        user_id=user.user_id,
+        address_id=address.address_id,
+        payment_id=payment_method.payment_id,
+        is_subscription=False,
+        order_date=order_date or datetime.now(UTC),
+        order_status=order_status,
+        subtotal=subtotal,
+        discount_amount=Decimal('0.00'),
+        shipping_cost=Decimal('150.00'),
+        total_amount=subtotal + Decimal('150.00'),
+        points_earned=0
+    )
+    db.add(order)
+    db.flush()
+    for product in products:
+        db.add(OrderItem(
+            order_id=order.order_id,
+            product_id=product.product_id,
+            quantity=1,
+            unit_price=product.price,
+            subtotal=product.price
+        ))
+    db.commit()
+    db.refresh(order)
+    return order
+
+
+# ==================== PRUEBAS UNITARIAS ====================
+
+class TestOrderServiceUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Clase que agrupa las pruebas unitarias del servicio de órdenes.
+    """
+
+    def test_get_order_by_id_details(self, db: Session, test_user: User, test_address, test_payment_method):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que el detalle de la orden incluya items, imagen principal y dirección.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+        """
+        # Arrange
+        products = _create_products(db, 2)
+        order = _create_order(db, test_user, test_address, test_payment_method, products)
+        cognito_sub = test_user.cognito_sub
+        zip_code = test_address.zip_code
+        db.expunge_all()
+
+        # Act
+        result = order_service.get_order_by_id(db, cognito_sub, order.order_id)
+
+        # Assert
+        assert result["success"] is True
+        detail = result["order"]
+        assert len(detail["items"]) == 2
+        assert detail["items"][0]["image_path"] == "https://example.com/producto-1.jpg"
+        assert detail["shipping_address"]["zip_code"] == zip_code
+        assert detail["coupon_code"] is None
+
+    @pytest.mark.parametrize("items_count", [1, 8])
+    def test_get_order_by_id_fixed_query_count(
+        self, db: Session, test_user: User, test_address, test_payment_method, query_counter, items_count
+    ):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que el detalle de la orden use el mismo número de consultas
+                     sin importar cuántos items tenga la orden (sin consultas N+1).
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+            query_counter (list): Sentencias SQL ejecutadas.
+            items_count (int): Número de items de la orden.
+        """
+        # Arrange
+        products = _create_products(db, items_count)
+        order = _create_order(db, test_user, test_address, test_payment_method, products)
+        cognito_sub = test_user.cognito_sub
+        db.expunge_all()
+        query_counter.clear()
+
+        # Act
+        result = order_service.get_order_by_id(db, cognito_sub, order.order_id)
+
+        # Assert - usuario, orden (+direccion y cupon), items (+producto) e imagenes
+        assert result["success"] is True
+        assert len(result["order"]["items"]) == items_count
+        assert len(query_counter) == 4
+
+    def test_get_order_by_id_other_user(self, db: Session, test_user: User, test_admin: User, test_address, test_payment_method):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que un usuario no pueda consultar órdenes de otro usuario.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario dueño de la orden.
+            test_admin (User): Otro usuario.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+        """
+        # Arrange
+        products = _create_products(db, 1)
+        order = _create_order(db, test_user, test_address, test_payment_method, products)
+
+        # Act
+        result = order_service.get_order_by_id(db, test_admin.cognito_sub, order.order_id)
+
+        # Assert
+        assert result["success"] is False
+        assert result["error"] == "Pedido no encontrado"
+
+    def test_get_user_orders_cursor_pagination(self, db: Session, test_user: User, test_address, test_payment_method):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que el listado pagine por cursor sin repetir ni omitir pedidos,
+                     incluyendo pedidos con la misma fecha.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+        """
+        # Arrange - 5 pedidos, dos de ellos con la misma fecha
+        products = _create_products(db, 1)
+        base_date = datetime(2025, 11, 1, 12, 0, 0)
+        dates = [base_date, base_date + timedelta(days=1), base_date + timedelta(days=1),
+                 base_date + timedelta(days=2), base_date + timedelta(days=3)]
+        created_ids = [
+            _create_order(db, test_user, test_address, test_payment_method, products, order_date=d).order_id
+            for d in dates
+        ]
+
+        # Act - recorrer todas las páginas de 2 en 2
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            result = order_service.get_user_orders(db, test_user.cognito_sub, limit=2, cursor=cursor)
+            assert result["success"] is True
+            seen.extend(order["order_id"] for order in result["orders"])
+            pages += 1
+            cursor = result["next_cursor"]
+            if cursor is None:
+                break
+
+        # Assert - más recientes primero, desempate por order_id descendente
+        assert pages == 3
+        assert seen == [created_ids[4], created_ids[3], created_ids[2], created_ids[1], created_ids[0]]
+        assert set(result["orders"][0].keys()) == {
+            "order_id", "is_subscription", "order_date", "order_status",
+            "tracking_number", "total_amount", "points_earned"
+        }
+
+    def test_get_user_orders_filters(self, db: Session, test_user: User, test_address, test_payment_method):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica los filtros por estado y rango de fechas del listado de pedidos.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+        """
+        # Arrange
+        products = _create_products(db, 1)
+        old = _create_order(db, test_user, test_address, test_payment_method, products,
+                            order_date=datetime(2025, 1, 10, 9, 0, 0))
+        shipped = _create_order(db, test_user, test_address, test_payment_method, products,
+                                order_date=datetime(2025, 6, 15, 23, 30, 0), order_status=OrderStatus.SHIPPED)
+        _create_order(db, test_user, test_address, test_payment_method, products,
+                      order_date=datetime(2025, 6, 20, 8, 0, 0))
+
+        # Act
+        by_status = order_service.get_user_orders(db, test_user.cognito_sub, order_status=OrderStatus.SHIPPED)
+        by_range = order_service.get_user_orders(
+            db, test_user.cognito_sub,
+            date_from=datetime(2025, 1, 1).date(),
+            date_to=datetime(2025, 6, 15).date()
+        )
+
+        # Assert
+        assert [o["order_id"] for o in by_status["orders"]] == [shipped.order_id]
+        assert [o["order_id"] for o in by_range["orders"]] == [shipped.order_id, old.order_id]
+
+    def test_get_user_orders_invalid_cursor(self, db: Session, test_user: User):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que un cursor mal formado regrese un error controlado.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+        """
+        result = order_service.get_user_orders(db, test_user.cognito_sub, cursor="no-es-un-cursor")
+
+        assert result["success"] is False
+        assert result["error"] == "Cursor inválido"
+
+    def test_bulk_update_order_status(self, db: Session, test_user: User, test_address, test_payment_method):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica la actualización masiva de estados: transiciones válidas por
+                     bloques, transiciones no permitidas, pedidos inexistentes y repetidos.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+        """
+        # Arrange
+        products = _create_products(db, 1)
+        paid = [_create_order(db, test_user, test_address, test_payment_method, products) for _ in range(3)]
+        shipped = _create_order(db, test_user, test_address, test_payment_method, products,
+                                order_status=OrderStatus.SHIPPED)
+        shipped.tracking_number = "TRK-ORIGINAL"
+        delivered = _create_order(db, test_user, test_address, test_payment_method, products,
+                                  order_status=OrderStatus.DELIVERED)
+        db.commit()
+
+        updates = [
+            {"order_id": paid[0].order_id, "new_status": OrderStatus.SHIPPED, "tracking_number": "TRK-1"},
+            {"order_id": paid[1].order_id, "new_status": OrderStatus.SHIPPED, "tracking_number": "TRK-2"},
+            {"order_id": paid[2].order_id, "new_status": OrderStatus.DELIVERED, "tracking_number": None},
+            {"order_id": shipped.order_id, "new_status": OrderStatus.DELIVERED, "tracking_number": None},
+            {"order_id": delivered.order_id, "new_status": OrderStatus.SHIPPED, "tracking_number": None},
+            {"order_id": 999999, "new_status": OrderStatus.SHIPPED, "tracking_number": None},
+            {"order_id": paid[0].order_id, "new_status": OrderStatus.DELIVERED, "tracking_number": None},
+        ]
+
+        # Act
+        result = order_service.bulk_update_order_status(db, updates, chunk_size=2)
+
+        # Assert
+        assert result["updated"] == 4
+        assert result["failed"] == 3
+        assert [r["success"] for r in result["results"]] == [True, True, True, True, False, False, False]
+        assert result["results"][4]["error"] == "Transición no permitida: delivered -> shipped"
+        assert result["results"][5]["error"] == "Pedido no encontrado"
+        assert result["results"][6]["error"] == "Pedido repetido en la solicitud"
+
+        db.expire_all()
+        assert db.get(Order, paid[0].order_id).order_status == OrderStatus.SHIPPED
+        assert db.get(Order, paid[0].order_id).tracking_number == "TRK-1"
+        assert db.get(Order, paid[2].order_id).order_status == OrderStatus.DELIVERED
+        assert db.get(Order, shipped.order_id).tracking_number == "TRK-ORIGINAL"
+        assert db.get(Order, delivered.order_id).order_status == OrderStatus.DELIVERED
+
+    def test_bulk_update_reports_concurrent_status_change(self, db: Session, test_user: User, test_address,
+                                                         test_payment_method, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Si otro proceso cambia el estado de un pedido entre la validación y el
+                     UPDATE, ese pedido no se sobrescribe y se reporta como fallido.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+            monkeypatch (MonkeyPatch): Intercepta el UPDATE del bloque.
+        """
+        # Arrange
+        products = _create_products(db, 1)
+        orders = [_create_order(db, test_user, test_address, test_payment_method, products) for _ in range(2)]
+        db.commit()
+        order_ids = [order.order_id for order in orders]
+
+        execute = db.execute
+
+        def cancel_before_update(statement, *args, **kwargs):
+            # Otro proceso cancela el segundo pedido justo antes del UPDATE en lote
+            if statement.is_dml and statement.table.name == "order":
+                execute(update(Order).where(Order.order_id == order_ids[1]).values(order_status=OrderStatus.CANCELLED))
+            return execute(statement, *args, **kwargs)
+
+        monkeypatch.setattr(db, "execute", cancel_before_update)
+
+        # Act
+        result = order_service.bulk_update_order_status(db, [
+            {"order_id": order_id, "new_status": OrderStatus.SHIPPED, "tracking_number": f"TRK-{order_id}"}
+            for order_id in order_ids
+        ])
+
+        # Assert
+        assert (result["updated"], result["failed"]) == (1, 1)
+        assert [r["success"] for r in result["results"]] == [True, False]
+        assert result["results"][1]["error"] == "El estado cambió concurrentemente"
+
+        monkeypatch.undo()
+        db.expire_all()
+        assert db.get(Order, order_ids[0]).order_status == OrderStatus.SHIPPED
+        assert db.get(Order, order_ids[1]).order_status == OrderStatus.CANCELLED
+        assert db.get(Order, order_ids[1]).tracking_number is None
@@ -0,0 +1,1180 @@
+# Autor: Lizbeth Barajas
+# Fecha: 20/11/2025
+# Descripción: Archivo de pruebas para el módulo de pagos. Incluye pruebas unitarias del
+#             servicio de idempotencia usado por los endpoints de checkout y pagos, del
+#             cálculo del resumen de checkout, del outbox de efectos posteriores al pago
+#             y de la ruta async de Stripe.
+
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from types import SimpleNamespace
+from decimal import Decimal
+from datetime import date, timedelta
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from app.services.idempotency_service import IdempotencyService
+from app.api.v1.payments.service import payment_process_service
+from app.api.v1.loyalty.service import loyalty_service
+from app.services.stripe_service import stripe_service
+from app.services.outbox_service import OutboxService, outbox_service
+from app.services.stripe_webhook_service import StripeWebhookService
+from app.services.stripe_mirror_service import stripe_mirror_service
+from app.api.v1.payment_method.service import payment_method_service
+from app.services.paypal_service import PayPalService
+from app.services.resilience import (
+    BulkheadFullError,
+    CircuitOpenError,
+    CircuitState,
+    DeadlineExceededError,
+    ResiliencePolicy,
+    deadline
+)
+from app.config import settings
+from app.models.idempotency_key import IdempotencyKey
+from app.models.enum import IdempotencyStatus, OutboxEventType, OutboxStatus, WebhookEventStatus
+from app.models.outbox_event import OutboxEvent
+from app.models.stripe_webhook_event import StripeWebhookEvent
+from app.models.stripe_customer import StripeCustomer
+from app.models.stripe_payment_method import StripePaymentMethod
+from app.models.order import Order
+from app.models.point_history import PointHistory
+from app.models.user import User
+from app.models.product import Product
+from app.models.cart_item import CartItem
+from app.models.coupon import Coupon
+from app.models.user_coupon import UserCoupon
+from app.models.loyalty_tier import LoyaltyTier
+from app.models.user_loyalty import UserLoyalty
+from tests.test_orders import _create_products, _create_order
+from tests.conftest import TestingSessionLocal
+
+
+def _prepare_checkout(db: Session, user: User, cart, items_count: int, free_shipping_threshold: str) -> str:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Crea el tier y la lealtad del usuario, llena el carrito con productos
+                 de $100 y asigna un cupón del 10% al usuario.
+    Parámetros:
+        db (Session): Sesión de base de datos de prueba.
+        user (User): Usuario de prueba.
+        cart (ShoppingCart): Carrito del usuario.
+        items_count (int): Número de productos distintos en el carrito.
+        free_shipping_threshold (str): Umbral de envío gratis del tier.
+    Retorna:
+        str: Código del cupón asignado.
+    """
+    tier = LoyaltyTier(
+        tier_level=2,
+        min_points_required=0,
+        points_multiplier=Decimal('1.00'),
+        free_shipping_threshold=Decimal(free_shipping_threshold),
+        monthly_coupons_count=1,
+        coupon_discount_percentage=10
+    )
+    db.add(tier)
+    db.flush()
+    db.add(UserLoyalty(
+        user_id=user.user_id,
+        tier_id=tier.tier_id,
+        total_points=0,
+        tier_achieved_date=date.today(),
+        last_points_update=date.today()
+    ))
+    for i in range(items_count):
+        product = Product(
+            name=f"Producto Checkout {i+1}",
+            description="Test",
+            brand="Test",
+            category="Test",
+            physical_activities=["test"],
+            fitness_objectives=["test"],
+            nutritional_value="Test",
+            price=Decimal('100.00'),
+            stock=10,
+            is_active=True
+        )
+        db.add(product)
+        db.flush()
+        db.add(CartItem(cart_id=cart.cart_id, product_id=product.product_id, quantity=2))
+    coupon = Coupon(
+        coupon_code="DESC10",
+        discount_value=Decimal('10.00'),
+        start_date=date.today() - timedelta(days=1),
+        expiration_date=date.today() + timedelta(days=30),
+        is_active=True
+    )
+    db.add(coupon)
+    db.flush()
+    db.add(UserCoupon(user_id=user.user_id, coupon_id=coupon.coupon_id))
+    db.commit()
+    # Cada prueba tiene su propia base: la tabla de tiers en memoria no debe venir de otra
+    loyalty_service._tier_cache = None
+    return coupon.coupon_code
+
+
+# ==================== PRUEBAS UNITARIAS ====================
+
+class TestIdempotencyServiceUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Clase que agrupa las pruebas unitarias del servicio de idempotencia.
+    """
+
+    @pytest.mark.parametrize("memory_cache", [True, False])
+    def test_retry_returns_stored_response(self, db: Session, test_user: User, memory_cache: bool):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que un reintento con la misma key regrese la respuesta guardada
+                     sin volver a ejecutar la operación, con y sin cache en memoria.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            memory_cache (bool): Si se usa el cache en memoria.
+        """
+        # Arrange
+        service = IdempotencyService(memory_cache=memory_cache)
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            return {"success": True, "order_id": len(calls)}
+
+        payload = {"address_id": 1, "payment_method_id": 2}
+
+        # Act
+        first = asyncio.run(service.execute(db, test_user.user_id, "stripe_checkout", "key-1", payload, handler))
+        second = asyncio.run(service.execute(db, test_user.user_id, "stripe_checkout", "key-1", payload, handler))
+
+        # Assert
+        assert len(calls) == 1
+        assert first == second == {"success": True, "order_id": 1}
+        record = db.query(IdempotencyKey).one()
+        assert record.status == IdempotencyStatus.COMPLETED
+
+    def test_concurrent_duplicates_wait_for_first(self, db: Session, test_user: User):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que duplicados concurrentes esperen a la primera ejecución
+                     en lugar de correr la operación en paralelo.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+        """
+        # Arrange
+        service = IdempotencyService()
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"success": True, "payment_intent_id": "pi_123"}
+
+        async def run_duplicates():
+            return await asyncio.gather(*[
+                service.execute(db, test_user.user_id, "paypal_capture", "key-2", {"id": 1}, handler)
+                for _ in range(5)
+            ])
+
+        # Act
+        results = asyncio.run(run_duplicates())
+
+        # Assert
+        assert len(calls) == 1
+        assert all(result == {"success": True, "payment_intent_id": "pi_123"} for result in results)
+        assert service._locks == {}
+
+    def test_key_reused_with_different_payload(self, db: Session, test_user: User):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que reutilizar la key con otro cuerpo regrese error 422.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+        """
+        # Arrange
+        service = IdempotencyService(memory_cache=False)
+
+        async def handler():
+            return {"success": True}
+
+        asyncio.run(service.execute(db, test_user.user_id, "stripe_checkout", "key-3", {"address_id": 1}, handler))
+
+        # Act & Assert
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(service.execute(db, test_user.user_id, "stripe_checkout", "key-3", {"address_id": 2}, handler))
+
+        assert exc_info.value.status_code == 422
+
+    def test_failed_execution_releases_key(self, db: Session, test_user: User):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que si la operación lanza una excepción la key se libere
+                     y un reintento vuelva a ejecutarla.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+        """
+        # Arrange
+        service = IdempotencyService()
+
+        async def failing_handler():
+            raise RuntimeError("timeout")
+
+        async def handler():
+            return {"success": True}
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(service.execute(db, test_user.user_id, "stripe_checkout", "key-4", {}, failing_handler))
+
+        # Act
+        result = asyncio.run(service.execute(db, test_user.user_id, "stripe_checkout", "key-4", {}, handler))
+
+        # Assert
+        assert result == {"success": True}
+        assert db.query(IdempotencyKey).count() == 1
+
+    def test_in_progress_key_from_other_worker(self, db: Session, test_user: User):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que si otro proceso tiene la key en proceso se regrese 409
+                     al agotar el tiempo de espera, sin ejecutar la operación.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+        """
+        # Arrange - Registro PROCESSING creado por "otro worker"
+        service = IdempotencyService(memory_cache=False, wait_timeout=0.1, poll_interval=0.02)
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            return {"success": True}
+
+        asyncio.run(service.execute(db, test_user.user_id, "stripe_checkout", "key-5", {}, handler))
+        db.query(IdempotencyKey).update({IdempotencyKey.status: IdempotencyStatus.PROCESSING})
+        db.commit()
+
+        # Act & Assert
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(service.execute(db, test_user.user_id, "stripe_checkout", "key-5", {}, handler))
+
+        assert exc_info.value.status_code == 409
+        assert len(calls) == 1
+
+
+class TestCheckoutSummaryUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Clase que agrupa las pruebas unitarias del resumen de checkout.
+    """
+
+    def test_summary_amounts(self, db: Session, test_user: User, test_cart, test_address):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica subtotal, envío gratis por tier, descuento del cupón y puntos.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_address (Address): Dirección de prueba.
+        """
+        # Arrange - 3 productos x 2 piezas x $100, envío gratis desde $500
+        coupon_code = _prepare_checkout(db, test_user, test_cart, 3, "500.00")
+
+        # Act
+        result = payment_process_service.calculate_checkout_summary(
+            db, test_user.user_id, test_address.address_id, coupon_code
+        )
+
+        # Assert
+        assert result["success"] is True
+        assert result["summary"] == {
+            "subtotal": 600.0,
+            "shipping_cost": 0.0,
+            "discount_amount": 60.0,
+            "total_amount": 540.0,
+            "items_count": 3,
+            "points_to_earn": 108
+        }
+        assert result["amounts"]["total_amount"] == Decimal('540.00')
+        assert result["coupon_id"] is not None
+
+    def test_summary_used_coupon(self, db: Session, test_user: User, test_cart, test_address):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que un cupón ya utilizado sea rechazado.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_address (Address): Dirección de prueba.
+        """
+        # Arrange
+        coupon_code = _prepare_checkout(db, test_user, test_cart, 1, "1000.00")
+        db.query(UserCoupon).update({UserCoupon.used_date: date.today()})
+        db.commit()
+
+        # Act
+        result = payment_process_service.calculate_checkout_summary(
+            db, test_user.user_id, test_address.address_id, coupon_code
+        )
+
+        # Assert
+        assert result["success"] is False
+        assert result["error"] == "Este cupón ya ha sido utilizado"
+
+    @pytest.mark.parametrize("items_count", [1, 8])
+    def test_summary_fixed_query_count(
+        self, db: Session, test_user: User, test_cart, test_address, query_counter, items_count
+    ):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que el resumen use el mismo número de consultas sin importar
+                     cuántos productos tenga el carrito, con la tabla de tiers en memoria.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_address (Address): Dirección de prueba.
+            query_counter (list): Sentencias SQL ejecutadas.
+            items_count (int): Número de productos en el carrito.
+        """
+        # Arrange - primera llamada carga la tabla de tiers
+        coupon_code = _prepare_checkout(db, test_user, test_cart, items_count, "500.00")
+        user_id = test_user.user_id
+        address_id = test_address.address_id
+        payment_process_service.calculate_checkout_summary(db, user_id, address_id, coupon_code)
+        query_counter.clear()
+
+        # Act
+        result = payment_process_service.calculate_checkout_summary(db, user_id, address_id, coupon_code)
+
+        # Assert - carrito+productos, dirección, lealtad y cupón
+        assert result["success"] is True
+        assert result["summary"]["items_count"] == items_count
+        assert len(query_counter) == 4
+
+    def test_stripe_session_charges_summary_total(
+        self, db: Session, test_user: User, test_cart, test_address, monkeypatch
+    ):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que la sesión de Stripe cobre el total exacto del resumen.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_address (Address): Dirección de prueba.
+            monkeypatch: Fixture de pytest para reemplazar la llamada a Stripe.
+        """
+        # Arrange
+        coupon_code = _prepare_checkout(db, test_user, test_cart, 2, "500.00")
+        stripe_calls = []
+
+        async def fake_create_checkout_session(**kwargs):
+            stripe_calls.append(kwargs)
+            return {"id": "cs_test_123", "url": "https://checkout.stripe.com/cs_test_123"}
+
+        monkeypatch.setattr(stripe_service, "create_checkout_session_async", fake_create_checkout_session)
+
+        # Act
+        result = asyncio.run(payment_process_service.create_stripe_checkout_session(
+            db=db,
+            cognito_sub=test_user.cognito_sub,
+            address_id=test_address.address_id,
+            coupon_code=coupon_code
+        ))
+
+        # Assert - 2 x 2 x $100 = 400, envío 150, descuento 40
+        assert result["success"] is True
+        assert result["total_amount"] == 510.0
+        assert stripe_calls[0]["amount"] == 51000
+
+
+class TestPaymentOutboxUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Clase que agrupa las pruebas del outbox de efectos posteriores al pago.
+    """
+
+    def _create_loyalty(self, db: Session, user: User) -> UserLoyalty:
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Crea los tiers 1 (desde 0 puntos) y 2 (desde 100 puntos) y la lealtad
+                     del usuario en tier 1.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            user (User): Usuario de prueba.
+        Retorna:
+            UserLoyalty: Registro de lealtad del usuario.
+        """
+        tiers = [
+            LoyaltyTier(tier_level=level, min_points_required=min_points, points_multiplier=Decimal('1.00'),
+                        free_shipping_threshold=Decimal('1000.00'), monthly_coupons_count=1,
+                        coupon_discount_percentage=10)
+            for level, min_points in ((1, 0), (2, 100))
+        ]
+        db.add_all(tiers)
+        db.flush()
+        loyalty = UserLoyalty(
+            user_id=user.user_id,
+            tier_id=tiers[0].tier_id,
+            total_points=0,
+            tier_achieved_date=date.today(),
+            last_points_update=date.today()
+        )
+        db.add(loyalty)
+        db.commit()
+        return loyalty
+
+    def test_worker_applies_points_and_tier_once(
+        self, db: Session, test_user: User, test_address, test_payment_method
+    ):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que el worker abone los puntos, suba de tier y marque el evento
+                     como procesado, y que una segunda ejecución no los vuelva a abonar.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+        """
+        # Arrange
+        loyalty = self._create_loyalty(db, test_user)
+        order = _create_order(db, test_user, test_address, test_payment_method, _create_products(db, 1))
+        outbox_service.enqueue(db, OutboxEventType.ORDER_PAID, order.order_id,
+                               {"user_id": test_user.user_id, "points": 120})
+        db.commit()
+
+        # Act
+        first = outbox_service.drain(db)
+        second = outbox_service.drain(db)
+
+        # Assert
+        assert first["processed"] == 1
+        assert second["claimed"] == 0
+        db.refresh(loyalty)
+        assert loyalty.total_points == 120
+        assert loyalty.loyalty_tier.tier_level == 2
+        assert db.query(PointHistory).filter(PointHistory.order_id == order.order_id).count() == 1
+        event = db.query(OutboxEvent).one()
+        assert event.status == OutboxStatus.PROCESSED
+        assert event.processed_at is not None
+
+    def test_failed_handler_rolls_back_event(
+        self, db: Session, test_user: User, test_address, test_payment_method
+    ):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que si un handler del evento falla no quede ningún efecto
+                     aplicado y el evento se reprograme con backoff.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+        """
+        # Arrange - el abono de puntos corre primero y la notificación falla después
+        loyalty = self._create_loyalty(db, test_user)
+        order = _create_order(db, test_user, test_address, test_payment_method, _create_products(db, 1))
+        service = OutboxService()
+
+        def failing_notification(db, event):
+            raise RuntimeError("Servicio de correo no disponible")
+
+        service.register_handler(OutboxEventType.ORDER_PAID, failing_notification)
+        service.enqueue(db, OutboxEventType.ORDER_PAID, order.order_id,
+                        {"user_id": test_user.user_id, "points": 50})
+        db.commit()
+
+        # Act
+        result = service.process_batch(db)
+
+        # Assert
+        assert result["retried"] == 1
+        db.refresh(loyalty)
+        assert loyalty.total_points == 0
+        assert db.query(PointHistory).count() == 0
+        event = db.query(OutboxEvent).one()
+        assert event.status == OutboxStatus.PENDING
+        assert event.attempts == 1
+        assert event.last_error == "Servicio de correo no disponible"
+        assert event.available_at > event.created_at
+
+    def test_saved_card_payment_only_commits_order(
+        self, db: Session, test_user: User, test_cart, test_address, test_payment_method, monkeypatch
+    ):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que el pago con tarjeta guardada cree la orden y el evento del
+                     outbox sin abonar puntos dentro de la petición.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+            monkeypatch: Fixture de pytest para reemplazar la llamada a Stripe.
+        """
+        # Arrange - 2 productos x 2 piezas x $100 + $150 de envío = $550
+        _prepare_checkout(db, test_user, test_cart, 2, "1000.00")
+        test_user.stripe_customer_id = "cus_test_123"
+        db.commit()
+        async def fake_create_payment_intent(**kwargs):
+            return {"success": True, "payment_intent_id": "pi_test_123"}
+
+        monkeypatch.setattr(
+            stripe_service,
+            "create_payment_intent_with_saved_card_async",
+            fake_create_payment_intent
+        )
+
+        # Act
+        result = asyncio.run(payment_process_service.create_stripe_checkout_session(
+            db=db,
+            cognito_sub=test_user.cognito_sub,
+            address_id=test_address.address_id,
+            payment_method_id=test_payment_method.payment_id
+        ))
+
+        # Assert
+        assert result["success"] is True
+        assert result["points_earned"] == 110
+        loyalty = db.query(UserLoyalty).filter(UserLoyalty.user_id == test_user.user_id).one()
+        assert loyalty.total_points == 0
+        event = db.query(OutboxEvent).one()
+        assert event.aggregate_id == result["order_id"]
+        assert event.payload == {"user_id": test_user.user_id, "points": 110}
+
+        outbox_service.drain(db)
+        db.refresh(loyalty)
+        assert loyalty.total_points == 110
+        assert db.get(Order, result["order_id"]).points_earned == 110
+
+
+class TestStripeAsyncUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas de la ruta async de StripeService (sin llamadas reales a Stripe).
+    """
+
+    @staticmethod
+    def _fake_client(latency: float):
+        async def create_async(params):
+            await asyncio.sleep(latency)
+            return SimpleNamespace(id="cs_test_async", url="https://checkout.stripe.com/cs_test_async")
+
+        return SimpleNamespace(v1=SimpleNamespace(checkout=SimpleNamespace(
+            sessions=SimpleNamespace(create_async=create_async)
+        )))
+
+    def test_checkout_sessions_do_not_block_loop(self, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que varias sesiones concurrentes se crean en paralelo en el
+                     mismo event loop.
+        Parámetros:
+            monkeypatch: Fixture de pytest para reemplazar el cliente de Stripe.
+        """
+        monkeypatch.setattr(stripe_service, "_get_async_client", lambda: self._fake_client(0.2))
+
+        async def create_many():
+            started = asyncio.get_running_loop().time()
+            results = await asyncio.gather(*(
+                stripe_service.create_checkout_session_async(
+                    amount=1000, currency="mxn", product_name="Compra BeFit",
+                    success_url="http://localhost/ok", cancel_url="http://localhost/cancel"
+                )
+                for _ in range(10)
+            ))
+            return results, asyncio.get_running_loop().time() - started
+
+        results, elapsed = asyncio.run(create_many())
+
+        assert all(result["id"] == "cs_test_async" for result in results)
+        assert elapsed < 1.0
+
+    def test_checkout_session_timeout(self, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que una llamada que excede su límite de tiempo regresa None
+                     igual que un error de Stripe.
+        Parámetros:
+            monkeypatch: Fixture de pytest para reemplazar el cliente de Stripe.
+        """
+        monkeypatch.setattr(stripe_service, "_get_async_client", lambda: self._fake_client(5))
+
+        result = asyncio.run(stripe_service.create_checkout_session_async(
+            amount=1000, currency="mxn", product_name="Compra BeFit",
+            success_url="http://localhost/ok", cancel_url="http://localhost/cancel",
+            timeout=0.05
+        ))
+
+        assert result is None
+
+    def test_saved_card_timeout_reconciles_with_same_key(self, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Si el cobro con tarjeta guardada vence el tiempo de la petición, se
+                     concilia repitiéndolo con la misma llave de Stripe (que regresa el
+                     Payment Intent original) en lugar de reportarlo como fallido.
+        Parámetros:
+            monkeypatch: Fixture de pytest para reemplazar el cliente de Stripe.
+        """
+        sent_keys = []
+
+        async def create_async(params, options=None):
+            sent_keys.append((options or {}).get("idempotency_key"))
+            if len(sent_keys) == 1:
+                # El primer intento se confirma en Stripe, pero la respuesta llega tarde
+                await asyncio.sleep(5)
+            return SimpleNamespace(id="pi_reconciled", status="succeeded", client_secret=None)
+
+        client = SimpleNamespace(v1=SimpleNamespace(payment_intents=SimpleNamespace(create_async=create_async)))
+        monkeypatch.setattr(stripe_service, "_get_async_client", lambda: client)
+
+        async def charge():
+            with deadline(0.05):
+                return await stripe_service.create_payment_intent_with_saved_card_async(
+                    amount=55000, currency="mxn", customer_id="cus_test", payment_method_id="pm_test",
+                    idempotency_key="checkout-key-1"
+                )
+
+        result = asyncio.run(charge())
+
+        assert result == {"success": True, "payment_intent_id": "pi_reconciled", "status": "succeeded"}
+        assert len(sent_keys) == 2 and set(sent_keys) == {"checkout-key-1"}
+
+    def test_unconfirmed_charge_is_not_stored_or_failed(self, db: Session, test_user: User, test_cart,
+                                                       test_address, test_payment_method, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Si el cobro no se pudo confirmar, el checkout no lo reporta como fallido
+                     ni guarda la respuesta de la Idempotency-Key, y el reintento del cliente
+                     usa la misma llave de Stripe y crea la orden.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_cart (ShoppingCart): Carrito de prueba.
+            test_address (Address): Dirección de prueba.
+            test_payment_method (PaymentMethod): Método de pago de prueba.
+            monkeypatch: Fixture de pytest para reemplazar la llamada a Stripe.
+        """
+        _prepare_checkout(db, test_user, test_cart, 1, "1000.00")
+        test_user.stripe_customer_id = "cus_test_123"
+        db.commit()
+        user_id, cognito_sub = test_user.user_id, test_user.cognito_sub
+        address_id, payment_id = test_address.address_id, test_payment_method.payment_id
+        sent_keys = []
+
+        async def fake_create_payment_intent(**kwargs):
+            sent_keys.append(kwargs["idempotency_key"])
+            if len(sent_keys) == 1:
+                return {"success": False, "error": "Stripe timeout", "outcome_unknown": True}
+            return {"success": True, "payment_intent_id": "pi_test_123"}
+
+        monkeypatch.setattr(stripe_service, "create_payment_intent_with_saved_card_async", fake_create_payment_intent)
+        service = IdempotencyService(memory_cache=False)
+
+        def checkout():
+            return asyncio.run(service.execute(
+                db=db, user_id=user_id, endpoint="stripe_checkout", key="client-key-1",
+                payload={"address_id": address_id, "payment_method_id": payment_id},
+                handler=lambda: payment_process_service.create_stripe_checkout_session(
+                    db=db, cognito_sub=cognito_sub, address_id=address_id,
+                    payment_method_id=payment_id, idempotency_key="client-key-1"
+                )
+            ))
+
+        first = checkout()
+        assert first["success"] is False and first["outcome_unknown"] is True
+        assert db.query(Order).count() == 0
+        assert db.query(IdempotencyKey).count() == 0
+
+        second = checkout()
+        assert second["success"] is True
+        assert db.query(Order).count() == 1
+        assert sent_keys[0] == sent_keys[1] and sent_keys[0].startswith("checkout-")
+
+
+class TestStripeWebhookQueueUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas de la ingesta de webhooks de Stripe y del worker que los procesa.
+    """
+
+    @staticmethod
+    def _payload(event_id: str, customer: str, created: int, event_type: str = "test.event") -> bytes:
+        return json.dumps({
+            "id": event_id,
+            "type": event_type,
+            "created": created,
+            "data": {"object": {"id": f"obj_{event_id}", "customer": customer}}
+        }).encode()
+
+    def test_duplicate_delivery_is_ignored(self, db: Session):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que una re-entrega del mismo event.id no crea otro registro.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+        """
+        service = StripeWebhookService()
+        payload = self._payload("evt_dup", "cus_1", 1700000000)
+
+        assert service.ingest(db, payload) is True
+        assert service.ingest(db, payload) is False
+        assert db.query(StripeWebhookEvent).filter_by(event_id="evt_dup").count() == 1
+
+    def test_events_processed_in_order_per_customer(self, db: Session):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que si el primer evento de un cliente falla, sus eventos
+                     posteriores esperan al reintento, mientras que los de otro cliente
+                     se procesan; al vencer el backoff se procesan en orden.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+        """
+        service = StripeWebhookService()
+        handled = []
+        failures = {"evt_a1": 1}
+
+        async def handler(handler_db: Session, event: dict) -> None:
+            if failures.get(event["id"], 0) > 0:
+                failures[event["id"]] -= 1
+                raise RuntimeError("fallo temporal")
+            handled.append(event["id"])
+
+        service.register_handler("test.event", handler)
+        service.ingest(db, self._payload("evt_a1", "cus_a", 1700000000))
+        service.ingest(db, self._payload("evt_a2", "cus_a", 1700000001))
+        service.ingest(db, self._payload("evt_b1", "cus_b", 1700000000))
+
+        first_run = asyncio.run(service.drain_async(TestingSessionLocal, workers=2))
+
+        assert handled == ["evt_b1"]
+        assert first_run["retried"] == 1
+        assert first_run["processed"] == 1
+
+        failed_event = db.query(StripeWebhookEvent).filter_by(event_id="evt_a1").one()
+        db.refresh(failed_event)
+        assert failed_event.status == WebhookEventStatus.PENDING
+        assert failed_event.attempts == 1
+
+        # Vence el backoff del evento fallido
+        failed_event.available_at = failed_event.received_at
+        db.commit()
+
+        second_run = asyncio.run(service.drain_async(TestingSessionLocal, workers=2))
+
+        assert handled == ["evt_b1", "evt_a1", "evt_a2"]
+        assert second_run["processed"] == 2
+        assert service.get_metrics(db)["counts"]["processed"] == 3
+
+
+
+class TestStripeMirrorUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas de la copia local de customers y métodos de pago de Stripe.
+    """
+
+    @staticmethod
+    def _event(event_id: str, event_type: str, created: int, data_object: dict) -> bytes:
+        return json.dumps({
+            "id": event_id,
+            "type": event_type,
+            "created": created,
+            "data": {"object": data_object}
+        }).encode()
+
+    @staticmethod
+    def _card(payment_method_id: str, customer, last4: str) -> dict:
+        return {
+            "id": payment_method_id,
+            "object": "payment_method",
+            "type": "card",
+            "customer": customer,
+            "card": {"brand": "visa", "last4": last4, "exp_month": 4, "exp_year": 2031, "funding": "debit"}
+        }
+
+    def test_webhooks_keep_payment_methods_in_sync(self, db: Session, test_user: User, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que los eventos payment_method.* actualizan la copia local, que
+                     un evento atrasado no pisa uno más nuevo y que guardar la tarjeta tras el
+                     setup intent no llama a Stripe si ya está en la copia.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            monkeypatch: Fixture de pytest para reemplazar la llamada a Stripe.
+        """
+        service = StripeWebhookService()
+        service.ingest(db, self._event("evt_pm2", "payment_method.updated", 1700000100, self._card("pm_1", "cus_1", "9999")))
+        service.ingest(db, self._event("evt_pm1", "payment_method.attached", 1700000000, self._card("pm_1", "cus_1", "4242")))
+        asyncio.run(service.drain_async(TestingSessionLocal))
+
+        mirrored = db.get(StripePaymentMethod, "pm_1")
+        db.refresh(mirrored)
+        assert (mirrored.customer_id, mirrored.last4) == ("cus_1", "9999")
+
+        def unexpected_call(payment_method_id):
+            raise AssertionError("No debe llamar a Stripe")
+
+        monkeypatch.setattr(stripe_service, "get_payment_method", unexpected_call)
+        test_user.stripe_customer_id = "cus_1"
+        db.commit()
+
+        # Mismo formato que la respuesta de Stripe, incluido el customer dueño de la tarjeta
+        local = stripe_mirror_service.get_payment_method(db, "pm_1")["payment_method"]
+        assert (local["customer"], local["card"]["last4"]) == ("cus_1", "9999")
+
+        result = payment_method_service.save_payment_method_from_setup(db, test_user.cognito_sub, "pm_1")
+        assert result["success"] is True
+        assert result["payment_method"].last_four == "9999"
+        assert result["payment_method"].expiration_date == "04/31"
+
+        service.ingest(db, self._event("evt_pm3", "payment_method.detached", 1700000200, self._card("pm_1", None, "9999")))
+        asyncio.run(service.drain_async(TestingSessionLocal))
+        db.refresh(mirrored)
+        assert mirrored.customer_id is None
+
+    def test_customer_lookup_hits_stripe_only_on_miss(self, db: Session, test_user: User, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que el customer de un correo se busca en Stripe solo la primera
+                     vez y que customer.deleted lo quita de la copia y del usuario.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            monkeypatch: Fixture de pytest para reemplazar la llamada a Stripe.
+        """
+        calls = []
+
+        def fake_get_or_create_customer(user_id: int, email: str, name: str):
+            calls.append(email)
+            return {"success": True, "customer_id": f"cus_{len(calls)}"}
+
+        monkeypatch.setattr(stripe_service, "get_or_create_customer", fake_get_or_create_customer)
+
+        first = stripe_mirror_service.get_or_create_customer(db, test_user.user_id, test_user.email, "Test User")
+        second = stripe_mirror_service.get_or_create_customer(db, test_user.user_id, test_user.email, "Test User")
+        assert first == second == {"success": True, "customer_id": "cus_1"}
+        assert calls == [test_user.email]
+
+        test_user.stripe_customer_id = "cus_1"
+        db.commit()
+
+        service = StripeWebhookService()
+        service.ingest(db, self._event("evt_cus_del", "customer.deleted", int(time.time()) + 60, {
+            "id": "cus_1", "object": "customer", "email": test_user.email, "deleted": True
+        }))
+        asyncio.run(service.drain_async(TestingSessionLocal))
+
+        db.refresh(test_user)
+        assert test_user.stripe_customer_id is None
+        assert db.get(StripeCustomer, "cus_1").deleted is True
+        assert stripe_mirror_service.get_or_create_customer(db, test_user.user_id, test_user.email, "Test User")["customer_id"] == "cus_2"
+
+class TestPayPalTokenCacheUnit:
+    """
+    Autor: Gabriel Vilchis
+    Descripción: Pruebas de la cache del token OAuth2 de PayPal (sin llamadas reales).
+    """
+
+    @staticmethod
+    def _service(expires_in: int = 32400, reject_first_token: bool = False):
+        """
+        PayPalService con un transporte simulado que cuenta las solicitudes de token.
+        """
+        calls = {"token": 0, "orders": 0}
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/v1/oauth2/token":
+                calls["token"] += 1
+                await asyncio.sleep(0.05)
+                return httpx.Response(200, json={
+                    "access_token": f"token-{calls['token']}",
+                    "expires_in": expires_in
+                })
+
+            calls["orders"] += 1
+            if reject_first_token and request.headers["Authorization"] == "Bearer token-1":
+                return httpx.Response(401, json={"error": "invalid_token"})
+            return httpx.Response(201, json={"id": f"ORDER-{calls['orders']}", "status": "CREATED"})
+
+        service = PayPalService()
+        service.base_url = "https://paypal.test"
+        service.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return service, calls
+
+    def test_concurrent_orders_share_one_token(self):
+        """
+        Autor: Gabriel Vilchis
+        Descripción: Verifica que varias órdenes concurrentes y las siguientes reutilizan un
+                     solo token (una sola solicitud a /v1/oauth2/token).
+        """
+        service, calls = self._service()
+
+        async def create_orders():
+            await asyncio.gather(*(service.create_order(100.0) for _ in range(10)))
+            await service.capture_order("ORDER-1")
+
+        asyncio.run(create_orders())
+
+        assert calls["token"] == 1
+        assert calls["orders"] == 11
+
+    def test_token_refreshed_ahead_of_expiry(self):
+        """
+        Autor: Gabriel Vilchis
+        Descripción: Verifica que un token próximo a vencer se sigue usando mientras se
+                     renueva en segundo plano.
+        """
+        service, calls = self._service(expires_in=300)
+
+        async def create_orders():
+            await service.create_order(100.0)
+            first_token = service.access_token
+            await service.create_order(100.0)
+            await service._refresh_task
+            return first_token
+
+        first_token = asyncio.run(create_orders())
+
+        assert first_token == "token-1"
+        assert service.access_token == "token-2"
+        assert calls["token"] == 2
+
+    def test_retry_once_on_401(self):
+        """
+        Autor: Gabriel Vilchis
+        Descripción: Verifica que ante un 401 se obtiene un token nuevo y la petición se
+                     reintenta una vez.
+        """
+        service, calls = self._service(reject_first_token=True)
+
+        result = asyncio.run(service.create_order(100.0))
+
+        assert result["status"] == "CREATED"
+        assert calls["token"] == 2
+        assert calls["orders"] == 2
+
+    def test_shared_client_lifecycle(self):
+        """
+        Autor: Gabriel Vilchis
+        Descripción: Verifica que start() crea un solo cliente con los límites de la
+                     configuración y que close() lo cierra.
+        """
+        service = PayPalService()
+
+        async def lifecycle():
+            await service.start()
+            client = service.client
+            await service.start()
+            assert service.client is client
+            await service.close()
+            return client
+
+        client = asyncio.run(lifecycle())
+
+        assert client.is_closed
+        assert service.client is None
+        assert client.timeout.connect == settings.PAYPAL_HTTP_CONNECT_TIMEOUT_SECONDS
+
+
+class TestResiliencePolicyUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas de la capa de resiliencia para proveedores externos.
+    """
+
+    @staticmethod
+    def _policy(**kwargs) -> ResiliencePolicy:
+        options = {
+            "timeout_seconds": 1.0,
+            "max_concurrent": 10,
+            "is_transient": lambda error: isinstance(error, ConnectionError),
+            "failure_threshold": 3,
+            "open_seconds": 0.1
+        }
+        options.update(kwargs)
+        return ResiliencePolicy("prueba", **options)
+
+    def test_circuit_opens_and_recovers(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que tras N fallos transitorios el circuito se abre y rechaza
+                     llamadas sin hacerlas, y que una llamada exitosa al vencer el tiempo lo
+                     vuelve a cerrar. Los errores de negocio no abren el circuito.
+        """
+        policy = self._policy()
+        calls = {"count": 0}
+
+        def failing():
+            calls["count"] += 1
+            raise ConnectionError("proveedor caído")
+
+        with pytest.raises(ValueError):
+            policy.call(lambda: (_ for _ in ()).throw(ValueError("tarjeta rechazada")))
+        for _ in range(3):
+            with pytest.raises(ConnectionError):
+                policy.call(failing)
+
+        assert policy.state == CircuitState.OPEN
+        with pytest.raises(CircuitOpenError):
+            policy.call(failing)
+        assert calls["count"] == 3
+
+        time.sleep(0.15)
+        assert policy.state == CircuitState.HALF_OPEN
+        assert policy.call(lambda: "ok") == "ok"
+        assert policy.state == CircuitState.CLOSED
+
+        metrics = policy.get_metrics()
+        assert metrics["failures"] == 3
+        assert metrics["short_circuited"] == 1
+        assert metrics["latency_ms"]["p50"] is not None
+
+    def test_retries_only_idempotent_operations(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que una operación idempotente se reintenta ante fallos
+                     transitorios y una que no lo es se intenta una sola vez.
+        """
+        policy = self._policy(max_retries=2, failure_threshold=10)
+        attempts = {"idempotent": 0, "other": 0}
+
+        def flaky(kind: str):
+            attempts[kind] += 1
+            if attempts[kind] < 3:
+                raise ConnectionError("timeout de red")
+            return kind
+
+        assert policy.call(lambda: flaky("idempotent"), idempotent=True) == "idempotent"
+        with pytest.raises(ConnectionError):
+            policy.call(lambda: flaky("other"))
+
+        assert attempts == {"idempotent": 3, "other": 1}
+        assert policy.get_metrics()["retries"] == 2
+
+    def test_bulkhead_rejects_excess_calls(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que las llamadas que exceden el límite de concurrencia fallan
+                     de inmediato en lugar de esperar.
+        """
+        policy = self._policy(max_concurrent=2)
+
+        async def slow():
+            await asyncio.sleep(0.1)
+            return "ok"
+
+        async def run_many():
+            return await asyncio.gather(
+                *(policy.call_async(slow) for _ in range(3)), return_exceptions=True
+            )
+
+        results = asyncio.run(run_many())
+
+        assert results.count("ok") == 2
+        assert sum(isinstance(result, BulkheadFullError) for result in results) == 1
+
+    def test_cancelled_calls_release_their_slot(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que una llamada cancelada (cliente desconectado, wait_for
+                     externo) libera su lugar del bulkhead y del circuito medio abierto, y
+                     que no cuenta como éxito ni como fallo.
+        """
+        policy = self._policy(max_concurrent=2, failure_threshold=1)
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        async def quick():
+            return "ok"
+
+        async def cancel_in_flight():
+            for _ in range(2):
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(policy.call_async(hang), 0.01)
+            assert policy.get_metrics()["in_flight"] == 0
+            # Sin la liberación, las dos canceladas llenarían el bulkhead para siempre
+            return await asyncio.gather(policy.call_async(quick), policy.call_async(quick))
+
+        assert asyncio.run(cancel_in_flight()) == ["ok", "ok"]
+        metrics = policy.get_metrics()
+        assert (metrics["in_flight"], metrics["successes"], metrics["failures"]) == (0, 2, 0)
+
+        # Con el circuito medio abierto, la llamada de prueba cancelada no agota el cupo
+        with pytest.raises(ConnectionError):
+            policy.call(lambda: (_ for _ in ()).throw(ConnectionError("proveedor caído")))
+        time.sleep(0.15)
+        assert policy.state == CircuitState.HALF_OPEN
+
+        async def cancel_probe():
+            task = asyncio.create_task(policy.call_async(hang))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_probe())
+        assert policy.state == CircuitState.HALF_OPEN
+        assert policy.call(lambda: "ok") == "ok"
+        assert policy.get_metrics()["in_flight"] == 0
+
+    def test_deadline_limits_calls(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que una llamada no excede el deadline de la petición aunque el
+                     timeout del proveedor sea mayor, y que con el deadline vencido no se llama.
+        """
+        policy = self._policy(timeout_seconds=5.0)
+
+        async def slow():
+            await asyncio.sleep(1)
+
+        async def within_deadline():
+            with deadline(0.1):
+                started = time.monotonic()
+                with pytest.raises(TimeoutError):
+                    await policy.call_async(slow, idempotent=True)
+                return time.monotonic() - started
+
+        assert asyncio.run(within_deadline()) < 0.5
+
+        with deadline(0):
+            with pytest.raises(DeadlineExceededError):
+                policy.call(lambda: "no se llama")
+        assert policy.get_metrics()["deadline_exceeded"] == 1
+
+    def test_paypal_capture_retried_with_same_request_id(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que una captura de PayPal que recibe un 503 se reintenta con
+                     el mismo PayPal-Request-Id (sin capturar dos veces).
+        """
+        request_ids = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/v1/oauth2/token":
+                return httpx.Response(200, json={"access_token": "token", "expires_in": 32400})
+            request_ids.append(request.headers["PayPal-Request-Id"])
+            if len(request_ids) == 1:
+                return httpx.Response(503, json={"name": "SERVICE_UNAVAILABLE"})
+            return httpx.Response(201, json={"id": "ORDER-1", "status": "COMPLETED"})
+
+        service = PayPalService()
+        service.base_url = "https://paypal.test"
+        service.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        result = asyncio.run(service.capture_order("ORDER-1"))
+
+        assert result["status"] == "COMPLETED"
+        assert request_ids == ["capture-ORDER-1", "capture-ORDER-1"]
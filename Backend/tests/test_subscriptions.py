@@ -0,0 +1,961 @@
+# Autor: Lizbeth Barajas
+# Fecha: 24/11/2025
+# Descripción: Archivo de pruebas para el módulo de suscripciones. Incluye pruebas unitarias
+#             del job de cobro recurrente (bloques, pool de hilos, una transacción por cobro,
+#             ledger de ejecuciones reanudables y varios workers reclamando bloques), del
+#             catálogo en memoria para armar las cajas, del historial paginado, de la
+#             expiración de puntos por lotes y de la emisión mensual de cupones.
+
+import string
+import threading
+import time
+import pytest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app.core.database import Base
+from app.api.v1.subscriptions.service import subscription_service
+from app.api.v1.loyalty.service import LoyaltyService, loyalty_service
+from app.services.stripe_service import stripe_service
+from app.services.resilience import RateLimiter
+from app.services.subscription_catalog_service import subscription_catalog_service
+from app.api.v1.products.service import ProductService
+from app.api.v1.products.schemas import ProductUpdate
+from app.models.user import User
+from app.models.address import Address
+from app.models.fitness_profile import FitnessProfile
+from app.models.payment_method import PaymentMethod
+from app.models.product import Product
+from app.models.subscription import Subscription
+from app.models.order import Order
+from app.models.billing_run import BillingRun
+from app.models.billing_run_item import BillingRunItem
+from app.models.loyalty_tier import LoyaltyTier
+from app.models.user_loyalty import UserLoyalty
+from app.models.point_history import PointHistory
+from app.models.coupon import Coupon
+from app.models.user_coupon import UserCoupon
+from app.models.coupon_issuance_run import CouponIssuanceRun
+from app.models.enum import (
+    UserRole,
+    AuthType,
+    Gender,
+    PaymentType,
+    SubscriptionStatus,
+    OrderStatus,
+    BillingRunStatus,
+    BillingItemStatus,
+    CouponIssuanceStatus
+)
+
+
+@pytest.fixture
+def billing_session_factory(tmp_path):
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Base de datos SQLite en archivo para las pruebas del job de cobro, ya que
+                 cada hilo del pool abre su propia conexión.
+    Parámetros:
+        tmp_path (Path): Directorio temporal de pytest.
+    Retorna:
+        sessionmaker: Fábrica de sesiones de la base de datos.
+    """
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'billing.db'}",
+        connect_args={"check_same_thread": False, "timeout": 30}
+    )
+    Base.metadata.create_all(bind=engine)
+    # El catálogo en memoria no debe arrastrar productos de otra base de prueba
+    subscription_catalog_service.invalidate()
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    subscription_catalog_service.invalidate()
+    engine.dispose()
+
+
+def _seed_due_subscriptions(session_factory, count: int) -> None:
+    """
+    Crea `count` usuarios con suscripción activa vencida, dirección, tarjeta y perfil, y
+    tres productos del plan recomendado.
+    """
+    db = session_factory()
+    try:
+        for name in ("Plan Fuerza Proteína", "Plan Fuerza Creatina", "Plan Fuerza Glutamina"):
+            db.add(Product(
+                name=name, description="Producto de suscripción", brand="BeFit",
+                category="Suplementos", physical_activities=[], fitness_objectives=[],
+                nutritional_value="N/A", price=Decimal("200.00"), stock=100, is_active=True
+            ))
+
+        for index in range(count):
+            user = User(
+                cognito_sub=f"billing-{index}", email=f"billing{index}@befit.test",
+                first_name="Billing", last_name=str(index), gender=Gender.FEMALE,
+                date_of_birth=date(1995, 1, 1), auth_type=AuthType.EMAIL,
+                role=UserRole.USER, account_status=True,
+                stripe_customer_id=f"cus_{index}"
+            )
+            db.add(user)
+            db.flush()
+
+            profile = FitnessProfile(
+                user_id=user.user_id, test_date=date.today(),
+                attributes={"recommended_plan": "Plan Fuerza"}
+            )
+            payment_method = PaymentMethod(
+                user_id=user.user_id, payment_type=PaymentType.CREDIT_CARD,
+                provider_ref=f"pm_{index}", last_four="4242", expiration_date="12/30",
+                is_default=True
+            )
+            db.add_all([profile, payment_method, Address(
+                user_id=user.user_id, address_name="Casa", address_line1="Calle 1",
+                country="México", state="Chihuahua", city="Ciudad Juárez", zip_code="32000",
+                recipient_name="Billing", phone_number="6560000000", is_default=True
+            )])
+            db.flush()
+
+            db.add(Subscription(
+                user_id=user.user_id, profile_id=profile.profile_id,
+                payment_method_id=payment_method.payment_id,
+                subscription_status=SubscriptionStatus.ACTIVE,
+                start_date=date.today() - timedelta(days=30),
+                next_delivery_date=date.today(), price=Decimal("499.00")
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+class TestSubscriptionBillingUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas del job de cobro de suscripciones vencidas.
+    """
+
+    def test_due_subscriptions_charged_in_parallel_chunks(self, billing_session_factory, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que las suscripciones se cobran por bloques con varios cobros a
+                     la vez, que un cobro fallido no revierte los demás y que el stock se
+                     descuenta sin perder actualizaciones concurrentes.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+            monkeypatch: Fixture de pytest para reemplazar el cobro en Stripe.
+        """
+        _seed_due_subscriptions(billing_session_factory, 12)
+        active = {"now": 0, "max": 0}
+        lock = threading.Lock()
+
+        def fake_charge(amount, currency, customer_id, payment_method_id, description, metadata, idempotency_key=None):
+            with lock:
+                active["now"] += 1
+                active["max"] = max(active["max"], active["now"])
+            time.sleep(0.05)
+            with lock:
+                active["now"] -= 1
+            if customer_id == "cus_3":
+                return {"success": False, "error": "Tarjeta rechazada"}
+            return {"success": True, "payment_intent_id": f"pi_{customer_id}"}
+
+        monkeypatch.setattr(stripe_service, "create_payment_intent_with_saved_card", fake_charge)
+
+        db = billing_session_factory()
+        try:
+            result = subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory,
+                workers=4, chunk_size=5, rate_limit_per_second=0
+            )
+            results = result["results"]
+
+            assert result["success"] is True
+            assert (results["total_processed"], results["successful"], results["failed"]) == (12, 11, 1)
+            assert [chunk["size"] for chunk in results["chunks"]] == [5, 5, 2]
+            assert results["errors"][0]["error"] == "Error en el cobro: Tarjeta rechazada"
+            assert results["throughput_per_second"] > 0
+            assert active["max"] > 1
+
+            subscriptions = db.query(Subscription).order_by(Subscription.subscription_id).all()
+            failed = subscriptions[3]
+            assert failed.failed_payment_attempts == 1
+            assert failed.next_delivery_date == date.today()
+            assert all(
+                subscription.next_delivery_date == date.today() + timedelta(days=30)
+                for subscription in subscriptions if subscription is not failed
+            )
+            assert db.query(Order).count() == 11
+            assert [product.stock for product in db.query(Product).all()] == [89, 89, 89]
+
+            # La fallida no se vuelve a intentar el mismo día
+            rerun = subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory, workers=4, rate_limit_per_second=0
+            )
+            assert rerun["results"]["total_processed"] == 0
+        finally:
+            db.close()
+
+    def test_interrupted_run_resumes_without_double_charge(self, billing_session_factory, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Simula que el proceso muere a la mitad de un cobro. Al vencer el lease del
+                     cobro a medias, la siguiente ejecución lo retoma: no repite los cobros
+                     terminados y reenvía el pendiente con la misma llave de idempotencia. Las
+                     porciones (max_items) limitan cuántas suscripciones cobra cada ejecución.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+            monkeypatch: Fixture de pytest para reemplazar el cobro en Stripe.
+        """
+        class ProcessKilled(BaseException):
+            pass
+
+        _seed_due_subscriptions(billing_session_factory, 6)
+        sent_keys = []
+        crash = {"customer_id": "cus_2"}
+
+        def fake_charge(amount, currency, customer_id, payment_method_id, description, metadata, idempotency_key=None):
+            sent_keys.append((customer_id, idempotency_key))
+            if crash["customer_id"] == customer_id:
+                raise ProcessKilled()
+            return {"success": True, "payment_intent_id": f"pi_{idempotency_key}"}
+
+        monkeypatch.setattr(stripe_service, "create_payment_intent_with_saved_card", fake_charge)
+
+        db = billing_session_factory()
+        try:
+            with pytest.raises(ProcessKilled):
+                subscription_service.process_due_subscriptions(
+                    db, session_factory=billing_session_factory,
+                    workers=1, chunk_size=2, rate_limit_per_second=0, max_items=4
+                )
+
+            run = db.query(BillingRun).one()
+            assert run.status == BillingRunStatus.RUNNING
+            statuses = [item.status for item in db.query(BillingRunItem).order_by(BillingRunItem.item_id)]
+            # El cobro que ya estaba en el pool al morir el otro sí terminó
+            assert statuses == [BillingItemStatus.SUCCEEDED, BillingItemStatus.SUCCEEDED, BillingItemStatus.CHARGING, BillingItemStatus.SUCCEEDED]
+
+            # Mientras el lease del cobro a medias siga vigente nadie más lo toma
+            waiting = subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory, rate_limit_per_second=0
+            )["results"]
+            assert (waiting["run_id"], waiting["total_processed"]) == (run.run_id, 0)
+            db.refresh(run)
+            assert run.status == BillingRunStatus.RUNNING
+
+            db.query(BillingRunItem).update({
+                BillingRunItem.claimed_until: BillingRunItem.claimed_until - timedelta(hours=1)
+            })
+            db.commit()
+            crash["customer_id"] = None
+
+            resumed = subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory,
+                workers=2, chunk_size=2, rate_limit_per_second=0
+            )["results"]
+
+            assert resumed["run_id"] == run.run_id and resumed["resumed"] is True
+            assert resumed["successful"] == 1
+            assert [customer for customer, _ in sent_keys] == ["cus_0", "cus_1", "cus_2", "cus_3", "cus_2"]
+            assert sent_keys[2][1] == sent_keys[4][1] == f"subscription-3-{date.today():%Y%m%d}-0"
+            assert db.query(Order).count() == 4
+
+            progress = subscription_service.get_billing_runs(db)
+            assert progress[0]["status"] == "completed"
+            assert progress[0]["counts"]["succeeded"] == 4
+            assert progress[0]["progress_percent"] == 100.0
+
+            # La siguiente porción es una ejecución nueva con el resto de las vencidas
+            next_slice = subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory,
+                workers=2, chunk_size=2, rate_limit_per_second=0, max_items=4
+            )["results"]
+            assert (next_slice["resumed"], next_slice["successful"]) == (False, 2)
+            assert db.query(Order).count() == 6
+        finally:
+            db.close()
+
+    def test_stale_run_is_closed_and_today_is_charged_in_same_call(self, billing_session_factory, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que si quedó interrumpida una ejecución de ayer, la llamada la
+                     cierra y en la misma llamada abre la de hoy y cobra las suscripciones
+                     que vencieron hoy.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+            monkeypatch: Fixture de pytest para reemplazar el cobro en Stripe.
+        """
+        _seed_due_subscriptions(billing_session_factory, 3)
+        db = billing_session_factory()
+        try:
+            stale = BillingRun(billing_date=date.today() - timedelta(days=1), status=BillingRunStatus.RUNNING)
+            db.add(stale)
+            db.commit()
+            stale_id = stale.run_id
+        finally:
+            db.close()
+
+        def fake_charge(amount, currency, customer_id, payment_method_id, description, metadata, idempotency_key=None):
+            return {"success": True, "payment_intent_id": f"pi_{idempotency_key}"}
+
+        monkeypatch.setattr(stripe_service, "create_payment_intent_with_saved_card", fake_charge)
+
+        db = billing_session_factory()
+        try:
+            results = subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory, workers=1, rate_limit_per_second=0
+            )["results"]
+
+            assert (results["run_id"], results["resumed"], results["successful"]) == (stale_id, True, 3)
+            assert db.query(Order).count() == 3
+            runs = db.query(BillingRun).order_by(BillingRun.run_id).all()
+            assert results["run_ids"] == [run.run_id for run in runs]
+            assert [(run.billing_date, run.status) for run in runs] == [
+                (date.today() - timedelta(days=1), BillingRunStatus.COMPLETED),
+                (date.today(), BillingRunStatus.COMPLETED)
+            ]
+        finally:
+            db.close()
+
+    def test_concurrent_workers_share_run_without_double_charge(self, billing_session_factory, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Simula dos réplicas corriendo el job a la vez. Ambas se unen a la misma
+                     ejecución, se reparten los cobros reclamando bloques y ninguna
+                     suscripción se cobra dos veces.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+            monkeypatch: Fixture de pytest para reemplazar el cobro en Stripe.
+        """
+        _seed_due_subscriptions(billing_session_factory, 20)
+        charged = []
+        lock = threading.Lock()
+
+        def fake_charge(amount, currency, customer_id, payment_method_id, description, metadata, idempotency_key=None):
+            time.sleep(0.02)
+            with lock:
+                charged.append(customer_id)
+            return {"success": True, "payment_intent_id": f"pi_{idempotency_key}"}
+
+        monkeypatch.setattr(stripe_service, "create_payment_intent_with_saved_card", fake_charge)
+
+        outputs = {}
+
+        def run_worker(worker_id):
+            db = billing_session_factory()
+            try:
+                outputs[worker_id] = subscription_service.process_due_subscriptions(
+                    db, session_factory=billing_session_factory, workers=2, chunk_size=2,
+                    rate_limit_per_second=0, worker_id=worker_id
+                )
+            finally:
+                db.close()
+
+        threads = [threading.Thread(target=run_worker, args=(f"replica-{n}",)) for n in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        results = [outputs[worker_id]["results"] for worker_id in sorted(outputs)]
+        assert len({result["run_id"] for result in results}) == 1
+        assert sum(result["successful"] for result in results) == 20
+        assert all(result["successful"] > 0 for result in results)
+        assert sorted(charged) == sorted(f"cus_{index}" for index in range(20))
+
+        db = billing_session_factory()
+        try:
+            assert db.query(Order).count() == 20
+            assert db.query(BillingRun).filter(BillingRun.status == BillingRunStatus.RUNNING).count() == 0
+            assert {item.claimed_by for item in db.query(BillingRunItem)} == {"replica-0", "replica-1"}
+        finally:
+            db.close()
+
+    def test_reclaimed_item_does_not_commit_a_second_order(self, billing_session_factory, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Simula que el lease vence mientras Stripe responde y otra réplica reclama
+                     el cobro. Al terminar, este worker ya no es dueño del registro: su orden se
+                     revierte y el cobro queda a cargo de la otra réplica.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+            monkeypatch: Fixture de pytest para reemplazar el cobro en Stripe.
+        """
+        _seed_due_subscriptions(billing_session_factory, 1)
+
+        def slow_charge(amount, currency, customer_id, payment_method_id, description, metadata, idempotency_key=None):
+            other = billing_session_factory()
+            try:
+                other.query(BillingRunItem).update({BillingRunItem.claimed_by: "replica-b"})
+                other.commit()
+            finally:
+                other.close()
+            return {"success": True, "payment_intent_id": f"pi_{idempotency_key}"}
+
+        monkeypatch.setattr(stripe_service, "create_payment_intent_with_saved_card", slow_charge)
+
+        db = billing_session_factory()
+        try:
+            results = subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory, workers=1,
+                rate_limit_per_second=0, worker_id="replica-a"
+            )["results"]
+            assert (results["successful"], results["failed"], results["skipped"]) == (0, 0, 1)
+
+            assert db.query(Order).count() == 0
+            item = db.query(BillingRunItem).one()
+            assert (item.status, item.claimed_by, item.order_id) == (BillingItemStatus.CHARGING, "replica-b", None)
+            assert db.query(Subscription).one().next_delivery_date == date.today()
+        finally:
+            db.close()
+
+    def test_only_one_running_run_when_workers_start_together(self, billing_session_factory):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Simula que otro worker crea su ejecución justo antes del INSERT de este.
+                     El índice único parcial rechaza la segunda ejecución RUNNING y este
+                     worker se une a la del otro.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+        """
+        db = billing_session_factory()
+        other_run = {}
+
+        def other_worker_opens_run(session, flush_context, instances):
+            other = billing_session_factory()
+            try:
+                run = BillingRun(billing_date=date.today(), status=BillingRunStatus.RUNNING)
+                other.add(run)
+                other.commit()
+                other_run["run_id"] = run.run_id
+            finally:
+                other.close()
+
+        try:
+            event.listen(db, "before_flush", other_worker_opens_run, once=True)
+            run, joined = subscription_service._open_billing_run(db, date.today(), None)
+
+            assert (run.run_id, joined) == (other_run["run_id"], True)
+            assert db.query(BillingRun).count() == 1
+        finally:
+            db.close()
+
+    def test_period_charged_elsewhere_does_not_create_second_order(self, billing_session_factory, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Simula que otro cobro registra el mismo periodo mientras Stripe responde.
+                     La fecha de entrega ya avanzó, así que la orden de este cobro se revierte
+                     y no se descuenta stock otra vez.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+            monkeypatch: Fixture de pytest para reemplazar el cobro en Stripe.
+        """
+        _seed_due_subscriptions(billing_session_factory, 1)
+
+        def charge_and_advance_elsewhere(amount, currency, customer_id, payment_method_id, description, metadata, idempotency_key=None):
+            other = billing_session_factory()
+            try:
+                other.query(Subscription).update({
+                    Subscription.next_delivery_date: date.today() + timedelta(days=30)
+                })
+                other.commit()
+            finally:
+                other.close()
+            return {"success": True, "payment_intent_id": f"pi_{idempotency_key}"}
+
+        monkeypatch.setattr(stripe_service, "create_payment_intent_with_saved_card", charge_and_advance_elsewhere)
+
+        db = billing_session_factory()
+        try:
+            results = subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory, workers=1, rate_limit_per_second=0
+            )["results"]
+
+            assert (results["successful"], results["skipped"]) == (0, 1)
+            assert db.query(Order).count() == 0
+            assert {product.stock for product in db.query(Product)} == {100}
+        finally:
+            db.close()
+
+    def test_charge_description_uses_billing_period(self, billing_session_factory, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que la descripción enviada a Stripe sale del periodo del ledger
+                     y no de la fecha del día, para que un reintento con la misma llave de
+                     idempotencia mande los mismos parámetros.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+            monkeypatch: Fixture de pytest para reemplazar el cobro en Stripe.
+        """
+        _seed_due_subscriptions(billing_session_factory, 1)
+        period = date(2025, 1, 31)
+        db = billing_session_factory()
+        try:
+            db.query(Subscription).update({Subscription.next_delivery_date: period})
+            db.commit()
+        finally:
+            db.close()
+        sent = []
+
+        def fake_charge(amount, currency, customer_id, payment_method_id, description, metadata, idempotency_key=None):
+            sent.append((description, idempotency_key))
+            return {"success": True, "payment_intent_id": f"pi_{idempotency_key}"}
+
+        monkeypatch.setattr(stripe_service, "create_payment_intent_with_saved_card", fake_charge)
+
+        db = billing_session_factory()
+        try:
+            subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory, workers=1, rate_limit_per_second=0
+            )
+        finally:
+            db.close()
+
+        assert sent == [(f"Suscripción mensual BeFit - {period:%B %Y}", "subscription-1-20250131-0")]
+
+    def test_rate_limiter_spaces_calls(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que el rate limiter no deja pasar más llamadas por segundo
+                     que las configuradas.
+        """
+        limiter = RateLimiter(rate_per_second=20, burst=1)
+
+        started = time.monotonic()
+        for _ in range(5):
+            limiter.acquire()
+
+        assert time.monotonic() - started >= 0.18
+
+
+class TestSubscriptionHistoryUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas del historial de órdenes de la suscripción.
+    """
+
+    def test_history_aggregates_in_sql_and_paginates(self, db, test_user, test_address, test_payment_method, query_counter):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que los totales cubren todas las órdenes de la suscripción
+                     aunque solo se regrese una página, y que el historial se obtiene con un
+                     número fijo de consultas.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            test_address (Address): Dirección del usuario.
+            test_payment_method (PaymentMethod): Tarjeta del usuario.
+            query_counter (list): Sentencias SQL ejecutadas.
+        """
+        profile = FitnessProfile(user_id=test_user.user_id, test_date=date.today(), attributes={})
+        db.add(profile)
+        db.flush()
+        subscription = Subscription(
+            user_id=test_user.user_id, profile_id=profile.profile_id,
+            payment_method_id=test_payment_method.payment_id,
+            subscription_status=SubscriptionStatus.ACTIVE,
+            start_date=date.today() - timedelta(days=150),
+            next_delivery_date=date.today() + timedelta(days=30), price=Decimal("499.00")
+        )
+        db.add(subscription)
+        db.flush()
+        for months_ago in range(5):
+            db.add(Order(
+                user_id=test_user.user_id, address_id=test_address.address_id,
+                payment_id=test_payment_method.payment_id, subscription_id=subscription.subscription_id,
+                is_subscription=True, order_status=OrderStatus.DELIVERED,
+                order_date=datetime.now() - timedelta(days=30 * months_ago),
+                subtotal=Decimal("600.00"), discount_amount=Decimal("0.00"), shipping_cost=Decimal("0.00"),
+                total_amount=Decimal("499.00") if months_ago else Decimal("399.50")
+            ))
+        db.commit()
+        user_id = test_user.user_id
+
+        query_counter.clear()
+        result = subscription_service.get_subscription_history(db, user_id, page=2, limit=2)
+
+        assert result["success"] is True
+        assert (result["total_orders"], result["total_spent"]) == (5, Decimal("2395.50"))
+        assert result["last_delivery_date"] == date.today()
+        assert (result["page"], result["total_pages"]) == (2, 3)
+        assert [order.order_date.date() for order in result["orders"]] == [
+            (datetime.now() - timedelta(days=60)).date(),
+            (datetime.now() - timedelta(days=90)).date()
+        ]
+        assert len(query_counter) == 3
+
+
+class TestSubscriptionCatalogUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas del catálogo plan -> productos en memoria.
+    """
+
+    def test_plan_ranking_stock_and_invalidation(self, billing_session_factory):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que los productos del plan salen ordenados por calificación,
+                     que un producto agotado por las cajas enviadas se reemplaza por uno que
+                     cubre los objetivos del perfil y que editar un producto recarga el catálogo.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+        """
+        db = billing_session_factory()
+        try:
+            for name, rating, stock, active, objectives in (
+                ("BeStrong Proteína", Decimal("4.0"), 10, True, []),
+                ("BeStrong Creatina", Decimal("4.8"), 10, True, []),
+                ("BeStrong Pre-entreno", None, 1, True, []),
+                ("BeStrong Descontinuado", Decimal("5.0"), 10, False, []),
+                ("Omega 3", None, 10, True, ["ganar_musculo", "salud"]),
+                ("Termogénico", None, 10, True, ["perder_grasa"])
+            ):
+                db.add(Product(
+                    name=name, description="Producto", brand="BeFit", category="Suplementos",
+                    physical_activities=[], fitness_objectives=objectives, nutritional_value="N/A",
+                    price=Decimal("200.00"), stock=stock, is_active=active, average_rating=rating
+                ))
+            db.commit()
+
+            def box():
+                return [
+                    product["name"] for product in
+                    subscription_catalog_service.select_products(db, "BeStrong", ["ganar_musculo"])
+                ]
+
+            assert box() == ["BeStrong Creatina", "BeStrong Proteína", "BeStrong Pre-entreno"]
+
+            subscription_catalog_service.record_shipment([3])
+            assert box() == ["BeStrong Creatina", "BeStrong Proteína", "Omega 3"]
+
+            # Reabastecer desde el servicio de productos invalida el catálogo
+            ProductService.update_product(db, 3, ProductUpdate(stock=5))
+            assert box() == ["BeStrong Creatina", "BeStrong Proteína", "BeStrong Pre-entreno"]
+        finally:
+            db.close()
+
+    def test_billing_loads_catalog_once(self, billing_session_factory, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que el job de cobro consulta la tabla de productos una sola vez
+                     (al cargar el catálogo) y no por cada suscripción.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+            monkeypatch: Fixture de pytest para reemplazar el cobro en Stripe.
+        """
+        _seed_due_subscriptions(billing_session_factory, 10)
+        monkeypatch.setattr(
+            stripe_service, "create_payment_intent_with_saved_card",
+            lambda **kwargs: {"success": True, "payment_intent_id": f"pi_{kwargs['customer_id']}"}
+        )
+        product_selects = []
+
+        def count_product_selects(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and "FROM product" in statement:
+                product_selects.append(statement)
+
+        engine = billing_session_factory.kw["bind"]
+        event.listen(engine, "before_cursor_execute", count_product_selects)
+        db = billing_session_factory()
+        try:
+            result = subscription_service.process_due_subscriptions(
+                db, session_factory=billing_session_factory, workers=4, chunk_size=5, rate_limit_per_second=0
+            )
+            assert result["results"]["successful"] == 10
+            assert len(product_selects) == 1
+            assert [product.stock for product in db.query(Product).all()] == [90, 90, 90]
+        finally:
+            event.remove(engine, "before_cursor_execute", count_product_selects)
+            db.close()
+
+
+class TestPointExpiryUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas del job de expiración de puntos por lotes.
+    """
+
+    def test_concurrent_expiry_records_each_account_once(self, billing_session_factory):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Corre la expiración en dos hilos a la vez con lotes pequeños y verifica
+                     que cada cuenta vencida se expira y registra en el historial una sola
+                     vez, y que las cuentas vigentes no se tocan.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+        """
+        db = billing_session_factory()
+        try:
+            tiers = [
+                LoyaltyTier(tier_level=level, min_points_required=min_points, points_multiplier=Decimal("1.00"),
+                            free_shipping_threshold=Decimal("1000.00"), monthly_coupons_count=1,
+                            coupon_discount_percentage=10)
+                for level, min_points in ((1, 0), (2, 100))
+            ]
+            db.add_all(tiers)
+            db.flush()
+            base_tier_id = tiers[0].tier_id
+            for index in range(30):
+                user = User(
+                    cognito_sub=f"points-{index}", email=f"points{index}@befit.test",
+                    first_name="Points", last_name=str(index), gender=Gender.MALE,
+                    date_of_birth=date(1995, 1, 1), auth_type=AuthType.EMAIL,
+                    role=UserRole.USER, account_status=True
+                )
+                db.add(user)
+                db.flush()
+                db.add(UserLoyalty(
+                    user_id=user.user_id, tier_id=tiers[1].tier_id,
+                    total_points=0 if index % 10 == 0 else 150,
+                    points_expiration_date=date.today() - timedelta(days=1) if index < 25 else date.today() + timedelta(days=30),
+                    tier_achieved_date=date.today() - timedelta(days=200),
+                    last_points_update=date.today() - timedelta(days=200)
+                ))
+            db.commit()
+        finally:
+            db.close()
+
+        outputs = []
+
+        def run_expiry():
+            session = billing_session_factory()
+            try:
+                outputs.append(loyalty_service.expire_all_points(session, batch_size=4))
+            finally:
+                session.close()
+
+        threads = [threading.Thread(target=run_expiry) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert all(output["success"] for output in outputs)
+        # 25 vencidas, 3 de ellas sin puntos
+        assert sum(output["users_affected"] for output in outputs) == 22
+        assert sum(output["total_expired_points"] for output in outputs) == 22 * 150
+
+        db = billing_session_factory()
+        try:
+            history = db.query(PointHistory).all()
+            assert len(history) == len({record.loyalty_id for record in history}) == 22
+            assert all(record.points_change == -150 and record.order_id is None for record in history)
+
+            loyalties = db.query(UserLoyalty).order_by(UserLoyalty.loyalty_id).all()
+            assert all(loyalty.total_points == 0 and loyalty.tier_id == base_tier_id for loyalty in loyalties[:25])
+            assert all(loyalty.total_points == 150 and loyalty.points_expiration_date for loyalty in loyalties[25:])
+        finally:
+            db.close()
+
+    def test_expiry_is_set_based_per_id_range(self, db, query_counter):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Verifica que la expiración registra el historial con INSERT ... SELECT
+                     por rango de IDs (no una fila por cuenta) y que resetea el tier al 1.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            query_counter (list): Sentencias SQL ejecutadas.
+        """
+        tiers = [
+            LoyaltyTier(tier_level=level, min_points_required=min_points, points_multiplier=Decimal("1.00"),
+                        free_shipping_threshold=Decimal("1000.00"), monthly_coupons_count=1,
+                        coupon_discount_percentage=10)
+            for level, min_points in ((1, 0), (2, 100))
+        ]
+        db.add_all(tiers)
+        db.flush()
+        base_tier_id = tiers[0].tier_id
+        for index in range(10):
+            user = User(
+                cognito_sub=f"range-{index}", email=f"range{index}@befit.test", first_name="Range",
+                last_name=str(index), gender=Gender.FEMALE, date_of_birth=date(1995, 1, 1),
+                auth_type=AuthType.EMAIL, role=UserRole.USER, account_status=True
+            )
+            db.add(user)
+            db.flush()
+            db.add(UserLoyalty(
+                user_id=user.user_id, tier_id=tiers[1].tier_id, total_points=100 + index,
+                points_expiration_date=date.today() - timedelta(days=1),
+                tier_achieved_date=date.today() - timedelta(days=200),
+                last_points_update=date.today() - timedelta(days=200)
+            ))
+        db.commit()
+
+        query_counter.clear()
+        result = loyalty_service.expire_all_points(db, batch_size=4)
+
+        assert (result["users_affected"], result["total_expired_points"], result["batches"]) == (10, 1045, 3)
+        history_inserts = [sql for sql in query_counter if sql.startswith("INSERT INTO point_history")]
+        assert len(history_inserts) == 3 and all("SELECT" in sql for sql in history_inserts)
+        assert sorted(record.points_change for record in db.query(PointHistory)) == [-(100 + i) for i in reversed(range(10))]
+        assert {(loyalty.total_points, loyalty.tier_id) for loyalty in db.query(UserLoyalty)} == {(0, base_tier_id)}
+
+
+def _seed_coupon_tiers(db, users: int) -> dict:
+    """
+    Tiers 1 (1 cupón de 5%), 2 (3 de 10%) y 3 (sin cupones) y `users` usuarios repartidos
+    entre ellos; uno de cada siete tiene la cuenta desactivada. Regresa los cupones
+    esperados por usuario.
+    """
+    tiers = [
+        LoyaltyTier(tier_level=level, min_points_required=min_points, points_multiplier=Decimal("1.00"),
+                    free_shipping_threshold=Decimal("1000.00"), monthly_coupons_count=coupons,
+                    coupon_discount_percentage=discount)
+        for level, min_points, coupons, discount in ((1, 0, 1, 5), (2, 100, 3, 10), (3, 500, 0, 15))
+    ]
+    db.add_all(tiers)
+    db.flush()
+    expected = {}
+    for index in range(users):
+        tier = tiers[index % 3]
+        user = User(
+            cognito_sub=f"coupons-{index}", email=f"coupons{index}@befit.test", first_name="Coupons",
+            last_name=str(index), gender=Gender.FEMALE, date_of_birth=date(1995, 1, 1),
+            auth_type=AuthType.EMAIL, role=UserRole.USER, account_status=index % 7 != 6
+        )
+        db.add(user)
+        db.flush()
+        db.add(UserLoyalty(
+            user_id=user.user_id, tier_id=tier.tier_id, total_points=tier.min_points_required,
+            tier_achieved_date=date.today(), last_points_update=date.today()
+        ))
+        expected[user.user_id] = tier.monthly_coupons_count if user.account_status else 0
+    db.commit()
+    return expected
+
+
+class TestMonthlyCouponsUnit:
+    """
+    Autor: Lizbeth Barajas
+    Descripción: Pruebas de la emisión mensual de cupones por bloques.
+    """
+
+    def test_chunked_issuance_by_tier_once_per_month(self, db, query_counter):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Emite los cupones del mes en bloques de 4 usuarios y verifica cupones
+                     por tier, códigos únicos de la secuencia, un INSERT por bloque, el
+                     avance guardado y que una segunda ejecución del mes no emite nada.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            query_counter (list): Sentencias SQL ejecutadas.
+        """
+        expected = _seed_coupon_tiers(db, 21)
+        # 12 usuarios activos con cupones (tiers 1 y 2): 3 bloques de 4
+        eligible = [user_id for user_id, count in expected.items() if count]
+
+        query_counter.clear()
+        result = loyalty_service.issue_monthly_coupons(db, chunk_size=4)
+
+        assert result["success"], result.get("error")
+        assert (result["users_processed"], result["coupons_issued"], result["chunks"]) == (
+            len(eligible), sum(expected.values()), 3
+        )
+        coupon_inserts = [sql for sql in query_counter if sql.startswith("INSERT INTO coupon ")]
+        assignment_inserts = [sql for sql in query_counter if sql.startswith("INSERT INTO user_coupon")]
+        assert len(coupon_inserts) == len(assignment_inserts) == 3
+
+        issued = {}
+        for user_id, coupon in db.query(UserCoupon.user_id, Coupon).join(Coupon, Coupon.coupon_id == UserCoupon.coupon_id):
+            issued.setdefault(user_id, []).append(coupon)
+        assert {user_id: len(coupons) for user_id, coupons in issued.items()} == {
+            user_id: count for user_id, count in expected.items() if count
+        }
+        assert {coupon.discount_value for coupons in issued.values() for coupon in coupons} == {Decimal("5.00"), Decimal("10.00")}
+        codes = [coupon.coupon_code for coupons in issued.values() for coupon in coupons]
+        assert len(set(codes)) == len(codes) and all(len(code) == 10 and code.isalnum() for code in codes)
+
+        run = db.query(CouponIssuanceRun).one()
+        assert run.status == CouponIssuanceStatus.COMPLETED and run.period_start == date.today().replace(day=1)
+        assert (run.total_users, run.users_processed, run.coupons_issued) == (len(eligible), len(eligible), len(codes))
+        assert loyalty_service.get_coupon_issuance_runs(db)[0]["progress_percent"] == 100.0
+
+        again = loyalty_service.issue_monthly_coupons(db, chunk_size=4)
+        assert (again["users_processed"], again["coupons_issued"], again["chunks"]) == (0, 0, 0)
+        assert db.query(Coupon).count() == len(codes)
+
+    def test_concurrent_issuance_gives_each_user_coupons_once(self, billing_session_factory):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Corre la emisión en dos hilos a la vez (como dos réplicas) y verifica
+                     que cada usuario recibe sus cupones una sola vez y sin códigos repetidos.
+        Parámetros:
+            billing_session_factory (sessionmaker): Fábrica de sesiones de la base de prueba.
+        """
+        db = billing_session_factory()
+        try:
+            expected = _seed_coupon_tiers(db, 40)
+        finally:
+            db.close()
+
+        outputs = []
+
+        def run_issuance():
+            session = billing_session_factory()
+            try:
+                outputs.append(loyalty_service.issue_monthly_coupons(session, chunk_size=3))
+            finally:
+                session.close()
+
+        threads = [threading.Thread(target=run_issuance) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert all(output["success"] for output in outputs), outputs
+        assert sum(output["coupons_issued"] for output in outputs) == sum(expected.values())
+
+        db = billing_session_factory()
+        try:
+            counts = {}
+            for user_id, in db.query(UserCoupon.user_id):
+                counts[user_id] = counts.get(user_id, 0) + 1
+            assert counts == {user_id: count for user_id, count in expected.items() if count}
+            codes = [code for code, in db.query(Coupon.coupon_code)]
+            assert len(codes) == len(set(codes)) == sum(expected.values())
+            assert db.query(CouponIssuanceRun).count() == 1
+        finally:
+            db.close()
+
+    def test_sequence_codes_are_distinct(self):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Los códigos de la secuencia no se repiten entre posiciones ni entre
+                     emisiones y siempre tienen 10 caracteres.
+        """
+        codes = {
+            loyalty_service.generate_sequence_coupon_code(run_id, position)
+            for run_id in (1, 2) for position in range(5000)
+        }
+        assert len(codes) == 10000
+        assert all(len(code) == 10 and set(code) <= set(string.digits + string.ascii_uppercase) for code in codes)
+
+    def test_user_coupons_retry_colliding_codes(self, db, test_user, monkeypatch):
+        """
+        Autor: Lizbeth Barajas
+        Descripción: Si un código aleatorio ya existe, la generación para un usuario se
+                     reintenta con otros códigos sin perder los cupones ya guardados.
+        Parámetros:
+            db (Session): Sesión de base de datos de prueba.
+            test_user (User): Usuario de prueba.
+            monkeypatch (MonkeyPatch): Reemplaza el generador de códigos.
+        """
+        _seed_coupon_tiers(db, 0)
+        tier_2 = db.query(LoyaltyTier).filter(LoyaltyTier.tier_level == 2).one()
+        db.add(UserLoyalty(
+            user_id=test_user.user_id, tier_id=tier_2.tier_id, total_points=100,
+            tier_achieved_date=date.today(), last_points_update=date.today()
+        ))
+        db.add(Coupon(coupon_code="TAKEN1", discount_value=Decimal("5.00"), start_date=date.today(),
+                      expiration_date=date.today(), is_active=True))
+        db.commit()
+        user_id = test_user.user_id
+
+        codes = iter(["TAKEN1", "NEWA01", "NEWA02", "NEWB01", "NEWB02", "NEWB03"])
+        monkeypatch.setattr(LoyaltyService, "generate_random_coupon_code", staticmethod(lambda: next(codes)))
+
+        generated = loyalty_service.generate_monthly_coupons_for_user(db, user_id)
+
+        assert generated == ["NEWB01", "NEWB02", "NEWB03"]
+        assigned = db.query(Coupon.coupon_code).join(UserCoupon).filter(UserCoupon.user_id == user_id).all()
+        assert sorted(code for code, in assigned) == generated
+        assert db.query(Coupon).count() == 4